@@ -36,14 +36,67 @@ def init_default_data():
     except Exception as e:
         print(f"❌ Default data initialization failed: {e}")
 
-def create_app():
-    """Flask ilovasi yaratish"""
+# db.create_all() mavjud jadvallarga yangi ustunlarni qo'shmaydi - modelga
+# keyinroq qo'shilgan ustunlar shu ro'yxat orqali qo'shiladi
+SCHEMA_UPDATES = [
+    # (jadval, ustun, SQL turi)
+    ('ai_configs', 'semantic_cache_threshold', 'FLOAT'),
+    ('inbound_updates', 'chat_key', 'VARCHAR(128)'),
+    ('telegram_bots', 'stream_replies', 'BOOLEAN'),
+    ('telegram_bots', 'polling_offset', 'BIGINT'),
+    ('ai_configs', 'fallback_provider', 'VARCHAR(20)'),
+    ('ai_configs', 'fallback_model', 'VARCHAR(50)'),
+    ('ai_configs', 'hedge_requests', 'BOOLEAN'),
+    ('conversations', 'account_id', 'INTEGER'),
+    ('conversations', 'summary', 'TEXT'),
+    ('conversations', 'summarized_message_id', 'INTEGER'),
+]
+
+# Mavjud jadvallarga keyinroq qo'shilgan indekslar (jadval, indeks nomi)
+SCHEMA_INDEXES = [
+    ('conversations', 'ix_conversations_chat'),
+]
+
+def apply_schema_updates():
+    """Mavjud bazaga yangi ustunlar (ALTER TABLE ... ADD COLUMN) va indekslarni qo'shish"""
+    from sqlalchemy import inspect, text
+    from models.user import db
+    
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    for table, column, column_type in SCHEMA_UPDATES:
+        if table not in tables:
+            continue
+        existing = {col['name'] for col in inspector.get_columns(table)}
+        if column in existing:
+            continue
+        with db.engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+        print(f"🔧 Column added: {table}.{column}")
+    
+    for table, index_name in SCHEMA_INDEXES:
+        if table not in tables:
+            continue
+        if index_name in {index['name'] for index in inspector.get_indexes(table)}:
+            continue
+        index = next(index for index in db.metadata.tables[table].indexes if index.name == index_name)
+        index.create(db.engine)
+        print(f"🔧 Index added: {table}.{index_name}")
+
+def create_app(config_overrides=None):
+    """Flask ilovasi yaratish
+
+    Args:
+        config_overrides: Config ustidan yoziladigan sozlamalar (masalan, rotate_encryption_key.py, asgi.py)
+    """
     from flask import Flask
     from flask_login import LoginManager
     from config import Config
     
     app = Flask(__name__)
     app.config.from_object(Config)
+    if config_overrides:
+        app.config.update(config_overrides)
     
     # Flask-Login setup
     login_manager = LoginManager()
@@ -69,6 +122,7 @@ def create_app():
         # Create tables
         with app.app_context():
             db.create_all()
+            apply_schema_updates()
             
             # Initialize default users for production
             if os.getenv('FLASK_ENV') == 'production' or not os.path.exists('app.db'):
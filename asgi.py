@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""ASGI entry point - webhooklar va inbound navbati asyncio da
+
+Dashboard va admin wsgi:app da qoladi; bu process faqat webhook yo'llarini
+(/telegram/webhook/, /whatsapp/webhook, /instagram/webhook, /api/webhooks/)
+qabul qiladi va navbatni ASGI_MAX_INFLIGHT tagacha parallel ishlaydi.
+AI (AsyncOpenAI, Gemini generate_content_async) va platformalarga javob
+(httpx.AsyncClient) event loop da kutiladi; DB qadamlari
+ASGI_BLOCKING_THREADS ta threadli pulda. Webhook URL lari shu processga
+yo'naltirilganda web processlarda INBOUND_WORKER_THREADS=0 qo'ying.
+
+Ishga tushirish (uvicorn alohida o'rnatiladi):
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+"""
+
+from app import create_app
+from utils.async_ingest import AsyncIngestService
+
+flask_app = create_app(AsyncIngestService.config_overrides())
+app = AsyncIngestService(flask_app)
@@ -8,6 +8,47 @@ class Config:
     
     # AI Service configuration
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+    LLM_CLIENT_CACHE_SIZE = int(os.getenv('LLM_CLIENT_CACHE_SIZE', 64))  # process bo'yicha saqlanadigan AI klientlari
+    AI_REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', 60))  # bitta Gemini/OpenAI so'rovi (soniya)
+    AI_MAX_OUTPUT_TOKENS = int(os.getenv('AI_MAX_OUTPUT_TOKENS', 1500))  # javob uchun qoldiriladigan tokenlar
+    PROMPT_MAX_INPUT_TOKENS = int(os.getenv('PROMPT_MAX_INPUT_TOKENS', 12000))  # prompt byudjeti (model oynasidan kichigi)
+    PROMPT_HISTORY_MESSAGES = int(os.getenv('PROMPT_HISTORY_MESSAGES', 10))  # promptga olinadigan oldingi xabarlar
+    # O'zgarmas prompt prefiksi: bilimlar bazasi shunchalik kichik bo'lsa butunlay system promptga qo'yiladi (0 - o'chirilgan)
+    PROMPT_PREFIX_MAX_TOKENS = int(os.getenv('PROMPT_PREFIX_MAX_TOKENS', 6000))
+    PROMPT_PREFIX_PROVIDERS = tuple(p.strip() for p in os.getenv('PROMPT_PREFIX_PROVIDERS', 'openai').split(',') if p.strip())  # prefiksni keshlaydigan provayderlar
+    PROMPT_PREFIX_CACHE_SIZE = int(os.getenv('PROMPT_PREFIX_CACHE_SIZE', 256))  # process bo'yicha (tenant, KB versiyasi)
+    
+    # Platforma chatlari xotirasi (utils/conversation_memory.py)
+    CONVERSATION_MEMORY_TURNS = int(os.getenv('CONVERSATION_MEMORY_TURNS', 20))  # chat bo'yicha xotiradagi so'nggi xabarlar
+    CONVERSATION_MEMORY_CHATS = int(os.getenv('CONVERSATION_MEMORY_CHATS', 10000))  # process bo'yicha chatlar (LRU)
+    CONVERSATION_MEMORY_FLUSH_INTERVAL = float(os.getenv('CONVERSATION_MEMORY_FLUSH_INTERVAL', 1))  # Message ga yozish (soniya)
+    CONVERSATION_SUMMARY_MAX_TOKENS = int(os.getenv('CONVERSATION_SUMMARY_MAX_TOKENS', 500))  # eski xabarlar xulosasi
+    
+    # Uzun suhbatlarni fonda xulosalash (utils/conversation_summarizer.py)
+    CONVERSATION_SUMMARY_ENABLED = os.getenv('CONVERSATION_SUMMARY_ENABLED', 'true').lower() == 'true'
+    CONVERSATION_SUMMARY_TRIGGER_TOKENS = int(os.getenv('CONVERSATION_SUMMARY_TRIGGER_TOKENS', 1500))  # oynadan tashqaridagi xulosalanmagan tokenlar
+    CONVERSATION_SUMMARY_MODEL = os.getenv('CONVERSATION_SUMMARY_MODEL', 'gemini-1.5-flash-8b')  # arzon model
+    CONVERSATION_SUMMARY_INPUT_TOKENS = int(os.getenv('CONVERSATION_SUMMARY_INPUT_TOKENS', 6000))  # bitta chaqiruvdagi xabarlar
+    CONVERSATION_SUMMARY_THREADS = int(os.getenv('CONVERSATION_SUMMARY_THREADS', 2))
+    
+    # Zaxira provayder (AIConfig.fallback_provider): failover va hedge so'rovlar
+    AI_FAILOVER_TIMEOUT = float(os.getenv('AI_FAILOVER_TIMEOUT', 30))  # javob kelmasa zaxiraga o'tish (soniya)
+    AI_HEDGE_DEFAULT_DELAY = float(os.getenv('AI_HEDGE_DEFAULT_DELAY', 8))  # p95 uchun namuna yetarli bo'lmaganda
+    AI_HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', 1))
+    AI_LATENCY_WINDOW = int(os.getenv('AI_LATENCY_WINDOW', 200))  # p95 hisoblanadigan so'nggi javoblar
+    AI_ROUTER_THREADS = int(os.getenv('AI_ROUTER_THREADS', 32))
+    AI_ROUTER_PLAN_CACHE_SIZE = int(os.getenv('AI_ROUTER_PLAN_CACHE_SIZE', 10000))  # process bo'yicha saqlanadigan tenant zaxira rejalari
+    
+    # Provayder circuit breaker va moslashuvchan parallellik limiti (utils/provider_guard.py)
+    PROVIDER_BREAKER_FAILURES = int(os.getenv('PROVIDER_BREAKER_FAILURES', 5))  # ketma-ket xatolardan keyin ochiladi
+    PROVIDER_BREAKER_COOLDOWN = float(os.getenv('PROVIDER_BREAKER_COOLDOWN', 30))  # ochiq turish vaqti (soniya)
+    PROVIDER_BREAKER_SYNC_INTERVAL = float(os.getenv('PROVIDER_BREAKER_SYNC_INTERVAL', 2))  # boshqa workerlar holatini o'qish
+    PROVIDER_CONCURRENCY_INITIAL = int(os.getenv('PROVIDER_CONCURRENCY_INITIAL', 8))  # process bo'yicha, provayder uchun
+    PROVIDER_CONCURRENCY_MIN = int(os.getenv('PROVIDER_CONCURRENCY_MIN', 1))
+    PROVIDER_CONCURRENCY_MAX = int(os.getenv('PROVIDER_CONCURRENCY_MAX', 32))
+    PROVIDER_QUEUE_TIMEOUT = float(os.getenv('PROVIDER_QUEUE_TIMEOUT', 1))  # limit to'lganda kutish (soniya)
+    PROVIDER_LATENCY_TARGET = float(os.getenv('PROVIDER_LATENCY_TARGET', 15))  # bundan sekin javob limitni kamaytiradi
+    PROVIDER_GUARD_SIZE = int(os.getenv('PROVIDER_GUARD_SIZE', 1000))  # process bo'yicha circuitlar (OpenAI - kalit bo'yicha)
     
     # Normalize DATABASE_URL for SQLAlchemy 2.x compatibility
     database_url = os.getenv('DATABASE_URL', 'sqlite:///app.db')
@@ -15,10 +56,70 @@ class Config:
         database_url = database_url.replace('postgres://', 'postgresql+psycopg2://', 1)
     SQLALCHEMY_DATABASE_URI = database_url
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Ulanishlar puli: gunicorn threadlari + inbound workerlar + fon threadlari (har bir process)
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    if not database_url.startswith('sqlite'):
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_pre_ping': True,
+            'pool_recycle': 1800
+        }
     UPLOAD_FOLDER = 'uploads/knowledge/'  # Store outside static for security
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
     LANGUAGES = ['uz', 'ru', 'en']
     
+    # Knowledge base retrieval settings
+    KNOWLEDGE_CHUNK_SIZE = int(os.getenv('KNOWLEDGE_CHUNK_SIZE', 1200))  # belgilar soni
+    KNOWLEDGE_CHUNK_OVERLAP = int(os.getenv('KNOWLEDGE_CHUNK_OVERLAP', 150))
+    KNOWLEDGE_TOP_K = int(os.getenv('KNOWLEDGE_TOP_K', 6))
+    KNOWLEDGE_TOKEN_BUDGET = int(os.getenv('KNOWLEDGE_TOKEN_BUDGET', 2000))
+    KNOWLEDGE_QUERY_LANGUAGE = os.getenv('KNOWLEDGE_QUERY_LANGUAGE', 'uz')  # savol tili berilmasa (uz - kirill so'zlar o'zbekcha ham qidiriladi)
+    KNOWLEDGE_INDEX_FOLDER = os.getenv('KNOWLEDGE_INDEX_FOLDER', 'uploads/index/')  # per-tenant inverted index
+    KNOWLEDGE_TABLE_MAX_ROWS = int(os.getenv('KNOWLEDGE_TABLE_MAX_ROWS', 500000))  # CSV mahsulot jadvali
+    KNOWLEDGE_TABLE_ROW_LIMIT = int(os.getenv('KNOWLEDGE_TABLE_ROW_LIMIT', 10))  # promptga qo'shiladigan qatorlar
+    
+    # AI response cache (takroriy savollar uchun)
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 86400))  # soniya
+    RESPONSE_CACHE_MEMORY_SIZE = int(os.getenv('RESPONSE_CACHE_MEMORY_SIZE', 2048))  # har bir worker uchun
+    RESPONSE_CACHE_MAX_PER_TENANT = int(os.getenv('RESPONSE_CACHE_MAX_PER_TENANT', 5000))  # DB dagi yozuvlar
+    
+    # O'xshash savollar keshi (xeshlangan n-gram vektorlar, numpy)
+    SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'true').lower() == 'true'
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.85))  # AIConfig da tenant uchun o'zgartiriladi
+    SEMANTIC_CACHE_DIM = int(os.getenv('SEMANTIC_CACHE_DIM', 512))
+    SEMANTIC_CACHE_MAX_PER_TENANT = int(os.getenv('SEMANTIC_CACHE_MAX_PER_TENANT', 5000))
+    SEMANTIC_CACHE_MAX_TENANTS = int(os.getenv('SEMANTIC_CACHE_MAX_TENANTS', 100))  # har bir worker xotirasida
+    SEMANTIC_CACHE_REFRESH = int(os.getenv('SEMANTIC_CACHE_REFRESH', 60))  # boshqa workerlar javoblarini o'qish (soniya)
+    
+    # Kiruvchi webhook navbati (javob alohida workerlarda tayyorlanadi)
+    INBOUND_QUEUE_ENABLED = os.getenv('INBOUND_QUEUE_ENABLED', 'true').lower() == 'true'
+    INBOUND_WORKER_THREADS = int(os.getenv('INBOUND_WORKER_THREADS', 8))  # web process ichidagi workerlar = parallel suhbatlar (0 - faqat inbound_worker.py)
+    INBOUND_QUEUE_BATCH = int(os.getenv('INBOUND_QUEUE_BATCH', 1))  # har bir thread bir martada oladigan yozuvlar
+    INBOUND_QUEUE_POLL_INTERVAL = float(os.getenv('INBOUND_QUEUE_POLL_INTERVAL', 1.0))  # soniya
+    INBOUND_QUEUE_MAX_DEPTH = int(os.getenv('INBOUND_QUEUE_MAX_DEPTH', 1000))  # oshsa webhook 503 qaytaradi (0 - cheksiz)
+    INBOUND_QUEUE_MAX_ATTEMPTS = int(os.getenv('INBOUND_QUEUE_MAX_ATTEMPTS', 5))  # vaqtinchalik xatoda urinishlar (oxirgisida xato xabari)
+    INBOUND_QUEUE_VISIBILITY_TIMEOUT = int(os.getenv('INBOUND_QUEUE_VISIBILITY_TIMEOUT', 300))  # osilib qolgan yozuv qayta navbatga
+    INBOUND_QUEUE_RETENTION = int(os.getenv('INBOUND_QUEUE_RETENTION', 86400))  # bajarilgan yozuvlar saqlanadi (soniya)
+    INBOUND_COALESCE_WINDOW = float(os.getenv('INBOUND_COALESCE_WINDOW', 1.5))  # bitta chatning ketma-ket xabarlari bitta javobga (0 - o'chiq)
+    
+    # Webhook marshrut jadvali: tashqi id -> akkaunt, tenant, ochilgan kalitlar (utils/routing_table.py)
+    ROUTING_TABLE_TTL = float(os.getenv('ROUTING_TABLE_TTL', 300))  # soniya
+    ROUTING_TABLE_SYNC_INTERVAL = float(os.getenv('ROUTING_TABLE_SYNC_INTERVAL', 1.0))  # boshqa workerlar o'zgarishlarini tekshirish (soniya)
+    ROUTING_TABLE_SIZE = int(os.getenv('ROUTING_TABLE_SIZE', 10000))  # process bo'yicha akkauntlar (LRU)
+    
+    # Asinxron webhook xizmati (asgi.py): AI va platforma so'rovlari asyncio da
+    ASGI_MAX_INFLIGHT = int(os.getenv('ASGI_MAX_INFLIGHT', 500))  # bir vaqtda ishlanadigan yangilanishlar (process bo'yicha)
+    ASGI_BLOCKING_THREADS = int(os.getenv('ASGI_BLOCKING_THREADS', 16))  # DB / kesh / prompt qadamlari uchun threadlar (= DB ulanishlari)
+    ASGI_CLAIM_BATCH = int(os.getenv('ASGI_CLAIM_BATCH', 20))  # dispetcher bir martada oladigan yozuvlar
+    
+    # Qayta yuborilgan webhook yangilanishlarini aniqlash (update_id, message.id, mid)
+    UPDATE_DEDUP_ENABLED = os.getenv('UPDATE_DEDUP_ENABLED', 'true').lower() == 'true'
+    UPDATE_DEDUP_MEMORY_SIZE = int(os.getenv('UPDATE_DEDUP_MEMORY_SIZE', 20000))  # har bir process uchun
+    UPDATE_DEDUP_RETENTION = int(os.getenv('UPDATE_DEDUP_RETENTION', 604800))  # seen_updates saqlanish muddati (soniya)
+    
     # Multi-channel bot integration settings - Auto-detect URL for production
     if os.environ.get('RENDER_SERVICE_NAME'):
         # Render.com deployment
@@ -31,13 +132,40 @@ class Config:
         WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', 'https://localhost:5000')
     
     ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY')  # Fernet encryption key
+    ENCRYPTION_KEY_VERSION = int(os.getenv('ENCRYPTION_KEY_VERSION', 1))  # kalit almashtirilganda oshiriladi
+    ENCRYPTION_OLD_KEYS = tuple(k.strip() for k in os.getenv('ENCRYPTION_OLD_KEYS', '').split(',') if k.strip())  # "versiya:kalit" - faqat ochish uchun
+    CREDENTIAL_ROTATION_BATCH = int(os.getenv('CREDENTIAL_ROTATION_BATCH', 100))  # qayta shifrlash partiyasi (qator)
+    CREDENTIAL_ROTATION_PAUSE = float(os.getenv('CREDENTIAL_ROTATION_PAUSE', 0.5))  # partiyalar orasida (soniya)
+    CREDENTIAL_CACHE_TTL = float(os.getenv('CREDENTIAL_CACHE_TTL', 300))  # ochilgan kalitlar keshi (soniya, 0 - o'chiq)
+    CREDENTIAL_CACHE_SIZE = int(os.getenv('CREDENTIAL_CACHE_SIZE', 4096))  # process bo'yicha
+    
+    # Platforma API lari uchun umumiy HTTP transport (keep-alive pul, qayta urinish)
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))  # soniya
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 10))  # soniya
+    HTTP_POOL_HOSTS = int(os.getenv('HTTP_POOL_HOSTS', 20))  # har bir process uchun host pullari
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 10))  # bitta hostga ochiq ulanishlar
+    HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 2))  # ulanish xatolari; 502/503/504 faqat GET/DELETE
+    HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', 0.3))
+    HTTP_CLIENT_HTTP2 = os.getenv('HTTP_CLIENT_HTTP2', 'true').lower() == 'true'  # httpx + h2 o'rnatilgan bo'lsa
     
     # Telegram Bot API settings
     TELEGRAM_API_URL = 'https://api.telegram.org/bot'
+    TELEGRAM_STREAM_EDIT_INTERVAL = float(os.getenv('TELEGRAM_STREAM_EDIT_INTERVAL', 1.5))  # bitta xabarni tahrirlash oralig'i (soniya)
+    TELEGRAM_STREAM_MIN_CHARS = int(os.getenv('TELEGRAM_STREAM_MIN_CHARS', 30))  # tahrirlash uchun kamida yangi belgilar
+    
+    # Telegram long polling (telegram_poller.py - webhook o'rnatilmagan botlar)
+    TELEGRAM_POLLING_TIMEOUT = int(os.getenv('TELEGRAM_POLLING_TIMEOUT', 30))  # getUpdates kutish vaqti (soniya)
+    TELEGRAM_POLLING_REFRESH = int(os.getenv('TELEGRAM_POLLING_REFRESH', 15))  # faol botlar ro'yxatini qayta o'qish (soniya)
+    TELEGRAM_POLLING_MAX_CONNECTIONS = int(os.getenv('TELEGRAM_POLLING_MAX_CONNECTIONS', 1000))  # umumiy ulanishlar puli
+    TELEGRAM_POLLING_SUBMIT_THREADS = int(os.getenv('TELEGRAM_POLLING_SUBMIT_THREADS', 8))  # navbatga yozuvchi threadlar
     
     # WhatsApp Business API settings
     WHATSAPP_API_URL = 'https://graph.facebook.com/v18.0'
     
+    # WhatsApp access token keshi (oauth/access_token har bir xabar uchun chaqirilmaydi)
+    WHATSAPP_TOKEN_TTL = int(os.getenv('WHATSAPP_TOKEN_TTL', 86400))  # javobda expires_in bo'lmasa (soniya)
+    WHATSAPP_TOKEN_REFRESH_MARGIN = int(os.getenv('WHATSAPP_TOKEN_REFRESH_MARGIN', 600))  # muddatdan oldin fonda yangilash
+    
     # Instagram Graph API settings
     INSTAGRAM_API_URL = 'https://graph.facebook.com/v18.0'
     
@@ -6,10 +6,12 @@ bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
 backlog = 2048
 
 # Worker processes
-workers = min(multiprocessing.cpu_count() * 2 + 1, 4)  # Limit for small instances
+workers = int(os.environ.get('GUNICORN_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 4)))  # Limit for small instances
 worker_class = 'gthread'
 worker_connections = 1000
-threads = 2
+# Webhooks only enqueue; AI answers run on INBOUND_WORKER_THREADS, but dashboard
+# SSE chats hold a request thread for the whole answer
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
 timeout = 120
 keepalive = 2
 
@@ -29,4 +31,10 @@ proc_name = 'ai_chatbot_platform'
 # Server mechanics
 preload_app = True
 daemon = False
-pidfile = '/tmp/gunicorn.pid'
\ No newline at end of file
+pidfile = '/tmp/gunicorn.pid'
+
+def post_worker_init(worker):
+    # Start inbound queue threads after fork (the app is preloaded in the master),
+    # so updates left pending by a restart don't wait for the next webhook
+    from utils.inbound_queue import InboundWorker
+    InboundWorker.ensure_started(worker.app.wsgi())
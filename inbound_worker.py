@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Webhook navbati workeri
+inbound_updates jadvalidagi Telegram/WhatsApp/Instagram yangilanishlarini
+qayta ishlaydi: AI javobini tayyorlaydi va platformaga yuboradi.
+
+Web process ichidagi workerlarni o'chirish uchun INBOUND_WORKER_THREADS=0.
+
+Ishlatish:
+    python inbound_worker.py                # 4 ta thread, to'xtatilguncha
+    python inbound_worker.py --threads 8
+    python inbound_worker.py --once         # navbat bo'shaguncha ishlab chiqish
+    python inbound_worker.py --stats        # navbat holatini ko'rsatish
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+
+# Add current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+def run_worker(threads=4, once=False, show_stats=False):
+    """Workerlarni ishga tushirish"""
+    try:
+        from app import create_app
+        from utils.inbound_queue import InboundQueue, InboundWorker
+
+        app = create_app()
+
+        if show_stats:
+            with app.app_context():
+                print(json.dumps(InboundQueue.get_stats(), indent=2))
+            return True
+
+        if once:
+            processed = InboundWorker.run(app, once=True)
+            print(f"✅ {processed} ta yangilanish qayta ishlandi")
+            return True
+
+        print(f"🔄 Inbound worker started: {threads} threads (pid {os.getpid()})")
+        signal.signal(signal.SIGTERM, lambda signum, frame: InboundWorker.stop())
+        workers = InboundWorker.start(app, threads)
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(1)
+        except KeyboardInterrupt:
+            InboundWorker.stop()
+            for worker in workers:
+                worker.join()
+        print("👋 Inbound worker stopped")
+        return True
+
+    except Exception as e:
+        print(f"❌ Inbound worker failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Webhook navbati workeri")
+    parser.add_argument('--threads', type=int, default=4, help="Worker threadlar soni")
+    parser.add_argument('--once', action='store_true', help="Navbat bo'shaguncha ishlab to'xtash")
+    parser.add_argument('--stats', action='store_true', help="Navbat holatini ko'rsatish")
+    args = parser.parse_args()
+
+    success = run_worker(args.threads, args.once, args.stats)
+    sys.exit(0 if success else 1)
@@ -8,4 +8,8 @@ app = create_app()
 if __name__ == '__main__':
     import os
     debug_mode = os.getenv('FLASK_ENV') == 'development' or os.getenv('DEBUG', 'False').lower() == 'true'
+    if not debug_mode or os.getenv('WERKZEUG_RUN_MAIN') == 'true':
+        # Navbat workerlari (reloader da faqat ilova ishlaydigan bola processda)
+        from utils.inbound_queue import InboundWorker
+        InboundWorker.ensure_started(app)
     app.run(debug=debug_mode, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -4,6 +4,13 @@ from models.admin_log import AdminLog, SystemStats
 from models.ai_config import AIConfig
 from models.conversation import Conversation, Message
 from models.knowledge_base import KnowledgeBase
+from models.knowledge_chunk import KnowledgeChunk
+from models.response_cache import ResponseCacheEntry, ResponseCacheStats
+from models.inbound_queue import InboundUpdate, SeenUpdate
+from models.access_token import AccessTokenCache
+from models.provider_circuit import ProviderCircuit
+from models.key_rotation import KeyRotationProgress
+from models.routing_version import RoutingVersion
 from models.marketing import MarketingMessage, Coupon
 from models.messaging import (
     MessagingPlatform, PlatformCredentials, TelegramBot, 
@@ -14,8 +21,9 @@ from models.messaging import (
 # Export all models and db instance
 __all__ = [
     'db', 'User', 'AdminLog', 'SystemStats', 'AIConfig', 
-    'Conversation', 'Message', 'KnowledgeBase', 'MarketingMessage', 
-    'Coupon', 'MessagingPlatform', 'PlatformCredentials', 'TelegramBot',
+    'Conversation', 'Message', 'KnowledgeBase', 'KnowledgeChunk', 'ResponseCacheEntry',
+    'ResponseCacheStats', 'InboundUpdate', 'SeenUpdate', 'AccessTokenCache', 'ProviderCircuit', 'MarketingMessage', 
+    'KeyRotationProgress', 'RoutingVersion', 'Coupon', 'MessagingPlatform', 'PlatformCredentials', 'TelegramBot',
     'WhatsAppAccount', 'InstagramAccount', 'TelegramConversation',
     'WhatsAppConversation', 'InstagramConversation', 'PlanRequest'
 ]
\ No newline at end of file
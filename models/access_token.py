@@ -0,0 +1,17 @@
+from datetime import datetime
+from models.user import db
+
+class AccessTokenCache(db.Model):
+    """Platforma access tokenlari keshi (shifrlangan, workerlar qayta ishga tushsa ham saqlanadi)"""
+    __tablename__ = 'access_token_cache'
+    __table_args__ = (
+        db.UniqueConstraint('provider', 'app_id', name='uq_access_token_cache_app'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(20), nullable=False)  # whatsapp
+    app_id = db.Column(db.String(100), nullable=False)
+    secret_hash = db.Column(db.String(64), nullable=False)  # app_secret o'zgarsa token eskiradi
+    encrypted_token = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,8 +1,6 @@
 from datetime import datetime
 from models.user import db
-from cryptography.fernet import Fernet
-from flask import current_app
-import base64
+from utils.credential_vault import CredentialVault
 
 class AIConfig(db.Model):
     """AI konfiguratsiya - Gemini yoki OpenAI tanlovi"""
@@ -15,6 +13,10 @@ class AIConfig(db.Model):
     use_openai = db.Column(db.Boolean, default=False)
     openai_model = db.Column(db.String(50), default='gpt-3.5-turbo')
     gemini_model = db.Column(db.String(50), default='gemini-1.5-flash')
+    semantic_cache_threshold = db.Column(db.Float)  # o'xshash savollar keshi (None - umumiy sozlama, >= 1 - o'chiq)
+    fallback_provider = db.Column(db.String(20))  # zaxira provayder: gemini, openai (None - o'chiq)
+    fallback_model = db.Column(db.String(50))  # None - provayderning tanlangan modeli
+    hedge_requests = db.Column(db.Boolean, default=False)  # p95 dan kechiksa zaxiraga parallel so'rov
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -23,12 +25,8 @@ class AIConfig(db.Model):
     
     def set_openai_key(self, api_key):
         """OpenAI API kalitini shifrlash va saqlash"""
-        if current_app.config.get('ENCRYPTION_KEY'):
-            fernet = Fernet(current_app.config['ENCRYPTION_KEY'].encode())
-            self.encrypted_openai_api_key = fernet.encrypt(api_key.encode()).decode()
-        else:
-            # Development uchun fallback
-            self.encrypted_openai_api_key = base64.b64encode(api_key.encode()).decode()
+        CredentialVault.forget(self.encrypted_openai_api_key)
+        self.encrypted_openai_api_key = CredentialVault.encrypt(api_key)
         self.use_openai = True
         self.ai_provider = 'openai'
         self.updated_at = datetime.utcnow()
@@ -37,13 +35,7 @@ class AIConfig(db.Model):
         """OpenAI API kalitini dekriptatsiya qilish"""
         if not self.encrypted_openai_api_key:
             return None
-            
-        if current_app.config.get('ENCRYPTION_KEY'):
-            fernet = Fernet(current_app.config['ENCRYPTION_KEY'].encode())
-            return fernet.decrypt(self.encrypted_openai_api_key.encode()).decode()
-        else:
-            # Development uchun fallback
-            return base64.b64decode(self.encrypted_openai_api_key.encode()).decode()
+        return CredentialVault.decrypt(self.encrypted_openai_api_key)
     
     def switch_to_gemini(self):
         """Gemini AI ga o'tish"""
@@ -77,6 +69,10 @@ class AIConfig(db.Model):
             'openai_model': self.openai_model,
             'gemini_model': self.gemini_model,
             'has_openai_key': bool(self.encrypted_openai_api_key),
+            'semantic_cache_threshold': self.semantic_cache_threshold,
+            'fallback_provider': self.fallback_provider,
+            'fallback_model': self.fallback_model,
+            'hedge_requests': bool(self.hedge_requests),
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
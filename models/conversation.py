@@ -18,11 +18,16 @@ class Message(db.Model):
 class Conversation(db.Model):
     """Barcha platformalar uchun umumiy suhbat modeli"""
     __tablename__ = 'conversations'
+    __table_args__ = (
+        # Platforma chati bo'yicha qidirish (ConversationMemory)
+        db.Index('ix_conversations_chat', 'platform', 'account_id', 'sender_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(100))  # Chat title for dashboard
     platform = db.Column(db.String(20), nullable=True, default='dashboard')  # telegram, whatsapp, instagram, dashboard
+    account_id = db.Column(db.Integer, nullable=True)  # platforma akkaunti (TelegramBot / WhatsAppAccount / InstagramAccount id)
     sender_id = db.Column(db.String(100), nullable=True)  # mijoz ID
     sender_name = db.Column(db.String(100))
     message = db.Column(db.Text, nullable=True)  # First message or empty for dashboard chats
@@ -35,6 +40,8 @@ class Conversation(db.Model):
     ai_provider = db.Column(db.String(20), default='gemini')  # gemini, openai
     message_count = db.Column(db.Integer, default=0)  # Total messages in conversation
     updated_at = db.Column(db.DateTime, default=datetime.utcnow)  # Last update time
+    summary = db.Column(db.Text)  # eski xabarlar xulosasi (ConversationSummarizer)
+    summarized_message_id = db.Column(db.Integer)  # xulosaga kirgan oxirgi Message.id
     
     # Relationships
     user = db.relationship('User', backref='conversations')
@@ -0,0 +1,48 @@
+from datetime import datetime
+from models.user import db
+
+class InboundUpdate(db.Model):
+    """Webhook orqali kelgan, hali qayta ishlanmagan yangilanishlar navbati"""
+    __tablename__ = 'inbound_updates'
+    __table_args__ = (
+        db.Index('ix_inbound_updates_status_available', 'status', 'available_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)  # telegram_bot, whatsapp_account, platform_telegram, ...
+    target_id = db.Column(db.String(64), nullable=False)  # bot/akkaunt/platforma ID si
+    payload = db.Column(db.JSON, nullable=False)  # xom webhook ma'lumoti
+    chat_key = db.Column(db.String(128), index=True)  # bitta chat xabarlari birlashtiriladi
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, processing, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)  # qayta urinish vaqti
+    locked_by = db.Column(db.String(36))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'target_id': self.target_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'processed_at': self.processed_at.isoformat() if self.processed_at else None
+        }
+
+class SeenUpdate(db.Model):
+    """Qabul qilingan platforma yangilanishlari ID lari (qayta yuborilganlarni tashlab yuborish uchun)"""
+    __tablename__ = 'seen_updates'
+    __table_args__ = (
+        db.UniqueConstraint('platform', 'account_key', 'external_id', name='uq_seen_updates_external'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    platform = db.Column(db.String(20), nullable=False)  # telegram, whatsapp, instagram
+    account_key = db.Column(db.String(64), nullable=False)  # navbat turi va bot/akkaunt ID si
+    external_id = db.Column(db.String(128), nullable=False)  # update_id, message.id, mid
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
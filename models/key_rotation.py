@@ -0,0 +1,14 @@
+from models.user import db
+
+class KeyRotationProgress(db.Model):
+    """Shifrlash kalitini almashtirish jarayoni - jadval bo'yicha kursor (KeyRotation davom ettiradi)"""
+    __tablename__ = 'key_rotation_progress'
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(64), nullable=False, unique=True)
+    key_version = db.Column(db.Integer, nullable=False)  # qaysi ENCRYPTION_KEY_VERSION ga o'tkazilmoqda
+    last_id = db.Column(db.Integer, nullable=False, default=0)  # shu id gacha tekshirilgan
+    rotated = db.Column(db.Integer, nullable=False, default=0)  # qayta shifrlangan qiymatlar
+    failed = db.Column(db.Integer, nullable=False, default=0)  # hech bir kalit bilan ochilmadi
+    finished_at = db.Column(db.Float)  # unix vaqt - jadval tugallangan
+    updated_at = db.Column(db.Float, default=0)  # unix vaqt
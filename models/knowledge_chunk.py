@@ -0,0 +1,31 @@
+from datetime import datetime
+from models.user import db
+
+class KnowledgeChunk(db.Model):
+    """Bilimlar bazasi faylining qidiruv uchun bo'laklari"""
+    __tablename__ = 'knowledge_chunks'
+
+    id = db.Column(db.Integer, primary_key=True)
+    knowledge_base_id = db.Column(db.Integer, db.ForeignKey('knowledge_base.id'), nullable=False, index=True)
+    user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False, index=True)
+    chunk_index = db.Column(db.Integer, nullable=False)  # fayl ichidagi tartib raqami
+    content = db.Column(db.Text, nullable=False)
+    char_count = db.Column(db.Integer, nullable=False)
+    token_count = db.Column(db.Integer, nullable=False)  # taxminiy token soni
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Relationships
+    knowledge_base = db.relationship(
+        'KnowledgeBase',
+        backref=db.backref('chunks', cascade='all, delete-orphan', order_by='KnowledgeChunk.chunk_index')
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'knowledge_base_id': self.knowledge_base_id,
+            'chunk_index': self.chunk_index,
+            'char_count': self.char_count,
+            'token_count': self.token_count,
+            'content_preview': self.content[:200] + '...' if len(self.content) > 200 else self.content
+        }
@@ -1,7 +1,6 @@
 from models.user import db
 from datetime import datetime
-from cryptography.fernet import Fernet
-from flask import current_app
+from utils.credential_vault import CredentialVault
 import os
 
 class MessagingPlatform(db.Model):
@@ -41,6 +40,8 @@ class TelegramBot(db.Model):
     encrypted_token = db.Column(db.Text, nullable=False)  # Encrypted bot token
     webhook_url = db.Column(db.String(500))
     is_active = db.Column(db.Boolean, default=False)
+    stream_replies = db.Column(db.Boolean, default=False)  # javobni yozilish davomida tahrirlab ko'rsatish
+    polling_offset = db.Column(db.BigInteger)  # getUpdates offseti (webhooksiz, telegram_poller.py)
     last_activity = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -49,29 +50,17 @@ class TelegramBot(db.Model):
     
     def set_token(self, token):
         """Encrypt and store telegram bot token."""
-        if current_app.config.get('ENCRYPTION_KEY'):
-            fernet = Fernet(current_app.config['ENCRYPTION_KEY'].encode())
-            self.encrypted_token = fernet.encrypt(token.encode()).decode()
-        else:
-            # Fallback for development - still not plain text
-            import base64
-            self.encrypted_token = base64.b64encode(token.encode()).decode()
+        CredentialVault.forget(self.encrypted_token)
+        self.encrypted_token = CredentialVault.encrypt(token)
     
     def get_token(self):
         """Decrypt and return telegram bot token."""
-        if current_app.config.get('ENCRYPTION_KEY'):
-            try:
-                # Try Fernet decryption first (for new tokens)
-                fernet = Fernet(current_app.config['ENCRYPTION_KEY'].encode())
-                return fernet.decrypt(self.encrypted_token.encode()).decode()
-            except Exception:
-                # Fallback to base64 for old tokens created without ENCRYPTION_KEY
-                import base64
-                return base64.b64decode(self.encrypted_token.encode()).decode()
-        else:
-            # Fallback for development
-            import base64
-            return base64.b64decode(self.encrypted_token.encode()).decode()
+        # Fallback to base64 for old tokens created without ENCRYPTION_KEY
+        return CredentialVault.decrypt(self.encrypted_token, legacy_base64=True)
+    
+    def forget_credentials(self):
+        """Drop the decrypted token from the process cache (bot deleted)."""
+        CredentialVault.forget(self.encrypted_token)
 
 class WhatsAppAccount(db.Model):
     __tablename__ = 'whatsapp_accounts'
@@ -93,35 +82,22 @@ class WhatsAppAccount(db.Model):
     
     def set_credentials(self, app_id, app_secret, verify_token):
         """Encrypt and store WhatsApp credentials."""
-        if current_app.config.get('ENCRYPTION_KEY'):
-            fernet = Fernet(current_app.config['ENCRYPTION_KEY'].encode())
-            self.encrypted_app_id = fernet.encrypt(app_id.encode()).decode()
-            self.encrypted_app_secret = fernet.encrypt(app_secret.encode()).decode()
-            self.encrypted_verify_token = fernet.encrypt(verify_token.encode()).decode()
-        else:
-            # Fallback for development
-            import base64
-            self.encrypted_app_id = base64.b64encode(app_id.encode()).decode()
-            self.encrypted_app_secret = base64.b64encode(app_secret.encode()).decode()
-            self.encrypted_verify_token = base64.b64encode(verify_token.encode()).decode()
+        CredentialVault.forget(self.encrypted_app_id, self.encrypted_app_secret, self.encrypted_verify_token)
+        self.encrypted_app_id = CredentialVault.encrypt(app_id)
+        self.encrypted_app_secret = CredentialVault.encrypt(app_secret)
+        self.encrypted_verify_token = CredentialVault.encrypt(verify_token)
     
     def get_credentials(self):
         """Decrypt and return WhatsApp credentials."""
-        if current_app.config.get('ENCRYPTION_KEY'):
-            fernet = Fernet(current_app.config['ENCRYPTION_KEY'].encode())
-            return {
-                'app_id': fernet.decrypt(self.encrypted_app_id.encode()).decode(),
-                'app_secret': fernet.decrypt(self.encrypted_app_secret.encode()).decode(),
-                'verify_token': fernet.decrypt(self.encrypted_verify_token.encode()).decode()
-            }
-        else:
-            # Fallback for development
-            import base64
-            return {
-                'app_id': base64.b64decode(self.encrypted_app_id.encode()).decode(),
-                'app_secret': base64.b64decode(self.encrypted_app_secret.encode()).decode(),
-                'verify_token': base64.b64decode(self.encrypted_verify_token.encode()).decode()
-            }
+        return {
+            'app_id': CredentialVault.decrypt(self.encrypted_app_id),
+            'app_secret': CredentialVault.decrypt(self.encrypted_app_secret),
+            'verify_token': CredentialVault.decrypt(self.encrypted_verify_token)
+        }
+    
+    def forget_credentials(self):
+        """Drop decrypted credentials from the process cache (account deleted)."""
+        CredentialVault.forget(self.encrypted_app_id, self.encrypted_app_secret, self.encrypted_verify_token)
 
 class InstagramAccount(db.Model):
     __tablename__ = 'instagram_accounts'
@@ -141,23 +117,16 @@ class InstagramAccount(db.Model):
     
     def set_access_token(self, access_token):
         """Encrypt and store Instagram access token."""
-        if current_app.config.get('ENCRYPTION_KEY'):
-            fernet = Fernet(current_app.config['ENCRYPTION_KEY'].encode())
-            self.encrypted_access_token = fernet.encrypt(access_token.encode()).decode()
-        else:
-            # Fallback for development
-            import base64
-            self.encrypted_access_token = base64.b64encode(access_token.encode()).decode()
+        CredentialVault.forget(self.encrypted_access_token)
+        self.encrypted_access_token = CredentialVault.encrypt(access_token)
     
     def get_access_token(self):
         """Decrypt and return Instagram access token."""
-        if current_app.config.get('ENCRYPTION_KEY'):
-            fernet = Fernet(current_app.config['ENCRYPTION_KEY'].encode())
-            return fernet.decrypt(self.encrypted_access_token.encode()).decode()
-        else:
-            # Fallback for development
-            import base64
-            return base64.b64decode(self.encrypted_access_token.encode()).decode()
+        return CredentialVault.decrypt(self.encrypted_access_token)
+    
+    def forget_credentials(self):
+        """Drop the decrypted access token from the process cache (account deleted)."""
+        CredentialVault.forget(self.encrypted_access_token)
 
 # Conversation tracking models
 class TelegramConversation(db.Model):
@@ -0,0 +1,11 @@
+from models.user import db
+
+class ProviderCircuit(db.Model):
+    """AI provayder circuit breaker holati (gunicorn workerlari o'rtasida umumiy)"""
+    __tablename__ = 'provider_circuits'
+
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(20), nullable=False, unique=True)  # gemini, openai:<kalit xeshi>
+    state = db.Column(db.String(10), nullable=False, default='closed')  # closed, open
+    opened_until = db.Column(db.Float, default=0)  # unix vaqt - shu paytgacha so'rov yuborilmaydi
+    changed_at = db.Column(db.Float, default=0)  # unix vaqt - oxirgi o'tish (workerlar solishtiradi)
@@ -0,0 +1,50 @@
+from datetime import datetime
+from models.user import db
+
+class ResponseCacheEntry(db.Model):
+    """Takrorlanadigan savollar uchun AI javoblari keshi (workerlar orasida umumiy)"""
+    __tablename__ = 'response_cache'
+
+    id = db.Column(db.Integer, primary_key=True)
+    cache_key = db.Column(db.String(64), nullable=False, unique=True)  # sha256 (tenant, savol, til, model, KB versiyasi)
+    user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False, index=True)
+    kb_version = db.Column(db.String(64), nullable=False)
+    language = db.Column(db.String(5), nullable=False)
+    provider = db.Column(db.String(20), nullable=False)
+    model = db.Column(db.String(50))
+    message = db.Column(db.Text, nullable=False)  # normallashtirilgan savol
+    response = db.Column(db.Text, nullable=False)
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_hit_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'message': self.message,
+            'language': self.language,
+            'provider': self.provider,
+            'model': self.model,
+            'hit_count': self.hit_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+class ResponseCacheStats(db.Model):
+    """Tenant bo'yicha javob keshi statistikasi"""
+    __tablename__ = 'response_cache_stats'
+
+    user_id = db.Column(db.String(36), db.ForeignKey('user.id'), primary_key=True)
+    hits = db.Column(db.Integer, default=0)
+    misses = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        total = (self.hits or 0) + (self.misses or 0)
+        return {
+            'hits': self.hits or 0,
+            'misses': self.misses or 0,
+            'hit_rate': round((self.hits or 0) / total, 4) if total else 0.0,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
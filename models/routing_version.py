@@ -0,0 +1,10 @@
+from models.user import db
+
+class RoutingVersion(db.Model):
+    """Platforma akkauntlari marshrut jadvali versiyasi (workerlar o'rtasida invalidatsiya)"""
+    __tablename__ = 'routing_versions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    platform = db.Column(db.String(20), nullable=False, unique=True)  # telegram, whatsapp, instagram
+    version = db.Column(db.Integer, nullable=False, default=0)  # akkaunt saqlansa/o'zgarsa/o'chirilsa oshadi
+    changed_at = db.Column(db.Float, default=0)  # unix vaqt
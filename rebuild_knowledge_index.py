@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Knowledge base qidiruv indeksini qayta qurish
+uploads/knowledge/ dagi mavjud fayllar (KnowledgeBase qatorlari) uchun
+bo'laklar, CSV mahsulot jadvallari va har bir foydalanuvchi inverted indeksini yaratadi.
+
+Ishlatish:
+    python rebuild_knowledge_index.py                 # barcha foydalanuvchilar
+    python rebuild_knowledge_index.py --user-id UUID  # bitta foydalanuvchi
+    python rebuild_knowledge_index.py --rechunk       # bo'laklar va CSV jadvallarini qaytadan yaratish
+    python rebuild_knowledge_index.py --reparse       # fayllarni diskdan qayta o'qish
+"""
+import argparse
+import os
+import sys
+
+# Add current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+def reparse_files(user_id):
+    """KnowledgeBase matnini diskdagi fayldan qayta o'qish"""
+    from models.user import db
+    from models.knowledge_base import KnowledgeBase
+    from utils.file_parser import FileParser
+
+    updated = 0
+    for knowledge_file in KnowledgeBase.query.filter_by(user_id=user_id).all():
+        if not os.path.exists(knowledge_file.file_path):
+            print(f"  ⚠️ Fayl topilmadi: {knowledge_file.file_path}")
+            continue
+        parse_result = FileParser.parse_file(knowledge_file.file_path, knowledge_file.file_type)
+        if not parse_result['success']:
+            print(f"  ⚠️ {knowledge_file.file_name}: {parse_result['error']}")
+            continue
+        knowledge_file.content = parse_result['content']
+        updated += 1
+    db.session.commit()
+    return updated
+
+def rebuild_index(user_id=None, rechunk=False, reparse=False):
+    """Indeksni qayta qurish"""
+    try:
+        from app import create_app
+        from models.user import db
+        from models.knowledge_base import KnowledgeBase
+        from utils.knowledge_retriever import KnowledgeRetriever
+
+        app = create_app()
+
+        with app.app_context():
+            print("🔄 Knowledge index rebuild started...")
+
+            if user_id:
+                user_ids = [user_id]
+            else:
+                user_ids = [row[0] for row in db.session.query(KnowledgeBase.user_id).distinct().all()]
+
+            for tenant_id in user_ids:
+                if reparse:
+                    updated = reparse_files(tenant_id)
+                    print(f"  📄 {tenant_id}: {updated} ta fayl qayta o'qildi")
+
+                result = KnowledgeRetriever.rebuild_index(tenant_id, rechunk=rechunk or reparse)
+                print(f"  ✅ {tenant_id}: {result['files']} ta fayl, {result['chunks']} ta bo'lak, {result['rows']} ta jadval qatori (versiya {result['version']})")
+
+            print(f"🎉 {len(user_ids)} ta foydalanuvchi indeksi qayta qurildi!")
+            return True
+
+    except Exception as e:
+        print(f"❌ Knowledge index rebuild failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Knowledge base qidiruv indeksini qayta qurish")
+    parser.add_argument('--user-id', help="Faqat shu foydalanuvchi indeksini qurish")
+    parser.add_argument('--rechunk', action='store_true', help="Bo'laklarni qaytadan yaratish")
+    parser.add_argument('--reparse', action='store_true', help="Fayllarni uploads/knowledge/ dan qayta o'qish")
+    args = parser.parse_args()
+
+    success = rebuild_index(args.user_id, args.rechunk, args.reparse)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Shifrlash kalitini almashtirish
+Barcha encrypted_* ustunlarni (Telegram, WhatsApp, Instagram, AI sozlamalari,
+platforma credentiallari, access token keshi) joriy ENCRYPTION_KEY bilan
+partiyalab qayta shifrlaydi. To'xtatilsa keyingi ishga tushirish davom ettiradi.
+
+Oldin: ENCRYPTION_KEY=yangi_kalit, ENCRYPTION_KEY_VERSION=2,
+       ENCRYPTION_OLD_KEYS=1:eski_kalit
+
+Ishlatish:
+    python rotate_encryption_key.py                # qayta shifrlash
+    python rotate_encryption_key.py --batch 500 --pause 0.1
+    python rotate_encryption_key.py --status       # eski kalitdagi qatorlar soni
+    python rotate_encryption_key.py --reset        # kursorlarni boshidan boshlash
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+
+# Add current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+def rotate(batch=None, pause=None, show_status=False, reset=False):
+    """Qayta shifrlashni ishga tushirish"""
+    try:
+        from app import create_app
+        from utils.key_rotation import KeyRotation
+
+        overrides = {}
+        if batch:
+            overrides['CREDENTIAL_ROTATION_BATCH'] = batch
+        if pause is not None:
+            overrides['CREDENTIAL_ROTATION_PAUSE'] = pause
+        app = create_app(overrides)
+
+        with app.app_context():
+            if reset:
+                KeyRotation.reset()
+                print("🔄 Kursorlar o'chirildi")
+            if show_status:
+                print(json.dumps(KeyRotation.get_status(), indent=2))
+                return True
+
+        print(f"🔄 Key rotation started (pid {os.getpid()})")
+        signal.signal(signal.SIGTERM, lambda signum, frame: KeyRotation.stop())
+        try:
+            checked = KeyRotation.run(app)
+        except KeyboardInterrupt:
+            KeyRotation.stop()
+            print("⏸️ To'xtatildi - keyingi ishga tushirish davom ettiradi")
+            return False
+
+        with app.app_context():
+            status = KeyRotation.get_status()
+        for table_name, table_status in status.get('tables', {}).items():
+            print(f"  ✅ {table_name}: {checked.get(table_name, 0)} ta qator tekshirildi, "
+                  f"{table_status['rotated']} ta qayta shifrlandi, {table_status['failed']} ta ochilmadi, "
+                  f"{table_status['pending']} ta eski kalitda")
+        pending = sum(table_status['pending'] for table_status in status.get('tables', {}).values())
+        print("🎉 Barcha qiymatlar yangi kalitda!" if status.get('enabled') and not pending
+              else f"⚠️ {pending} ta qator hali eski kalitda")
+        return status.get('enabled', False) and not pending
+
+    except Exception as e:
+        print(f"❌ Key rotation failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Shifrlangan ustunlarni joriy ENCRYPTION_KEY bilan qayta shifrlash")
+    parser.add_argument('--batch', type=int, help="Bir partiyadagi qatorlar (CREDENTIAL_ROTATION_BATCH)")
+    parser.add_argument('--pause', type=float, help="Partiyalar orasida kutish, soniya (CREDENTIAL_ROTATION_PAUSE)")
+    parser.add_argument('--status', action='store_true', help="Holatni ko'rsatish")
+    parser.add_argument('--reset', action='store_true', help="Kursorlarni o'chirish")
+    args = parser.parse_args()
+
+    success = rotate(args.batch, args.pause, args.status, args.reset)
+    sys.exit(0 if success else 1)
@@ -1,13 +1,21 @@
 """
 Admin panel routes
 """
-from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, flash
+from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, flash, current_app
 from models.user import User, db
 from models.conversation import Conversation, Message
 from models.knowledge_base import KnowledgeBase
 from models.messaging import MessagingPlatform, PlatformCredentials
 from models.ai_config import AIConfig
 from utils.crypto_utils import CryptoUtils
+from utils.inbound_queue import InboundQueue
+from utils.ai_router import ProviderStats
+from utils.provider_guard import ProviderGuard
+from utils.prompt_builder import PromptBuilder
+from utils.prompt_prefix import PromptPrefix
+from utils.conversation_memory import ConversationMemory
+from utils.key_rotation import KeyRotation
+from utils.routing_table import RoutingTable
 from datetime import datetime, timedelta
 import uuid
 from functools import wraps
@@ -308,6 +316,60 @@ def settings():
     """Tizim sozlamalari"""
     return render_template('admin/settings.html')
 
+@admin_bp.route('/api/inbound-queue')
+@admin_required
+def inbound_queue_stats():
+    """Webhook navbati holati (chuqurlik, kechikish, backpressure) va marshrut jadvali (shu process)"""
+    try:
+        return jsonify({'success': True, 'stats': InboundQueue.get_stats(), 'routing': RoutingTable.get_stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/api/ai-providers')
+@admin_required
+def ai_provider_stats():
+    """Provayder/model bo'yicha kechikish (p95), xatolar, failover va hedge soni, circuit holati (shu process)"""
+    try:
+        return jsonify({'success': True, 'stats': ProviderStats.get_stats(), 'guards': ProviderGuard.get_stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/api/prompt-sizes')
+@admin_required
+def prompt_size_stats():
+    """Tenant bo'yicha prompt o'lchamlari: o'rtacha/eng katta token soni, kesilgan bilimlar va tarix, keshdan olingan tokenlar, suhbat xotirasi va xulosalar (shu process)"""
+    try:
+        return jsonify({'success': True, 'stats': PromptBuilder.get_stats(), 'prefixes': PromptPrefix.get_stats(),
+                        'memory': ConversationMemory.get_stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/api/key-rotation')
+@admin_required
+def key_rotation_status():
+    """Shifrlash kalitini almashtirish holati: jadval bo'yicha eski kalitdagi qatorlar va kursor"""
+    try:
+        return jsonify({'success': True, 'status': KeyRotation.get_status()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/api/key-rotation', methods=['POST'])
+@admin_required
+def start_key_rotation():
+    """Barcha shifrlangan ustunlarni joriy ENCRYPTION_KEY bilan fonda qayta shifrlash"""
+    try:
+        if not CryptoUtils.is_encryption_available():
+            return jsonify({'success': False, 'error': 'ENCRYPTION_KEY o\'rnatilmagan'}), 400
+        
+        started = KeyRotation.start(current_app._get_current_object())
+        return jsonify({
+            'success': True,
+            'started': started,
+            'message': 'Qayta shifrlash boshlandi' if started else 'Qayta shifrlash allaqachon ishlamoqda'
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @admin_bp.route('/api/broadcast', methods=['POST'])
 @admin_required
 def broadcast_message():
@@ -7,7 +7,10 @@ from models.messaging import MessagingPlatform, PlatformCredentials
 from models.conversation import Conversation, Message
 from utils.ai_handler import AIHandler
 from utils.crypto_utils import CryptoUtils
+from utils.knowledge_retriever import KnowledgeRetriever
 from utils.messaging_utils import MessagingUtils
+from utils.inbound_queue import InboundQueue, RetryableError
+from utils.messaging.telegram import TelegramHandler
 from datetime import datetime
 import uuid
 import json
@@ -38,11 +41,104 @@ def verify_whatsapp_webhook(signature, payload, verify_token):
     except:
         return False
 
+# Webhook qabuli Flask routelari va asgi.py (AsyncIngestService) uchun umumiy:
+# natija (javob, status, sarlavhalar)
+
+def queue_update(kind, platform_id, data, platform_type):
+    """Yangilanishni navbatga qo'yish; navbat to'lgan bo'lsa 503 (platforma qayta yuboradi)"""
+    success, message = InboundQueue.submit(kind, platform_id, data, platform_type)
+    if not success:
+        return {'status': 'error', 'error': message}, 503, {'Retry-After': '30'}
+    return {'status': 'ok'}, 200, {}
+
+def active_platform(platform_id, platform_type):
+    """Faol platforma (id va turi bo'yicha)"""
+    return MessagingPlatform.query.filter_by(
+        id=platform_id,
+        platform_type=platform_type,
+        is_active=True
+    ).first()
+
+def verify_subscription(platform_id, platform_type, verify_token, challenge):
+    """Webhook tasdiqlash (GET hub.challenge) -> (matn, status)"""
+    platform = active_platform(platform_id, platform_type)
+    
+    if platform:
+        credentials = platform.credentials.first()
+        if credentials and verify_token == CryptoUtils.decrypt_text(credentials.webhook_verify_token):
+            return challenge, 200
+    
+    return 'Verification failed', 403
+
+def telegram_intake(platform_id, data):
+    """Telegram yangilanishini qabul qilish"""
+    try:
+        # Platform mavjudligini tekshirish
+        platform = active_platform(platform_id, 'telegram')
+        
+        if not platform:
+            return {'error': 'Platform not found'}, 404, {}
+        
+        if not data or 'message' not in data:
+            return {'status': 'ok'}, 200, {}  # Telegram requires 200 response
+        
+        # AI javobi navbat orqali tayyorlanadi - Telegram kutib qolmaydi
+        return queue_update('platform_telegram', platform.id, data, 'telegram')
+        
+    except Exception as e:
+        print(f"Telegram webhook error: {str(e)}")
+        return {'status': 'error'}, 500, {}
+
+def whatsapp_intake(platform_id, data):
+    """WhatsApp yangilanishini qabul qilish"""
+    try:
+        # Platform tekshirish
+        platform = active_platform(platform_id, 'whatsapp')
+        
+        if not platform:
+            return {'error': 'Platform not found'}, 404, {}
+        
+        if not data or 'entry' not in data:
+            return {'status': 'ok'}, 200, {}
+        
+        return queue_update('platform_whatsapp', platform.id, data, 'whatsapp')
+        
+    except Exception as e:
+        print(f"WhatsApp webhook error: {str(e)}")
+        return {'status': 'error'}, 500, {}
+
+def instagram_intake(platform_id, data):
+    """Instagram yangilanishini qabul qilish"""
+    try:
+        # Instagram messaging webhook logic
+        # Similar to WhatsApp but for Instagram Direct Messages
+        platform = active_platform(platform_id, 'instagram')
+        
+        if not platform:
+            return {'error': 'Platform not found'}, 404, {}
+        
+        # Instagram webhook ma'lumotlarini qayta ishlash
+        # Haqiqiy implementation Instagram Graph API documentation asosida amalga oshiriladi
+        
+        return {'status': 'ok'}, 200, {}
+        
+    except Exception as e:
+        print(f"Instagram webhook error: {str(e)}")
+        return {'status': 'error'}, 500, {}
+
+def intake_response(result):
+    """(javob, status, sarlavhalar) -> Flask javobi"""
+    body, status, headers = result
+    return jsonify(body), status, headers
+
 @api_webhooks_bp.route('/telegram/<platform_id>', methods=['POST'])
 def telegram_webhook(platform_id):
     """Telegram webhook handler"""
+    return intake_response(telegram_intake(platform_id, request.get_json(silent=True)))
+
+def process_telegram_update(platform_id, data):
+    """Navbatdagi Telegram yangilanishini qayta ishlash (InboundWorker)"""
     try:
-        # Platform mavjudligini tekshirish
         platform = MessagingPlatform.query.filter_by(
             id=platform_id,
             platform_type='telegram',
@@ -50,13 +146,7 @@ def telegram_webhook(platform_id):
         ).first()
         
         if not platform:
-            return jsonify({'error': 'Platform not found'}), 404
-        
-        # Webhook data olish
-        data = request.get_json()
-        
-        if not data or 'message' not in data:
-            return jsonify({'status': 'ok'})  # Telegram requires 200 response
+            return False, "Platform not found or inactive"
         
         message_data = data['message']
         
@@ -76,7 +166,7 @@ def telegram_webhook(platform_id):
         message_text = message_data.get('text', '').strip()
         
         if not message_text:
-            return jsonify({'status': 'ok'})
+            return False, "No message text"
         
         # Platform foydalanuvchisini topish/yaratish
         user = platform.user
@@ -121,15 +211,8 @@ def telegram_webhook(platform_id):
         try:
             ai_handler = AIHandler()
             
-            # Knowledge base ma'lumotlari
-            knowledge_content = ""
-            from models.knowledge_base import KnowledgeBase
-            knowledge_files = KnowledgeBase.query.filter_by(
-                user_id=user.id, is_active=True
-            ).all()
-            for kb_file in knowledge_files:
-                if kb_file.content:
-                    knowledge_content += f"\n\n{kb_file.filename}:\n{kb_file.content}"
+            # Knowledge base dan savolga mos bo'laklar
+            knowledge_content = KnowledgeRetriever.build_context(user.id, message_text)
             
             # AI config olish
             ai_config = user.ai_configs.filter_by(is_active=True).first()
@@ -141,7 +224,8 @@ def telegram_webhook(platform_id):
                 knowledge_base_content=knowledge_content,
                 ai_provider=ai_provider,
                 model=model,
-                language='uz'  # Default til
+                language='uz',  # Default til
+                user_id=user.id
             )
             
             if ai_response.get('success'):
@@ -180,7 +264,9 @@ def telegram_webhook(platform_id):
                 db.session.commit()
                 
             else:
-                # AI xatosi - xato xabarini yuborish
+                if not InboundQueue.is_final_attempt():
+                    raise RetryableError(f"AI error: {ai_response.get('error')}")
+                # AI xatosi (oxirgi urinish) - xato xabarini yuborish
                 error_message = "Kechirasiz, hozirda javob bera olmayapman. Keyinroq qayta urinib ko'ring."
                 messaging_utils = MessagingUtils()
                 messaging_utils.send_telegram_message(platform, chat_id, error_message)
@@ -190,6 +276,9 @@ def telegram_webhook(platform_id):
         except Exception as ai_error:
             print(f"AI error in Telegram webhook: {str(ai_error)}")
             db.session.rollback()
+            if not InboundQueue.is_final_attempt():
+                # InboundQueue yozuvni qayta navbatga qo'yadi
+                raise
             
             # Xato xabarini yuborish
             error_message = "Texnik xatolik yuz berdi. Iltimos, administratorga murojaat qiling."
@@ -198,80 +287,63 @@ def telegram_webhook(platform_id):
                 messaging_utils.send_telegram_message(platform, chat_id, error_message)
             except:
                 pass
+            return False, f"AI error: {str(ai_error)}"
         
-        return jsonify({'status': 'ok'})
+        return True, "Message processed"
         
     except Exception as e:
-        print(f"Telegram webhook error: {str(e)}")
-        return jsonify({'status': 'error'}), 500
+        print(f"Telegram update processing error: {str(e)}")
+        db.session.rollback()
+        raise
 
 @api_webhooks_bp.route('/whatsapp/<platform_id>', methods=['GET', 'POST'])
 def whatsapp_webhook(platform_id):
     """WhatsApp webhook handler"""
     if request.method == 'GET':
         # WhatsApp webhook verification
-        verify_token = request.args.get('hub.verify_token')
-        challenge = request.args.get('hub.challenge')
-        
-        platform = MessagingPlatform.query.filter_by(
-            id=platform_id,
-            platform_type='whatsapp',
-            is_active=True
-        ).first()
-        
-        if platform:
-            credentials = platform.credentials.first()
-            if credentials and verify_token == CryptoUtils.decrypt_text(credentials.webhook_verify_token):
-                return challenge
-        
-        return 'Verification failed', 403
+        return verify_subscription(platform_id, 'whatsapp', request.args.get('hub.verify_token'),
+                                   request.args.get('hub.challenge'))
+    return intake_response(whatsapp_intake(platform_id, request.get_json(silent=True)))
+
+def process_whatsapp_update(platform_id, data):
+    """Navbatdagi WhatsApp yangilanishini qayta ishlash (InboundWorker)"""
+    platform = MessagingPlatform.query.filter_by(
+        id=platform_id,
+        platform_type='whatsapp',
+        is_active=True
+    ).first()
     
-    try:
-        # Platform tekshirish
-        platform = MessagingPlatform.query.filter_by(
-            id=platform_id,
-            platform_type='whatsapp',
-            is_active=True
-        ).first()
-        
-        if not platform:
-            return jsonify({'error': 'Platform not found'}), 404
-        
-        data = request.get_json()
-        
-        if not data or 'entry' not in data:
-            return jsonify({'status': 'ok'})
-        
-        for entry in data['entry']:
-            if 'changes' in entry:
-                for change in entry['changes']:
-                    if change.get('field') == 'messages' and 'value' in change:
-                        value = change['value']
-                        
-                        if 'messages' in value:
-                            for message in value['messages']:
-                                # Xabar ma'lumotlari
-                                wa_message_id = message.get('id')
-                                from_number = message.get('from')
-                                message_type = message.get('type')
-                                timestamp = message.get('timestamp')
+    if not platform:
+        return False, "Platform not found or inactive"
+    
+    processed = 0
+    for entry in data['entry']:
+        if 'changes' in entry:
+            for change in entry['changes']:
+                if change.get('field') == 'messages' and 'value' in change:
+                    value = change['value']
+                    
+                    if 'messages' in value:
+                        for message in value['messages']:
+                            # Xabar ma'lumotlari
+                            wa_message_id = message.get('id')
+                            from_number = message.get('from')
+                            message_type = message.get('type')
+                            timestamp = message.get('timestamp')
+                            
+                            # Faqat text xabarlarni qayta ishlaymiz
+                            if message_type == 'text' and 'text' in message:
+                                message_text = message['text'].get('body', '').strip()
                                 
-                                # Faqat text xabarlarni qayta ishlaymiz
-                                if message_type == 'text' and 'text' in message:
-                                    message_text = message['text'].get('body', '').strip()
-                                    
-                                    if message_text:
-                                        # Xabarni qayta ishlash
-                                        process_whatsapp_message(
-                                            platform, from_number, message_text,
-                                            wa_message_id, timestamp
-                                        )
-        
-        return jsonify({'status': 'ok'})
-        
-    except Exception as e:
-        print(f"WhatsApp webhook error: {str(e)}")
-        return jsonify({'status': 'error'}), 500
+                                if message_text:
+                                    # Xabarni qayta ishlash
+                                    process_whatsapp_message(
+                                        platform, from_number, message_text,
+                                        wa_message_id, timestamp
+                                    )
+                                    processed += 1
+    
+    return True, f"{processed} messages processed"
 
 def process_whatsapp_message(platform, from_number, message_text, wa_message_id, timestamp):
     """WhatsApp xabarini qayta ishlash"""
@@ -313,21 +385,15 @@ def process_whatsapp_message(platform, from_number, message_text, wa_message_id,
         # AI javob olish va yuborish
         ai_handler = AIHandler()
         
-        # Knowledge base
-        knowledge_content = ""
-        from models.knowledge_base import KnowledgeBase
-        knowledge_files = KnowledgeBase.query.filter_by(
-            user_id=user.id, is_active=True
-        ).all()
-        for kb_file in knowledge_files:
-            if kb_file.content:
-                knowledge_content += f"\n\n{kb_file.filename}:\n{kb_file.content}"
+        # Knowledge base dan savolga mos bo'laklar
+        knowledge_content = KnowledgeRetriever.build_context(user.id, message_text)
         
         ai_response = ai_handler.generate_response(
             message=message_text,
             knowledge_base_content=knowledge_content,
             ai_provider="gemini",
-            language='uz'
+            language='uz',
+            user_id=user.id
         )
         
         if ai_response.get('success'):
@@ -363,51 +429,20 @@ def process_whatsapp_message(platform, from_number, message_text, wa_message_id,
     except Exception as e:
         print(f"WhatsApp message processing error: {str(e)}")
         db.session.rollback()
+        raise
 
 @api_webhooks_bp.route('/instagram/<platform_id>', methods=['GET', 'POST'])
 def instagram_webhook(platform_id):
     """Instagram webhook handler"""
     if request.method == 'GET':
         # Instagram webhook verification
-        verify_token = request.args.get('hub.verify_token')
-        challenge = request.args.get('hub.challenge')
-        
-        platform = MessagingPlatform.query.filter_by(
-            id=platform_id,
-            platform_type='instagram',
-            is_active=True
-        ).first()
-        
-        if platform:
-            credentials = platform.credentials.first()
-            if credentials and verify_token == CryptoUtils.decrypt_text(credentials.webhook_verify_token):
-                return challenge
-        
-        return 'Verification failed', 403
-    
-    try:
-        # Instagram messaging webhook logic
-        # Similar to WhatsApp but for Instagram Direct Messages
-        
-        platform = MessagingPlatform.query.filter_by(
-            id=platform_id,
-            platform_type='instagram',
-            is_active=True
-        ).first()
-        
-        if not platform:
-            return jsonify({'error': 'Platform not found'}), 404
-        
-        data = request.get_json()
-        
-        # Instagram webhook ma'lumotlarini qayta ishlash
-        # Haqiqiy implementation Instagram Graph API documentation asosida amalga oshiriladi
-        
-        return jsonify({'status': 'ok'})
-        
-    except Exception as e:
-        print(f"Instagram webhook error: {str(e)}")
-        return jsonify({'status': 'error'}), 500
+        return verify_subscription(platform_id, 'instagram', request.args.get('hub.verify_token'),
+                                   request.args.get('hub.challenge'))
+    return intake_response(instagram_intake(platform_id, request.get_json(silent=True)))
+
+InboundQueue.register('platform_telegram', process_telegram_update,
+                       chat_key=TelegramHandler.chat_key, merge=TelegramHandler.merge_updates)
+InboundQueue.register('platform_whatsapp', process_whatsapp_update)
 
 @api_webhooks_bp.route('/status')
 def webhook_status():
@@ -1,21 +1,37 @@
 """
 Foydalanuvchi dashboard routes
 """
-from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, current_app
+from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, current_app, Response, stream_with_context
 from models.user import User, db
 from models.conversation import Conversation, Message
 from models.knowledge_base import KnowledgeBase
+from models.ai_config import AIConfig
 from models.messaging import MessagingPlatform, PlatformCredentials, TelegramBot, WhatsAppAccount, InstagramAccount
 from utils.ai_handler import AIHandler
 from utils.crypto_utils import CryptoUtils
 from utils.file_parser import FileParser
+from utils.knowledge_retriever import KnowledgeRetriever
+from utils.response_cache import ResponseCache
+from utils.semantic_cache import SemanticCache
+from utils.ai_router import AIRouter
+from utils.routing_table import RoutingTable
 from datetime import datetime, timedelta
 import uuid
 import os
+import json
 from functools import wraps
 
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
 
+def conversation_history(conversation_id):
+    """Suhbatning so'nggi PROMPT_HISTORY_MESSAGES ta xabari (eskisidan yangisiga)"""
+    limit = current_app.config.get('PROMPT_HISTORY_MESSAGES', 10)
+    if not conversation_id or limit <= 0:
+        return []
+    messages = Message.query.filter_by(conversation_id=conversation_id) \
+        .order_by(Message.created_at.desc(), Message.id.desc()).limit(limit).all()
+    return [{'role': m.role, 'content': m.content} for m in reversed(messages)]
+
 def login_required(f):
     """Login talab qiluvchi decorator"""
     @wraps(f)
@@ -116,7 +132,9 @@ def send_message():
             conversation = Conversation.query.filter_by(id=conversation_id, user_id=user.id).first()
             if not conversation:
                 return jsonify({'success': False, 'error': 'Suhbat topilmadi'}), 404
+            history = conversation_history(conversation.id)
         else:
+            history = []
             # Yangi suhbat yaratish
             conversation = Conversation(
                 user_id=user.id,
@@ -141,12 +159,9 @@ def send_message():
         
         # AI javob olish
         try:
-            # Knowledge base ma'lumotlarini olish
-            knowledge_content = ""
-            knowledge_files = KnowledgeBase.query.filter_by(user_id=user.id, is_active=True).all()
-            for kb_file in knowledge_files:
-                if kb_file.content:
-                    knowledge_content += f"\n\n{kb_file.filename}:\n{kb_file.content}"
+            # Knowledge base dan savolga mos bo'laklarni olish
+            knowledge_content = KnowledgeRetriever.build_context(user.id, message_text,
+                                                                 language=session.get('language', 'uz'))
             
             # AI handler orqali javob olish
             ai_handler = AIHandler()
@@ -154,7 +169,9 @@ def send_message():
                 message=message_text,
                 knowledge_base_content=knowledge_content,
                 ai_provider="gemini",  # Default
-                language=session.get('language', 'uz')
+                language=session.get('language', 'uz'),
+                user_id=user.id,
+                history=history
             )
             
             if ai_response.get('success'):
@@ -213,6 +230,145 @@ def send_message():
         db.session.rollback()
         return jsonify({'success': False, 'error': 'Server xatosi yuz berdi'}), 500
 
+@dashboard_bp.route('/api/chat/stream', methods=['POST'])
+@login_required
+def stream_message():
+    """Xabar yuborish API - AI javobi Server-Sent Events orqali bo'laklab qaytadi
+
+    Hodisalar: `start` (conversation_id, user_message), `delta` (javob
+    bo'lagi), oxirida `done` (saqlangan ai_response) yoki `error`.
+    Foydalanuvchi xabari javob kutilmasdan saqlanadi, AI javobi esa oqim
+    tugagach bitta Message sifatida yoziladi.
+    """
+    data = request.get_json(silent=True) or {}
+    message_text = (data.get('message') or '').strip()
+    conversation_id = data.get('conversation_id')
+    
+    if not message_text:
+        return jsonify({'success': False, 'error': "Xabar matni bo'sh bo'lishi mumkin emas"}), 400
+    
+    user = User.query.get(session['user_id'])
+    language = session.get('language', 'uz')
+    
+    try:
+        new_conversation = not conversation_id
+        if conversation_id:
+            conversation = Conversation.query.filter_by(id=conversation_id, user_id=user.id).first()
+            if not conversation:
+                return jsonify({'success': False, 'error': 'Suhbat topilmadi'}), 404
+            history = conversation_history(conversation.id)
+        else:
+            history = []
+            conversation = Conversation(
+                user_id=user.id,
+                title=message_text[:50] + ('...' if len(message_text) > 50 else ''),
+                platform='dashboard',
+                sender_id=str(user.id),
+                message=message_text,
+                created_at=datetime.utcnow(),
+                updated_at=datetime.utcnow()
+            )
+            db.session.add(conversation)
+            db.session.flush()
+        
+        user_message = Message(
+            conversation_id=conversation.id,
+            role='user',
+            content=message_text,
+            created_at=datetime.utcnow()
+        )
+        db.session.add(user_message)
+        # Javob yaratilayotganda tranzaksiya (SQLite da yozuvchi qulfi) ochiq qolmasligi uchun
+        db.session.commit()
+        knowledge_content = KnowledgeRetriever.build_context(user.id, message_text, language=language)
+    except Exception:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': 'Server xatosi yuz berdi'}), 500
+    
+    conversation_id, user_message_id, user_id = conversation.id, user_message.id, user.id
+    user_message_created = user_message.created_at.isoformat()
+    
+    def event(name, payload):
+        return f"event: {name}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        yield event('start', {
+            'conversation_id': conversation_id,
+            'user_message': {
+                'id': user_message_id,
+                'content': message_text,
+                'created_at': user_message_created
+            }
+        })
+        
+        result = None
+        for item in AIHandler().generate_response_stream(
+            message=message_text,
+            knowledge_base_content=knowledge_content,
+            ai_provider="gemini",  # Default
+            language=language,
+            user_id=user_id,
+            history=history
+        ):
+            if item.get('done'):
+                result = item
+            else:
+                yield event('delta', {'text': item['delta']})
+        
+        try:
+            if not result or not result.get('success'):
+                # /api/chat/send dagidek: javobsiz xabar tarixda qolmaydi
+                Message.query.filter_by(id=user_message_id).delete()
+                if new_conversation:
+                    Conversation.query.filter_by(id=conversation_id).delete()
+                db.session.commit()
+                yield event('error', {
+                    'success': False,
+                    'error': f"AI xatosi: {(result or {}).get('error', 'Nomalum xato')}"
+                })
+                return
+            
+            ai_message = Message(
+                conversation_id=conversation_id,
+                role='assistant',
+                content=result['response'],
+                created_at=datetime.utcnow(),
+                extra_data={
+                    'model_used': result.get('model_used'),
+                    'response_time': result.get('response_time'),
+                    'knowledge_used': bool(knowledge_content),
+                    'streamed': True
+                }
+            )
+            db.session.add(ai_message)
+            Conversation.query.filter_by(id=conversation_id).update({
+                'updated_at': datetime.utcnow(),
+                'message_count': Conversation.message_count + 2
+            })
+            db.session.commit()
+            
+            yield event('done', {
+                'success': True,
+                'conversation_id': conversation_id,
+                'ai_response': {
+                    'id': ai_message.id,
+                    'content': ai_message.content,
+                    'created_at': ai_message.created_at.isoformat(),
+                    'model_used': result.get('model_used'),
+                    'response_time': result.get('response_time'),
+                    'cached': bool(result.get('cached'))
+                }
+            })
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Streamed reply save error: {str(e)}")
+            yield event('error', {'success': False, 'error': 'Server xatosi yuz berdi'})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # nginx/proxy buferlamasin
+    })
+
 @dashboard_bp.route('/api/conversations')
 @login_required
 def get_conversations():
@@ -360,11 +516,13 @@ def toggle_platform(platform_id):
             bot = TelegramBot.query.filter_by(id=bot_id, user_id=user.id).first()
             if bot:
                 if activate:
-                    # Replit da webhook ishlamaydi, faqat botni faollashtirish
+                    # Replit da webhook ishlamaydi - bot telegram_poller.py (long polling) orqali ishlaydi
                     if current_app.config.get('IS_REPLIT', False):
                         bot.is_active = True
+                        bot.webhook_url = None
                         db.session.commit()
-                        return jsonify({'success': True, 'message': 'Bot faollashtirildi (Replit muhitida webhook o\'rnatish mumkin emas)'})
+                        RoutingTable.invalidate('telegram')
+                        return jsonify({'success': True, 'message': 'Bot faollashtirildi (Replit muhitida webhook o\'rniga long polling ishlatiladi)'})
                     else:
                         # Bot faollashtirilganda webhook avtomatik o'rnatish (production da)
                         from utils.messaging.telegram import TelegramHandler
@@ -380,6 +538,7 @@ def toggle_platform(platform_id):
                             bot.webhook_url = webhook_url
                             bot.is_active = True
                             db.session.commit()
+                            RoutingTable.invalidate('telegram')
                             return jsonify({'success': True, 'message': 'Bot faollashtirildi va webhook sozlandi'})
                         else:
                             return jsonify({'success': False, 'error': f'Webhook xatosi: {message}'}), 500
@@ -387,6 +546,7 @@ def toggle_platform(platform_id):
                     # Bot nofaol qilish
                     bot.is_active = False
                     db.session.commit()
+                    RoutingTable.invalidate('telegram')
                     return jsonify({'success': True, 'message': 'Bot to\'xtatildi'})
                 
         elif platform_type == 'whatsapp':
@@ -394,6 +554,7 @@ def toggle_platform(platform_id):
             if account:
                 account.is_active = activate
                 db.session.commit()
+                RoutingTable.invalidate(platform_type)
                 return jsonify({'success': True, 'message': 'Status o\'zgartirildi'})
                 
         elif platform_type == 'instagram':
@@ -401,6 +562,7 @@ def toggle_platform(platform_id):
             if account:
                 account.is_active = activate
                 db.session.commit()
+                RoutingTable.invalidate(platform_type)
                 return jsonify({'success': True, 'message': 'Status o\'zgartirildi'})
         
         return jsonify({'success': False, 'error': 'Platform topilmadi'}), 404
@@ -491,7 +653,12 @@ def upload_knowledge():
         )
         
         db.session.add(knowledge_file)
+        db.session.flush()
+        
+        # Qidiruv uchun bo'laklarga ajratish va indeksga qo'shish
+        KnowledgeRetriever.index_knowledge_file(knowledge_file)
         db.session.commit()
+        KnowledgeRetriever.sync_file_index(knowledge_file)
         
         return jsonify({
             'success': True,
@@ -528,12 +695,110 @@ def delete_knowledge(file_id):
         db.session.delete(knowledge_file)
         db.session.commit()
         
+        # Qidiruv indeksidan olib tashlash
+        KnowledgeRetriever.remove_file_index(user.id, file_id)
+        
         return jsonify({'success': True, 'message': 'Fayl muvaffaqiyatli o\'chirildi'})
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': 'Fayl o\'chirishda xato yuz berdi'}), 500
 
+@dashboard_bp.route('/knowledge/<int:file_id>/toggle', methods=['POST'])
+@login_required
+def toggle_knowledge(file_id):
+    """Faylni faol/nofaol qilish"""
+    try:
+        data = request.get_json() or {}
+        activate = bool(data.get('active', False))
+        
+        user = User.query.get(session['user_id'])
+        
+        knowledge_file = KnowledgeBase.query.filter_by(id=file_id, user_id=user.id).first()
+        if not knowledge_file:
+            return jsonify({'success': False, 'error': 'Fayl topilmadi'}), 404
+        
+        knowledge_file.is_active = activate
+        db.session.commit()
+        
+        # Indeksni faqat shu fayl uchun yangilash
+        KnowledgeRetriever.sync_file_index(knowledge_file)
+        
+        return jsonify({'success': True, 'message': 'Status o\'zgartirildi', 'is_active': knowledge_file.is_active})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': 'Fayl o\'chirishda xato yuz berdi'}), 500
+
+@dashboard_bp.route('/api/cache-stats')
+@login_required
+def cache_stats():
+    """Javob keshi statistikasi (hit/miss)"""
+    try:
+        user = User.query.get(session['user_id'])
+        return jsonify({'success': True, 'stats': ResponseCache.get_stats(user.id)})
+    except Exception as e:
+        current_app.logger.error(f"Cache stats error: {str(e)}")
+        return jsonify({'success': False, 'error': 'Statistikani olishda xato'}), 500
+
+@dashboard_bp.route('/api/semantic-cache', methods=['POST'])
+@login_required
+def semantic_cache_settings():
+    """O'xshash savollar keshi chegarasini sozlash (bo'sh - standart, 0 - o'chiq)"""
+    try:
+        user = User.query.get(session['user_id'])
+        data = request.get_json() or {}
+        threshold = data.get('threshold')
+        if threshold is not None:
+            threshold = float(threshold)
+            if threshold < 0 or threshold > 1:
+                return jsonify({'success': False, 'error': 'Chegara 0 va 1 orasida bo\'lishi kerak'}), 400
+        
+        config = AIConfig.get_or_create_for_user(user.id)
+        config.semantic_cache_threshold = threshold
+        db.session.commit()
+        SemanticCache.forget_threshold(user.id)
+        
+        return jsonify({'success': True, 'threshold': SemanticCache.get_threshold(user.id)})
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Noto\'g\'ri chegara qiymati'}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Semantic cache settings error: {str(e)}")
+        return jsonify({'success': False, 'error': 'Sozlamani saqlashda xato'}), 500
+
+@dashboard_bp.route('/api/ai-failover', methods=['POST'])
+@login_required
+def ai_failover_settings():
+    """Zaxira AI provayderini sozlash (provider bo'sh - o'chiq)"""
+    try:
+        user = User.query.get(session['user_id'])
+        data = request.get_json() or {}
+        provider = data.get('fallback_provider') or None
+        model = data.get('fallback_model') or None
+        
+        config = AIConfig.get_or_create_for_user(user.id)
+        if provider is not None:
+            if provider not in ('gemini', 'openai'):
+                return jsonify({'success': False, 'error': 'Noto\'g\'ri provayder'}), 400
+            if provider == 'openai' and not config.encrypted_openai_api_key:
+                return jsonify({'success': False, 'error': 'OpenAI API kaliti saqlanmagan'}), 400
+            if model and model not in AIHandler.get_available_models(provider):
+                return jsonify({'success': False, 'error': 'Noto\'g\'ri model'}), 400
+        
+        config.fallback_provider = provider
+        config.fallback_model = model if provider else None
+        config.hedge_requests = bool(data.get('hedge_requests', False)) and provider is not None
+        config.updated_at = datetime.utcnow()
+        db.session.commit()
+        AIRouter.forget_plan(user.id)
+        
+        return jsonify({'success': True, 'config': config.to_dict()})
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"AI failover settings error: {str(e)}")
+        return jsonify({'success': False, 'error': 'Sozlamani saqlashda xato'}), 500
+
 @dashboard_bp.route('/knowledge/<int:file_id>/view')
 @login_required
 def view_knowledge(file_id):
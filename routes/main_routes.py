@@ -2,7 +2,8 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, login_user, logout_user, current_user
 from werkzeug.utils import secure_filename
 from models.user import db, User
-from utils.ai_handler import get_ai_response
+from utils.ai_handler import get_ai_result
+from utils.conversation_memory import ConversationMemory
 import os
 from datetime import datetime
 
@@ -92,23 +93,25 @@ def send_message():
     if not user_input:
         return jsonify({'reply': "Xabar bo'sh bo'lmasligi kerak."})
 
-    # Get chat history from session
-    history = session.get('chat_history', [])
-    context = "\n".join([f"Foydalanuvchi: {h['user']}\nAI: {h['bot']}" for h in history[-3:]]) if history else ""
-
-    reply = get_ai_response(user_input, context)
-    
-    # Update chat history
-    history.append({"user": user_input, "bot": reply})
-    session['chat_history'] = history[-10:]  # Keep last 10 messages
+    # Chat tarixi server tomonida (session cookie da emas)
+    history = ConversationMemory.history('web', None, current_user.id, current_user.id)
+    result = get_ai_result(user_input, "", history)
+    reply = result['response']
+    if result.get('success'):
+        # AI xato xabari suhbat tarixiga kirmasin
+        ConversationMemory.append('web', None, current_user.id, current_user.id, user_input, reply,
+                                  sender_name=current_user.full_name)
 
     return jsonify({'reply': reply})
 
 @main_bp.route('/chat/history')
 @login_required
 def get_chat_history():
-    history = session.get('chat_history', [])
-    return jsonify(history)
+    turns = ConversationMemory.turns('web', None, current_user.id, current_user.id)
+    history = [{'user': turn['content'], 'bot': reply['content']}
+               for turn, reply in zip(turns, turns[1:])
+               if turn['role'] == 'user' and reply['role'] == 'assistant']
+    return jsonify(history[-10:])
 
 @main_bp.route('/knowledge', methods=['GET', 'POST'])
 @login_required
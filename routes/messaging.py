@@ -5,6 +5,8 @@ from models.user import User, db
 from utils.messaging.telegram import TelegramHandler
 from utils.messaging.whatsapp import WhatsAppHandler
 from utils.messaging.instagram import InstagramHandler
+from utils.inbound_queue import InboundQueue
+from utils.routing_table import RoutingTable
 from functools import wraps
 import logging
 
@@ -42,40 +44,141 @@ def messaging_redirect():
     """Messaging sahifasidan dashboard/platforms ga yo'naltirish"""
     return redirect(url_for('dashboard.messaging_platforms'))
 
-# ===== TELEGRAM WEBHOOK ROUTES =====
+# ===== INBOUND QUEUE HANDLERS =====
+# Webhooklar yangilanishni navbatga qo'yadi, javobni InboundWorker (yoki asgi.py dispetcheri) tayyorlaydi
 
-@messaging_bp.route('/telegram/webhook/<int:user_id>', methods=['POST'])
-def telegram_webhook(user_id):
-    """Handle incoming Telegram webhook updates"""
+InboundQueue.register('telegram_bot', lambda bot_id, data: TelegramHandler.process_webhook_update(int(bot_id), data),
+                       chat_key=TelegramHandler.chat_key, merge=TelegramHandler.merge_updates,
+                       async_handler=lambda bot_id, data: TelegramHandler.aprocess_webhook_update(int(bot_id), data))
+InboundQueue.register('whatsapp_account', lambda account_id, data: WhatsAppHandler.process_webhook_message(int(account_id), data),
+                       async_handler=lambda account_id, data: WhatsAppHandler.aprocess_webhook_message(int(account_id), data))
+InboundQueue.register('instagram_account', lambda account_id, data: InstagramHandler.process_webhook_update(int(account_id), data),
+                       async_handler=lambda account_id, data: InstagramHandler.aprocess_webhook_update(int(account_id), data))
+
+# ===== WEBHOOK INTAKE =====
+# Flask routelari va asgi.py (AsyncIngestService) uchun umumiy: (javob, status, sarlavhalar)
+
+def queue_update(kind, target_id, data, platform):
+    """Yangilanishni navbatga qo'yish; navbat to'lgan bo'lsa platforma keyinroq qayta yuboradi"""
+    success, message = InboundQueue.submit(kind, target_id, data, platform)
+    if not success:
+        return {'error': message}, 503, {'Retry-After': '30'}
+    return {'status': 'success', 'message': message}, 200, {}
+
+def verify_subscription(args):
+    """Meta webhook tasdiqlash (GET hub.challenge) -> (matn, status)"""
+    mode = args.get('hub.mode')
+    token = args.get('hub.verify_token')
+    challenge = args.get('hub.challenge')
+    
+    # In production, verify the token against stored values
+    if mode == 'subscribe' and token and challenge:
+        return challenge, 200
+    
+    return 'Verification failed', 403
+
+def telegram_intake(user_id, update_data):
+    """Telegram yangilanishini qabul qilish"""
     try:
-        # Get JSON data from request
-        update_data = request.get_json()
         if not update_data:
-            return jsonify({'error': 'No JSON data provided'}), 400
+            return {'error': 'No JSON data provided'}, 400, {}
         
-        # Find active bot for this user
-        bot = TelegramBot.query.filter_by(
-            user_id=user_id, 
-            is_active=True
-        ).first()
+        # Find active bot for this user (marshrut jadvalidan)
+        bot = RoutingTable.resolve('telegram', user_id)
         
         if not bot:
             logger.warning(f"No active Telegram bot found for user {user_id}")
-            return jsonify({'error': 'Bot not found or inactive'}), 404
+            return {'error': 'Bot not found or inactive'}, 404, {}
         
-        # Process the update
-        success, message = TelegramHandler.process_webhook_update(bot.id, update_data)
+        # Matnli xabarsiz yangilanishlar (tahrirlash, callback) qayta ishlanmaydi
+        if not update_data.get('message'):
+            return {'status': 'success', 'message': 'Ignored'}, 200, {}
         
-        if success:
-            logger.info(f"Telegram webhook processed successfully for bot {bot.id}")
-            return jsonify({'status': 'success', 'message': message}), 200
-        else:
-            logger.error(f"Telegram webhook processing failed: {message}")
-            return jsonify({'error': message}), 400
+        # Javob navbat orqali tayyorlanadi - Telegram kutib qolmaydi
+        return queue_update('telegram_bot', bot.account_id, update_data, 'telegram')
             
     except Exception as e:
         logger.error(f"Telegram webhook error: {str(e)}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return {'error': 'Internal server error'}, 500, {}
+
+def whatsapp_intake(webhook_data):
+    """WhatsApp yangilanishini qabul qilish"""
+    try:
+        if not webhook_data:
+            return {'error': 'No JSON data provided'}, 400, {}
+        
+        # Extract phone number ID to find the account
+        entry = webhook_data.get('entry', [])
+        if not entry:
+            return {'error': 'No entry in webhook data'}, 400, {}
+        
+        changes = entry[0].get('changes', [])
+        if not changes:
+            return {'error': 'No changes in entry'}, 400, {}
+        
+        value = changes[0].get('value', {})
+        metadata = value.get('metadata', {})
+        phone_number_id = metadata.get('phone_number_id', '')
+        
+        if not phone_number_id:
+            return {'error': 'No phone number ID found'}, 400, {}
+        
+        # Find account by phone number ID (marshrut jadvalidan)
+        account = RoutingTable.resolve('whatsapp', phone_number_id)
+        
+        if not account:
+            logger.warning(f"No active WhatsApp account found for phone number {phone_number_id}")
+            return {'error': 'Account not found or inactive'}, 404, {}
+        
+        # Status yangilanishlari (delivered, read) da xabar bo'lmaydi
+        if not value.get('messages'):
+            return {'status': 'success'}, 200, {}
+        
+        return queue_update('whatsapp_account', account.account_id, webhook_data, 'whatsapp')
+            
+    except Exception as e:
+        logger.error(f"WhatsApp webhook error: {str(e)}")
+        return {'error': 'Internal server error'}, 500, {}
+
+def instagram_intake(webhook_data):
+    """Instagram yangilanishini qabul qilish"""
+    try:
+        if not webhook_data:
+            return {'error': 'No JSON data provided'}, 400, {}
+        
+        # Extract page ID to find the account
+        entry = webhook_data.get('entry', [])
+        if not entry:
+            return {'error': 'No entry in webhook data'}, 400, {}
+        
+        page_id = entry[0].get('id', '')
+        if not page_id:
+            return {'error': 'No page ID found'}, 400, {}
+        
+        # Find account by page ID (marshrut jadvalidan)
+        account = RoutingTable.resolve('instagram', page_id)
+        
+        if not account:
+            logger.warning(f"No active Instagram account found for page {page_id}")
+            return {'error': 'Account not found or inactive'}, 404, {}
+        
+        return queue_update('instagram_account', account.account_id, webhook_data, 'instagram')
+            
+    except Exception as e:
+        logger.error(f"Instagram webhook error: {str(e)}")
+        return {'error': 'Internal server error'}, 500, {}
+
+def intake_response(result):
+    """(javob, status, sarlavhalar) -> Flask javobi"""
+    body, status, headers = result
+    return jsonify(body), status, headers
+
+# ===== TELEGRAM WEBHOOK ROUTES =====
+
+@messaging_bp.route('/telegram/webhook/<int:user_id>', methods=['POST'])
+def telegram_webhook(user_id):
+    """Handle incoming Telegram webhook updates"""
+    return intake_response(telegram_intake(user_id, request.get_json(silent=True)))
 
 @messaging_bp.route('/telegram/set-webhook', methods=['POST'])
 @login_required
@@ -119,6 +222,7 @@ def set_telegram_webhook():
             bot.webhook_url = webhook_url
             bot.is_active = True
             db.session.commit()
+            RoutingTable.invalidate('telegram')
             
             return jsonify({
                 'status': 'success',
@@ -137,124 +241,20 @@ def set_telegram_webhook():
 @messaging_bp.route('/whatsapp/webhook', methods=['GET', 'POST'])
 def whatsapp_webhook():
     """Handle WhatsApp Business API webhooks"""
-    
     if request.method == 'GET':
         # Webhook verification (challenge)
-        mode = request.args.get('hub.mode')
-        token = request.args.get('hub.verify_token')
-        challenge = request.args.get('hub.challenge')
-        
-        # Find account with this verify token
-        # Note: In production, you should have a more secure way to handle this
-        if mode == 'subscribe' and token and challenge:
-            # For simplicity, we'll return the challenge
-            # In production, verify against stored verify_token
-            return challenge, 200
-        
-        return 'Verification failed', 403
-    
-    else:  # POST request
-        try:
-            webhook_data = request.get_json()
-            if not webhook_data:
-                return jsonify({'error': 'No JSON data provided'}), 400
-            
-            # Extract phone number ID to find the account
-            entry = webhook_data.get('entry', [])
-            if not entry:
-                return jsonify({'error': 'No entry in webhook data'}), 400
-            
-            changes = entry[0].get('changes', [])
-            if not changes:
-                return jsonify({'error': 'No changes in entry'}), 400
-            
-            value = changes[0].get('value', {})
-            metadata = value.get('metadata', {})
-            phone_number_id = metadata.get('phone_number_id', '')
-            
-            if not phone_number_id:
-                return jsonify({'error': 'No phone number ID found'}), 400
-            
-            # Find account by phone number ID
-            account = WhatsAppAccount.query.filter_by(
-                phone_number_id=phone_number_id,
-                is_active=True
-            ).first()
-            
-            if not account:
-                logger.warning(f"No active WhatsApp account found for phone number {phone_number_id}")
-                return jsonify({'error': 'Account not found or inactive'}), 404
-            
-            # Process the message
-            success, message = WhatsAppHandler.process_webhook_message(account.id, webhook_data)
-            
-            if success:
-                logger.info(f"WhatsApp webhook processed successfully for account {account.id}")
-                return jsonify({'status': 'success'}), 200
-            else:
-                logger.error(f"WhatsApp webhook processing failed: {message}")
-                return jsonify({'error': message}), 400
-                
-        except Exception as e:
-            logger.error(f"WhatsApp webhook error: {str(e)}")
-            return jsonify({'error': 'Internal server error'}), 500
+        return verify_subscription(request.args)
+    return intake_response(whatsapp_intake(request.get_json(silent=True)))
 
 # ===== INSTAGRAM WEBHOOK ROUTES =====
 
 @messaging_bp.route('/instagram/webhook', methods=['GET', 'POST'])
 def instagram_webhook():
     """Handle Instagram Graph API webhooks"""
-    
     if request.method == 'GET':
         # Webhook verification
-        mode = request.args.get('hub.mode')
-        token = request.args.get('hub.verify_token')
-        challenge = request.args.get('hub.challenge')
-        
-        if mode == 'subscribe' and token and challenge:
-            # In production, verify the token against stored values
-            return challenge, 200
-        
-        return 'Verification failed', 403
-    
-    else:  # POST request
-        try:
-            webhook_data = request.get_json()
-            if not webhook_data:
-                return jsonify({'error': 'No JSON data provided'}), 400
-            
-            # Extract page ID to find the account
-            entry = webhook_data.get('entry', [])
-            if not entry:
-                return jsonify({'error': 'No entry in webhook data'}), 400
-            
-            page_id = entry[0].get('id', '')
-            if not page_id:
-                return jsonify({'error': 'No page ID found'}), 400
-            
-            # Find account by page ID
-            account = InstagramAccount.query.filter_by(
-                page_id=page_id,
-                is_active=True
-            ).first()
-            
-            if not account:
-                logger.warning(f"No active Instagram account found for page {page_id}")
-                return jsonify({'error': 'Account not found or inactive'}), 404
-            
-            # Process the update
-            success, message = InstagramHandler.process_webhook_update(account.id, webhook_data)
-            
-            if success:
-                logger.info(f"Instagram webhook processed successfully for account {account.id}")
-                return jsonify({'status': 'success'}), 200
-            else:
-                logger.error(f"Instagram webhook processing failed: {message}")
-                return jsonify({'error': message}), 400
-                
-        except Exception as e:
-            logger.error(f"Instagram webhook error: {str(e)}")
-            return jsonify({'error': 'Internal server error'}), 500
+        return verify_subscription(request.args)
+    return intake_response(instagram_intake(request.get_json(silent=True)))
 
 # ===== BOT MANAGEMENT ROUTES =====
 
@@ -350,12 +350,14 @@ def save_telegram_bot():
         # Create new bot
         bot = TelegramBot(
             user_id=user.id,
-            bot_name=bot_name
+            bot_name=bot_name,
+            stream_replies=bool(data.get('stream_replies', False))
         )
         bot.set_token(bot_token)
         
         db.session.add(bot)
         db.session.commit()
+        RoutingTable.invalidate('telegram')
         
         return jsonify({'success': True, 'message': 'Bot saved successfully'}), 200
         
@@ -364,6 +366,31 @@ def save_telegram_bot():
         logger.error(f"Save Telegram bot error: {str(e)}")
         return jsonify({'error': 'Failed to save bot'}), 500
 
+@messaging_bp.route('/api/bots/telegram/<int:bot_id>/streaming', methods=['POST'])
+@login_required
+def set_telegram_streaming(bot_id):
+    """Javobni yozilish davomida ko'rsatish (editMessageText) rejimini yoqish/o'chirish"""
+    try:
+        data = request.get_json() or {}
+        bot = TelegramBot.query.filter_by(
+            id=bot_id,
+            user_id=session['user_id']
+        ).first()
+        
+        if not bot:
+            return jsonify({'error': 'Bot not found'}), 404
+        
+        bot.stream_replies = bool(data.get('enabled', not bot.stream_replies))
+        db.session.commit()
+        RoutingTable.invalidate('telegram')
+        
+        return jsonify({'success': True, 'stream_replies': bot.stream_replies}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Telegram streaming setting error: {str(e)}")
+        return jsonify({'error': 'Failed to update bot'}), 500
+
 @messaging_bp.route('/api/bots/whatsapp/save', methods=['POST'])
 @login_required
 def save_whatsapp_account():
@@ -392,6 +419,7 @@ def save_whatsapp_account():
         
         db.session.add(account)
         db.session.commit()
+        RoutingTable.invalidate('whatsapp')
         
         return jsonify({'success': True, 'message': 'Account saved successfully'}), 200
         
@@ -426,6 +454,7 @@ def save_instagram_account():
         
         db.session.add(account)
         db.session.commit()
+        RoutingTable.invalidate('instagram')
         
         return jsonify({'success': True, 'message': 'Account saved successfully'}), 200
         
@@ -449,8 +478,10 @@ def delete_telegram_bot(bot_id):
         if not bot:
             return jsonify({'error': 'Bot not found'}), 404
         
+        bot.forget_credentials()
         db.session.delete(bot)
         db.session.commit()
+        RoutingTable.invalidate('telegram')
         
         return jsonify({'success': True, 'message': 'Bot deleted successfully'}), 200
         
@@ -472,8 +503,10 @@ def delete_whatsapp_account(account_id):
         if not account:
             return jsonify({'error': 'Account not found'}), 404
         
+        account.forget_credentials()
         db.session.delete(account)
         db.session.commit()
+        RoutingTable.invalidate('whatsapp')
         
         return jsonify({'success': True, 'message': 'Account deleted successfully'}), 200
         
@@ -495,8 +528,10 @@ def delete_instagram_account(account_id):
         if not account:
             return jsonify({'error': 'Account not found'}), 404
         
+        account.forget_credentials()
         db.session.delete(account)
         db.session.commit()
+        RoutingTable.invalidate('instagram')
         
         return jsonify({'success': True, 'message': 'Account deleted successfully'}), 200
         
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Telegram long polling
+Webhook o'rnatilmagan barcha faol Telegram botlar uchun getUpdates ni
+bitta processda polling qiladi va yangilanishlarni webhook bilan bir xil
+navbatga (inbound_updates) beradi.
+
+Botlar dashboardda yoqilganda/o'chirilganda avtomatik qo'shiladi va
+to'xtatiladi (TELEGRAM_POLLING_REFRESH soniyada bir marta).
+
+Ishlatish:
+    python telegram_poller.py
+"""
+import asyncio
+import logging
+import os
+import signal
+import sys
+
+# Add current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+def run_poller():
+    """Pollerni to'xtatilguncha ishlatish"""
+    try:
+        from app import create_app
+        from utils.telegram_poller import TelegramPoller
+
+        app = create_app()
+        poller = TelegramPoller(app)
+        # Har bir getUpdates so'rovi loglanmasin (botlar ko'p bo'lsa)
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sig, poller.stop)
+            await poller.run()
+
+        print(f"🔄 Telegram poller started (pid {os.getpid()})")
+        asyncio.run(main())
+        print("👋 Telegram poller stopped")
+        return True
+
+    except Exception as e:
+        print(f"❌ Telegram poller failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+if __name__ == "__main__":
+    success = run_poller()
+    sys.exit(0 if success else 1)
@@ -1,9 +1,16 @@
-import google.generativeai as genai
 import openai
 from flask import current_app
 import json
 import time
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Iterator, List
+from utils.response_cache import ResponseCache
+from utils.semantic_cache import SemanticCache
+from utils.llm_clients import LLMClientRegistry
+from utils.ai_router import AIRouter
+from utils.provider_guard import ProviderGuard
+from utils.prompt_builder import PromptBuilder
+from utils.prompt_prefix import PromptPrefix
+from utils.async_runtime import AsyncRuntime
 
 class AIHandler:
     """Dual AI handler - Gemini va OpenAI"""
@@ -13,8 +20,7 @@ class AIHandler:
     
     def setup_gemini(self):
         """Gemini AI ni sozlash"""
-        if current_app.config.get('GEMINI_API_KEY'):
-            genai.configure(api_key=current_app.config['GEMINI_API_KEY'])
+        LLMClientRegistry.configure_gemini(current_app.config.get('GEMINI_API_KEY'))
         
     def setup_openai(self, api_key: str):
         """OpenAI ni sozlash"""
@@ -22,7 +28,8 @@ class AIHandler:
     
     def generate_response(self, message: str, knowledge_base_content: str = "", 
                          ai_provider: str = "gemini", model: str = None,
-                         openai_api_key: str = None, language: str = "uz") -> Dict[str, Any]:
+                         openai_api_key: str = None, language: str = "uz",
+                         user_id: str = None, history: List[Dict[str, str]] = None) -> Dict[str, Any]:
         """
         AI javob yaratish
         
@@ -33,23 +40,49 @@ class AIHandler:
             model: AI model nomi
             openai_api_key: OpenAI API kalit (agar OpenAI ishlatilsa)
             language: Javob tili (uz, ru, en)
+            user_id: Tenant ID si - berilsa javob keshi ishlatiladi
+            history: Oldingi xabarlar [{'role': 'user'|'assistant'|'system', 'content'}] -
+                     eskisidan yangisiga; byudjetga sig'magan eng eskilari tashlanadi
+                     ('system' - suhbat xulosasi, ConversationMemory). Tarix bo'lsa
+                     javob keshi ishlatilmaydi - javob shu suhbat kontekstiga bog'liq
             
         Returns:
-            Dict: {'response': str, 'success': bool, 'error': str, 'provider': str, 'response_time': float}
+            Dict: {'response': str, 'success': bool, 'error': str, 'provider': str,
+                   'response_time': float, 'cached': bool, 'similarity': float}
         """
         start_time = time.time()
+        provider, model = self._resolve_provider(ai_provider, model, openai_api_key)
+        
+        cacheable = self._is_cacheable(user_id, history)
         
         try:
-            if ai_provider == "openai" and openai_api_key:
-                return self._generate_openai_response(
-                    message, knowledge_base_content, model or "gpt-4o-mini", 
-                    openai_api_key, language, start_time
-                )
-            else:
+            if cacheable:
+                cached = self._cached_result(user_id, message, language, provider, model, start_time)
+                if cached:
+                    return cached
+            
+            def call(call_provider, call_model, api_key):
+                if call_provider == "openai":
+                    return self._generate_openai_response(
+                        message, knowledge_base_content, call_model, 
+                        api_key, language, start_time, history, user_id
+                    )
                 return self._generate_gemini_response(
-                    message, knowledge_base_content, model or "gemini-1.5-flash", 
-                    language, start_time
+                    message, knowledge_base_content, call_model, 
+                    language, start_time, history, user_id
                 )
+            
+            # Tenant zaxira provayderi sozlagan bo'lsa failover / hedge
+            fallback = AIRouter.get_plan(user_id) if user_id else None
+            result = AIRouter.execute(call, provider, model, openai_api_key, fallback)
+            if not result.get('success'):
+                raise Exception(result.get('error'))
+            
+            if cacheable:
+                # Failover bo'lsa javobni yozgan model kaliti ostida
+                self._store_cached(user_id, message, language, result.get('provider', provider),
+                                   result.get('model_used', model), result['response'])
+            return result
                 
         except Exception as e:
             return {
@@ -60,17 +93,142 @@ class AIHandler:
                 'response_time': time.time() - start_time
             }
     
+    def generate_response_stream(self, message: str, knowledge_base_content: str = "",
+                                 ai_provider: str = "gemini", model: str = None,
+                                 openai_api_key: str = None, language: str = "uz",
+                                 user_id: str = None,
+                                 history: List[Dict[str, str]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        AI javobini bo'laklab yaratish (SDK larning streaming API si orqali)
+        
+        Argumentlar generate_response bilan bir xil.
+        
+        Yields:
+            Dict: {'delta': str} - javobning navbatdagi bo'lagi;
+                  oxirida generate_response natijasi bilan bir xil lug'at
+                  ('done': True bilan, 'response' - to'liq matn)
+        """
+        start_time = time.time()
+        provider, model = self._resolve_provider(ai_provider, model, openai_api_key)
+        parts = []
+        cacheable = self._is_cacheable(user_id, history)
+        
+        try:
+            if cacheable:
+                cached = self._cached_result(user_id, message, language, provider, model, start_time)
+                if cached:
+                    yield {'delta': cached['response']}
+                    yield dict(cached, done=True)
+                    return
+            
+            def open_stream(call_provider, call_model, api_key):
+                if call_provider == "openai":
+                    return self._stream_openai_response(message, knowledge_base_content, call_model,
+                                                        api_key, language, history, user_id)
+                return self._stream_gemini_response(message, knowledge_base_content, call_model, language,
+                                                    history, user_id)
+            
+            # Zaxira provayder bo'lsa failover / hedge birinchi bo'lakkacha
+            fallback = AIRouter.get_plan(user_id) if user_id else None
+            stream = AIRouter.execute_stream(open_stream, provider, model, openai_api_key, fallback)
+            
+            for chunk in stream['chunks']:
+                if chunk:
+                    parts.append(chunk)
+                    yield {'delta': chunk}
+            
+            response = ''.join(parts)
+            if not response.strip():
+                raise Exception(f"{stream['provider']} bo'sh javob qaytardi")
+            
+            if cacheable:
+                self._store_cached(user_id, message, language, stream['provider'], stream['model_used'], response)
+            yield {
+                'done': True,
+                'response': response,
+                'success': True,
+                'error': None,
+                'provider': stream['provider'],
+                'model_used': stream['model_used'],
+                'failover': stream['failover'],
+                'hedged': stream['hedged'],
+                'response_time': time.time() - start_time
+            }
+            
+        except Exception as e:
+            yield {
+                'done': True,
+                'response': self._get_error_message(language),
+                'partial_response': ''.join(parts),
+                'success': False,
+                'error': str(e),
+                'provider': ai_provider,
+                'response_time': time.time() - start_time
+            }
+    
+    def _resolve_provider(self, ai_provider: str, model: Optional[str], openai_api_key: Optional[str]):
+        """(provider, model) - OpenAI kaliti bo'lmasa Gemini ishlatiladi"""
+        if ai_provider == "openai" and openai_api_key:
+            return "openai", model or "gpt-4o-mini"
+        return "gemini", model or "gemini-1.5-flash"
+    
+    @staticmethod
+    def _is_cacheable(user_id: Optional[str], history: Optional[List[Dict[str, str]]]) -> bool:
+        """Javob keshi (aynan va semantik) ishlatiladimi
+        
+        Suhbat tarixi yoki xulosasi bo'lsa javob faqat shu suhbatga tegishli
+        ("narxi qancha?" kabi davom savollari) - u boshqa suhbatga berilmasin
+        va keshdagi kontekstsiz javob ham bu suhbatga qaytarilmasin.
+        """
+        if not user_id or not getattr(history, 'complete', True):
+            return False  # complete=False - ConversationMemory chatni yuklay olmadi
+        return not any(item.get('content') for item in history or []
+                       if item.get('role') in ('user', 'assistant', 'system'))
+    
+    def _cached_result(self, user_id: str, message: str, language: str, provider: str,
+                       model: str, start_time: float) -> Optional[Dict[str, Any]]:
+        """Javob keshi (aynan yoki semantik moslik) - topilmasa None"""
+        cached = ResponseCache.get(user_id, message, language, provider, model)
+        similarity = 1.0
+        if cached is None:
+            # Aynan shu savol yo'q - qayta ifodalangan savolni qidirish
+            near_duplicate = SemanticCache.lookup(user_id, message, language, provider, model)
+            if near_duplicate:
+                cached, similarity = near_duplicate
+        if cached is None:
+            return None
+        return {
+            'response': cached,
+            'success': True,
+            'error': None,
+            'provider': provider,
+            'response_time': time.time() - start_time,
+            'cached': True,
+            'similarity': similarity
+        }
+    
+    @staticmethod
+    def _store_cached(user_id: str, message: str, language: str, provider: str, model: str,
+                      response: str) -> None:
+        """Javobni aynan va semantik keshga yozish"""
+        ResponseCache.set(user_id, message, language, provider, model, response)
+        SemanticCache.add(user_id, message, language, provider, model, response)
+    
     def _generate_gemini_response(self, message: str, knowledge_base: str, 
-                                 model: str, language: str, start_time: float) -> Dict[str, Any]:
+                                 model: str, language: str, start_time: float,
+                                 history: List[Dict[str, str]] = None, user_id: str = None) -> Dict[str, Any]:
         """Gemini AI bilan javob yaratish"""
         try:
-            genai_model = genai.GenerativeModel(model)
+            genai_model = LLMClientRegistry.gemini_model(model)
             
-            # Prompt yaratish
-            prompt = self._build_prompt(message, knowledge_base, language)
+            # Prompt yaratish (model kontekst byudjetiga moslab)
+            prompt = self._build_prompt(message, knowledge_base, language, model, history, user_id)
             
-            # AI dan javob olish
-            response = genai_model.generate_content(prompt)
+            # AI dan javob olish (circuit ochiq bo'lsa darhol rad etiladi)
+            with ProviderGuard.call('gemini'):
+                response = genai_model.generate_content(
+                    prompt, request_options={'timeout': current_app.config.get('AI_REQUEST_TIMEOUT', 60.0)}
+                )
             
             return {
                 'response': response.text,
@@ -84,27 +242,32 @@ class AIHandler:
             raise Exception(f"Gemini API xato: {str(e)}")
     
     def _generate_openai_response(self, message: str, knowledge_base: str, 
-                                 model: str, api_key: str, language: str, start_time: float) -> Dict[str, Any]:
+                                 model: str, api_key: str, language: str, start_time: float,
+                                 history: List[Dict[str, str]] = None, user_id: str = None) -> Dict[str, Any]:
         """OpenAI bilan javob yaratish (v1.0.0+ API)"""
         try:
-            from openai import OpenAI
+            # Shu kalit uchun umumiy client (ulanishlar puli qayta ishlatiladi)
+            client = LLMClientRegistry.openai_client(api_key)
             
-            # OpenAI client yaratish
-            client = OpenAI(api_key=api_key)
+            # Prompt yaratish (model kontekst byudjetiga moslab)
+            built = self._build_messages(message, knowledge_base, language, model, history, user_id)
             
-            # Prompt yaratish
-            system_prompt = self._build_system_prompt(knowledge_base, language)
+            # OpenAI dan javob olish (circuit ochiq bo'lsa darhol rad etiladi)
+            with ProviderGuard.call(ProviderGuard.circuit_name('openai', api_key)):
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=built['messages'],
+                    max_tokens=built['max_output_tokens'],
+                    temperature=0.7,
+                    timeout=current_app.config.get('AI_REQUEST_TIMEOUT', 60.0)
+                )
             
-            # OpenAI dan javob olish
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": message}
-                ],
-                max_tokens=1500,
-                temperature=0.7
-            )
+            # Prefiks keshidan olingan tokenlar (OpenAI avtomatik keshlaydi)
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                details = getattr(usage, 'prompt_tokens_details', None)
+                PromptBuilder.record_usage(user_id, usage.prompt_tokens,
+                                           getattr(details, 'cached_tokens', 0) if details else 0)
             
             return {
                 'response': response.choices[0].message.content,
@@ -117,8 +280,295 @@ class AIHandler:
         except Exception as e:
             raise Exception(f"OpenAI API xato: {str(e)}")
     
-    def _build_system_prompt(self, knowledge_base: str, language: str) -> str:
-        """AI uchun system prompt yaratish"""
+    def _stream_gemini_response(self, message: str, knowledge_base: str,
+                                model: str, language: str, history: List[Dict[str, str]] = None,
+                                user_id: str = None) -> Iterator[str]:
+        """Gemini javobi bo'laklari"""
+        try:
+            genai_model = LLMClientRegistry.gemini_model(model)
+            prompt = self._build_prompt(message, knowledge_base, language, model, history, user_id)
+            with ProviderGuard.call('gemini'):
+                for chunk in genai_model.generate_content(prompt, stream=True):
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Matnsiz bo'lak (masalan, faqat finish_reason)
+                        continue
+                    yield text
+        except Exception as e:
+            raise Exception(f"Gemini API xato: {str(e)}")
+    
+    def _stream_openai_response(self, message: str, knowledge_base: str,
+                                model: str, api_key: str, language: str,
+                                history: List[Dict[str, str]] = None, user_id: str = None) -> Iterator[str]:
+        """OpenAI javobi bo'laklari"""
+        try:
+            client = LLMClientRegistry.openai_client(api_key)
+            built = self._build_messages(message, knowledge_base, language, model, history, user_id)
+            with ProviderGuard.call(ProviderGuard.circuit_name('openai', api_key)):
+                stream = client.chat.completions.create(
+                    model=model,
+                    messages=built['messages'],
+                    max_tokens=built['max_output_tokens'],
+                    temperature=0.7,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                    elif getattr(chunk, 'usage', None) is not None:
+                        # Oxirgi bo'lak: token hisobi (keshdan olinganlari bilan)
+                        details = getattr(chunk.usage, 'prompt_tokens_details', None)
+                        PromptBuilder.record_usage(user_id, chunk.usage.prompt_tokens,
+                                                   getattr(details, 'cached_tokens', 0) if details else 0)
+        except Exception as e:
+            raise Exception(f"OpenAI API xato: {str(e)}")
+    
+    # ===== ASINXRON (asgi.py) =====
+    
+    async def agenerate_response(self, message: str, knowledge_base_content: str = "",
+                                 ai_provider: str = "gemini", model: str = None,
+                                 openai_api_key: str = None, language: str = "uz",
+                                 user_id: str = None, history: List[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        generate_response ning asinxron varianti (AsyncOpenAI, Gemini generate_content_async)
+        
+        Argumentlar va natija generate_response bilan bir xil. Kesh, tenant
+        rejasi va prompt yig'ish (DB) AsyncRuntime thread pulida.
+        """
+        start_time = time.time()
+        provider, model = self._resolve_provider(ai_provider, model, openai_api_key)
+        
+        cacheable = self._is_cacheable(user_id, history)
+        
+        try:
+            if cacheable:
+                cached = await AsyncRuntime.run(self._cached_result, user_id, message, language,
+                                                provider, model, start_time)
+                if cached:
+                    return cached
+            
+            async def call(call_provider, call_model, api_key):
+                if call_provider == "openai":
+                    return await self._agenerate_openai_response(
+                        message, knowledge_base_content, call_model,
+                        api_key, language, start_time, history, user_id
+                    )
+                return await self._agenerate_gemini_response(
+                    message, knowledge_base_content, call_model,
+                    language, start_time, history, user_id
+                )
+            
+            fallback = await AsyncRuntime.run(AIRouter.get_plan, user_id) if user_id else None
+            result = await AIRouter.aexecute(call, provider, model, openai_api_key, fallback)
+            if not result.get('success'):
+                raise Exception(result.get('error'))
+            
+            if cacheable:
+                await AsyncRuntime.run(self._store_cached, user_id, message, language,
+                                       result.get('provider', provider), result.get('model_used', model),
+                                       result['response'])
+            return result
+                
+        except Exception as e:
+            return {
+                'response': self._get_error_message(language),
+                'success': False,
+                'error': str(e),
+                'provider': ai_provider,
+                'response_time': time.time() - start_time
+            }
+    
+    async def agenerate_response_stream(self, message: str, knowledge_base_content: str = "",
+                                        ai_provider: str = "gemini", model: str = None,
+                                        openai_api_key: str = None, language: str = "uz",
+                                        user_id: str = None,
+                                        history: List[Dict[str, str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """generate_response_stream ning asinxron varianti (hodisalar bir xil)"""
+        start_time = time.time()
+        provider, model = self._resolve_provider(ai_provider, model, openai_api_key)
+        parts = []
+        cacheable = self._is_cacheable(user_id, history)
+        
+        try:
+            if cacheable:
+                cached = await AsyncRuntime.run(self._cached_result, user_id, message, language,
+                                                provider, model, start_time)
+                if cached:
+                    yield {'delta': cached['response']}
+                    yield dict(cached, done=True)
+                    return
+            
+            def open_stream(call_provider, call_model, api_key):
+                if call_provider == "openai":
+                    return self._astream_openai_response(message, knowledge_base_content, call_model,
+                                                         api_key, language, history, user_id)
+                return self._astream_gemini_response(message, knowledge_base_content, call_model, language,
+                                                     history, user_id)
+            
+            fallback = await AsyncRuntime.run(AIRouter.get_plan, user_id) if user_id else None
+            stream = await AIRouter.aexecute_stream(open_stream, provider, model, openai_api_key, fallback)
+            
+            try:
+                async for chunk in stream['chunks']:
+                    if chunk:
+                        parts.append(chunk)
+                        yield {'delta': chunk}
+            finally:
+                await stream['chunks'].aclose()
+            
+            response = ''.join(parts)
+            if not response.strip():
+                raise Exception(f"{stream['provider']} bo'sh javob qaytardi")
+            
+            if cacheable:
+                await AsyncRuntime.run(self._store_cached, user_id, message, language,
+                                       stream['provider'], stream['model_used'], response)
+            yield {
+                'done': True,
+                'response': response,
+                'success': True,
+                'error': None,
+                'provider': stream['provider'],
+                'model_used': stream['model_used'],
+                'failover': stream['failover'],
+                'hedged': stream['hedged'],
+                'response_time': time.time() - start_time
+            }
+            
+        except Exception as e:
+            yield {
+                'done': True,
+                'response': self._get_error_message(language),
+                'partial_response': ''.join(parts),
+                'success': False,
+                'error': str(e),
+                'provider': ai_provider,
+                'response_time': time.time() - start_time
+            }
+    
+    async def _agenerate_gemini_response(self, message: str, knowledge_base: str,
+                                         model: str, language: str, start_time: float,
+                                         history: List[Dict[str, str]] = None,
+                                         user_id: str = None) -> Dict[str, Any]:
+        """Gemini AI bilan javob yaratish (asinxron)"""
+        try:
+            genai_model = LLMClientRegistry.gemini_model(model)
+            prompt = await AsyncRuntime.run(self._build_prompt, message, knowledge_base, language, model,
+                                            history, user_id)
+            
+            async with ProviderGuard.acall('gemini'):
+                response = await genai_model.generate_content_async(
+                    prompt, request_options={'timeout': current_app.config.get('AI_REQUEST_TIMEOUT', 60.0)}
+                )
+            
+            return {
+                'response': response.text,
+                'success': True,
+                'error': None,
+                'provider': 'gemini',
+                'response_time': time.time() - start_time
+            }
+            
+        except Exception as e:
+            raise Exception(f"Gemini API xato: {str(e)}")
+    
+    async def _agenerate_openai_response(self, message: str, knowledge_base: str,
+                                         model: str, api_key: str, language: str, start_time: float,
+                                         history: List[Dict[str, str]] = None,
+                                         user_id: str = None) -> Dict[str, Any]:
+        """OpenAI bilan javob yaratish (AsyncOpenAI)"""
+        try:
+            client = LLMClientRegistry.openai_async_client(api_key)
+            built = await AsyncRuntime.run(self._build_messages, message, knowledge_base, language, model,
+                                           history, user_id)
+            
+            async with ProviderGuard.acall(ProviderGuard.circuit_name('openai', api_key)):
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=built['messages'],
+                    max_tokens=built['max_output_tokens'],
+                    temperature=0.7,
+                    timeout=current_app.config.get('AI_REQUEST_TIMEOUT', 60.0)
+                )
+            
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                details = getattr(usage, 'prompt_tokens_details', None)
+                PromptBuilder.record_usage(user_id, usage.prompt_tokens,
+                                           getattr(details, 'cached_tokens', 0) if details else 0)
+            
+            return {
+                'response': response.choices[0].message.content,
+                'success': True,
+                'error': None,
+                'provider': 'openai',
+                'response_time': time.time() - start_time
+            }
+            
+        except Exception as e:
+            raise Exception(f"OpenAI API xato: {str(e)}")
+    
+    async def _astream_gemini_response(self, message: str, knowledge_base: str,
+                                       model: str, language: str, history: List[Dict[str, str]] = None,
+                                       user_id: str = None) -> AsyncIterator[str]:
+        """Gemini javobi bo'laklari (asinxron)"""
+        try:
+            genai_model = LLMClientRegistry.gemini_model(model)
+            prompt = await AsyncRuntime.run(self._build_prompt, message, knowledge_base, language, model,
+                                            history, user_id)
+            async with ProviderGuard.acall('gemini'):
+                response = await genai_model.generate_content_async(prompt, stream=True)
+                async for chunk in response:
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        continue
+                    yield text
+        except Exception as e:
+            raise Exception(f"Gemini API xato: {str(e)}")
+    
+    async def _astream_openai_response(self, message: str, knowledge_base: str,
+                                       model: str, api_key: str, language: str,
+                                       history: List[Dict[str, str]] = None,
+                                       user_id: str = None) -> AsyncIterator[str]:
+        """OpenAI javobi bo'laklari (AsyncOpenAI)"""
+        try:
+            client = LLMClientRegistry.openai_async_client(api_key)
+            built = await AsyncRuntime.run(self._build_messages, message, knowledge_base, language, model,
+                                           history, user_id)
+            async with ProviderGuard.acall(ProviderGuard.circuit_name('openai', api_key)):
+                stream = await client.chat.completions.create(
+                    model=model,
+                    messages=built['messages'],
+                    max_tokens=built['max_output_tokens'],
+                    temperature=0.7,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                try:
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
+                        elif getattr(chunk, 'usage', None) is not None:
+                            details = getattr(chunk.usage, 'prompt_tokens_details', None)
+                            PromptBuilder.record_usage(user_id, chunk.usage.prompt_tokens,
+                                                       getattr(details, 'cached_tokens', 0) if details else 0)
+                finally:
+                    # Oqim o'rtasida to'xtatilsa (hedge yutqazdi) HTTP javob yopiladi
+                    await stream.close()
+        except Exception as e:
+            raise Exception(f"OpenAI API xato: {str(e)}")
+    
+    def _build_system_prompt(self, knowledge_base: str, language: str, use_knowledge: bool = False) -> str:
+        """
+        AI uchun system prompt yaratish
+        
+        Args:
+            knowledge_base: System promptga qo'yiladigan (o'zgarmas) bilimlar
+            use_knowledge: Bilimlar foydalanuvchi xabari bilan keladi - qoidalar kerak
+        """
         
         # Til bo'yicha yo'riqnomalar
         language_instructions = {
@@ -141,13 +591,11 @@ If the knowledge base doesn't contain the answer, help using your general knowle
         
         instruction = language_instructions.get(language, language_instructions['uz'])
         
-        if knowledge_base:
+        if knowledge_base or use_knowledge:
+            knowledge_block = f"\nBILIMLAR BAZASI:\n{knowledge_base}\n" if knowledge_base else ""
             system_prompt = f"""
 {instruction}
-
-BILIMLAR BAZASI:
-{knowledge_base}
-
+{knowledge_block}
 QOIDALAR:
 1. Avval bilimlar bazasini tekshir
 2. Agar javob bor bo'lsa, uni ishlatib javob ber
@@ -164,10 +612,52 @@ Foydalanuvchiga yordam ber va javobni {language} tilida ber.
         
         return system_prompt
     
-    def _build_prompt(self, message: str, knowledge_base: str, language: str) -> str:
-        """Gemini uchun prompt yaratish (backward compatibility)"""
-        system_prompt = self._build_system_prompt(knowledge_base, language)
-        return f"{system_prompt}\n\nFOYDALANUVCHI SAVOLI: {message}"
+    def _assemble_prompt(self, provider: str, message: str, knowledge_base: str, language: str, model: str,
+                         history: List[Dict[str, str]] = None, user_id: str = None) -> Dict[str, Any]:
+        """
+        Prompt qismlari: avval tenant uchun o'zgarmas qism, keyin o'zgaruvchilari
+        
+        System prompt (yo'riqnoma va provayder keshlaydigan bo'lsa butun
+        bilimlar bazasi) tenantning barcha xabarlari uchun bir xil - provayder
+        uni prefiks sifatida keshlay oladi. Savolga mos bilimlar esa tarixdan
+        keyin, savol bilan birga yuboriladi.
+        """
+        pinned = PromptPrefix.knowledge(user_id, provider)
+        # Prefiks byudjetning yarmidan oshmasin - tarix va savolga joy qolsin
+        if pinned and PromptBuilder.estimate_tokens(pinned, model) * 2 > PromptBuilder.input_budget(model):
+            pinned = ""
+        if pinned:
+            knowledge_base = ""  # Butun baza system promptda
+        system = self._build_system_prompt(pinned, language, use_knowledge=bool(knowledge_base))
+        return PromptBuilder.build(system, message, knowledge_base, model, history, user_id)
+    
+    @staticmethod
+    def _question_text(built: Dict[str, Any]) -> str:
+        """Savol (va unga mos bilimlar)"""
+        if built['knowledge']:
+            return f"BILIMLAR BAZASI:{built['knowledge']}\n\nFOYDALANUVCHI SAVOLI: {built['message']}"
+        return built['message']
+    
+    def _build_prompt(self, message: str, knowledge_base: str, language: str, model: str = "gemini-1.5-flash",
+                      history: List[Dict[str, str]] = None, user_id: str = None) -> str:
+        """Gemini uchun prompt yaratish (bitta matn: yo'riqnoma, suhbat tarixi, savol)"""
+        built = self._assemble_prompt('gemini', message, knowledge_base, language, model, history, user_id)
+        labels = {'user': 'FOYDALANUVCHI: ', 'assistant': 'AI: ', 'system': ''}
+        transcript = "\n".join(f"{labels.get(item['role'], '')}{item['content']}" for item in built['history'])
+        history_block = f"\n\nSUHBAT TARIXI:\n{transcript}" if transcript else ""
+        question = self._question_text(built)
+        if not built['knowledge']:
+            question = f"FOYDALANUVCHI SAVOLI: {question}"
+        return f"{built['system']}{history_block}\n\n{question}"
+    
+    def _build_messages(self, message: str, knowledge_base: str, language: str, model: str,
+                        history: List[Dict[str, str]] = None, user_id: str = None) -> Dict[str, Any]:
+        """OpenAI uchun xabarlar ro'yxati va javob uchun qolgan token limiti"""
+        built = self._assemble_prompt('openai', message, knowledge_base, language, model, history, user_id)
+        messages = [{"role": "system", "content": built['system']}]
+        messages.extend({"role": item['role'], "content": item['content']} for item in built['history'])
+        messages.append({"role": "user", "content": self._question_text(built)})
+        return {'messages': messages, 'max_output_tokens': built['max_output_tokens']}
     
     def _get_error_message(self, language: str) -> str:
         """Xato xabarlari"""
@@ -202,13 +692,67 @@ Foydalanuvchiga yordam ber va javobni {language} tilida ber.
             return ["gpt-4o", "gpt-4o-mini", "gpt-4-turbo", "gpt-3.5-turbo"]
         return []
 
+def get_ai_result(prompt, context="", history=None):
+    """AI javobi to'liq natija bilan (AIHandler.generate_response lug'ati)
+
+    context matn yoki User obyekti bo'lishi mumkin; User berilsa, uning
+    bilimlar bazasidan savolga mos bo'laklar olinadi. history -
+    ConversationMemory.history() natijasi (mazmunli tarix bo'lsa yoki chat
+    yuklanmagan bo'lsa javob keshi ishlatilmaydi - AIHandler._is_cacheable).
+    success=False bo'lsa 'response' - xato xabari, uni xotiraga qo'shmang.
+    """
+    user_id = None
+    if context and not isinstance(context, str):
+        from utils.knowledge_retriever import KnowledgeRetriever
+        user_id = context.id
+        context = KnowledgeRetriever.build_context(user_id, prompt)
+
+    return AIHandler().generate_response(prompt, context, user_id=user_id, history=history)
+
 # Backward compatibility uchun eski funksiyalarni saqlash
-def get_ai_response(prompt, context=""):
-    """Eski AI funksiya - backward compatibility uchun"""
-    handler = AIHandler()
-    result = handler.generate_response(prompt, context)
+def get_ai_response(prompt, context="", history=None):
+    """Eski AI funksiya - backward compatibility uchun (faqat javob matni, get_ai_result)"""
+    result = get_ai_result(prompt, context, history)
     return result.get('response', 'Kechirasiz, AI hozir ishlamayapti.')
 
+def get_ai_response_stream(prompt, context="", history=None):
+    """get_ai_response ning bo'laklab ishlaydigan varianti
+
+    Yields:
+        Dict: AIHandler.generate_response_stream hodisalari
+    """
+    user_id = None
+    if context and not isinstance(context, str):
+        from utils.knowledge_retriever import KnowledgeRetriever
+        user_id = context.id
+        context = KnowledgeRetriever.build_context(user_id, prompt)
+
+    return AIHandler().generate_response_stream(prompt, context, user_id=user_id, history=history)
+
+async def aget_ai_result(prompt, context="", history=None):
+    """get_ai_result ning asinxron varianti (asgi.py) - bilimlar bazasi thread pulida o'qiladi"""
+    user_id = None
+    if context and not isinstance(context, str):
+        from utils.knowledge_retriever import KnowledgeRetriever
+        user_id = context.id
+        context = await AsyncRuntime.run(KnowledgeRetriever.build_context, user_id, prompt)
+
+    return await AIHandler().agenerate_response(prompt, context, user_id=user_id, history=history)
+
+async def aget_ai_response_stream(prompt, context="", history=None):
+    """get_ai_response_stream ning asinxron varianti
+
+    Returns:
+        AsyncIterator: AIHandler.agenerate_response_stream hodisalari
+    """
+    user_id = None
+    if context and not isinstance(context, str):
+        from utils.knowledge_retriever import KnowledgeRetriever
+        user_id = context.id
+        context = await AsyncRuntime.run(KnowledgeRetriever.build_context, user_id, prompt)
+
+    return AIHandler().agenerate_response_stream(prompt, context, user_id=user_id, history=history)
+
 def load_knowledge_base():
     """Eski knowledge base funksiya - backward compatibility uchun"""
     return ""  # Yangi tizimda database orqali amalga oshiriladi
\ No newline at end of file
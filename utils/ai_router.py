@@ -0,0 +1,525 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+from flask import current_app
+from models.ai_config import AIConfig
+
+class ProviderStats:
+    """Provayder/model bo'yicha kechikish va xatolar statistikasi (process ichida)
+
+    So'nggi AI_LATENCY_WINDOW ta muvaffaqiyatli javob vaqtidan p95
+    hisoblanadi; hedge so'rovi muddati shunga moslashadi.
+    """
+
+    # (provider, model) -> {'latencies': deque, 'outcomes': deque, 'requests', 'errors', 'hedged', 'failovers'}
+    _stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    _lock = threading.Lock()
+
+    MIN_SAMPLES = 20  # p95 shuncha namunadan keyin ishonchli
+
+    @staticmethod
+    def _entry(provider: str, model: str) -> Dict[str, Any]:
+        key = (provider, model)
+        entry = ProviderStats._stats.get(key)
+        if entry is None:
+            window = current_app.config.get('AI_LATENCY_WINDOW', 200)
+            entry = ProviderStats._stats[key] = {
+                'latencies': deque(maxlen=window),
+                'outcomes': deque(maxlen=window),
+                'requests': 0, 'errors': 0, 'hedged': 0, 'failovers': 0
+            }
+        return entry
+
+    @staticmethod
+    def record(provider: str, model: str, latency: float, success: bool) -> None:
+        with ProviderStats._lock:
+            entry = ProviderStats._entry(provider, model)
+            entry['requests'] += 1
+            entry['outcomes'].append(success)
+            if success:
+                entry['latencies'].append(latency)
+            else:
+                entry['errors'] += 1
+
+    @staticmethod
+    def count(provider: str, model: str, counter: str) -> None:
+        with ProviderStats._lock:
+            ProviderStats._entry(provider, model)[counter] += 1
+
+    @staticmethod
+    def p95(provider: str, model: str) -> Optional[float]:
+        with ProviderStats._lock:
+            latencies = sorted(ProviderStats._entry(provider, model)['latencies'])
+        if len(latencies) < ProviderStats.MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    @staticmethod
+    def error_rate(provider: str, model: str) -> float:
+        with ProviderStats._lock:
+            outcomes = list(ProviderStats._entry(provider, model)['outcomes'])
+        if not outcomes:
+            return 0.0
+        return outcomes.count(False) / len(outcomes)
+
+    @staticmethod
+    def hedge_delay(provider: str, model: str) -> float:
+        """
+        Ikkinchi (hedge) so'rov yuborish muddati
+
+        p95 kechikish (namuna kam bo'lsa AI_HEDGE_DEFAULT_DELAY); xatolar
+        ulushi oshgani sari muddat qisqaradi - ishonchsiz provayder uchun
+        zaxira tezroq ishga tushadi.
+        """
+        config = current_app.config
+        delay = ProviderStats.p95(provider, model) or config.get('AI_HEDGE_DEFAULT_DELAY', 8.0)
+        delay *= 1 - ProviderStats.error_rate(provider, model)
+        return max(config.get('AI_HEDGE_MIN_DELAY', 1.0), min(delay, config.get('AI_FAILOVER_TIMEOUT', 30.0)))
+
+    @staticmethod
+    def get_stats() -> Dict[str, Any]:
+        """Admin panel uchun: provider:model -> ko'rsatkichlar"""
+        result = {}
+        for provider, model in list(ProviderStats._stats):
+            entry = ProviderStats._stats[(provider, model)]
+            p95 = ProviderStats.p95(provider, model)
+            result[f"{provider}:{model}"] = {
+                'requests': entry['requests'],
+                'errors': entry['errors'],
+                'error_rate': round(ProviderStats.error_rate(provider, model), 4),
+                'p95_seconds': round(p95, 3) if p95 is not None else None,
+                'hedge_delay_seconds': round(ProviderStats.hedge_delay(provider, model), 3),
+                'hedged': entry['hedged'],
+                'failovers': entry['failovers']
+            }
+        return result
+
+class _StreamStart:
+    """Bitta provayder oqimining boshlanishi: birinchi bo'lakkacha (thread pulida)
+
+    Yutqazgan oqim yopiladi: birinchi bo'lak kelib bo'lgan bo'lsa
+    abandon() chaqirgan thread da, hali kelmagan bo'lsa kelgan zahoti
+    pul threadida - ProviderGuard joyi bo'shatiladi.
+    """
+
+    def __init__(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+        self.chunks: Optional[Iterator[str]] = None
+        self.first: Optional[str] = None
+        self.error: Optional[str] = None
+        self.abandoned = False
+        self.lock = threading.Lock()
+
+    def run(self, app, open_stream: Callable, api_key: Optional[str]) -> '_StreamStart':
+        with app.app_context():
+            chunks = None
+            try:
+                chunks = open_stream(self.provider, self.model, api_key)
+                first = next((chunk for chunk in chunks if chunk), None)
+                if first is None:
+                    raise Exception(f"{self.provider} bo'sh javob qaytardi")
+            except Exception as e:
+                self.error = str(e)
+                ProviderStats.record(self.provider, self.model, 0.0, False)
+                return self
+            with self.lock:
+                if not self.abandoned:
+                    self.chunks, self.first = chunks, first
+                    return self
+            chunks.close()
+        return self
+
+    def abandon(self) -> None:
+        with self.lock:
+            self.abandoned = True
+            chunks, self.chunks = self.chunks, None
+        if chunks is not None:
+            chunks.close()
+
+    def iterate(self) -> Iterator[str]:
+        yield self.first
+        yield from self.chunks
+
+class AIRouter:
+    """Asosiy va zaxira provayder o'rtasida so'rovni boshqarish
+
+    Tenantning AIConfig.fallback_provider / fallback_model sozlamasi bo'lsa:
+    - Asosiy provayder xato qaytarsa - darhol zaxiraga o'tiladi (failover)
+    - Asosiy javob muddatida kelmasa zaxiraga ham so'rov yuboriladi va
+      birinchi kelgan muvaffaqiyatli javob qaytariladi. Muddat:
+      hedge_requests yoqilgan bo'lsa p95 kechikish (ProviderStats.hedge_delay),
+      aks holda AI_FAILOVER_TIMEOUT.
+
+    SDK chaqiruvlarini to'xtatib bo'lmaydi: yutqazgan so'rov natijasi
+    tashlab yuboriladi, uning davomiyligi AI_REQUEST_TIMEOUT bilan cheklangan.
+    Oqimli javoblarda (execute_stream) failover va hedge faqat birinchi
+    bo'lakkacha - foydalanuvchiga matn ketgandan keyin provayder almashmaydi.
+
+    aexecute / aexecute_stream - asinxron variantlar (asgi.py): so'rovlar
+    event loop vazifalari, yutqazgani bekor qilinadi (ulanish yopiladi).
+    """
+
+    # user_id -> (o'qilgan vaqt, reja), LRU tartibida (AI_ROUTER_PLAN_CACHE_SIZE)
+    _plans: 'OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]' = OrderedDict()
+    _executor: Optional[ThreadPoolExecutor] = None
+    _lock = threading.Lock()
+
+    PLAN_TTL = 60  # soniya
+
+    @staticmethod
+    def _get_executor() -> ThreadPoolExecutor:
+        if AIRouter._executor is None:
+            with AIRouter._lock:
+                if AIRouter._executor is None:
+                    AIRouter._executor = ThreadPoolExecutor(
+                        max_workers=current_app.config.get('AI_ROUTER_THREADS', 32),
+                        thread_name_prefix='ai-router'
+                    )
+        return AIRouter._executor
+
+    # ===== TENANT REJASI =====
+
+    @staticmethod
+    def get_plan(user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Tenantning zaxira provayderi
+
+        Returns:
+            Optional[Dict]: {'provider', 'model', 'api_key', 'hedge'} yoki
+                            zaxira sozlanmagan bo'lsa None
+        """
+        key = str(user_id)
+        now = time.monotonic()
+        with AIRouter._lock:
+            cached = AIRouter._plans.get(key)
+            if cached and now - cached[0] < AIRouter.PLAN_TTL:
+                AIRouter._plans.move_to_end(key)
+                return cached[1]
+
+        plan = None
+        config = AIConfig.query.filter_by(user_id=user_id).order_by(AIConfig.updated_at.desc()).first()
+        if config and config.fallback_provider in ('gemini', 'openai'):
+            api_key = config.get_openai_key() if config.fallback_provider == 'openai' else None
+            if config.fallback_provider == 'gemini' or api_key:
+                default_model = config.gemini_model if config.fallback_provider == 'gemini' else config.openai_model
+                plan = {
+                    'provider': config.fallback_provider,
+                    'model': config.fallback_model or default_model,
+                    'api_key': api_key,
+                    'hedge': bool(config.hedge_requests)
+                }
+
+        with AIRouter._lock:
+            AIRouter._plans[key] = (now, plan)
+            AIRouter._plans.move_to_end(key)
+            while len(AIRouter._plans) > current_app.config.get('AI_ROUTER_PLAN_CACHE_SIZE', 10000):
+                AIRouter._plans.popitem(last=False)
+        return plan
+
+    @staticmethod
+    def forget_plan(user_id: str) -> None:
+        """AIConfig o'zgarganda keshlangan rejani o'chirish"""
+        with AIRouter._lock:
+            AIRouter._plans.pop(str(user_id), None)
+
+    # ===== BAJARISH =====
+
+    @staticmethod
+    def _timed(app, call: Callable, provider: str, model: str, api_key: Optional[str]) -> Dict[str, Any]:
+        """Bitta provayder chaqiruvi (thread pulida) - natija va statistika"""
+        started = time.time()
+        with app.app_context():
+            try:
+                result = call(provider, model, api_key)
+            except Exception as e:
+                result = {'success': False, 'error': str(e), 'provider': provider}
+            ProviderStats.record(provider, model, time.time() - started, bool(result.get('success')))
+        result.setdefault('model_used', model)
+        return result
+
+    @staticmethod
+    def execute(call: Callable, provider: str, model: str, api_key: Optional[str],
+                fallback: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        So'rovni bajarish (zaxira bilan)
+
+        Args:
+            call: call(provider, model, api_key) -> generate_response natijasi;
+                  muvaffaqiyatsizlikda istisno yoki success=False
+            fallback: get_plan() natijasi
+
+        Returns:
+            Dict: G'olib javob ('failover', 'hedged' belgilari bilan)
+        """
+        app = current_app._get_current_object()
+        if not fallback or (fallback['provider'], fallback['model']) == (provider, model):
+            return AIRouter._timed(app, call, provider, model, api_key)
+
+        config = current_app.config
+        deadline = ProviderStats.hedge_delay(provider, model) if fallback['hedge'] \
+            else config.get('AI_FAILOVER_TIMEOUT', 30.0)
+        overall = config.get('AI_REQUEST_TIMEOUT', 60.0)
+        started = time.time()
+
+        executor = AIRouter._get_executor()
+        primary = executor.submit(AIRouter._timed, app, call, provider, model, api_key)
+        done, _ = wait([primary], timeout=deadline)
+        if done and primary.result().get('success'):
+            return primary.result()
+
+        # Xato yoki muddat o'tdi - zaxira provayder
+        hedged = not done
+        ProviderStats.count(provider, model, 'hedged' if hedged else 'failovers')
+        secondary = executor.submit(AIRouter._timed, app, call, fallback['provider'],
+                                    fallback['model'], fallback['api_key'])
+        pending = {secondary} | ({primary} if hedged else set())
+        last_error = primary.result() if done else None
+        while pending:
+            remaining = overall - (time.time() - started)
+            done, pending = wait(pending, timeout=max(0.0, remaining), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                result = future.result()
+                if result.get('success'):
+                    for other in pending:
+                        other.cancel()  # Hali boshlanmagan bo'lsa; boshlangani tashlab yuboriladi
+                    result['failover'] = future is secondary
+                    result['hedged'] = hedged
+                    return result
+                last_error = result
+
+        return last_error or {'success': False, 'error': f"AI providers timed out after {overall}s",
+                              'provider': provider}
+
+    @staticmethod
+    def execute_stream(open_stream: Callable, provider: str, model: str, api_key: Optional[str],
+                       fallback: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Oqimni boshlash (zaxira bilan): birinchi bo'lak kelguncha execute kabi
+
+        Args:
+            open_stream: open_stream(provider, model, api_key) -> matn bo'laklari iteratori
+            fallback: get_plan() natijasi
+
+        Returns:
+            Dict: {'chunks': iterator, 'provider', 'model_used', 'failover', 'hedged'}
+
+        Raises:
+            Exception: hech bir provayder birinchi bo'lakni bermadi
+        """
+        if not fallback or (fallback['provider'], fallback['model']) == (provider, model):
+            return {'chunks': open_stream(provider, model, api_key), 'provider': provider,
+                    'model_used': model, 'failover': False, 'hedged': False}
+
+        app = current_app._get_current_object()
+        config = current_app.config
+        deadline = ProviderStats.hedge_delay(provider, model) if fallback['hedge'] \
+            else config.get('AI_FAILOVER_TIMEOUT', 30.0)
+        overall = config.get('AI_REQUEST_TIMEOUT', 60.0)
+        started = time.time()
+
+        executor = AIRouter._get_executor()
+        primary_start = _StreamStart(provider, model)
+        primary = executor.submit(primary_start.run, app, open_stream, api_key)
+        done, _ = wait([primary], timeout=deadline)
+        if done and primary_start.chunks is not None:
+            return AIRouter._stream_result(primary_start, False, False)
+
+        # Xato yoki birinchi bo'lak kechikdi - zaxira provayder
+        hedged = not done
+        ProviderStats.count(provider, model, 'hedged' if hedged else 'failovers')
+        secondary_start = _StreamStart(fallback['provider'], fallback['model'])
+        secondary = executor.submit(secondary_start.run, app, open_stream, fallback['api_key'])
+        starts = {secondary: secondary_start, primary: primary_start}
+        pending = {secondary} | ({primary} if hedged else set())
+        last_error = primary_start.error
+        while pending:
+            remaining = overall - (time.time() - started)
+            done, pending = wait(pending, timeout=max(0.0, remaining), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                start = starts[future]
+                if start.chunks is not None:
+                    for other, other_start in starts.items():
+                        if other is not future:
+                            other.cancel()  # Hali boshlanmagan bo'lsa
+                            other_start.abandon()
+                    return AIRouter._stream_result(start, future is secondary, hedged)
+                last_error = start.error
+
+        for future in pending:
+            future.cancel()
+            starts[future].abandon()
+        raise Exception(last_error or f"AI providers timed out after {overall}s")
+
+    @staticmethod
+    def _stream_result(start: _StreamStart, failover: bool, hedged: bool) -> Dict[str, Any]:
+        return {'chunks': start.iterate(), 'provider': start.provider, 'model_used': start.model,
+                'failover': failover, 'hedged': hedged}
+
+    # ===== ASINXRON (asgi.py) =====
+
+    @staticmethod
+    async def _atimed(call: Callable, provider: str, model: str, api_key: Optional[str]) -> Dict[str, Any]:
+        """_timed ning asinxron varianti"""
+        started = time.time()
+        try:
+            result = await call(provider, model, api_key)
+        except Exception as e:
+            result = {'success': False, 'error': str(e), 'provider': provider}
+        ProviderStats.record(provider, model, time.time() - started, bool(result.get('success')))
+        result.setdefault('model_used', model)
+        return result
+
+    @staticmethod
+    async def aexecute(call: Callable, provider: str, model: str, api_key: Optional[str],
+                       fallback: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        execute() ning asinxron varianti
+
+        Args:
+            call: async call(provider, model, api_key) -> generate_response natijasi
+            fallback: get_plan() natijasi
+        """
+        if not fallback or (fallback['provider'], fallback['model']) == (provider, model):
+            return await AIRouter._atimed(call, provider, model, api_key)
+
+        config = current_app.config
+        deadline = ProviderStats.hedge_delay(provider, model) if fallback['hedge'] \
+            else config.get('AI_FAILOVER_TIMEOUT', 30.0)
+        overall = config.get('AI_REQUEST_TIMEOUT', 60.0)
+        started = time.time()
+
+        primary = asyncio.ensure_future(AIRouter._atimed(call, provider, model, api_key))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=deadline)
+            if done and primary.result().get('success'):
+                return primary.result()
+
+            # Xato yoki muddat o'tdi - zaxira provayder
+            hedged = not done
+            ProviderStats.count(provider, model, 'hedged' if hedged else 'failovers')
+            secondary = asyncio.ensure_future(AIRouter._atimed(call, fallback['provider'],
+                                                               fallback['model'], fallback['api_key']))
+            pending = {secondary} | ({primary} if hedged else set())
+            last_error = primary.result() if done else None
+            while pending:
+                remaining = overall - (time.time() - started)
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, remaining),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    result = task.result()
+                    if result.get('success'):
+                        result['failover'] = task is secondary
+                        result['hedged'] = hedged
+                        return result
+                    last_error = result
+        finally:
+            # Yutqazgan yoki muddati o'tgan so'rov to'xtatiladi, ProviderGuard joyi bo'shaydi
+            for task in pending:
+                task.cancel()
+
+        return last_error or {'success': False, 'error': f"AI providers timed out after {overall}s",
+                              'provider': provider}
+
+    @staticmethod
+    async def _astart(open_stream: Callable, provider: str, model: str,
+                      api_key: Optional[str]) -> Tuple[AsyncIterator[str], str]:
+        """Oqimni birinchi bo'lakkacha ochish -> (qolgan bo'laklar, birinchi bo'lak)"""
+        chunks = open_stream(provider, model, api_key)
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    return chunks, chunk
+            raise Exception(f"{provider} bo'sh javob qaytardi")
+        except BaseException as e:
+            await chunks.aclose()
+            if isinstance(e, Exception):
+                ProviderStats.record(provider, model, 0.0, False)
+            raise
+
+    @staticmethod
+    async def _aiterate(chunks: AsyncIterator[str], first: str) -> AsyncIterator[str]:
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    @staticmethod
+    async def aexecute_stream(open_stream: Callable, provider: str, model: str, api_key: Optional[str],
+                              fallback: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        execute_stream() ning asinxron varianti
+
+        Args:
+            open_stream: open_stream(provider, model, api_key) -> matn bo'laklari (async iterator)
+            fallback: get_plan() natijasi
+
+        Returns:
+            Dict: {'chunks': async iterator, 'provider', 'model_used', 'failover', 'hedged'}
+
+        Raises:
+            Exception: hech bir provayder birinchi bo'lakni bermadi
+        """
+        if not fallback or (fallback['provider'], fallback['model']) == (provider, model):
+            return {'chunks': open_stream(provider, model, api_key), 'provider': provider,
+                    'model_used': model, 'failover': False, 'hedged': False}
+
+        config = current_app.config
+        deadline = ProviderStats.hedge_delay(provider, model) if fallback['hedge'] \
+            else config.get('AI_FAILOVER_TIMEOUT', 30.0)
+        overall = config.get('AI_REQUEST_TIMEOUT', 60.0)
+        started = time.time()
+
+        primary = asyncio.ensure_future(AIRouter._astart(open_stream, provider, model, api_key))
+        starts = {primary: (provider, model)}
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=deadline)
+            if done and primary.exception() is None:
+                return AIRouter._astream_result(primary, provider, model, False, False)
+
+            # Xato yoki birinchi bo'lak kechikdi - zaxira provayder
+            hedged = not done
+            ProviderStats.count(provider, model, 'hedged' if hedged else 'failovers')
+            secondary = asyncio.ensure_future(AIRouter._astart(open_stream, fallback['provider'],
+                                                               fallback['model'], fallback['api_key']))
+            starts[secondary] = (fallback['provider'], fallback['model'])
+            pending = {secondary} | ({primary} if hedged else set())
+            last_error = str(primary.exception()) if done else None
+            while pending:
+                remaining = overall - (time.time() - started)
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, remaining),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                winner = next((task for task in done if task.exception() is None), None)
+                if winner is not None:
+                    for task in done - {winner}:
+                        if task.exception() is None:
+                            await task.result()[0].aclose()  # Bir vaqtda kelgan ikkinchi oqim
+                    return AIRouter._astream_result(winner, *starts[winner], winner is secondary, hedged)
+                last_error = str(next(iter(done)).exception())
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise Exception(last_error or f"AI providers timed out after {overall}s")
+
+    @staticmethod
+    def _astream_result(task: 'asyncio.Task', provider: str, model: str, failover: bool,
+                        hedged: bool) -> Dict[str, Any]:
+        chunks, first = task.result()
+        return {'chunks': AIRouter._aiterate(chunks, first), 'provider': provider, 'model_used': model,
+                'failover': failover, 'hedged': hedged}
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+from utils.async_runtime import AsyncRuntime
+from utils.http_client import HttpClient
+from utils.inbound_queue import InboundQueue, InboundWorker
+
+class AsyncIngestService:
+    """Webhooklar va inbound navbati uchun ASGI ilova (asyncio)
+
+    gunicorn gthread da bir vaqtda tayyorlanayotgan javoblar soni
+    threadlar soni bilan cheklangan - har bir javob AI va platforma
+    so'rovlarini kutib thread ni band qiladi. Bu ilovada:
+
+    - Webhook yo'llari (/telegram/webhook/<id>, /whatsapp/webhook,
+      /instagram/webhook, /api/webhooks/<platforma>/<id>) event loop da
+      qabul qilinadi: so'rov tanasi o'qiladi va JSON ajratiladi, marshrut
+      jadvali, dedup va navbatga yozish (Flask routelari bilan umumiy
+      *_intake funksiyalari) AsyncRuntime thread pulida
+    - Navbatni asyncio dispetcheri bo'shatadi: har bir yozuv alohida vazifa
+      (InboundQueue.aprocess), bir vaqtda ASGI_MAX_INFLIGHT tagacha. AI
+      (AsyncOpenAI, Gemini generate_content_async) va platformaga javob
+      (httpx.AsyncClient) event loop da kutiladi, shuning uchun yuzlab
+      suhbat bir necha DB threadi bilan parallel ishlanadi
+
+    Boshqa yo'llar (dashboard, admin) uchun 404 - ular wsgi:app da qoladi.
+    """
+
+    SHUTDOWN_GRACE = 30  # to'xtashda ishlanayotgan yangilanishlarni kutish (soniya)
+
+    def __init__(self, flask_app):
+        from routes import api_webhooks, messaging
+
+        self.flask_app = flask_app
+        config = flask_app.config
+        self.max_inflight = max(1, config.get('ASGI_MAX_INFLIGHT', 500))
+        self.claim_batch = max(1, config.get('ASGI_CLAIM_BATCH', 20))
+        self._inflight = set()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._last_maintenance = 0.0
+
+        # (yo'l, {metod: ishlovchi(yo'l parametrlari, query, JSON)}) - ishlovchilar thread pulida
+        self._routes: List[Tuple['re.Pattern', Dict[str, Callable]]] = [
+            (re.compile(r'/telegram/webhook/(\d+)'), {
+                'POST': lambda params, args, data: messaging.telegram_intake(int(params[0]), data)
+            }),
+            (re.compile(r'/whatsapp/webhook'), {
+                'GET': lambda params, args, data: messaging.verify_subscription(args),
+                'POST': lambda params, args, data: messaging.whatsapp_intake(data)
+            }),
+            (re.compile(r'/instagram/webhook'), {
+                'GET': lambda params, args, data: messaging.verify_subscription(args),
+                'POST': lambda params, args, data: messaging.instagram_intake(data)
+            }),
+            (re.compile(r'/api/webhooks/telegram/([^/]+)'), {
+                'POST': lambda params, args, data: api_webhooks.telegram_intake(params[0], data)
+            }),
+            (re.compile(r'/api/webhooks/(whatsapp|instagram)/([^/]+)'), {
+                'GET': lambda params, args, data: api_webhooks.verify_subscription(
+                    params[1], params[0], args.get('hub.verify_token'), args.get('hub.challenge')),
+                'POST': lambda params, args, data: (api_webhooks.whatsapp_intake if params[0] == 'whatsapp'
+                                                    else api_webhooks.instagram_intake)(params[1], data)
+            })
+        ]
+
+    @staticmethod
+    def config_overrides() -> Dict[str, Any]:
+        """
+        create_app() uchun sozlamalar: thread workerlar o'rniga dispetcher,
+        DB puli har bir AsyncRuntime threadiga ulanish yetadigan
+        """
+        from config import Config
+
+        overrides: Dict[str, Any] = {'INBOUND_WORKER_THREADS': 0}
+        engine_options = getattr(Config, 'SQLALCHEMY_ENGINE_OPTIONS', None)
+        if engine_options:
+            overrides['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+                engine_options, pool_size=max(Config.DB_POOL_SIZE, Config.ASGI_BLOCKING_THREADS)
+            )
+        return overrides
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            with self.flask_app.app_context():
+                await self._http(scope, receive, send)
+
+    # ===== LIFESPAN =====
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def start(self) -> None:
+        """Navbat dispetcherini ishga tushirish (event loop ichida)"""
+        if self.flask_app.config.get('INBOUND_QUEUE_ENABLED', True) and self._dispatcher is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def stop(self) -> None:
+        """Yangi yozuv olmaslik va ishlanayotganlarini SHUTDOWN_GRACE gacha kutish"""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._dispatcher:
+            await self._dispatcher
+            self._dispatcher = None
+        if self._inflight:
+            # Tugamaganlari VISIBILITY_TIMEOUT dan keyin qayta navbatga qaytadi
+            await asyncio.wait(self._inflight, timeout=self.SHUTDOWN_GRACE)
+        await HttpClient.aclose()
+        AsyncRuntime.shutdown()
+
+    # ===== HTTP =====
+
+    async def _http(self, scope, receive, send):
+        handlers, params = self._match(scope['path'])
+        if handlers is None:
+            await self._respond_json(send, 404, {'error': 'Not found'})
+            return
+        handler = handlers.get(scope['method'])
+        if handler is None:
+            await self._respond_json(send, 405, {'error': 'Method not allowed'},
+                                     {'Allow': ', '.join(handlers)})
+            return
+
+        body = await self._read_body(receive, send)
+        if body is None:
+            return
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+        args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+
+        result = await AsyncRuntime.run(handler, params, args, data)
+        if len(result) == 2:
+            # Webhook tasdiqlash: (matn, status)
+            text, status = result
+            await self._respond(send, status, [('Content-Type', 'text/plain; charset=utf-8')],
+                                str(text or '').encode('utf-8'))
+            return
+
+        body, status, headers = result
+        if status == 200 and self._wakeup is not None:
+            self._wakeup.set()  # Navbatga yozildi - dispetcher kutmasin
+        await self._respond_json(send, status, body, headers)
+
+    def _match(self, path: str) -> Tuple[Optional[Dict[str, Callable]], Tuple[str, ...]]:
+        for pattern, handlers in self._routes:
+            match = pattern.fullmatch(path)
+            if match:
+                return handlers, match.groups()
+        return None, ()
+
+    async def _read_body(self, receive, send) -> Optional[bytes]:
+        """So'rov tanasi (MAX_CONTENT_LENGTH dan oshsa 413 va None)"""
+        limit = self.flask_app.config.get('MAX_CONTENT_LENGTH') or 0
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if limit and size > limit:
+                await self._respond_json(send, 413, {'error': 'Request too large'})
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    @staticmethod
+    async def _respond_json(send, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        await AsyncIngestService._respond(
+            send, status, [('Content-Type', 'application/json')] + list((headers or {}).items()),
+            json.dumps(body).encode('utf-8')
+        )
+
+    @staticmethod
+    async def _respond(send, status: int, headers: List[Tuple[str, str]], body: bytes):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    # ===== NAVBAT DISPETCHERI =====
+
+    async def _dispatch(self):
+        poll_interval = self.flask_app.config.get('INBOUND_QUEUE_POLL_INTERVAL', 1.0)
+        with self.flask_app.app_context():
+            while not self._stopping:
+                free = self.max_inflight - len(self._inflight)
+                if free <= 0:
+                    await asyncio.wait(self._inflight, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                self._wakeup.clear()
+                try:
+                    items = await AsyncRuntime.run(self._claim, min(free, self.claim_batch))
+                except Exception as e:
+                    self.flask_app.logger.error(f"ASGI dispatcher error: {str(e)}")
+                    items = []
+                for item in items:
+                    task = asyncio.get_running_loop().create_task(self._process(item))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
+                if items:
+                    continue
+                # Boshqa processlar yozgan yangilanishlar POLL_INTERVAL da bir olinadi
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _claim(self, limit: int) -> List[Dict[str, Any]]:
+        if time.monotonic() - self._last_maintenance >= InboundWorker.MAINTENANCE_INTERVAL:
+            self._last_maintenance = time.monotonic()
+            InboundQueue.maintain()
+        return InboundQueue.claim(limit)
+
+    async def _process(self, item: Dict[str, Any]) -> None:
+        with self.flask_app.app_context():
+            try:
+                await InboundQueue.aprocess(item)
+            except Exception as e:
+                # Yozuv yangilanmadi - VISIBILITY_TIMEOUT dan keyin qayta navbatga qaytadi
+                self.flask_app.logger.error(f"ASGI inbound processing error: {str(e)}")
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from flask import current_app
+from models.user import db
+
+class AsyncRuntime:
+    """asyncio yo'li (asgi.py) uchun sinxron qadamlarni bajarish
+
+    DB drayverlari (psycopg2, sqlite3) sinxron, shuning uchun event loop DB
+    ga to'g'ridan-to'g'ri murojaat qilmaydi: qisqa sinxron qadamlar
+    (marshrut jadvali, suhbat tarixi, bilimlar bazasi, kesh, natijani
+    yozish) ASGI_BLOCKING_THREADS ta threadli pulda, har biri o'z ilova
+    konteksti va db.session i bilan bajariladi. AI va platforma so'rovlari
+    event loop da asinxron klientlar orqali ketadi - javob kutilayotganda
+    thread band bo'lmaydi.
+    """
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _get_executor() -> ThreadPoolExecutor:
+        if AsyncRuntime._executor is None:
+            with AsyncRuntime._lock:
+                if AsyncRuntime._executor is None:
+                    AsyncRuntime._executor = ThreadPoolExecutor(
+                        max_workers=current_app.config.get('ASGI_BLOCKING_THREADS', 16),
+                        thread_name_prefix='asgi-blocking'
+                    )
+        return AsyncRuntime._executor
+
+    @staticmethod
+    async def run(func: Callable, *args, **kwargs) -> Any:
+        """func(*args, **kwargs) ni thread pulida joriy ilova bilan bajarish"""
+        app = current_app._get_current_object()
+
+        def call():
+            with app.app_context():
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    db.session.remove()
+
+        # run_in_executor kontekstni (event loop dagi app context ni) threadga o'tkazmaydi
+        return await asyncio.get_running_loop().run_in_executor(AsyncRuntime._get_executor(), call)
+
+    @staticmethod
+    def shutdown() -> None:
+        with AsyncRuntime._lock:
+            executor, AsyncRuntime._executor = AsyncRuntime._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,337 @@
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from flask import current_app
+from sqlalchemy import insert, select, update
+from models.user import db
+from models.conversation import Conversation, Message
+from utils.prompt_builder import PromptBuilder
+from utils.conversation_summarizer import ConversationSummarizer
+
+class _ChatMemory:
+    """Bitta chatning xotirasi (o'z lock i ostida o'zgaradi)"""
+
+    def __init__(self, user_id: str, max_turns: int):
+        self.lock = threading.Lock()
+        self.user_id = str(user_id)
+        self.conversation_id: Optional[int] = None
+        self.persisted = 0  # DB dagi conversations.message_count (shu process bilgani)
+        self.turns: deque = deque(maxlen=max_turns)  # {'role', 'content'}
+        self.summary = ""  # Conversation.summary (ConversationSummarizer yozadi)
+        self.digest: List[str] = []  # xulosadan keyin oynadan chiqqan xabarlar qatorlari
+        self.unsummarized_tokens = 0  # oynadan chiqqan, xulosaga kirmagan xabarlar
+        self.pending: List[Dict[str, Any]] = []  # hali yozilmagan xabarlar
+        self.sender_name: Optional[str] = None
+        self.loaded = False
+
+class MemoryHistory(list):
+    """ConversationMemory.history natijasi
+
+    complete=False - chat DB dan yuklanmadi (xato), tarix bo'sh ko'rinsa ham
+    suhbat yangi ekani ma'lum emas; AIHandler javob keshini ishlatmaydi.
+    """
+
+    def __init__(self, items=(), complete: bool = True):
+        super().__init__(items)
+        self.complete = complete
+
+class ConversationMemory:
+    """Platforma chatlari uchun suhbat xotirasi (Telegram, WhatsApp, Instagram, web chat)
+
+    Kalit: (platforma, akkaunt id, tashqi chat id). Har bir chat uchun
+    so'nggi CONVERSATION_MEMORY_TURNS ta xabar process xotirasida saqlanadi
+    va promptga tarix sifatida beriladi. Undan eskilari Conversation.summary
+    (ConversationSummarizer fonda yangilaydi) va xulosa yangilanguncha
+    oynadan chiqqan xabarlarning qisqa qatorlari ko'rinishida beriladi.
+
+    - Yozish kechiktirilgan (write-behind): yangi xabarlar fon threadida har
+      CONVERSATION_MEMORY_FLUSH_INTERVAL soniyada Message jadvaliga
+      yoziladi; chat uchun Conversation yozuvi birinchi marta shunda yaratiladi
+    - Xotirada bo'lmagan chat DB dan bir marta yuklanadi (faqat so'nggi
+      xabarlar); keyin har javobda faqat conversations.message_count
+      tekshiriladi - boshqa worker yozgan bo'lsa qayta yuklanadi
+    - Chatlar soni CONVERSATION_MEMORY_CHATS bilan cheklangan (LRU)
+    """
+
+    # (platform, account_id, chat_id) -> _ChatMemory
+    _chats: 'OrderedDict[Tuple[str, int, str], _ChatMemory]' = OrderedDict()
+    # Yozilishi kerak bo'lgan chatlar (LRU dan chiqib ketgan bo'lsa ham yo'qolmaydi)
+    _dirty: Dict[Tuple[str, int, str], _ChatMemory] = {}
+    _lock = threading.Lock()
+    _wakeup = threading.Condition(_lock)
+    _flusher: Optional[threading.Thread] = None
+    _pid: Optional[int] = None
+
+    SUMMARY_LINE_CHARS = 200  # xulosadagi bitta xabar qatori
+
+    LABELS = {'user': 'Foydalanuvchi', 'assistant': 'AI'}
+
+    @staticmethod
+    def _key(platform: str, account_id: Optional[int], chat_id: Any) -> Tuple[str, int, str]:
+        return platform, int(account_id or 0), str(chat_id)
+
+    @staticmethod
+    def _entry(key: Tuple[str, int, str], user_id: str) -> _ChatMemory:
+        with ConversationMemory._lock:
+            entry = ConversationMemory._chats.get(key) or ConversationMemory._dirty.get(key)
+            if entry is None:
+                entry = _ChatMemory(user_id, current_app.config.get('CONVERSATION_MEMORY_TURNS', 20))
+            ConversationMemory._chats[key] = entry
+            ConversationMemory._chats.move_to_end(key)
+            while len(ConversationMemory._chats) > current_app.config.get('CONVERSATION_MEMORY_CHATS', 10000):
+                ConversationMemory._chats.popitem(last=False)
+            return entry
+
+    # ===== O'QISH =====
+
+    @staticmethod
+    def history(platform: str, account_id: Optional[int], chat_id: Any, user_id: str) -> MemoryHistory:
+        """
+        Chat tarixi (AIHandler history argumenti uchun)
+
+        Returns:
+            MemoryHistory: [{'role', 'content'}] - eskisidan yangisiga; xulosa
+                           bo'lsa birinchi element role='system'
+        """
+        key = ConversationMemory._key(platform, account_id, chat_id)
+        entry = ConversationMemory._entry(key, user_id)
+        with entry.lock:
+            try:
+                ConversationMemory._refresh(key, entry)
+            except Exception as e:
+                # Xotirada borini ishlatish - javob tarixsiz qolmasin
+                current_app.logger.warning(f"Conversation memory load error: {str(e)}")
+            items = MemoryHistory(entry.turns, complete=entry.loaded)
+            summary = "\n".join(([entry.summary] if entry.summary else []) + entry.digest)
+            if summary:
+                items.insert(0, {'role': 'system', 'content': f"Oldingi suhbat xulosasi:\n{summary}"})
+            return items
+
+    @staticmethod
+    def turns(platform: str, account_id: Optional[int], chat_id: Any, user_id: str) -> List[Dict[str, str]]:
+        """So'nggi xabarlar (xulosasiz)"""
+        return [item for item in ConversationMemory.history(platform, account_id, chat_id, user_id)
+                if item['role'] != 'system']
+
+    @staticmethod
+    def _refresh(key: Tuple[str, int, str], entry: _ChatMemory) -> None:
+        """Xotirani DB bilan solishtirish (entry.lock ostida)"""
+        table = Conversation.__table__
+        with db.engine.connect() as conn:
+            if entry.conversation_id is None:
+                platform, account_id, chat_id = key
+                row = conn.execute(
+                    select(table.c.id, table.c.message_count, table.c.summary, table.c.summarized_message_id)
+                    .where(table.c.platform == platform, table.c.sender_id == chat_id,
+                           table.c.account_id == account_id if account_id else table.c.account_id.is_(None))
+                    .order_by(table.c.id.desc()).limit(1)
+                ).first()
+            else:
+                row = conn.execute(
+                    select(table.c.id, table.c.message_count, table.c.summary, table.c.summarized_message_id)
+                    .where(table.c.id == entry.conversation_id)
+                ).first()
+
+            if row is None:
+                entry.loaded = True
+                return  # Yangi chat - Conversation birinchi yozishda yaratiladi
+            if entry.loaded and row.id == entry.conversation_id and (row.message_count or 0) == entry.persisted:
+                return  # Xotira yangi
+
+            # Birinchi murojaat yoki boshqa worker yozgan - so'nggi xabarlarni qayta yuklash
+            messages = Message.__table__
+            rows = conn.execute(
+                select(messages.c.id, messages.c.role, messages.c.content)
+                .where(messages.c.conversation_id == row.id)
+                .order_by(messages.c.id.desc()).limit(entry.turns.maxlen)
+            ).all()
+
+        entry.conversation_id = row.id
+        entry.persisted = row.message_count or 0
+        entry.summary = row.summary or ""
+        entry.digest = []
+        entry.unsummarized_tokens = 0
+        entry.turns.clear()
+        for _, role, content in reversed(rows):
+            entry.turns.append({'role': role, 'content': content})
+        if rows and (row.message_count or 0) > len(rows) and (row.summarized_message_id or 0) < rows[-1].id:
+            # Oynadan eski, xulosaga kirmagan xabarlar bo'lishi mumkin - summarizer tekshiradi
+            ConversationSummarizer.schedule(key, row.id)
+        # Hali yozilmagan xabarlar DB dagilardan keyin keladi
+        for item in entry.pending:
+            entry.turns.append({'role': item['role'], 'content': item['content']})
+        entry.loaded = True
+
+    # ===== YOZISH =====
+
+    @staticmethod
+    def append(platform: str, account_id: Optional[int], chat_id: Any, user_id: str,
+               user_text: str, reply: str, sender_name: Optional[str] = None) -> None:
+        """Savol-javob juftligini xotiraga qo'shish (DB ga fonda yoziladi)"""
+        key = ConversationMemory._key(platform, account_id, chat_id)
+        entry = ConversationMemory._entry(key, user_id)
+        now = datetime.utcnow()
+        with entry.lock:
+            if not entry.loaded:
+                try:
+                    ConversationMemory._refresh(key, entry)
+                except Exception as e:
+                    current_app.logger.warning(f"Conversation memory load error: {str(e)}")
+            entry.sender_name = sender_name or entry.sender_name
+            for role, content in (('user', user_text), ('assistant', reply)):
+                if len(entry.turns) == entry.turns.maxlen:
+                    ConversationMemory._fold(entry, entry.turns[0])
+                entry.turns.append({'role': role, 'content': content})
+                entry.pending.append({'role': role, 'content': content, 'created_at': now})
+
+        ConversationMemory._ensure_flusher()
+        with ConversationMemory._wakeup:
+            ConversationMemory._dirty[key] = entry
+            ConversationMemory._wakeup.notify()
+
+    @staticmethod
+    def _fold(entry: _ChatMemory, item: Dict[str, str]) -> None:
+        """
+        Oynadan chiqayotgan xabarni xulosa yangilanguncha qisqa qator sifatida saqlash
+
+        Qatorlar CONVERSATION_SUMMARY_MAX_TOKENS dan oshmaydi (eng eskisi tashlanadi).
+        """
+        entry.unsummarized_tokens += PromptBuilder.estimate_tokens(item['content'])
+        content = " ".join(item['content'].split())
+        if len(content) > ConversationMemory.SUMMARY_LINE_CHARS:
+            content = content[:ConversationMemory.SUMMARY_LINE_CHARS].rstrip() + "..."
+        entry.digest.append(f"{ConversationMemory.LABELS.get(item['role'], item['role'])}: {content}")
+
+        max_tokens = current_app.config.get('CONVERSATION_SUMMARY_MAX_TOKENS', 500)
+        while len(entry.digest) > 1 and PromptBuilder.estimate_tokens("\n".join(entry.digest)) > max_tokens:
+            entry.digest.pop(0)
+
+    @staticmethod
+    def adopt_summary(key: Tuple[str, int, str], conversation_id: int, summary: str) -> None:
+        """ConversationSummarizer yangi xulosa yozganda - oynadan eski xabarlar endi unda"""
+        with ConversationMemory._lock:
+            entry = ConversationMemory._chats.get(key) or ConversationMemory._dirty.get(key)
+        if entry is None:
+            return
+        with entry.lock:
+            if entry.conversation_id == conversation_id:
+                entry.summary = summary
+                entry.digest = []
+                entry.unsummarized_tokens = 0
+
+    @staticmethod
+    def _ensure_flusher() -> None:
+        with ConversationMemory._lock:
+            if ConversationMemory._pid == os.getpid() and ConversationMemory._flusher \
+                    and ConversationMemory._flusher.is_alive():
+                return
+            app = current_app._get_current_object()
+            first_start = ConversationMemory._pid is None
+            ConversationMemory._pid = os.getpid()
+            ConversationMemory._flusher = threading.Thread(
+                target=ConversationMemory._flush_loop, args=(app,), name='conversation-memory', daemon=True
+            )
+            ConversationMemory._flusher.start()
+        if first_start:
+            # To'xtashda yozilmay qolganlarini yozish
+            atexit.register(ConversationMemory.flush, app)
+
+    @staticmethod
+    def _flush_loop(app) -> None:
+        interval = app.config.get('CONVERSATION_MEMORY_FLUSH_INTERVAL', 1.0)
+        while True:
+            with ConversationMemory._wakeup:
+                while not ConversationMemory._dirty:
+                    ConversationMemory._wakeup.wait()
+            # Bir nechta xabarni bitta tranzaksiyada yozish uchun biroz kutish
+            time.sleep(interval)
+            ConversationMemory.flush(app)
+
+    @staticmethod
+    def flush(app) -> int:
+        """
+        Yozilmagan xabarlarni Message jadvaliga yozish
+
+        Returns:
+            int: Yozilgan xabarlar soni
+        """
+        with ConversationMemory._lock:
+            dirty = list(ConversationMemory._dirty.items())
+            ConversationMemory._dirty.clear()
+
+        written = 0
+        with app.app_context():
+            for key, entry in dirty:
+                with entry.lock:
+                    try:
+                        written += ConversationMemory._write(key, entry)
+                    except Exception as e:
+                        app.logger.warning(f"Conversation memory write error: {str(e)}")
+                        with ConversationMemory._lock:
+                            ConversationMemory._dirty.setdefault(key, entry)  # Keyingi urinishda
+        return written
+
+    @staticmethod
+    def _write(key: Tuple[str, int, str], entry: _ChatMemory) -> int:
+        """Bitta chatning yozilmagan xabarlari (entry.lock ostida)"""
+        pending = entry.pending
+        if not pending:
+            return 0
+        platform, account_id, chat_id = key
+        conversations = Conversation.__table__
+        now = datetime.utcnow()
+
+        with db.engine.begin() as conn:
+            conversation_id = entry.conversation_id
+            if conversation_id is None:
+                first_text = next((item['content'] for item in pending if item['role'] == 'user'), "")
+                title_name = entry.sender_name or chat_id
+                conversation_id = conn.execute(insert(conversations).values(
+                    user_id=entry.user_id,
+                    title=f"{platform.capitalize()}: {title_name}"[:100],
+                    platform=platform,
+                    account_id=account_id or None,
+                    sender_id=chat_id,
+                    sender_name=entry.sender_name,
+                    message=first_text,
+                    message_count=0,
+                    created_at=now,
+                    updated_at=now
+                )).inserted_primary_key[0]
+
+            if pending:
+                conn.execute(insert(Message.__table__), [{
+                    'conversation_id': conversation_id,
+                    'role': item['role'],
+                    'content': item['content'],
+                    'created_at': item['created_at'],
+                    'extra_data': {'source': platform}
+                } for item in pending])
+
+            values = {'message_count': conversations.c.message_count + len(pending), 'updated_at': now}
+            replies = [item['content'] for item in pending if item['role'] == 'assistant']
+            if replies:
+                values['reply'] = replies[-1]
+            conn.execute(update(conversations).where(conversations.c.id == conversation_id).values(**values))
+
+        entry.conversation_id = conversation_id
+        entry.persisted += len(pending)
+        entry.pending = []
+        if entry.unsummarized_tokens >= current_app.config.get('CONVERSATION_SUMMARY_TRIGGER_TOKENS', 1500):
+            ConversationSummarizer.schedule(key, conversation_id)
+        return len(pending)
+
+    # ===== STATISTIKA =====
+
+    @staticmethod
+    def get_stats() -> Dict[str, int]:
+        with ConversationMemory._lock:
+            return {
+                'chats': len(ConversationMemory._chats),
+                'dirty_chats': len(ConversationMemory._dirty),
+                'summarizer': ConversationSummarizer.get_stats()
+            }
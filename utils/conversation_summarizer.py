@@ -0,0 +1,196 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from flask import current_app
+from sqlalchemy import func, select, update
+from models.user import db
+from models.conversation import Conversation, Message
+from utils.llm_clients import LLMClientRegistry
+from utils.prompt_builder import PromptBuilder
+from utils.provider_guard import ProviderGuard, ProviderUnavailable
+
+class ConversationSummarizer:
+    """Uzun suhbatlarning eski xabarlarini fonda xulosaga siqish
+
+    Suhbat xotira oynasidan (CONVERSATION_MEMORY_TURNS) tashqaridagi,
+    hali xulosaga kirmagan xabarlar CONVERSATION_SUMMARY_TRIGGER_TOKENS dan
+    oshganda arzon model (CONVERSATION_SUMMARY_MODEL) oldingi xulosa va shu
+    xabarlardan yangi xulosa yozadi; Conversation.summary va
+    summarized_message_id yangilanadi. Shunday qilib promptdagi tarix
+    suhbat uzunligidan qat'i nazar taxminan bir xil hajmda qoladi.
+
+    Ish alohida thread pulida bajariladi - javob yo'li kutmaydi. Bir
+    suhbat uchun bir vaqtda bitta vazifa; workerlar o'rtasida
+    summarized_message_id bo'yicha optimistik yozish.
+    """
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _scheduled = set()  # conversation_id lar
+    _lock = threading.Lock()
+    _stats = {'runs': 0, 'summarized_messages': 0, 'skipped': 0, 'failures': 0}
+
+    PROMPT = (
+        "Quyidagi mijoz va AI yordamchi suhbatining qisqa xulosasini yoz. Oldingi xulosa "
+        "bo'lsa, uni yangi xabarlar bilan to'ldir. Ismlar, buyurtmalar, raqamlar, manzillar, "
+        "mijoz xohishlari va ochiq qolgan savollarni saqla; salomlashish va takrorlarni tashla. "
+        "Xulosani suhbat tilida, {max_words} so'zdan oshirmay yoz."
+    )
+
+    @staticmethod
+    def _get_executor(app) -> ThreadPoolExecutor:
+        if ConversationSummarizer._executor is None:
+            with ConversationSummarizer._lock:
+                if ConversationSummarizer._executor is None:
+                    ConversationSummarizer._executor = ThreadPoolExecutor(
+                        max_workers=app.config.get('CONVERSATION_SUMMARY_THREADS', 2),
+                        thread_name_prefix='conversation-summary'
+                    )
+        return ConversationSummarizer._executor
+
+    @staticmethod
+    def schedule(key: Tuple[str, int, str], conversation_id: int) -> bool:
+        """
+        Suhbatni xulosalash navbatiga qo'yish (darhol qaytadi)
+
+        Args:
+            key: ConversationMemory kaliti - yangi xulosa xotiraga ham beriladi
+
+        Returns:
+            bool: Navbatga qo'yildi (shu suhbat uchun vazifa allaqachon bo'lsa False)
+        """
+        app = current_app._get_current_object()
+        if not app.config.get('CONVERSATION_SUMMARY_ENABLED', True):
+            return False
+        with ConversationSummarizer._lock:
+            if conversation_id in ConversationSummarizer._scheduled:
+                return False
+            ConversationSummarizer._scheduled.add(conversation_id)
+        ConversationSummarizer._get_executor(app).submit(ConversationSummarizer._run, app, key, conversation_id)
+        return True
+
+    @staticmethod
+    def _run(app, key: Tuple[str, int, str], conversation_id: int) -> None:
+        with app.app_context():
+            try:
+                while ConversationSummarizer.summarize(conversation_id, key):
+                    pass  # Uzun suhbat - CONVERSATION_SUMMARY_INPUT_TOKENS dan bo'lib siqiladi
+            except ProviderUnavailable:
+                ConversationSummarizer._count('skipped')  # Keyingi triggerda qayta uriniladi
+            except Exception as e:
+                ConversationSummarizer._count('failures')
+                app.logger.warning(f"Conversation summary error for {conversation_id}: {str(e)}")
+            finally:
+                db.session.remove()
+                with ConversationSummarizer._lock:
+                    ConversationSummarizer._scheduled.discard(conversation_id)
+
+    @staticmethod
+    def _count(counter: str, value: int = 1) -> None:
+        with ConversationSummarizer._lock:
+            ConversationSummarizer._stats[counter] += value
+
+    # ===== XULOSALASH =====
+
+    @staticmethod
+    def summarize(conversation_id: int, key: Optional[Tuple[str, int, str]] = None) -> bool:
+        """
+        Bir qadam: oynadan eski xabarlardan (CONVERSATION_SUMMARY_INPUT_TOKENS gacha) xulosa
+
+        Returns:
+            bool: Xulosa yangilandi va yana siqiladigan xabarlar qolgan bo'lishi mumkin
+        """
+        config = current_app.config
+        conversations = Conversation.__table__
+        messages = Message.__table__
+
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(conversations.c.summary, conversations.c.summarized_message_id)
+                .where(conversations.c.id == conversation_id)
+            ).first()
+            if row is None:
+                return False
+            since = row.summarized_message_id or 0
+            keep = config.get('CONVERSATION_MEMORY_TURNS', 20)
+            # Xotira oynasidagi xabarlar xulosaga kirmaydi
+            boundary = conn.execute(
+                select(messages.c.id).where(messages.c.conversation_id == conversation_id)
+                .order_by(messages.c.id.desc()).offset(keep).limit(1)
+            ).scalar()
+            if boundary is None or boundary <= since:
+                return False
+            rows = conn.execute(
+                select(messages.c.id, messages.c.role, messages.c.content)
+                .where(messages.c.conversation_id == conversation_id,
+                       messages.c.id > since, messages.c.id <= boundary)
+                .order_by(messages.c.id)
+            ).all()
+
+        batch, _ = ConversationSummarizer._take_batch(rows, config.get('CONVERSATION_SUMMARY_INPUT_TOKENS', 6000))
+        total_tokens = sum(PromptBuilder.estimate_tokens(content) for _, _, content in rows)
+        if not batch or total_tokens < config.get('CONVERSATION_SUMMARY_TRIGGER_TOKENS', 1500):
+            return False
+
+        summary = ConversationSummarizer._generate(row.summary, batch)
+        last_id = batch[-1][0]
+        with db.engine.begin() as conn:
+            updated = conn.execute(
+                update(conversations)
+                .where(conversations.c.id == conversation_id,
+                       func.coalesce(conversations.c.summarized_message_id, 0) == since)
+                .values(summary=summary, summarized_message_id=last_id)
+            ).rowcount
+        if not updated:
+            return False  # Boshqa worker xulosalab bo'ldi
+
+        ConversationSummarizer._count('runs')
+        ConversationSummarizer._count('summarized_messages', len(batch))
+        if key is not None and last_id == boundary:
+            from utils.conversation_memory import ConversationMemory
+            ConversationMemory.adopt_summary(key, conversation_id, summary)
+        return last_id < boundary
+
+    @staticmethod
+    def _take_batch(rows: List[Any], max_tokens: int) -> Tuple[List[Any], int]:
+        """Eng eski xabarlardan max_tokens gacha (kamida bitta)"""
+        batch, used = [], 0
+        for item in rows:
+            item_tokens = PromptBuilder.estimate_tokens(item[2])
+            if batch and used + item_tokens > max_tokens:
+                break
+            batch.append(item)
+            used += item_tokens
+        return batch, used
+
+    @staticmethod
+    def _generate(previous: Optional[str], batch: List[Any]) -> str:
+        """Arzon model bilan xulosa yozish"""
+        config = current_app.config
+        max_tokens = config.get('CONVERSATION_SUMMARY_MAX_TOKENS', 500)
+        labels = {'user': 'Mijoz', 'assistant': 'AI'}
+        # Bitta xabar butun kirishni egallamasin
+        line_tokens = config.get('CONVERSATION_SUMMARY_INPUT_TOKENS', 6000) // 4
+        transcript = "\n".join(
+            f"{labels.get(role, role)}: {PromptBuilder.truncate(content, line_tokens)}" for _, role, content in batch
+        )
+        prompt = ConversationSummarizer.PROMPT.format(max_words=int(max_tokens * 0.6))
+        if previous:
+            prompt += f"\n\nOLDINGI XULOSA:\n{previous}"
+        prompt += f"\n\nYANGI XABARLAR:\n{transcript}\n\nXULOSA:"
+
+        model = LLMClientRegistry.gemini_model(config.get('CONVERSATION_SUMMARY_MODEL', 'gemini-1.5-flash-8b'))
+        with ProviderGuard.call('gemini'):
+            response = model.generate_content(
+                prompt,
+                generation_config={'max_output_tokens': max_tokens, 'temperature': 0.2},
+                request_options={'timeout': config.get('AI_REQUEST_TIMEOUT', 60.0)}
+            )
+        summary = (response.text or "").strip()
+        if not summary:
+            raise Exception("Empty summary")
+        return summary
+
+    @staticmethod
+    def get_stats() -> Dict[str, Any]:
+        with ConversationSummarizer._lock:
+            return dict(ConversationSummarizer._stats, scheduled=len(ConversationSummarizer._scheduled))
@@ -0,0 +1,245 @@
+import base64
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from flask import current_app
+
+class _Keyring:
+    """Joriy kalitlar: versiya -> Fernet va hammasi uchun MultiFernet"""
+
+    def __init__(self, primary_version: int, keys: Tuple[Tuple[Optional[int], str], ...]):
+        self.primary_version = primary_version
+        self.prefix = f"{CredentialVault.VERSION_PREFIX}{primary_version}{CredentialVault.VERSION_SEPARATOR}"
+        fernets = [Fernet(key.encode()) for _, key in keys]
+        self.primary = fernets[0]
+        self.by_version = {version: fernet for (version, _), fernet in zip(keys, fernets) if version is not None}
+        self.any = MultiFernet(fernets)  # versiyasiz (eski) qiymatlar uchun
+
+class CredentialVault:
+    """Platforma va AI kalitlarini shifrlash/ochish (process bo'yicha kesh)
+
+    - Shifrlangan qiymat kalit versiyasi bilan saqlanadi: "v<versiya>:<fernet
+      token>". Yangi qiymatlar ENCRYPTION_KEY (ENCRYPTION_KEY_VERSION) bilan
+      shifrlanadi; ochishda versiya bo'yicha kalit tanlanadi, ENCRYPTION_OLD_KEYS
+      ("versiya:kalit") dagi eski kalitlar ham ishlaydi. Versiyasiz (avvalgi)
+      qiymatlar barcha kalitlar bilan sinab ko'riladi. Kalit almashtirish:
+      yangi kalit ENCRYPTION_KEY ga, eskisi ENCRYPTION_OLD_KEYS ga qo'yiladi,
+      keyin KeyRotation barcha qiymatlarni fonda qayta shifrlaydi.
+    - Kalitlar obyektlari bir marta quriladi va sozlamalar o'zgarguncha qayta
+      ishlatiladi.
+    - Ochilgan qiymatlar shifrlangan matn bo'yicha CREDENTIAL_CACHE_TTL
+      soniya xotirada turadi: har bir kiruvchi xabar uchun Fernet (HMAC +
+      AES) qayta hisoblanmaydi. Fernet har safar yangi IV ishlatadi, shuning
+      uchun kalit yangilanganda shifrlangan matn ham o'zgaradi va eski yozuv
+      o'z-o'zidan ishlatilmay qoladi; set_*/o'chirishda forget() uni darhol
+      olib tashlaydi.
+
+    ENCRYPTION_KEY bo'lmasa (development) qiymatlar base64 da saqlanadi.
+    """
+
+    VERSION_PREFIX = 'v'
+    VERSION_SEPARATOR = ':'  # Fernet tokenida (urlsafe base64) uchramaydi
+
+    _keyring: Optional[Tuple[Tuple, _Keyring]] = None  # (sozlamalar, kalitlar)
+    # shifrlangan matn -> (ochiq matn, muddati time.monotonic()); qo'shilish tartibida
+    _plain: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+    _lock = threading.Lock()
+    _stats = {'hits': 0, 'misses': 0, 'legacy_base64': 0}
+
+    # ===== KALITLAR =====
+
+    @staticmethod
+    def _keys() -> Tuple[int, Tuple[Tuple[Optional[int], str], ...]]:
+        """(asosiy versiya, ((versiya, kalit), ...)) - asosiy kalit birinchi"""
+        config = current_app.config
+        primary = config.get('ENCRYPTION_KEY')
+        version = int(config.get('ENCRYPTION_KEY_VERSION', 1))
+        if not primary:
+            return version, ()
+        keys = [(version, primary)]
+        for entry in config.get('ENCRYPTION_OLD_KEYS', ()):
+            old_version, separator, key = entry.rpartition(CredentialVault.VERSION_SEPARATOR)
+            if not separator:
+                old_version, key = None, entry
+            if key and key != primary:
+                keys.append((int(old_version) if old_version else None, key))
+        return version, tuple(keys)
+
+    @staticmethod
+    def keyring() -> Optional[_Keyring]:
+        """Joriy kalitlar (ENCRYPTION_KEY yo'q bo'lsa None)"""
+        settings = CredentialVault._keys()
+        if not settings[1]:
+            return None
+        cached = CredentialVault._keyring
+        if cached is not None and cached[0] == settings:
+            return cached[1]
+
+        keyring = _Keyring(*settings)
+        with CredentialVault._lock:
+            if CredentialVault._keyring is not None and CredentialVault._keyring[0] != settings:
+                CredentialVault._plain.clear()  # Kalitlar o'zgardi - eski qiymatlar ochilmasligi mumkin
+            CredentialVault._keyring = (settings, keyring)
+        return keyring
+
+    @staticmethod
+    def split_version(encrypted: str) -> Tuple[Optional[int], str]:
+        """'v2:gAAAA...' -> (2, 'gAAAA...'); versiyasiz qiymat -> (None, qiymat)"""
+        if encrypted.startswith(CredentialVault.VERSION_PREFIX):
+            version, separator, token = encrypted[1:].partition(CredentialVault.VERSION_SEPARATOR)
+            if separator and version.isdigit():
+                return int(version), token
+        return None, encrypted
+
+    @staticmethod
+    def needs_rotation(encrypted: Optional[str]) -> bool:
+        """Qiymat joriy kalit bilan shifrlanmagan (versiyasi boshqa, versiyasiz yoki base64)"""
+        keyring = CredentialVault.keyring()
+        return bool(encrypted) and keyring is not None and not encrypted.startswith(keyring.prefix)
+
+    # ===== SHIFRLASH =====
+
+    @staticmethod
+    def encrypt(text: str) -> str:
+        """Qiymatni joriy ENCRYPTION_KEY bilan shifrlash (development da base64)"""
+        encrypted = CredentialVault._encrypt(text)
+        if CredentialVault.keyring() is not None:
+            CredentialVault._store(encrypted, text)  # Keyingi o'qish keshdan
+        return encrypted
+
+    @staticmethod
+    def _encrypt(text: str) -> str:
+        keyring = CredentialVault.keyring()
+        if keyring is None:
+            return base64.b64encode(text.encode()).decode()
+        return keyring.prefix + keyring.primary.encrypt(text.encode()).decode()
+
+    @staticmethod
+    def reencrypt(encrypted: str, legacy_base64: bool = False) -> str:
+        """Qiymatni joriy kalit bilan qayta shifrlash (keshga yozilmaydi)"""
+        return CredentialVault._encrypt(CredentialVault._decrypt(encrypted, legacy_base64))
+
+    # ===== OCHISH =====
+
+    @staticmethod
+    def decrypt(encrypted: str, legacy_base64: bool = False) -> str:
+        """
+        Shifrlangan qiymatni ochish (keshdan yoki Fernet bilan)
+
+        Args:
+            legacy_base64: Fernet ochmasa base64 deb o'qish (ENCRYPTION_KEY
+                           o'rnatilishidan oldin saqlangan qiymatlar)
+
+        Raises:
+            InvalidToken: qiymat hech bir kalit bilan ochilmadi
+        """
+        CredentialVault.keyring()  # Kalitlar o'zgargan bo'lsa kesh tozalanadi
+        plain = CredentialVault._lookup(encrypted)
+        if plain is None:
+            plain = CredentialVault._decrypt(encrypted, legacy_base64)
+            CredentialVault._store(encrypted, plain)
+        return plain
+
+    @staticmethod
+    def decrypt_many(encrypted_values: Iterable[Optional[str]], legacy_base64: bool = False) -> List[Optional[str]]:
+        """
+        Bir nechta qiymatni bitta qulf bilan ochish (ro'yxatlar, polling uchun)
+
+        Returns:
+            List: kirish tartibida; bo'sh yoki ochilmagan qiymat o'rnida None
+        """
+        values = list(encrypted_values)
+        CredentialVault.keyring()
+        now = time.monotonic()
+        found: Dict[str, str] = {}
+        with CredentialVault._lock:
+            CredentialVault._purge(now)
+            for encrypted in set(filter(None, values)):
+                item = CredentialVault._plain.get(encrypted)
+                if item is not None:
+                    found[encrypted] = item[0]
+            missing = set(filter(None, values)) - found.keys()
+            CredentialVault._stats['hits'] += len(found)
+            CredentialVault._stats['misses'] += len(missing)
+
+        for encrypted in missing:
+            try:
+                found[encrypted] = CredentialVault._decrypt(encrypted, legacy_base64)
+            except Exception as e:
+                current_app.logger.warning(f"Credential decrypt error: {type(e).__name__}")
+                continue
+            CredentialVault._store(encrypted, found[encrypted])
+        return [found.get(encrypted) if encrypted else None for encrypted in values]
+
+    @staticmethod
+    def _decrypt(encrypted: str, legacy_base64: bool) -> str:
+        keyring = CredentialVault.keyring()
+        if keyring is None:
+            return base64.b64decode(encrypted.encode()).decode()
+        version, token = CredentialVault.split_version(encrypted)
+        try:
+            fernet = keyring.by_version.get(version, keyring.any)
+            return fernet.decrypt(token.encode()).decode()
+        except InvalidToken:
+            if not legacy_base64 or version is not None:
+                raise
+            # ENCRYPTION_KEY o'rnatilishidan oldingi qiymat - KeyRotation shifrlaydi
+            with CredentialVault._lock:
+                CredentialVault._stats['legacy_base64'] += 1
+            return base64.b64decode(encrypted.encode()).decode()
+
+    # ===== KESH =====
+
+    @staticmethod
+    def _lookup(encrypted: str) -> Optional[str]:
+        now = time.monotonic()
+        with CredentialVault._lock:
+            item = CredentialVault._plain.get(encrypted)
+            if item is not None and item[1] > now:
+                CredentialVault._stats['hits'] += 1
+                return item[0]
+            CredentialVault._stats['misses'] += 1
+            return None
+
+    @staticmethod
+    def _store(encrypted: str, plain: str) -> None:
+        config = current_app.config
+        ttl = config.get('CREDENTIAL_CACHE_TTL', 300)
+        if ttl <= 0:
+            return
+        now = time.monotonic()
+        with CredentialVault._lock:
+            CredentialVault._plain.pop(encrypted, None)
+            CredentialVault._plain[encrypted] = (plain, now + ttl)
+            CredentialVault._purge(now)
+            while len(CredentialVault._plain) > config.get('CREDENTIAL_CACHE_SIZE', 4096):
+                CredentialVault._plain.popitem(last=False)
+
+    @staticmethod
+    def _purge(now: float) -> None:
+        """Muddati o'tganlarni olib tashlash (_lock ostida; yozuvlar muddat tartibida)"""
+        while CredentialVault._plain:
+            _, expires_at = next(iter(CredentialVault._plain.values()))
+            if expires_at > now:
+                break
+            CredentialVault._plain.popitem(last=False)
+
+    @staticmethod
+    def forget(*encrypted_values: Optional[str]) -> None:
+        """Qiymatlarni keshdan o'chirish (kalit yangilanganda yoki akkaunt o'chirilganda)"""
+        with CredentialVault._lock:
+            for encrypted in encrypted_values:
+                if encrypted:
+                    CredentialVault._plain.pop(encrypted, None)
+
+    @staticmethod
+    def clear() -> None:
+        with CredentialVault._lock:
+            CredentialVault._plain.clear()
+
+    @staticmethod
+    def get_stats() -> Dict[str, int]:
+        with CredentialVault._lock:
+            return dict(CredentialVault._stats, entries=len(CredentialVault._plain))
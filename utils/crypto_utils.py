@@ -3,6 +3,7 @@ import os
 from cryptography.fernet import Fernet
 from flask import current_app
 from typing import Optional
+from utils.credential_vault import CredentialVault
 
 class CryptoUtils:
     """Shifrlash/deshifrlash utilitasi"""
@@ -24,19 +25,18 @@ class CryptoUtils:
         
         Args:
             text: Shifrlanadigan matn
-            key: Shifrlash kaliti (agar berilmasa, app config dan olinadi)
+            key: Shifrlash kaliti (agar berilmasa, app config dagi kalitlar - CredentialVault)
             
         Returns:
             str: Shirlangan matn (base64 format)
         """
         try:
-            if not key:
-                key = CryptoUtils.get_encryption_key()
-            
             if key:
                 fernet = Fernet(key.encode())
                 encrypted = fernet.encrypt(text.encode())
                 return encrypted.decode()
+            elif CryptoUtils.is_encryption_available():
+                return CredentialVault.encrypt(text)
             else:
                 # Production da fallback ruxsat etilmagan
                 if CryptoUtils.is_production():
@@ -62,19 +62,20 @@ class CryptoUtils:
         
         Args:
             encrypted_text: Shirlangan matn
-            key: Shifrlash kaliti (agar berilmasa, app config dan olinadi)
+            key: Shifrlash kaliti (agar berilmasa, app config dagi kalitlar - CredentialVault)
             
         Returns:
             str: Deshirlangan matn
         """
         try:
-            if not key:
-                key = CryptoUtils.get_encryption_key()
-            
             if key:
                 fernet = Fernet(key.encode())
-                decrypted = fernet.decrypt(encrypted_text.encode())
+                _, token = CredentialVault.split_version(encrypted_text)
+                decrypted = fernet.decrypt(token.encode())
                 return decrypted.decode()
+            elif CryptoUtils.is_encryption_available():
+                # Ilova kaliti: keshlangan MultiFernet va ochilgan qiymatlar keshi
+                return CredentialVault.decrypt(encrypted_text)
             else:
                 # Production da fallback ruxsat etilmagan
                 if CryptoUtils.is_production():
@@ -15,6 +15,8 @@ class FileParser:
     
     ALLOWED_EXTENSIONS = {'pdf', 'docx', 'csv', 'txt'}
     
+    MAX_CSV_COLUMNS = 100
+    
     @staticmethod
     def is_allowed_file(filename: str) -> bool:
         """Fayl formatini tekshirish"""
@@ -265,33 +267,28 @@ class FileParser:
             
             content = ""
             row_count = 0
-            max_rows = 5000  # Qatorlar soni cheklovi
+            # Matn ko'rinishi faqat ko'rish sahifasi va zaxira uchun; to'liq jadval
+            # (yuz minglab qatorlar) ProductTable indeksida saqlanadi
+            max_rows = 5000
             
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+            with open(file_path, 'r', encoding='utf-8-sig', errors='ignore') as file:
                 # CSV formatini aniqlash
-                sample = file.read(1024)
+                delimiter = FileParser._detect_csv_delimiter(file.read(4096))
                 file.seek(0)
                 
-                try:
-                    sniffer = csv.Sniffer()
-                    delimiter = sniffer.sniff(sample).delimiter
-                except:
-                    delimiter = ','  # Default delimiter
-                
                 reader = csv.reader(file, delimiter=delimiter)
                 
                 for row in reader:
                     # Har bir qatordagi ustunlar sonini cheklash
-                    if len(row) > 100:
-                        row = row[:100] + ['[QO\'SHIMCHA USTUNLAR QISQARTIRILDI]']
+                    if len(row) > FileParser.MAX_CSV_COLUMNS:
+                        row = row[:FileParser.MAX_CSV_COLUMNS] + ['[QO\'SHIMCHA USTUNLAR QISQARTIRILDI]']
                     
-                    content += " | ".join(row) + "\n"
                     row_count += 1
-                    
-                    # Qatorlar soni cheklovi
-                    if row_count > max_rows:
-                        content += f"... (faylning qolgan qismi o'qilmadi - {max_rows} qatordan ortiq)\n"
-                        break
+                    if row_count <= max_rows:
+                        content += " | ".join(row) + "\n"
+                
+                if row_count > max_rows:
+                    content += f"... (ko'rinishda birinchi {max_rows} qator, jami {row_count} qator)\n"
             
             return {
                 'content': content.strip(),
@@ -313,6 +310,83 @@ class FileParser:
                 'metadata': {}
             }
     
+    @staticmethod
+    def _detect_csv_delimiter(sample: str) -> str:
+        """CSV ajratuvchisini aniqlash"""
+        try:
+            return csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter
+        except csv.Error:
+            return ','  # Default delimiter
+    
+    @staticmethod
+    def _looks_like_header(first_row: List[str], sample: str) -> bool:
+        """Birinchi qator ustun nomlari ekanligini taxmin qilish"""
+        cells = [cell.strip() for cell in first_row]
+        filled = [cell for cell in cells if cell]
+        if not filled:
+            return False
+        # Ustun nomlari raqam yoki havola bo'lmaydi
+        if any(cell.replace(' ', '').replace('.', '').replace(',', '').isdigit()
+               or cell.lower().startswith(('http://', 'https://')) for cell in filled):
+            return False
+        try:
+            if csv.Sniffer().has_header(sample):
+                return True
+        except csv.Error:
+            pass
+        # Qisqa va takrorlanmaydigan nomlar
+        return len(set(filled)) == len(filled) and all(len(cell) <= 40 for cell in filled)
+    
+    @staticmethod
+    def read_csv_table(file_path: str, max_rows: int = 500000) -> Dict[str, Any]:
+        """
+        CSV faylni ustun nomlari va qatorlar ko'rinishida o'qish (mahsulot jadvali uchun)
+        
+        Args:
+            file_path: Fayl manzili
+            max_rows: O'qiladigan qatorlar soni cheklovi
+            
+        Returns:
+            Dict: {'success': bool, 'error': str, 'header': List[str], 'rows': List[List[str]],
+                   'delimiter': str, 'truncated': bool}
+        """
+        try:
+            with open(file_path, 'r', encoding='utf-8-sig', errors='ignore', newline='') as file:
+                sample = file.read(4096)
+                file.seek(0)
+                delimiter = FileParser._detect_csv_delimiter(sample)
+                reader = csv.reader(file, delimiter=delimiter)
+                
+                first_row = next(reader, None)
+                if not first_row:
+                    return {'success': False, 'error': 'CSV fayl bo\'sh', 'header': [], 'rows': [],
+                            'delimiter': delimiter, 'truncated': False}
+                if not FileParser._looks_like_header(first_row, sample):
+                    return {'success': False, 'error': 'CSV faylda ustun nomlari topilmadi', 'header': [],
+                            'rows': [], 'delimiter': delimiter, 'truncated': False}
+                
+                header = first_row[:FileParser.MAX_CSV_COLUMNS]
+                width = len(header)
+                rows = []
+                truncated = False
+                for row in reader:
+                    if not any(cell.strip() for cell in row):
+                        continue
+                    if len(rows) >= max_rows:
+                        truncated = True
+                        break
+                    # Qator uzunligini sarlavhaga moslash
+                    if len(row) < width:
+                        row = row + [''] * (width - len(row))
+                    rows.append([cell.strip() for cell in row[:width]])
+            
+            return {'success': True, 'error': None, 'header': [name.strip() for name in header],
+                    'rows': rows, 'delimiter': delimiter, 'truncated': truncated}
+            
+        except Exception as e:
+            return {'success': False, 'error': f'CSV parse qilishda xato: {str(e)}', 'header': [],
+                    'rows': [], 'delimiter': ',', 'truncated': False}
+    
     @staticmethod
     def _parse_txt(file_path: str) -> Dict[str, Any]:
         """TXT faylni parse qilish"""
@@ -0,0 +1,264 @@
+import asyncio
+import os
+import threading
+from typing import Any, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import current_app, has_app_context
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - asinxron yo'l (asgi.py) httpx talab qiladi
+    httpx = None
+
+try:
+    import h2  # noqa: F401 - httpx HTTP/2 uchun kerak
+except ImportError:  # pragma: no cover - h2 o'rnatilmagan bo'lsa HTTP/1.1
+    h2 = None
+
+class HttpClient:
+    """Platforma API lari (Telegram, WhatsApp, Instagram) uchun umumiy HTTP transport
+
+    Har bir process uchun bitta sessiya: hostlar bo'yicha keep-alive
+    ulanishlar puli, shuning uchun har bir so'rovda TCP+TLS handshake
+    takrorlanmaydi. Ulanish va o'qish timeoutlari alohida. Ulanish xatolari
+    (so'rov hali yuborilmagan) barcha metodlar uchun backoff bilan qayta
+    uriniladi; 502/503/504 javoblari faqat idempotent so'rovlar (GET, DELETE)
+    uchun - POST (sendMessage, editMessageText va h.k.) qayta yuborilmaydi,
+    xabar ikki marta ketmaydi. 429 qayta urinilmaydi va Retry-After uchun
+    thread uxlatilmaydi: javob chaqiruvchiga qaytadi (masalan, Telegram
+    retry_after ni o'zi hisobga oladi).
+
+    `h2` paketi o'rnatilgan va HTTP_CLIENT_HTTP2 yoqilgan bo'lsa httpx orqali
+    HTTP/2 ishlatiladi. Ikkala holatda ham javob va xatolar requests
+    kutubxonasidagidek (response.json(), raise_for_status(),
+    requests.exceptions.RequestException).
+
+    Asinxron yo'l (asgi.py) uchun arequest/aget/apost - event loop ga
+    bog'langan bitta httpx.AsyncClient, xatolar va javob shu ko'rinishda.
+    """
+
+    _client = None
+    _pid: Optional[int] = None
+    _lock = threading.Lock()
+    _async_client = None
+    _async_loop = None
+
+    RETRY_STATUSES = (502, 503, 504)
+    RETRY_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'DELETE'})  # idempotent
+
+    @staticmethod
+    def _config(name: str, default):
+        if has_app_context():
+            return current_app.config.get(name, default)
+        return default
+
+    @staticmethod
+    def _timeout(timeout=None, read_timeout: Optional[float] = None) -> Tuple[float, float]:
+        """(connect, read) timeout juftligi"""
+        if isinstance(timeout, tuple):
+            return timeout
+        connect = HttpClient._config('HTTP_CONNECT_TIMEOUT', 3.05)
+        read = read_timeout or timeout or HttpClient._config('HTTP_READ_TIMEOUT', 10)
+        return connect, read
+
+    # ===== SESSIYA =====
+
+    @staticmethod
+    def _build_session() -> requests.Session:
+        retries = HttpClient._config('HTTP_RETRIES', 2)
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=False,  # javob kutilayotgan so'rov qayta yuborilmaydi, ReadTimeout o'zi qaytadi
+            status=retries,
+            backoff_factor=HttpClient._config('HTTP_RETRY_BACKOFF', 0.3),
+            status_forcelist=HttpClient.RETRY_STATUSES,
+            allowed_methods=HttpClient.RETRY_METHODS,  # status bo'yicha; ulanish xatosi har qanday metodda
+            respect_retry_after_header=False,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=HttpClient._config('HTTP_POOL_HOSTS', 20),
+            pool_maxsize=HttpClient._config('HTTP_POOL_MAXSIZE', 10),
+            max_retries=retry
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @staticmethod
+    def _build_http2_client():
+        transport = httpx.HTTPTransport(http2=True, retries=HttpClient._config('HTTP_RETRIES', 2),
+                                        limits=HttpClient._limits())
+        return httpx.Client(transport=transport, http2=True)
+
+    @staticmethod
+    def _limits():
+        pool_size = HttpClient._config('HTTP_POOL_MAXSIZE', 10)
+        return httpx.Limits(max_connections=pool_size * HttpClient._config('HTTP_POOL_HOSTS', 20),
+                            max_keepalive_connections=pool_size)
+
+    @staticmethod
+    def uses_http2() -> bool:
+        return httpx is not None and h2 is not None and bool(HttpClient._config('HTTP_CLIENT_HTTP2', True))
+
+    @staticmethod
+    def get_client():
+        """Shu process uchun sessiya (gunicorn fork dan keyin qayta yaratiladi)"""
+        if HttpClient._pid != os.getpid():
+            with HttpClient._lock:
+                if HttpClient._pid != os.getpid():
+                    HttpClient._client = HttpClient._build_http2_client() if HttpClient.uses_http2() \
+                        else HttpClient._build_session()
+                    HttpClient._pid = os.getpid()
+        return HttpClient._client
+
+    @staticmethod
+    def get_async_client():
+        """Joriy event loop uchun httpx.AsyncClient (loop almashsa qayta yaratiladi)"""
+        loop = asyncio.get_running_loop()
+        if HttpClient._async_loop is not loop:
+            http2 = HttpClient.uses_http2()
+            transport = httpx.AsyncHTTPTransport(http2=http2, retries=HttpClient._config('HTTP_RETRIES', 2),
+                                                 limits=HttpClient._limits())
+            HttpClient._async_client = httpx.AsyncClient(transport=transport, http2=http2)
+            HttpClient._async_loop = loop
+        return HttpClient._async_client
+
+    @staticmethod
+    async def aclose() -> None:
+        """Asinxron klientni yopish (ASGI lifespan shutdown)"""
+        client, HttpClient._async_client, HttpClient._async_loop = HttpClient._async_client, None, None
+        if client is not None:
+            await client.aclose()
+
+    # ===== SO'ROVLAR =====
+
+    @staticmethod
+    def request(method: str, url: str, timeout=None, read_timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        HTTP so'rov yuborish
+
+        Args:
+            timeout: O'qish timeouti yoki (connect, read) juftligi
+            read_timeout: Faqat o'qish timeouti (long polling uchun)
+
+        Returns:
+            requests.Response yoki unga mos HTTP/2 javob
+        """
+        client = HttpClient.get_client()
+        connect, read = HttpClient._timeout(timeout, read_timeout)
+        if isinstance(client, requests.Session):
+            return client.request(method, url, timeout=(connect, read), **kwargs)
+        return HttpClient._httpx_request(client, method, url, connect, read, **kwargs)
+
+    @staticmethod
+    def get(url: str, **kwargs) -> Any:
+        return HttpClient.request('GET', url, **kwargs)
+
+    @staticmethod
+    def post(url: str, **kwargs) -> Any:
+        return HttpClient.request('POST', url, **kwargs)
+
+    @staticmethod
+    async def arequest(method: str, url: str, timeout=None, read_timeout: Optional[float] = None,
+                       **kwargs) -> '_Http2Response':
+        """HTTP so'rov (asinxron) - request() bilan bir xil timeoutlar, javob va xatolar"""
+        client = HttpClient.get_async_client()
+        connect, read = HttpClient._timeout(timeout, read_timeout)
+        attempts = 1 + (HttpClient._config('HTTP_RETRIES', 2) if method.upper() in HttpClient.RETRY_METHODS else 0)
+        backoff = HttpClient._config('HTTP_RETRY_BACKOFF', 0.3)
+        for attempt in range(attempts):
+            try:
+                response = await client.request(method, url, timeout=httpx.Timeout(read, connect=connect), **kwargs)
+            except Exception as e:
+                HttpClient._raise_translated(e)
+            if response.status_code not in HttpClient.RETRY_STATUSES or attempt == attempts - 1:
+                return _Http2Response(response)
+            await asyncio.sleep(backoff * (2 ** attempt))
+
+    @staticmethod
+    async def aget(url: str, **kwargs) -> '_Http2Response':
+        return await HttpClient.arequest('GET', url, **kwargs)
+
+    @staticmethod
+    async def apost(url: str, **kwargs) -> '_Http2Response':
+        return await HttpClient.arequest('POST', url, **kwargs)
+
+    @staticmethod
+    def _httpx_request(client, method: str, url: str, connect: float, read: float, **kwargs) -> '_Http2Response':
+        """httpx so'rovi - xatolar requests istisnolariga o'tkaziladi"""
+        try:
+            response = client.request(method, url, timeout=httpx.Timeout(read, connect=connect), **kwargs)
+        except Exception as e:
+            HttpClient._raise_translated(e)
+        return _Http2Response(response)
+
+    @staticmethod
+    def _raise_translated(error: Exception) -> None:
+        """httpx istisnosini requests istisnosi sifatida qayta ko'tarish"""
+        if isinstance(error, httpx.TimeoutException):
+            raise requests.exceptions.Timeout(str(error)) from error
+        if isinstance(error, httpx.TransportError):
+            raise requests.exceptions.ConnectionError(str(error)) from error
+        if isinstance(error, httpx.HTTPError):
+            raise requests.exceptions.RequestException(str(error)) from error
+        raise error
+
+    # ===== XATOLAR =====
+
+    @staticmethod
+    def is_transient(error: Exception) -> bool:
+        """Qayta urinsa o'tishi mumkin bo'lgan xato (ulanish, timeout, 429, 5xx)"""
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None)
+        return status is not None and (status == 429 or status >= 500)
+
+    @staticmethod
+    def error_message(error: Exception) -> 'ErrorText':
+        """(False, message) natijalari uchun "Network error: ..." matni (transient belgisi bilan)"""
+        return ErrorText(f"Network error: {str(error)}", HttpClient.is_transient(error))
+
+class ErrorText(str):
+    """Xato matni - oddiy str, transient=True bo'lsa qayta urinish mumkin (InboundQueue)"""
+
+    def __new__(cls, text: str, transient: bool = False):
+        value = super().__new__(cls, text)
+        value.transient = transient
+        return value
+
+class _Http2Response:
+    """httpx javobi uchun requests.Response ga mos interfeys"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.reason = response.reason_phrase
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self._response.text
+
+    @property
+    def content(self) -> bytes:
+        return self._response.content
+
+    def json(self, **kwargs):
+        return self._response.json(**kwargs)
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(
+                f"{self.status_code} Error: {self.reason} for url: {self.url}", response=self
+            )
@@ -0,0 +1,527 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
+from flask import current_app
+from sqlalchemy import delete, exists, func, insert, or_, select, update
+from models.user import db
+from models.inbound_queue import InboundUpdate
+from utils.update_dedup import UpdateDeduplicator
+from utils.async_runtime import AsyncRuntime
+
+class RetryableError(Exception):
+    """Vaqtinchalik xato (tarmoq, platforma 429/5xx, AI provayderi ishlamayapti)
+
+    Ishlovchi buni tashlasa yozuv backoff bilan qayta navbatga qo'yiladi;
+    (False, message) qaytarish - doimiy rad etish (bot o'chirilgan, xabar yo'q),
+    qayta urinilmaydi.
+    """
+
+class InboundQueue:
+    """Kiruvchi webhook yangilanishlari uchun DB dagi navbat
+
+    Webhook faqat so'rovni tekshiradi, xom ma'lumotni inbound_updates
+    jadvaliga yozadi va darhol 200 qaytaradi. AI javobi va platformaga
+    yuborish InboundWorker threadlarida bajariladi - web process ichida
+    (INBOUND_WORKER_THREADS) yoki alohida `python inbound_worker.py` orqali.
+
+    Yangilanish turlari (kind) uchun ishlovchilar register() bilan
+    qo'shiladi: handler(target_id, payload) -> (success, message).
+    Ishlovchi istisno (RetryableError yoki kutilmagan xato) tashlasa yozuv
+    backoff bilan qayta navbatga qo'yiladi; oxirgi urinishda foydalanuvchiga
+    xato xabari yuborilishi uchun ishlovchi is_final_attempt() ni tekshiradi.
+    asgi.py dispetcheri uchun turga asinxron ishlovchi ham berilishi mumkin
+    (async_handler, aprocess) - natija va qayta urinish qoidalari bir xil.
+    """
+
+    _handlers: Dict[str, Callable[[str, Dict[str, Any]], Tuple[bool, str]]] = {}
+    _async_handlers: Dict[str, Callable[[str, Dict[str, Any]], Awaitable[Tuple[bool, str]]]] = {}
+    # Ketma-ket xabarlarni birlashtirish: kind -> (chat_key(payload), merge(payloads))
+    _coalescers: Dict[str, Tuple[Callable, Callable]] = {}
+
+    # Backpressure: navbat chuqurligi process ichida qisqa muddat keshlanadi
+    _depth: Tuple[float, int] = (0.0, 0)
+    _counters = {'enqueued': 0, 'duplicates': 0, 'coalesced': 0, 'rejected': 0, 'processed': 0, 'failed': 0, 'retried': 0}
+    _lock = threading.Lock()
+    # Shu thread / asyncio vazifasida ishlanayotgan element (is_final_attempt uchun)
+    _current: ContextVar[Optional[Dict[str, Any]]] = ContextVar('inbound_item', default=None)
+
+    DEPTH_CACHE_SECONDS = 2
+    RETRY_BASE_SECONDS = 5
+    RETRY_MAX_SECONDS = 300
+    # Bitta javobga birlashtiriladigan xabarlar chegarasi
+    COALESCE_MAX_UPDATES = 20
+
+    @staticmethod
+    def register(kind: str, handler: Callable[[str, Dict[str, Any]], Tuple[bool, str]],
+                 chat_key: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None,
+                 merge: Optional[Callable[[List[Dict[str, Any]]], Dict[str, Any]]] = None,
+                 async_handler: Optional[Callable[[str, Dict[str, Any]], Awaitable[Tuple[bool, str]]]] = None) -> None:
+        """
+        Yangilanish turi uchun ishlovchini ro'yxatga olish
+
+        Args:
+            chat_key: Yangilanishdan chat ID sini olish - berilsa bitta chatning
+                      INBOUND_COALESCE_WINDOW ichidagi xabarlari birlashtiriladi
+            merge: Bitta chat yangilanishlarini (kelish tartibida) bittaga birlashtirish
+            async_handler: handler ning asinxron varianti (asgi.py); berilmasa
+                           sinxron handler thread pulida bajariladi
+        """
+        InboundQueue._handlers[kind] = handler
+        if async_handler:
+            InboundQueue._async_handlers[kind] = async_handler
+        if chat_key and merge:
+            InboundQueue._coalescers[kind] = (chat_key, merge)
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return bool(current_app.config.get('INBOUND_QUEUE_ENABLED', True))
+
+    @staticmethod
+    def is_final_attempt() -> bool:
+        """
+        Joriy yangilanish uchun boshqa urinish bo'lmaydimi
+
+        Navbatsiz (webhook so'rovi ichida) chaqirilganda ham True - ishlovchi
+        RetryableError o'rniga foydalanuvchiga xato xabarini yuboradi.
+        """
+        item = InboundQueue._current.get()
+        if item is None:
+            return True
+        return item['attempts'] >= current_app.config.get('INBOUND_QUEUE_MAX_ATTEMPTS', 5)
+
+    @staticmethod
+    def _count(name: str, amount: int = 1) -> None:
+        with InboundQueue._lock:
+            InboundQueue._counters[name] += amount
+
+    # ===== NAVBATGA QO'SHISH =====
+
+    @staticmethod
+    def is_overloaded() -> bool:
+        """Navbat INBOUND_QUEUE_MAX_DEPTH dan oshganmi (webhook 503 qaytaradi)"""
+        max_depth = current_app.config.get('INBOUND_QUEUE_MAX_DEPTH', 1000)
+        if not max_depth:
+            return False
+        checked_at, depth = InboundQueue._depth
+        now = time.monotonic()
+        if now - checked_at >= InboundQueue.DEPTH_CACHE_SECONDS:
+            depth = InboundQueue.depth()
+            InboundQueue._depth = (now, depth)
+        return depth >= max_depth
+
+    @staticmethod
+    def depth() -> int:
+        """Qayta ishlanishi kutilayotgan yozuvlar soni"""
+        table = InboundUpdate.__table__
+        with db.engine.connect() as conn:
+            return conn.execute(
+                select(func.count()).select_from(table).where(table.c.status == 'pending')
+            ).scalar() or 0
+
+    @staticmethod
+    def submit(kind: str, target_id, payload: Dict[str, Any],
+               platform: Optional[str] = None) -> Tuple[bool, str]:
+        """
+        Webhook yangilanishini navbatga qo'yish
+
+        platform berilsa qayta yuborilgan yangilanishlar (update_id, message.id,
+        mid) navbatga qo'yilmaydi. Navbat o'chirilgan bo'lsa ishlovchi shu
+        so'rov ichida chaqiriladi.
+
+        Returns:
+            Tuple: (success, message) - success=False bo'lsa navbat to'lgan
+        """
+        queued = InboundQueue.is_enabled()
+        if queued and InboundQueue.is_overloaded():
+            InboundQueue._count('rejected')
+            current_app.logger.warning(f"Inbound queue is full, {kind} update rejected")
+            return False, "Queue is full"
+
+        account_key = f"{kind}:{target_id}"
+        new_ids = []
+        if platform and UpdateDeduplicator.is_enabled():
+            external_ids = UpdateDeduplicator.extract_ids(platform, payload)
+            if external_ids:
+                new_ids = UpdateDeduplicator.claim(platform, account_key, external_ids)
+                if not new_ids:
+                    InboundQueue._count('duplicates')
+                    return True, "Duplicate"
+                payload = UpdateDeduplicator.filter_payload(platform, payload, new_ids)
+
+        table = InboundUpdate.__table__
+        utc_now = datetime.utcnow()
+        try:
+            if not queued:
+                success, message = InboundQueue._handlers[kind](str(target_id), payload)
+                if not success and new_ids:
+                    UpdateDeduplicator.release(platform, account_key, new_ids)
+                return success, message
+            # Chat xabarlari oyna tugaguncha kutadi - keyingi xabarlar bilan birga javob beriladi
+            chat_key, available_at = None, utc_now
+            window = current_app.config.get('INBOUND_COALESCE_WINDOW', 1.5)
+            if kind in InboundQueue._coalescers:
+                chat_id = InboundQueue._coalescers[kind][0](payload)
+                if chat_id:
+                    chat_key = f"{account_key}:{chat_id}"
+                    available_at = utc_now + timedelta(seconds=window)
+            with db.engine.begin() as conn:
+                conn.execute(insert(table).values(
+                    kind=kind, target_id=str(target_id), payload=payload, status='pending',
+                    chat_key=chat_key, attempts=0, available_at=available_at, created_at=utc_now
+                ))
+        except Exception:
+            # Yangilanish qabul qilinmadi - platforma qayta yuborganda ishlanishi kerak
+            if new_ids:
+                UpdateDeduplicator.release(platform, account_key, new_ids)
+            raise
+        InboundQueue._count('enqueued')
+
+        # Shu processdagi workerlarni uyg'otish
+        InboundWorker.ensure_started(current_app._get_current_object())
+        InboundWorker.notify()
+        return True, "Queued"
+
+    # ===== WORKER UCHUN =====
+
+    @staticmethod
+    def claim(limit: int) -> List[Dict[str, Any]]:
+        """
+        Navbatdan yozuvlarni band qilish
+
+        PostgreSQL da SELECT ... FOR UPDATE SKIP LOCKED, SQLite da
+        status='pending' sharti bilan UPDATE - bitta yozuvni faqat bitta
+        worker oladi. Chat yozuvi olinganda shu chatning barcha kutayotgan
+        yozuvlari ham olinadi va bitta elementga birlashtiriladi; chatning
+        oldingi xabari hali ishlanayotgan bo'lsa chat o'tkazib yuboriladi
+        (javoblar tartibi saqlanadi).
+
+        Returns:
+            List[Dict]: {'id', 'ids', 'kind', 'target_id', 'payload', 'attempts'}
+        """
+        table = InboundUpdate.__table__
+        busy = InboundUpdate.__table__.alias('busy')
+        token = str(uuid.uuid4())
+        utc_now = datetime.utcnow()
+        skip_locked = db.engine.dialect.name == 'postgresql'
+
+        with db.engine.begin() as conn:
+            chat_busy = exists().where(busy.c.chat_key == table.c.chat_key, busy.c.status == 'processing')
+            query = select(table.c.id, table.c.chat_key).where(
+                table.c.status == 'pending', table.c.available_at <= utc_now,
+                or_(table.c.chat_key.is_(None), ~chat_busy)
+            ).order_by(table.c.id).limit(limit)
+            if skip_locked:
+                query = query.with_for_update(skip_locked=True)
+            selected = conn.execute(query).all()
+            if not selected:
+                return []
+
+            ids = [row.id for row in selected]
+            chat_keys = {row.chat_key for row in selected if row.chat_key}
+            if chat_keys:
+                # Oyna ichida kelgan keyingi xabarlar (hali vaqti kelmagan bo'lsa ham)
+                followers = select(table.c.id).where(
+                    table.c.chat_key.in_(chat_keys), table.c.status == 'pending'
+                ).order_by(table.c.id).limit(InboundQueue.COALESCE_MAX_UPDATES * len(chat_keys))
+                if skip_locked:
+                    followers = followers.with_for_update(skip_locked=True)
+                ids = sorted(set(ids) | set(conn.execute(followers).scalars().all()))
+
+            conn.execute(
+                update(table).where(table.c.id.in_(ids), table.c.status == 'pending').values(
+                    status='processing', locked_by=token, locked_at=utc_now,
+                    attempts=table.c.attempts + 1
+                )
+            )
+            rows = conn.execute(
+                select(table.c.id, table.c.kind, table.c.target_id, table.c.payload,
+                       table.c.attempts, table.c.chat_key)
+                .where(table.c.locked_by == token, table.c.status == 'processing')
+                .order_by(table.c.id)
+            ).all()
+
+        items, chats = [], {}
+        for row in rows:
+            if row.chat_key and row.chat_key in chats:
+                item = chats[row.chat_key]
+                item['ids'].append(row.id)
+                item['payloads'].append(row.payload)
+                item['attempts'] = max(item['attempts'], row.attempts)
+                continue
+            item = {'id': row.id, 'ids': [row.id], 'kind': row.kind, 'target_id': row.target_id,
+                    'payloads': [row.payload], 'attempts': row.attempts}
+            if row.chat_key:
+                chats[row.chat_key] = item
+            items.append(item)
+
+        for item in items:
+            payloads = item.pop('payloads')
+            if len(payloads) > 1:
+                item['payload'] = InboundQueue._coalescers[item['kind']][1](payloads)
+                InboundQueue._count('coalesced', len(payloads) - 1)
+            else:
+                item['payload'] = payloads[0]
+        return items
+
+    @staticmethod
+    def process(item: Dict[str, Any]) -> None:
+        """Bitta elementni ishlovchiga berish va natijani yozish"""
+        handler = InboundQueue._handlers.get(item['kind'])
+        if handler is None:
+            InboundQueue._finish(item, 'failed', f"No handler for {item['kind']}")
+            return
+
+        token = InboundQueue._current.set(item)
+        try:
+            success, message = handler(item['target_id'], item['payload'])
+        except RetryableError as e:
+            db.session.rollback()
+            current_app.logger.warning(f"Inbound {item['kind']} update {item['id']} will be retried: {str(e)}")
+            InboundQueue._retry(item, str(e))
+            return
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Inbound {item['kind']} update {item['id']} error: {str(e)}")
+            InboundQueue._retry(item, f"{str(e)}\n{traceback.format_exc(limit=5)}")
+            return
+        finally:
+            InboundQueue._current.reset(token)
+            # Ishlovchi ochiq qoldirgan tranzaksiya navbat yozuvlarini bloklamasin
+            db.session.remove()
+
+        # Ishlovchi rad etgan yangilanish (xabar yo'q, bot o'chirilgan) qayta urinilmaydi
+        InboundQueue._finish(item, 'done' if success else 'failed', None if success else message)
+
+    @staticmethod
+    async def aprocess(item: Dict[str, Any]) -> None:
+        """
+        process() ning asinxron varianti (asgi.py dispetcheri)
+
+        Asinxron ishlovchi event loop da bajariladi, navbat yozuvini
+        yangilash AsyncRuntime thread pulida. Asinxron ishlovchisi yo'q tur
+        (masalan, eski platform_* yangilanishlari) process() orqali threadda.
+        """
+        handler = InboundQueue._async_handlers.get(item['kind'])
+        if handler is None:
+            await AsyncRuntime.run(InboundQueue.process, item)
+            return
+
+        token = InboundQueue._current.set(item)
+        try:
+            success, message = await handler(item['target_id'], item['payload'])
+        except RetryableError as e:
+            current_app.logger.warning(f"Inbound {item['kind']} update {item['id']} will be retried: {str(e)}")
+            await AsyncRuntime.run(InboundQueue._retry, item, str(e))
+            return
+        except Exception as e:
+            current_app.logger.error(f"Inbound {item['kind']} update {item['id']} error: {str(e)}")
+            await AsyncRuntime.run(InboundQueue._retry, item, f"{str(e)}\n{traceback.format_exc(limit=5)}")
+            return
+        finally:
+            InboundQueue._current.reset(token)
+
+        await AsyncRuntime.run(InboundQueue._finish, item, 'done' if success else 'failed',
+                               None if success else message)
+
+    @staticmethod
+    def _finish(item: Dict[str, Any], status: str, error: Optional[str]) -> None:
+        table = InboundUpdate.__table__
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.id.in_(item['ids'])).values(
+                status=status, last_error=error, processed_at=datetime.utcnow(), locked_by=None
+            ))
+        InboundQueue._count('processed' if status == 'done' else 'failed', len(item['ids']))
+
+    @staticmethod
+    def _retry(item: Dict[str, Any], error: str) -> None:
+        """Eksponensial kutish bilan qayta navbatga qo'yish yoki failed"""
+        max_attempts = current_app.config.get('INBOUND_QUEUE_MAX_ATTEMPTS', 5)
+        if item['attempts'] >= max_attempts:
+            InboundQueue._finish(item, 'failed', error)
+            return
+
+        delay = min(InboundQueue.RETRY_BASE_SECONDS * 2 ** (item['attempts'] - 1), InboundQueue.RETRY_MAX_SECONDS)
+        table = InboundUpdate.__table__
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.id.in_(item['ids'])).values(
+                status='pending', last_error=error, locked_by=None,
+                available_at=datetime.utcnow() + timedelta(seconds=delay)
+            ))
+        InboundQueue._count('retried')
+
+    @staticmethod
+    def maintain() -> Dict[str, int]:
+        """
+        Osilib qolgan yozuvlarni qaytarish va eski yozuvlarni tozalash
+
+        Worker process to'xtab qolsa uning 'processing' yozuvlari
+        INBOUND_QUEUE_VISIBILITY_TIMEOUT dan keyin qayta navbatga qo'yiladi.
+
+        Returns:
+            Dict: {'requeued', 'expired', 'pruned'} (pruned - seen_updates bilan birga)
+        """
+        table = InboundUpdate.__table__
+        config = current_app.config
+        utc_now = datetime.utcnow()
+        stale_before = utc_now - timedelta(seconds=config.get('INBOUND_QUEUE_VISIBILITY_TIMEOUT', 300))
+        prune_before = utc_now - timedelta(seconds=config.get('INBOUND_QUEUE_RETENTION', 86400))
+        max_attempts = config.get('INBOUND_QUEUE_MAX_ATTEMPTS', 5)
+        stale = (table.c.status == 'processing') & (table.c.locked_at < stale_before)
+
+        with db.engine.begin() as conn:
+            expired = conn.execute(update(table).where(stale, table.c.attempts >= max_attempts).values(
+                status='failed', locked_by=None, processed_at=utc_now, last_error='Processing timed out'
+            )).rowcount or 0
+            requeued = conn.execute(update(table).where(stale).values(
+                status='pending', locked_by=None, available_at=utc_now
+            )).rowcount or 0
+            pruned = conn.execute(delete(table).where(
+                table.c.status.in_(('done', 'failed')), table.c.processed_at < prune_before
+            )).rowcount or 0
+        if UpdateDeduplicator.is_enabled():
+            pruned += UpdateDeduplicator.prune()
+        if requeued or expired:
+            current_app.logger.warning(f"Inbound queue: {requeued} stale updates requeued, {expired} failed")
+        return {'requeued': requeued, 'expired': expired, 'pruned': pruned}
+
+    # ===== STATISTIKA =====
+
+    @staticmethod
+    def get_stats() -> Dict[str, Any]:
+        """
+        Navbat holati (backpressure metrikalari)
+
+        Returns:
+            Dict: holatlar bo'yicha soni, eng eski kutayotgan yozuv yoshi,
+                  to'lish darajasi va shu process hisoblagichlari
+        """
+        table = InboundUpdate.__table__
+        with db.engine.connect() as conn:
+            by_status = dict(conn.execute(
+                select(table.c.status, func.count()).group_by(table.c.status)
+            ).all())
+            oldest = conn.execute(
+                select(func.min(table.c.created_at)).where(table.c.status == 'pending')
+            ).scalar()
+
+        pending = by_status.get('pending', 0)
+        max_depth = current_app.config.get('INBOUND_QUEUE_MAX_DEPTH', 1000)
+        with InboundQueue._lock:
+            counters = dict(InboundQueue._counters)
+        return {
+            'pending': pending,
+            'processing': by_status.get('processing', 0),
+            'done': by_status.get('done', 0),
+            'failed': by_status.get('failed', 0),
+            'oldest_pending_seconds': round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else 0.0,
+            'max_depth': max_depth,
+            'saturation': round(pending / max_depth, 4) if max_depth else 0.0,
+            'overloaded': bool(max_depth) and pending >= max_depth,
+            'worker_threads': InboundWorker.thread_count(),
+            'process_counters': counters
+        }
+
+class InboundWorker:
+    """Navbatni bo'shatuvchi threadlar puli
+
+    Web process ichida gunicorn worker ishga tushganda (gunicorn.conf.py
+    post_worker_init - fork dan keyin) yoki birinchi submit() da ishga
+    tushadi, shuning uchun restartdan oldin qolgan pending yozuvlar ham
+    darhol ishlanadi. Alohida process uchun inbound_worker.py ishlatiladi.
+    """
+
+    _threads: List[threading.Thread] = []
+    _pid: Optional[int] = None
+    _wakeup = threading.Event()
+    _stop = threading.Event()
+    _lock = threading.Lock()
+
+    MAINTENANCE_INTERVAL = 30  # soniya
+
+    @staticmethod
+    def ensure_started(app, threads: Optional[int] = None) -> None:
+        """Shu processda workerlar ishlamayotgan bo'lsa ishga tushirish (soni - INBOUND_WORKER_THREADS)"""
+        if threads is None:
+            threads = app.config['INBOUND_WORKER_THREADS']
+        if threads <= 0 or InboundWorker._pid == os.getpid():
+            return
+        with InboundWorker._lock:
+            if InboundWorker._pid == os.getpid():
+                return
+            InboundWorker.start(app, threads)
+
+    @staticmethod
+    def start(app, threads: int) -> List[threading.Thread]:
+        """Daemon worker threadlarni ishga tushirish"""
+        InboundWorker._pid = os.getpid()
+        InboundWorker._stop.clear()
+        InboundWorker._threads = []
+        for index in range(threads):
+            thread = threading.Thread(
+                target=InboundWorker.run, args=(app,),
+                name=f"inbound-worker-{index + 1}", daemon=True
+            )
+            thread.start()
+            InboundWorker._threads.append(thread)
+        return InboundWorker._threads
+
+    @staticmethod
+    def stop() -> None:
+        InboundWorker._stop.set()
+        InboundWorker._wakeup.set()
+
+    @staticmethod
+    def notify() -> None:
+        InboundWorker._wakeup.set()
+
+    @staticmethod
+    def wait_for_work(timeout: float) -> None:
+        """Yangi yozuv (notify) yoki timeout gacha kutish"""
+        InboundWorker._wakeup.wait(timeout)
+        InboundWorker._wakeup.clear()
+
+    @staticmethod
+    def thread_count() -> int:
+        if InboundWorker._pid != os.getpid():
+            return 0
+        return sum(1 for thread in InboundWorker._threads if thread.is_alive())
+
+    @staticmethod
+    def run(app, once: bool = False) -> int:
+        """
+        Worker tsikli: navbatdan olish -> qayta ishlash -> kutish
+
+        Args:
+            once: Navbat bo'shaguncha ishlab to'xtash (CLI --once)
+
+        Returns:
+            int: Qayta ishlangan yozuvlar soni
+        """
+        processed = 0
+        last_maintenance = 0.0
+        while not InboundWorker._stop.is_set():
+            items = []
+            with app.app_context():
+                try:
+                    if time.monotonic() - last_maintenance >= InboundWorker.MAINTENANCE_INTERVAL:
+                        last_maintenance = time.monotonic()
+                        InboundQueue.maintain()
+                    items = InboundQueue.claim(app.config.get('INBOUND_QUEUE_BATCH', 1))
+                    for item in items:
+                        InboundQueue.process(item)
+                        processed += 1
+                except Exception as e:
+                    app.logger.error(f"Inbound worker error: {str(e)}")
+                    db.session.remove()
+
+            if items:
+                continue
+            if once:
+                break
+            InboundWorker.wait_for_work(app.config.get('INBOUND_QUEUE_POLL_INTERVAL', 1.0))
+        return processed
@@ -0,0 +1,219 @@
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from flask import current_app
+from sqlalchemy import and_, func, insert, or_, select, update
+from models.user import db
+from models.access_token import AccessTokenCache
+from models.ai_config import AIConfig
+from models.messaging import InstagramAccount, PlatformCredentials, TelegramBot, WhatsAppAccount
+from models.key_rotation import KeyRotationProgress
+from utils.credential_vault import CredentialVault
+
+class KeyRotation:
+    """Shifrlangan ustunlarni joriy ENCRYPTION_KEY ga fonda o'tkazish
+
+    Kalit almashtirish tartibi (to'xtovsiz):
+      1. ENCRYPTION_KEY = yangi kalit, ENCRYPTION_KEY_VERSION = oldingisidan
+         katta son, ENCRYPTION_OLD_KEYS = "eski_versiya:eski_kalit" - o'qish
+         ikkala kalit bilan ishlaydi, yangi yozuvlar yangi kalit bilan.
+      2. KeyRotation (admin panel yoki rotate_encryption_key.py) barcha
+         encrypted_* ustunlarni CREDENTIAL_ROTATION_BATCH qatordan qayta
+         shifrlaydi, partiyalar orasida CREDENTIAL_ROTATION_PAUSE kutadi.
+      3. Hamma jadvalda pending 0 bo'lgach eski kalit ENCRYPTION_OLD_KEYS dan
+         olib tashlanadi.
+
+    Har bir jadval kursori key_rotation_progress da saqlanadi - process
+    to'xtasa, keyingi ishga tushirish shu joydan davom etadi. Qiymat faqat
+    o'qilgan holicha turgan bo'lsa yoziladi, shuning uchun shu orada
+    foydalanuvchi saqlagan yangi kalit ustidan yozilmaydi. ENCRYPTION_KEY
+    o'rnatilishidan oldin base64 da saqlangan qiymatlar (Telegram tokenlari,
+    CryptoUtils orqali yozilganlar) ham shifrlanadi.
+    """
+
+    # (model, shifrlangan ustunlar, base64 dagi eski qiymatlar bo'lishi mumkin)
+    TARGETS = (
+        (TelegramBot, ('encrypted_token',), True),
+        (WhatsAppAccount, ('encrypted_app_id', 'encrypted_app_secret', 'encrypted_verify_token'), False),
+        (InstagramAccount, ('encrypted_access_token',), False),
+        (AIConfig, ('encrypted_openai_api_key',), False),
+        (PlatformCredentials, ('encrypted_value',), True),  # CryptoUtils development fallback
+        (AccessTokenCache, ('encrypted_token',), True)
+    )
+
+    _thread: Optional[threading.Thread] = None
+    _stop = threading.Event()
+    _lock = threading.Lock()
+
+    # ===== ISHGA TUSHIRISH =====
+
+    @staticmethod
+    def start(app) -> bool:
+        """Fonda ishga tushirish (shu processda allaqachon ishlayotgan bo'lsa False)"""
+        with KeyRotation._lock:
+            if KeyRotation.is_running():
+                return False
+            KeyRotation._stop.clear()
+            KeyRotation._thread = threading.Thread(
+                target=KeyRotation.run, args=(app,), name="key-rotation", daemon=True
+            )
+            KeyRotation._thread.start()
+        return True
+
+    @staticmethod
+    def stop() -> None:
+        KeyRotation._stop.set()
+
+    @staticmethod
+    def is_running() -> bool:
+        return KeyRotation._thread is not None and KeyRotation._thread.is_alive()
+
+    @staticmethod
+    def run(app) -> Dict[str, int]:
+        """
+        Barcha jadvallarni qayta shifrlash (to'xtatilguncha yoki tugaguncha)
+
+        Returns:
+            Dict: jadval -> shu ishga tushirishda tekshirilgan qatorlar
+        """
+        checked: Dict[str, int] = {}
+        with app.app_context():
+            if CredentialVault.keyring() is None:
+                app.logger.warning("Key rotation skipped: ENCRYPTION_KEY is not set")
+                return checked
+            pause = app.config.get('CREDENTIAL_ROTATION_PAUSE', 0.5)
+            for model, columns, legacy_base64 in KeyRotation.TARGETS:
+                table_name = model.__tablename__
+                checked[table_name] = 0
+                while not KeyRotation._stop.is_set():
+                    try:
+                        processed = KeyRotation.run_batch(model, columns, legacy_base64)
+                    except Exception as e:
+                        # Kursor saqlangan - keyingi ishga tushirish shu joydan davom etadi
+                        app.logger.error(f"Key rotation error on {table_name}: {str(e)}")
+                        db.session.remove()
+                        return checked
+                    if not processed:
+                        break
+                    checked[table_name] += processed
+                    KeyRotation._stop.wait(pause)
+            db.session.remove()
+        app.logger.info(f"Key rotation finished: {checked}")
+        return checked
+
+    # ===== PARTIYA =====
+
+    @staticmethod
+    def run_batch(model, columns: Tuple[str, ...], legacy_base64: bool = False) -> int:
+        """
+        Kursordan keyingi CREDENTIAL_ROTATION_BATCH qatorni qayta shifrlash
+
+        Returns:
+            int: Tekshirilgan qatorlar (0 - jadval tugagan)
+        """
+        keyring = CredentialVault.keyring()
+        table = model.__table__
+        progress = KeyRotation._progress(table.name, keyring.primary_version)
+        if progress['finished_at']:
+            return 0
+
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.id, *[table.c[column] for column in columns])
+                .where(table.c.id > progress['last_id'])
+                .order_by(table.c.id)
+                .limit(current_app.config.get('CREDENTIAL_ROTATION_BATCH', 100))
+            ).all()
+
+        rotated = failed = 0
+        # updated_at (onupdate) o'zgarmasin - masalan, AccessTokenCache yangilash vaqti
+        unchanged = {column.name: column for column in table.c if column.onupdate is not None}
+        with db.engine.begin() as conn:
+            for row in rows:
+                for column in columns:
+                    value = row._mapping[column]
+                    if not CredentialVault.needs_rotation(value):
+                        continue
+                    try:
+                        new_value = CredentialVault.reencrypt(value, legacy_base64)
+                    except Exception as e:
+                        failed += 1
+                        current_app.logger.warning(
+                            f"Key rotation: {table.name}.{column} id={row.id} could not be decrypted ({type(e).__name__})"
+                        )
+                        continue
+                    rotated += conn.execute(
+                        update(table)
+                        .where(table.c.id == row.id, table.c[column] == value)
+                        .values({column: new_value, **unchanged})
+                    ).rowcount
+
+        KeyRotation._save(table.name, {
+            'key_version': keyring.primary_version,
+            'last_id': rows[-1].id if rows else progress['last_id'],
+            'rotated': progress['rotated'] + rotated,
+            'failed': progress['failed'] + failed,
+            'finished_at': None if rows else time.time(),
+            'updated_at': time.time()
+        })
+        return len(rows)
+
+    @staticmethod
+    def _progress(table_name: str, key_version: int) -> Dict[str, Any]:
+        """Jadval kursori; boshqa versiyaga o'tkazilgan bo'lsa boshidan"""
+        table = KeyRotationProgress.__table__
+        with db.engine.connect() as conn:
+            row = conn.execute(select(table).where(table.c.table_name == table_name)).first()
+        if row is None or row.key_version != key_version:
+            return {'last_id': 0, 'rotated': 0, 'failed': 0, 'finished_at': None}
+        return {'last_id': row.last_id, 'rotated': row.rotated, 'failed': row.failed, 'finished_at': row.finished_at}
+
+    @staticmethod
+    def _save(table_name: str, values: Dict[str, Any]) -> None:
+        table = KeyRotationProgress.__table__
+        with db.engine.begin() as conn:
+            updated = conn.execute(update(table).where(table.c.table_name == table_name).values(**values)).rowcount
+            if not updated:
+                conn.execute(insert(table).values(table_name=table_name, **values))
+
+    @staticmethod
+    def reset() -> None:
+        """Kursorlarni o'chirish - keyingi ishga tushirish barcha qatorlarni qayta tekshiradi"""
+        with db.engine.begin() as conn:
+            conn.execute(KeyRotationProgress.__table__.delete())
+
+    # ===== HOLAT =====
+
+    @staticmethod
+    def get_status() -> Dict[str, Any]:
+        """Admin panel uchun: jadval -> kursor, qayta shifrlanganlar va hali eski kalitdagi qatorlar"""
+        keyring = CredentialVault.keyring()
+        if keyring is None:
+            return {'enabled': False, 'running': KeyRotation.is_running(), 'tables': {}}
+
+        progress_table = KeyRotationProgress.__table__
+        tables = {}
+        with db.engine.connect() as conn:
+            progress = {row.table_name: row for row in conn.execute(select(progress_table)).all()}
+            for model, columns, _ in KeyRotation.TARGETS:
+                table = model.__table__
+                pending = conn.execute(select(func.count()).select_from(table).where(or_(*[
+                    and_(table.c[column].isnot(None), table.c[column] != '',
+                         ~table.c[column].startswith(keyring.prefix, autoescape=True))
+                    for column in columns
+                ]))).scalar()
+                row = progress.get(table.name)
+                current = row is not None and row.key_version == keyring.primary_version
+                tables[table.name] = {
+                    'pending': pending,
+                    'last_id': row.last_id if current else 0,
+                    'rotated': row.rotated if current else 0,
+                    'failed': row.failed if current else 0,
+                    'finished': bool(current and row.finished_at)
+                }
+        return {
+            'enabled': True,
+            'key_version': keyring.primary_version,
+            'running': KeyRotation.is_running(),
+            'tables': tables
+        }
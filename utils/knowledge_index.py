@@ -0,0 +1,488 @@
+import array
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import sys
+import threading
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from flask import current_app
+from utils import text_normalizer
+
+try:
+    import fcntl  # Worker processlar orasida manifest yozishni qulflash uchun
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# Segment fayl formati (little-endian):
+#   header | docs (chunk_id, length) | term jadvali | termlar blob | postings (doc_idx, tf)
+# Termlar UTF-8 baytlari bo'yicha saralangan, shuning uchun mmap ustida
+# binary search qilinadi va faylni to'liq o'qish shart emas.
+SEGMENT_MAGIC = b'KIX1'
+_HEADER = struct.Struct('<4sIIQI')   # magic, doc_count, term_count, total_length, blob_length
+_DOC = struct.Struct('<II')          # chunk_id, hujjat uzunligi (termlar soni)
+_TERM = struct.Struct('<IHII')       # blob offset, term uzunligi, postings boshlanishi, postings soni
+_POSTING = struct.Struct('<II')      # segment ichidagi hujjat indeksi, term chastotasi
+
+MAX_TERM_LENGTH = 64  # juda uzun "so'zlar" (havolalar, base64) indekslanmaydi
+
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = '.lock'
+
+class _Segment:
+    """Bitta bilimlar bazasi fayli uchun mmap qilingan indeks segmenti"""
+
+    def __init__(self, path: str, buffer: Optional[mmap.mmap] = None, offset: int = 0):
+        """
+        Args:
+            path: Segment fayli
+            buffer: Boshqa faylga joylangan segment uchun ochiq mmap (jadval indekslari)
+            offset: buffer ichidagi segment boshlanishi
+        """
+        self.path = path
+        if buffer is None:
+            with open(path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mm = buffer
+        magic, self.doc_count, self.term_count, self.total_length, blob_length = _HEADER.unpack_from(self._mm, offset)
+        if magic != SEGMENT_MAGIC:
+            if offset == 0:
+                self._mm.close()
+            raise ValueError(f"Noto'g'ri segment fayl: {path}")
+        self._docs_off = offset + _HEADER.size
+        self._terms_off = self._docs_off + self.doc_count * _DOC.size
+        self._blob_off = self._terms_off + self.term_count * _TERM.size
+        self._postings_off = self._blob_off + blob_length
+
+    def _term_at(self, position: int) -> Tuple[bytes, int, int]:
+        blob_offset, length, postings_start, postings_count = _TERM.unpack_from(
+            self._mm, self._terms_off + position * _TERM.size
+        )
+        start = self._blob_off + blob_offset
+        return self._mm[start:start + length], postings_start, postings_count
+
+    def postings(self, term: bytes) -> Optional[Tuple[int, int]]:
+        """Term uchun (postings boshlanishi, soni) ni binary search bilan topish"""
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            candidate, start, count = self._term_at(mid)
+            if candidate < term:
+                lo = mid + 1
+            elif candidate > term:
+                hi = mid
+            else:
+                return start, count
+        return None
+
+    def iter_postings(self, start: int, count: int) -> Iterable[Tuple[int, int]]:
+        begin = self._postings_off + start * _POSTING.size
+        return _POSTING.iter_unpack(self._mm[begin:begin + count * _POSTING.size])
+
+    def posting_docs(self, start: int, count: int) -> memoryview:
+        """Postings ro'yxatidagi hujjat indekslari (saralangan, nusxa olinmaydi)
+
+        Natija ustida bisect ishlatib, katta ro'yxatlarda hujjat bor-yo'qligini
+        to'liq o'qimasdan tekshirish mumkin.
+        """
+        begin = self._postings_off + start * _POSTING.size
+        return memoryview(self._mm)[begin:begin + count * _POSTING.size].cast('I')[::2]
+
+    def doc(self, doc_idx: int) -> Tuple[int, int]:
+        """(chunk_id, hujjat uzunligi)"""
+        return _DOC.unpack_from(self._mm, self._docs_off + doc_idx * _DOC.size)
+
+class KnowledgeIndex:
+    """Har bir foydalanuvchi (tenant) uchun diskdagi inverted indeks
+
+    Har bir faol KnowledgeBase fayli alohida segment faylga yoziladi, shuning
+    uchun yuklash/o'chirish/faollashtirish faqat bitta segmentni o'zgartiradi.
+    Segmentlar mmap orqali o'qiladi - gunicorn workerlar OS page cache ni
+    bo'lishadi va korpusni qayta tokenizatsiya qilmaydi.
+    """
+
+    # Process ichidagi ochiq segmentlar keshi: user_id -> tenant holati
+    _tenants: Dict[str, Dict[str, Any]] = {}
+    _lock = threading.Lock()
+
+    # ===== TOKENIZATSIYA =====
+
+    @staticmethod
+    def tokenize(text: str, language: Optional[str] = None) -> List[str]:
+        """Qidiruv uchun matnni termlarga ajratish (normalizatsiya + stemming; language - savol tili)"""
+        return text_normalizer.tokenize(text, language)
+
+    # ===== FAYL YO'LLARI =====
+
+    @staticmethod
+    def _tenant_dir(user_id: str) -> str:
+        base = current_app.config.get('KNOWLEDGE_INDEX_FOLDER', 'uploads/index/')
+        return os.path.join(base, str(user_id))
+
+    @staticmethod
+    def _segment_name(knowledge_base_id: int) -> str:
+        return f"kb_{knowledge_base_id}.seg"
+
+    @staticmethod
+    @contextmanager
+    def _tenant_lock(tenant_dir: str):
+        """Manifestni o'zgartirishda workerlar orasidagi qulf"""
+        os.makedirs(tenant_dir, exist_ok=True)
+        with open(os.path.join(tenant_dir, LOCK_NAME), 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_manifest(tenant_dir: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(tenant_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _write_manifest(tenant_dir: str, manifest: Dict[str, Any]) -> None:
+        KnowledgeIndex._write_atomic(
+            os.path.join(tenant_dir, MANIFEST_NAME),
+            json.dumps(manifest, sort_keys=True).encode('utf-8')
+        )
+
+    @staticmethod
+    def _empty_manifest() -> Dict[str, Any]:
+        # generation - indeks papkasi qaytadan yaratilganda versiya raqamlari
+        # takrorlansa ham eski kesh yozuvlari mos kelmasligi uchun
+        return {'version': 0, 'generation': uuid.uuid4().hex[:12],
+                'normalizer': text_normalizer.NORMALIZER_VERSION, 'segments': {}}
+
+    # ===== SEGMENT YOZISH =====
+
+    @staticmethod
+    def _encode_segment(docs: List[Tuple[int, str]]) -> Tuple[bytes, int, int]:
+        """
+        Bo'laklar ro'yxatidan segment baytlarini yaratish
+
+        Args:
+            docs: [(chunk_id, matn)]
+
+        Returns:
+            Tuple: (baytlar, hujjatlar soni, umumiy uzunlik)
+        """
+        # Postings va hujjatlar jadvali massivlarda yig'iladi - yuz minglab
+        # qatorli CSV jadvallarida har bir yozuvni struct.pack qilish sekin
+        postings: Dict[str, List[int]] = {}
+        doc_table = array.array('I')
+        total_length = 0
+        # Jadval ustunlarida bir xil qiymatlar (narx, tavsif) ko'p takrorlanadi
+        parsed: Dict[str, Tuple[List[Tuple[str, int]], int]] = {}
+        for doc_idx, (chunk_id, text) in enumerate(docs):
+            text = text or ""
+            entry = parsed.get(text)
+            if entry is None:
+                terms = KnowledgeIndex.tokenize(text)
+                unique = set(terms)
+                freqs = [(term, 1) for term in unique] if len(unique) == len(terms) \
+                    else list(Counter(terms).items())
+                entry = parsed[text] = (
+                    [(term, tf) for term, tf in freqs if len(term) <= MAX_TERM_LENGTH], len(terms)
+                )
+            term_freqs, length = entry
+            for term, tf in term_freqs:
+                entries = postings.get(term)
+                if entries is None:
+                    postings[term] = [doc_idx, tf]
+                else:
+                    entries += (doc_idx, tf)
+            doc_table.append(chunk_id)
+            doc_table.append(length)
+            total_length += length
+
+        term_table = bytearray()
+        blob = bytearray()
+        posting_data = array.array('I')
+        posting_count = 0
+        for encoded, term in sorted((term.encode('utf-8'), term) for term in postings):
+            entries = postings[term]
+            term_table += _TERM.pack(len(blob), len(encoded), posting_count, len(entries) // 2)
+            blob += encoded
+            posting_data.extend(entries)
+            posting_count += len(entries) // 2
+
+        if sys.byteorder != 'little':
+            doc_table.byteswap()
+            posting_data.byteswap()
+        header = _HEADER.pack(SEGMENT_MAGIC, len(docs), len(postings), total_length, len(blob))
+        return b''.join((header, doc_table.tobytes(), term_table, blob, posting_data.tobytes())), len(docs), total_length
+
+    @staticmethod
+    def _segment_entry(segment_name: str, doc_count: int, total_length: int,
+                       table: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        entry = {
+            'file': segment_name,
+            'docs': doc_count,
+            'total_length': total_length
+        }
+        if table:
+            entry['table'] = table
+        return entry
+
+    @staticmethod
+    def write_segment(user_id: str, knowledge_base_id: int, docs: List[Tuple[int, str]],
+                      table: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Fayl segmentini yozish (yangi yoki qayta indekslangan fayl)
+
+        Args:
+            table: CSV fayl uchun mahsulot jadvali ma'lumoti ({'file', 'rows', 'file_name'})
+
+        Returns:
+            int: Manifestning yangi versiyasi
+        """
+        tenant_dir = KnowledgeIndex._tenant_dir(user_id)
+        data, doc_count, total_length = KnowledgeIndex._encode_segment(docs)
+        segment_name = KnowledgeIndex._segment_name(knowledge_base_id)
+
+        with KnowledgeIndex._tenant_lock(tenant_dir):
+            KnowledgeIndex._write_atomic(os.path.join(tenant_dir, segment_name), data)
+            manifest = KnowledgeIndex._read_manifest(tenant_dir) or KnowledgeIndex._empty_manifest()
+            manifest['segments'][str(knowledge_base_id)] = KnowledgeIndex._segment_entry(
+                segment_name, doc_count, total_length, table
+            )
+            manifest['version'] += 1
+            KnowledgeIndex._write_manifest(tenant_dir, manifest)
+            return manifest['version']
+
+    @staticmethod
+    def remove_segment(user_id: str, knowledge_base_id: int) -> int:
+        """
+        Fayl segmentini indeksdan olib tashlash (o'chirish yoki nofaol qilish)
+
+        Returns:
+            int: Manifestning yangi versiyasi
+        """
+        tenant_dir = KnowledgeIndex._tenant_dir(user_id)
+        with KnowledgeIndex._tenant_lock(tenant_dir):
+            manifest = KnowledgeIndex._read_manifest(tenant_dir) or KnowledgeIndex._empty_manifest()
+            entry = manifest['segments'].pop(str(knowledge_base_id), None)
+            manifest['version'] += 1
+            KnowledgeIndex._write_manifest(tenant_dir, manifest)
+
+            if entry:
+                names = [entry['file']] + ([entry['table']['file']] if entry.get('table') else [])
+                for name in names:
+                    try:
+                        os.remove(os.path.join(tenant_dir, name))
+                    except OSError:
+                        pass
+            return manifest['version']
+
+    @staticmethod
+    def replace_all(user_id: str, files: Dict[int, List[Tuple[int, str]]],
+                    tables: Optional[Dict[int, Dict[str, Any]]] = None) -> int:
+        """
+        Tenant indeksini butunlay qayta qurish
+
+        Args:
+            files: {knowledge_base_id: [(chunk_id, matn)]} - faqat faol fayllar
+            tables: {knowledge_base_id: jadval ma'lumoti} - CSV mahsulot jadvallari
+
+        Returns:
+            int: Manifestning yangi versiyasi
+        """
+        tenant_dir = KnowledgeIndex._tenant_dir(user_id)
+        with KnowledgeIndex._tenant_lock(tenant_dir):
+            old_manifest = KnowledgeIndex._read_manifest(tenant_dir) or KnowledgeIndex._empty_manifest()
+            manifest = {
+                'version': old_manifest['version'] + 1,
+                'generation': old_manifest.get('generation') or uuid.uuid4().hex[:12],
+                'normalizer': text_normalizer.NORMALIZER_VERSION,
+                'segments': {}
+            }
+
+            for knowledge_base_id, docs in files.items():
+                data, doc_count, total_length = KnowledgeIndex._encode_segment(docs)
+                segment_name = KnowledgeIndex._segment_name(knowledge_base_id)
+                KnowledgeIndex._write_atomic(os.path.join(tenant_dir, segment_name), data)
+                manifest['segments'][str(knowledge_base_id)] = KnowledgeIndex._segment_entry(
+                    segment_name, doc_count, total_length, (tables or {}).get(knowledge_base_id)
+                )
+
+            KnowledgeIndex._write_manifest(tenant_dir, manifest)
+
+            # Manifestda qolmagan segment va jadvallarni tozalash
+            keep = set()
+            for entry in manifest['segments'].values():
+                keep.add(entry['file'])
+                if entry.get('table'):
+                    keep.add(entry['table']['file'])
+            for name in os.listdir(tenant_dir):
+                if name.endswith(('.seg', '.tbl')) and name not in keep:
+                    try:
+                        os.remove(os.path.join(tenant_dir, name))
+                    except OSError:
+                        pass
+            return manifest['version']
+
+    @staticmethod
+    def drop_tenant(user_id: str) -> None:
+        """Tenant indeks papkasini o'chirish"""
+        with KnowledgeIndex._lock:
+            KnowledgeIndex._tenants.pop(str(user_id), None)
+        shutil.rmtree(KnowledgeIndex._tenant_dir(user_id), ignore_errors=True)
+
+    # ===== O'QISH =====
+
+    @staticmethod
+    def _load(user_id: str) -> Optional[Dict[str, Any]]:
+        """Tenant segmentlarini ochish; manifest o'zgarmagan bo'lsa keshdan"""
+        tenant_dir = KnowledgeIndex._tenant_dir(user_id)
+        manifest_path = os.path.join(tenant_dir, MANIFEST_NAME)
+        try:
+            stat = os.stat(manifest_path)
+        except OSError:
+            return None
+        stat_key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+        cached = KnowledgeIndex._tenants.get(str(user_id))
+        if cached and cached['stat_key'] == stat_key:
+            return cached
+
+        manifest = KnowledgeIndex._read_manifest(tenant_dir)
+        if manifest is None:
+            return None
+        if manifest.get('normalizer') != text_normalizer.NORMALIZER_VERSION:
+            # Boshqa tokenizer bilan qurilgan indeks - qayta qurish kerak
+            return None
+
+        segments = []
+        tables = {}
+        doc_count = 0
+        total_length = 0
+        for knowledge_base_id, entry in manifest['segments'].items():
+            if entry.get('table'):
+                tables[int(knowledge_base_id)] = entry['table']
+            try:
+                segment = _Segment(os.path.join(tenant_dir, entry['file']))
+            except (OSError, ValueError) as e:
+                current_app.logger.warning(f"Knowledge index segment skipped: {str(e)}")
+                continue
+            segments.append(segment)
+            doc_count += segment.doc_count
+            total_length += segment.total_length
+
+        tenant = {
+            'stat_key': stat_key,
+            'version': manifest['version'],
+            'version_key': f"{manifest.get('generation', '')}:{manifest['version']}",
+            'dir': tenant_dir,
+            'segments': segments,
+            'tables': tables,
+            'doc_count': doc_count,
+            'avg_length': (total_length / doc_count) if doc_count else 0.0
+        }
+
+        # Eski segmentlar boshqa threadlar ishlatib bo'lgach GC tomonidan yopiladi
+        with KnowledgeIndex._lock:
+            KnowledgeIndex._tenants[str(user_id)] = tenant
+        return tenant
+
+    @staticmethod
+    def exists(user_id: str) -> bool:
+        return os.path.exists(os.path.join(KnowledgeIndex._tenant_dir(user_id), MANIFEST_NAME))
+
+    @staticmethod
+    def get_version(user_id: str) -> int:
+        """Tenant indeks versiyasi (har bir o'zgarishda oshadi)"""
+        tenant = KnowledgeIndex._load(user_id)
+        return tenant['version'] if tenant else 0
+
+    @staticmethod
+    def get_version_key(user_id: str) -> str:
+        """
+        Bilimlar bazasi holatining kaliti (javob keshlari uchun)
+
+        Har qanday fayl yuklash/o'chirish/faollashtirish yoki indeksni qayta
+        qurishda o'zgaradi.
+        """
+        tenant = KnowledgeIndex._load(user_id)
+        return tenant['version_key'] if tenant else '0'
+
+    @staticmethod
+    def get_tables(user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Faol CSV mahsulot jadvallari
+
+        Returns:
+            Optional[Dict]: {'dir', 'version', 'tables': {knowledge_base_id: ma'lumot}}
+            yoki indeks hali qurilmagan bo'lsa None
+        """
+        tenant = KnowledgeIndex._load(user_id)
+        if tenant is None:
+            return None
+        return {'dir': tenant['dir'], 'version': tenant['version'], 'tables': tenant['tables']}
+
+    @staticmethod
+    def search(user_id: str, terms: Iterable[str], limit: int,
+               k1: float = 1.5, b: float = 0.75) -> Optional[List[Tuple[int, float]]]:
+        """
+        BM25 bo'yicha eng mos bo'laklarni topish
+
+        Returns:
+            Optional[List]: [(chunk_id, score)] yoki indeks hali qurilmagan bo'lsa None
+        """
+        tenant = KnowledgeIndex._load(user_id)
+        if tenant is None:
+            return None
+
+        doc_count = tenant['doc_count']
+        if not doc_count:
+            return []
+        avg_length = tenant['avg_length'] or 1.0
+        encoded_terms = [term.encode('utf-8') for term in set(terms)]
+
+        # Global document frequency (barcha segmentlar bo'yicha)
+        matches = []
+        document_frequency: Dict[bytes, int] = {}
+        for segment in tenant['segments']:
+            for term in encoded_terms:
+                found = segment.postings(term)
+                if found:
+                    matches.append((segment, term, found))
+                    document_frequency[term] = document_frequency.get(term, 0) + found[1]
+
+        scores: Dict[Tuple[int, int], float] = {}
+        for segment, term, (start, count) in matches:
+            df = document_frequency[term]
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            seg_key = id(segment)
+            for doc_idx, tf in segment.iter_postings(start, count):
+                doc_length = segment.doc(doc_idx)[1]
+                norm = k1 * (1 - b + b * doc_length / avg_length)
+                key = (seg_key, doc_idx)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+        segments_by_key = {id(segment): segment for segment in tenant['segments']}
+        results = [
+            (segments_by_key[seg_key].doc(doc_idx)[0], score)
+            for (seg_key, doc_idx), score in scores.items()
+        ]
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results[:limit]
@@ -0,0 +1,349 @@
+import math
+import os
+import re
+from typing import Dict, Any, List, Optional
+from flask import current_app
+from models.user import db
+from models.knowledge_base import KnowledgeBase
+from models.knowledge_chunk import KnowledgeChunk
+from utils.knowledge_index import KnowledgeIndex
+from utils.product_table import ProductTable
+from utils.response_cache import ResponseCache
+from utils.semantic_cache import SemanticCache
+from utils.prompt_prefix import PromptPrefix
+
+class KnowledgeRetriever:
+    """Bilimlar bazasidan savolga tegishli bo'laklarni topish (BM25)"""
+
+    # BM25 parametrlari
+    BM25_K1 = 1.5
+    BM25_B = 0.75
+
+    # Taxminiy hisob: 1 token ~ 4 belgi
+    CHARS_PER_TOKEN = 4
+
+    _PARAGRAPH_RE = re.compile(r"\n\s*\n")
+    _SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Matndagi taxminiy token soni"""
+        if not text:
+            return 0
+        return max(1, math.ceil(len(text) / KnowledgeRetriever.CHARS_PER_TOKEN))
+
+    @staticmethod
+    def tokenize(text: str, language: Optional[str] = None) -> List[str]:
+        """Qidiruv uchun matnni so'zlarga ajratish (language - savol tili)"""
+        return KnowledgeIndex.tokenize(text, language)
+
+    @staticmethod
+    def split_into_chunks(text: str, chunk_size: Optional[int] = None,
+                          overlap: Optional[int] = None) -> List[str]:
+        """
+        Matnni bo'laklarga ajratish
+
+        Avval paragraflar bo'yicha yig'iladi, juda uzun paragraflar gaplarga,
+        gaplar esa kerak bo'lsa so'zlarga bo'linadi.
+
+        Args:
+            text: Fayl matni
+            chunk_size: Bo'lak hajmi (belgilar)
+            overlap: Qo'shni bo'laklar orasidagi umumiy qism (belgilar)
+
+        Returns:
+            List[str]: Bo'laklar ro'yxati
+        """
+        chunk_size = chunk_size or current_app.config.get('KNOWLEDGE_CHUNK_SIZE', 1200)
+        if overlap is None:
+            overlap = current_app.config.get('KNOWLEDGE_CHUNK_OVERLAP', 150)
+        overlap = min(overlap, chunk_size // 2)
+
+        if not text or not text.strip():
+            return []
+
+        # Bo'lakdan katta bo'lmagan qismlarga ajratish
+        pieces = []
+        for paragraph in KnowledgeRetriever._PARAGRAPH_RE.split(text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            if len(paragraph) <= chunk_size:
+                pieces.append(paragraph)
+                continue
+            for sentence in KnowledgeRetriever._SENTENCE_RE.split(paragraph):
+                while len(sentence) > chunk_size:
+                    cut = sentence.rfind(' ', 0, chunk_size)
+                    if cut <= 0:
+                        cut = chunk_size
+                    pieces.append(sentence[:cut].strip())
+                    sentence = sentence[cut:].strip()
+                if sentence:
+                    pieces.append(sentence)
+
+        # Qismlarni bo'laklarga yig'ish
+        chunks = []
+        current = ""
+        for piece in pieces:
+            if current and len(current) + len(piece) + 2 > chunk_size:
+                chunks.append(current)
+                # Kontekst uzilmasligi uchun oldingi bo'lak oxirini qo'shish
+                tail = current[-overlap:] if overlap else ""
+                if tail and ' ' in tail:
+                    tail = tail[tail.index(' ') + 1:]
+                current = f"{tail}\n{piece}" if tail else piece
+            else:
+                current = f"{current}\n\n{piece}" if current else piece
+        if current:
+            chunks.append(current)
+
+        return chunks
+
+    @staticmethod
+    def index_knowledge_file(knowledge_file: KnowledgeBase) -> int:
+        """
+        KnowledgeBase faylini bo'laklarga ajratib saqlash (commit qilinmaydi)
+
+        Ustun nomlari bor CSV fayllar bo'laklarga emas, mahsulot jadvaliga
+        yoziladi (ProductTable).
+
+        Returns:
+            int: Yaratilgan bo'laklar soni
+        """
+        if knowledge_file.id is None:
+            db.session.flush()
+
+        # Eski bo'laklarni o'chirish (qayta indekslashda)
+        KnowledgeChunk.query.filter_by(knowledge_base_id=knowledge_file.id).delete()
+
+        if KnowledgeRetriever._build_table(knowledge_file):
+            return 0
+
+        chunks = KnowledgeRetriever.split_into_chunks(knowledge_file.content or "")
+        for position, chunk_text in enumerate(chunks):
+            db.session.add(KnowledgeChunk(
+                knowledge_base_id=knowledge_file.id,
+                user_id=knowledge_file.user_id,
+                chunk_index=position,
+                content=chunk_text,
+                char_count=len(chunk_text),
+                token_count=KnowledgeRetriever.estimate_tokens(chunk_text)
+            ))
+
+        return len(chunks)
+
+    @staticmethod
+    def _build_table(knowledge_file: KnowledgeBase) -> Optional[Dict[str, Any]]:
+        """CSV fayl uchun mahsulot jadvalini yaratish (boshqa turlar uchun None)"""
+        if knowledge_file.file_type != 'csv' or not knowledge_file.file_path \
+                or not os.path.exists(knowledge_file.file_path):
+            return None
+        try:
+            return ProductTable.build(
+                knowledge_file.user_id, knowledge_file.id,
+                knowledge_file.file_path, knowledge_file.file_name
+            )
+        except Exception as e:
+            # Jadval yaratilmasa fayl oddiy matn bo'laklari sifatida indekslanadi
+            current_app.logger.error(f"Product table build error: {str(e)}")
+            return None
+
+    @staticmethod
+    def _file_table(knowledge_file: KnowledgeBase) -> Optional[Dict[str, Any]]:
+        """Fayl jadvalining manifest ma'lumoti; jadval diskda yo'q bo'lsa qayta quriladi"""
+        if knowledge_file.file_type != 'csv' or knowledge_file.chunks:
+            return None
+        return ProductTable.describe(knowledge_file.user_id, knowledge_file.id) \
+            or KnowledgeRetriever._build_table(knowledge_file)
+
+    @staticmethod
+    def _file_docs(knowledge_file: KnowledgeBase) -> List[tuple]:
+        """Fayl bo'laklarini indeks uchun [(chunk_id, matn)] ko'rinishida olish"""
+        return db.session.query(KnowledgeChunk.id, KnowledgeChunk.content) \
+            .filter_by(knowledge_base_id=knowledge_file.id) \
+            .order_by(KnowledgeChunk.chunk_index).all()
+
+    @staticmethod
+    def sync_file_index(knowledge_file: KnowledgeBase) -> None:
+        """
+        Bitta fayl uchun diskdagi indeksni yangilash (commit dan keyin chaqiriladi)
+
+        Faol fayl segmenti qayta yoziladi, nofaol fayl indeksdan olib tashlanadi.
+        """
+        try:
+            if knowledge_file.is_active:
+                KnowledgeIndex.write_segment(
+                    knowledge_file.user_id, knowledge_file.id,
+                    KnowledgeRetriever._file_docs(knowledge_file),
+                    table=KnowledgeRetriever._file_table(knowledge_file)
+                )
+            else:
+                KnowledgeIndex.remove_segment(knowledge_file.user_id, knowledge_file.id)
+        except Exception as e:
+            # Indeks keyingi qidiruvda yoki rebuild buyrug'i bilan tiklanadi
+            current_app.logger.error(f"Knowledge index update error: {str(e)}")
+            KnowledgeIndex.drop_tenant(knowledge_file.user_id)
+        # Eski bilimlar asosidagi keshlangan javoblar endi ishlatilmaydi
+        ResponseCache.invalidate_tenant(knowledge_file.user_id)
+        SemanticCache.invalidate_tenant(knowledge_file.user_id)
+        PromptPrefix.forget(knowledge_file.user_id)
+
+    @staticmethod
+    def remove_file_index(user_id: str, knowledge_base_id: int) -> None:
+        """O'chirilgan faylni indeksdan olib tashlash"""
+        try:
+            KnowledgeIndex.remove_segment(user_id, knowledge_base_id)
+        except Exception as e:
+            current_app.logger.error(f"Knowledge index update error: {str(e)}")
+            KnowledgeIndex.drop_tenant(user_id)
+        ResponseCache.invalidate_tenant(user_id)
+        SemanticCache.invalidate_tenant(user_id)
+        PromptPrefix.forget(user_id)
+
+    @staticmethod
+    def rebuild_index(user_id: str, rechunk: bool = False) -> Dict[str, int]:
+        """
+        Foydalanuvchi indeksini DB dagi bo'laklardan qayta qurish
+
+        Args:
+            user_id: Foydalanuvchi ID si
+            rechunk: True bo'lsa barcha fayllar qaytadan bo'laklarga ajratiladi
+
+        Returns:
+            Dict: {'files': int, 'chunks': int, 'rows': int, 'version': int}
+        """
+        knowledge_files = KnowledgeBase.query.filter_by(user_id=user_id).all()
+
+        # Bo'laklari ham, jadvali ham yo'q (eski) fayllarni qayta indekslash
+        changed = False
+        for knowledge_file in knowledge_files:
+            if rechunk or not (knowledge_file.chunks or KnowledgeRetriever._file_table(knowledge_file)):
+                KnowledgeRetriever.index_knowledge_file(knowledge_file)
+                changed = True
+        if changed:
+            db.session.commit()
+
+        files = {}
+        tables = {}
+        chunk_total = 0
+        row_total = 0
+        for knowledge_file in knowledge_files:
+            if knowledge_file.is_active:
+                docs = KnowledgeRetriever._file_docs(knowledge_file)
+                files[knowledge_file.id] = docs
+                chunk_total += len(docs)
+                table = KnowledgeRetriever._file_table(knowledge_file)
+                if table:
+                    tables[knowledge_file.id] = table
+                    row_total += table['rows']
+
+        version = KnowledgeIndex.replace_all(user_id, files, tables)
+        ResponseCache.invalidate_tenant(user_id)
+        SemanticCache.invalidate_tenant(user_id)
+        PromptPrefix.forget(user_id)
+        return {'files': len(files), 'chunks': chunk_total, 'rows': row_total, 'version': version}
+
+    @staticmethod
+    def search(user_id: str, query: str, top_k: Optional[int] = None,
+               language: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Savolga eng mos bo'laklarni topish
+
+        Args:
+            user_id: Foydalanuvchi (tenant) ID si
+            query: Foydalanuvchi savoli
+            top_k: Qaytariladigan bo'laklar soni
+            language: Savol tili (berilmasa KNOWLEDGE_QUERY_LANGUAGE)
+
+        Returns:
+            List[Dict]: [{'chunk_id', 'file_name', 'content', 'token_count', 'score'}]
+        """
+        top_k = top_k or current_app.config.get('KNOWLEDGE_TOP_K', 6)
+        language = language or current_app.config.get('KNOWLEDGE_QUERY_LANGUAGE', 'uz')
+        query_terms = KnowledgeRetriever.tokenize(query or "", language)
+        if not query_terms:
+            return []
+
+        hits = KnowledgeIndex.search(
+            user_id, query_terms, top_k,
+            k1=KnowledgeRetriever.BM25_K1, b=KnowledgeRetriever.BM25_B
+        )
+        if hits is None:
+            # Indeks hali qurilmagan (eski foydalanuvchi yoki yangi worker diski)
+            KnowledgeRetriever.rebuild_index(user_id)
+            hits = KnowledgeIndex.search(
+                user_id, query_terms, top_k,
+                k1=KnowledgeRetriever.BM25_K1, b=KnowledgeRetriever.BM25_B
+            ) or []
+        if not hits:
+            return []
+
+        # Faqat tanlangan bo'laklar matnini DB dan olish
+        scores = dict(hits)
+        rows = db.session.query(
+            KnowledgeChunk.id, KnowledgeChunk.content, KnowledgeChunk.token_count, KnowledgeBase.file_name
+        ).join(KnowledgeBase, KnowledgeChunk.knowledge_base_id == KnowledgeBase.id) \
+         .filter(KnowledgeChunk.id.in_(list(scores)), KnowledgeBase.is_active == True).all()
+
+        results = [{
+            'chunk_id': chunk_id,
+            'file_name': file_name,
+            'content': content,
+            'token_count': token_count,
+            'score': scores[chunk_id]
+        } for chunk_id, content, token_count, file_name in rows]
+        results.sort(key=lambda item: (-item['score'], item['chunk_id']))
+        return results
+
+    @staticmethod
+    def build_context(user_id: str, query: str, top_k: Optional[int] = None,
+                      token_budget: Optional[int] = None, language: Optional[str] = None) -> str:
+        """
+        AI prompt uchun bilimlar bazasi kontekstini yig'ish
+
+        Avval CSV mahsulot jadvallaridan mos qatorlar, keyin eng mos bo'laklar
+        token byudjeti tugaguncha qo'shiladi.
+
+        Returns:
+            str: Fayl nomi bilan guruhlangan qatorlar va bo'laklar matni
+        """
+        token_budget = token_budget or current_app.config.get('KNOWLEDGE_TOKEN_BUDGET', 2000)
+
+        try:
+            results = KnowledgeRetriever.search(user_id, query, top_k, language)
+            tables = ProductTable.search(user_id, query, language=language)
+        except Exception as e:
+            current_app.logger.error(f"Knowledge retrieval error: {str(e)}")
+            db.session.rollback()
+            return ""
+
+        used_tokens = 0
+        table_sections: Dict[str, List[str]] = {}
+        for table in tables:
+            for values in table['rows']:
+                line = ProductTable.format_row(table['columns'], values)
+                line_tokens = KnowledgeRetriever.estimate_tokens(line)
+                if used_tokens + line_tokens > token_budget:
+                    break
+                table_sections.setdefault(table['file_name'], []).append(line)
+                used_tokens += line_tokens
+
+        selected = []
+        for result in results:
+            if used_tokens + result['token_count'] > token_budget:
+                continue
+            selected.append(result)
+            used_tokens += result['token_count']
+
+        # Bir fayldagi bo'laklarni birga ko'rsatish
+        grouped: Dict[str, List[str]] = {}
+        for result in selected:
+            grouped.setdefault(result['file_name'], []).append(result['content'])
+
+        return "".join(
+            f"\n\n{file_name}:\n" + "\n".join(lines)
+            for file_name, lines in table_sections.items()
+        ) + "".join(
+            f"\n\n{file_name}:\n" + "\n...\n".join(contents)
+            for file_name, contents in grouped.items()
+        )
@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+import google.generativeai as genai
+from flask import current_app, has_app_context
+
+class LLMClientRegistry:
+    """AI provayder klientlari reestri (process bo'yicha umumiy)
+
+    Har bir xabar uchun yangi OpenAI klienti yoki genai.GenerativeModel
+    yaratilmaydi: klientlar (provider, API kalit xeshi, model) bo'yicha
+    saqlanadi, shuning uchun SDK ichidagi ulanishlar puli (httpx / gRPC
+    kanali) so'rovlar orasida qayta ishlatiladi. Reestr hajmi
+    LLM_CLIENT_CACHE_SIZE bilan cheklangan - eng uzoq ishlatilmagan klient
+    chiqarib yuboriladi. Kalitning o'zi saqlanmaydi, faqat SHA-256 xeshi.
+
+    OpenAI klienti modelga bog'liq emas, shuning uchun uning yozuvida model
+    bo'sh satr. Gemini SDK (google-generativeai) bitta global kalit bilan
+    ishlaydi: genai.configure faqat kalit o'zgarganda chaqiriladi.
+    GenerativeModel ning asinxron klienti (generate_content_async) shu
+    model obyektida saqlanadi; OpenAI uchun alohida AsyncOpenAI yozuvi.
+    """
+
+    # (provider, key_hash, model) -> klient, LRU tartibida
+    _clients: 'OrderedDict[Tuple[str, str, str], Any]' = OrderedDict()
+    _gemini_key_hash: Optional[str] = None
+    _pid: Optional[int] = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _key_hash(api_key: str) -> str:
+        return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _max_size() -> int:
+        if has_app_context():
+            return max(1, current_app.config.get('LLM_CLIENT_CACHE_SIZE', 64))
+        return 64
+
+    @staticmethod
+    def _check_process() -> None:
+        """gunicorn fork dan keyin ota processdan qolgan klientlarni tashlash (_lock ostida)"""
+        if LLMClientRegistry._pid != os.getpid():
+            LLMClientRegistry._clients.clear()
+            LLMClientRegistry._gemini_key_hash = None
+            LLMClientRegistry._pid = os.getpid()
+
+    @staticmethod
+    def _get_or_create(key: Tuple[str, str, str], factory) -> Any:
+        with LLMClientRegistry._lock:
+            LLMClientRegistry._check_process()
+            client = LLMClientRegistry._clients.get(key)
+            if client is not None:
+                LLMClientRegistry._clients.move_to_end(key)
+                return client
+
+            client = factory()
+            LLMClientRegistry._clients[key] = client
+            # Chiqarilgan klient yopilmaydi - boshqa thread hali ishlatayotgan bo'lishi mumkin
+            while len(LLMClientRegistry._clients) > LLMClientRegistry._max_size():
+                LLMClientRegistry._clients.popitem(last=False)
+            return client
+
+    # ===== GEMINI =====
+
+    @staticmethod
+    def configure_gemini(api_key: Optional[str]) -> None:
+        """genai ni sozlash - kalit avvalgisi bilan bir xil bo'lsa hech narsa qilinmaydi"""
+        if not api_key:
+            return
+        key_hash = LLMClientRegistry._key_hash(api_key)
+        with LLMClientRegistry._lock:
+            LLMClientRegistry._check_process()
+            if LLMClientRegistry._gemini_key_hash == key_hash:
+                return
+            genai.configure(api_key=api_key)
+            # Eski kalit bilan yaratilgan modellar eski gRPC klientini ushlab turadi
+            for key in [key for key in LLMClientRegistry._clients if key[0] == 'gemini']:
+                del LLMClientRegistry._clients[key]
+            LLMClientRegistry._gemini_key_hash = key_hash
+
+    @staticmethod
+    def gemini_model(model: str, api_key: Optional[str] = None) -> 'genai.GenerativeModel':
+        """
+        Gemini modeli (GEMINI_API_KEY bilan)
+
+        Args:
+            model: Model nomi
+            api_key: Kalit (berilmasa ilova konfiguratsiyasidagi GEMINI_API_KEY)
+        """
+        if api_key is None and has_app_context():
+            api_key = current_app.config.get('GEMINI_API_KEY')
+        LLMClientRegistry.configure_gemini(api_key)
+        key = ('gemini', LLMClientRegistry._key_hash(api_key), model)
+        return LLMClientRegistry._get_or_create(key, lambda: genai.GenerativeModel(model))
+
+    # ===== OPENAI =====
+
+    @staticmethod
+    def openai_client(api_key: str) -> Any:
+        """Shu API kalit uchun OpenAI klienti (thread-safe, barcha modellar uchun bitta)"""
+        from openai import OpenAI
+
+        key = ('openai', LLMClientRegistry._key_hash(api_key), '')
+        return LLMClientRegistry._get_or_create(key, lambda: OpenAI(api_key=api_key))
+
+    @staticmethod
+    def openai_async_client(api_key: str) -> Any:
+        """openai_client ning asinxron varianti (AsyncOpenAI, asgi.py event loop ida)"""
+        from openai import AsyncOpenAI
+
+        key = ('openai_async', LLMClientRegistry._key_hash(api_key), '')
+        return LLMClientRegistry._get_or_create(key, lambda: AsyncOpenAI(api_key=api_key))
+
+    @staticmethod
+    def size() -> int:
+        return len(LLMClientRegistry._clients)
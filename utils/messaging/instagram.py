@@ -1,9 +1,14 @@
 import requests
 import json
 from flask import current_app
+from utils.http_client import HttpClient
 from models.messaging import InstagramAccount, InstagramConversation
 from models.user import db
-from utils.ai_handler import get_ai_response
+from utils.ai_handler import get_ai_result, aget_ai_result
+from utils.async_runtime import AsyncRuntime
+from utils.conversation_memory import ConversationMemory
+from utils.routing_table import RoutingTable
+from utils.inbound_queue import InboundQueue, RetryableError
 
 class InstagramHandler:
     """Handle Instagram Graph API operations"""
@@ -19,7 +24,7 @@ class InstagramHandler:
                 'access_token': access_token
             }
             
-            response = requests.get(api_url, params=params, timeout=10)
+            response = HttpClient.get(api_url, params=params)
             response.raise_for_status()
             
             result = response.json()
@@ -44,14 +49,14 @@ class InstagramHandler:
                 'access_token': access_token
             }
             
-            response = requests.post(api_url, data=data, timeout=10)
+            response = HttpClient.post(api_url, data=data)
             response.raise_for_status()
             
             result = response.json()
             return True, result
             
         except requests.exceptions.RequestException as e:
-            return False, f"Network error: {str(e)}"
+            return False, HttpClient.error_message(e)
         except Exception as e:
             return False, f"Error: {str(e)}"
     
@@ -67,134 +72,204 @@ class InstagramHandler:
                 'access_token': access_token
             }
             
-            response = requests.post(api_url, json=data, timeout=10)
+            response = HttpClient.post(api_url, json=data)
             response.raise_for_status()
             
             result = response.json()
             return True, result
             
         except requests.exceptions.RequestException as e:
-            return False, f"Network error: {str(e)}"
+            return False, HttpClient.error_message(e)
         except Exception as e:
             return False, f"Error: {str(e)}"
     
     @staticmethod
-    def process_webhook_update(account_id, webhook_data):
-        """Process incoming Instagram webhook update"""
+    async def areply_to_comment(access_token, comment_id, message_text):
+        """reply_to_comment ning asinxron varianti (asgi.py)"""
         try:
-            # Get account instance
-            account = InstagramAccount.query.get(account_id)
-            if not account or not account.is_active:
-                return False, "Account not found or inactive"
-            
-            # Extract data from webhook
-            entry = webhook_data.get('entry', [])
-            if not entry:
-                return False, "No entry in webhook data"
-            
-            changes = entry[0].get('changes', [])
-            if not changes:
-                return False, "No changes in entry"
-            
-            value = changes[0].get('value', {})
-            
-            # Handle different types of updates (comments, messages)
-            if 'comment_id' in value:
-                return InstagramHandler._process_comment(account, value)
-            elif 'message' in value:
-                return InstagramHandler._process_direct_message(account, value)
-            else:
-                return False, "Unknown webhook update type"
-                
+            api_url = f"{current_app.config['INSTAGRAM_API_URL']}/{comment_id}/replies"
+            
+            data = {
+                'message': message_text,
+                'access_token': access_token
+            }
+            
+            response = await HttpClient.apost(api_url, data=data)
+            response.raise_for_status()
+            
+            result = response.json()
+            return True, result
+            
+        except requests.exceptions.RequestException as e:
+            return False, HttpClient.error_message(e)
         except Exception as e:
-            return False, f"Error processing update: {str(e)}"
+            return False, f"Error: {str(e)}"
     
     @staticmethod
-    def _process_comment(account, comment_data):
-        """Process Instagram comment"""
+    async def asend_direct_message(access_token, page_id, recipient_id, message_text):
+        """send_direct_message ning asinxron varianti (asgi.py)"""
         try:
-            comment_id = comment_data.get('comment_id', '')
-            text = comment_data.get('text', '')
-            from_user = comment_data.get('from', {})
-            user_id = str(from_user.get('id', ''))
-            username = from_user.get('username', '')
+            api_url = f"{current_app.config['INSTAGRAM_API_URL']}/{page_id}/messages"
             
-            if not text or not user_id:
-                return False, "Missing comment data"
+            data = {
+                'recipient': {'id': recipient_id},
+                'message': {'text': message_text},
+                'access_token': access_token
+            }
             
-            # Get AI response with knowledge base context
-            from models.user import User
-            user_obj = User.query.get(account.user_id)
-            ai_response = get_ai_response(text, user_obj)
-            
-            # Save conversation
-            conversation = InstagramConversation(
-                account_id=account.id,
-                instagram_user_id=user_id,
-                instagram_username=username,
-                message_text=text,
-                response_text=ai_response,
-                message_type='comment'
-            )
-            db.session.add(conversation)
+            response = await HttpClient.apost(api_url, json=data)
+            response.raise_for_status()
             
-            # Reply to comment
-            access_token = account.get_access_token()
-            success, result = InstagramHandler.reply_to_comment(
-                access_token, comment_id, ai_response
-            )
+            result = response.json()
+            return True, result
             
-            if success:
-                db.session.commit()
-                return True, "Comment processed and reply sent"
-            else:
-                db.session.rollback()
-                return False, f"Failed to send reply: {result}"
-                
+        except requests.exceptions.RequestException as e:
+            return False, HttpClient.error_message(e)
         except Exception as e:
-            db.session.rollback()
-            return False, f"Error processing comment: {str(e)}"
+            return False, f"Error: {str(e)}"
+    
+    @staticmethod
+    def _parse_update(account_id, webhook_data):
+        """
+        Javob uchun kerakli ma'lumotlar: marshrut jadvalidan akkaunt va
+        (direct xabar uchun) suhbat tarixi
+        
+        Returns:
+            tuple: (update, None) yoki rad etilganda (None, sabab)
+        """
+        # Akkaunt, tenant va token - marshrut jadvalidan
+        route = RoutingTable.account('instagram', account_id)
+        if not route or not route.is_active:
+            return None, "Account not found or inactive"
+        if not route.credentials:
+            return None, "Access token could not be decrypted"
+        
+        # Extract data from webhook
+        entry = webhook_data.get('entry', [])
+        if not entry:
+            return None, "No entry in webhook data"
+        
+        changes = entry[0].get('changes', [])
+        if not changes:
+            return None, "No changes in entry"
+        
+        value = changes[0].get('value', {})
+        
+        # Handle different types of updates (comments, messages)
+        if 'comment_id' in value:
+            from_user = value.get('from', {})
+            update = {
+                'message_type': 'comment',
+                'comment_id': value.get('comment_id', ''),
+                'text': value.get('text', ''),
+                'user_id': str(from_user.get('id', '')),
+                'username': from_user.get('username', ''),
+                'history': None  # Izohlar alohida - suhbat tarixi yo'q
+            }
+            if not update['text'] or not update['user_id']:
+                return None, "Missing comment data"
+        elif 'message' in value:
+            update = {
+                'message_type': 'direct_message',
+                'text': value.get('message', {}).get('text', ''),
+                'user_id': str(value.get('sender', {}).get('id', '')),
+                'username': None
+            }
+            if not update['text'] or not update['user_id']:
+                return None, "Missing message data"
+            update['history'] = ConversationMemory.history('instagram', route.account_id, update['user_id'],
+                                                           route.user_id)
+        else:
+            return None, "Unknown webhook update type"
+        
+        update['route'] = route
+        return update, None
+    
+    @staticmethod
+    def _save_reply(update, ai_response, ai_ok):
+        """Yuborilgan javobni saqlash"""
+        route = update['route']
+        conversation = InstagramConversation(
+            account_id=route.account_id,
+            instagram_user_id=update['user_id'],
+            instagram_username=update['username'],
+            message_text=update['text'],
+            response_text=ai_response,
+            message_type=update['message_type']
+        )
+        db.session.add(conversation)
+        db.session.commit()
+        if ai_ok and update['message_type'] == 'direct_message':
+            # AI xato xabari suhbat tarixiga kirmasin
+            ConversationMemory.append('instagram', route.account_id, update['user_id'], route.user_id,
+                                      update['text'], ai_response)
+    
+    @staticmethod
+    def _finish(update, success, result):
+        """Yuborish natijasi; vaqtinchalik xatoda (oxirgi urinish bo'lmasa) qayta navbatga"""
+        if not success:
+            if getattr(result, 'transient', False) and not InboundQueue.is_final_attempt():
+                raise RetryableError(f"Failed to send reply: {result}")
+            return False, f"Failed to send reply: {result}"
+        return True, ("Comment processed and reply sent" if update['message_type'] == 'comment'
+                      else "Message processed and reply sent")
     
     @staticmethod
-    def _process_direct_message(account, message_data):
-        """Process Instagram direct message"""
+    def process_webhook_update(account_id, webhook_data):
+        """Process incoming Instagram webhook update"""
         try:
-            message = message_data.get('message', {})
-            text = message.get('text', '')
-            sender = message_data.get('sender', {})
-            user_id = str(sender.get('id', ''))
-            
-            if not text or not user_id:
-                return False, "Missing message data"
+            update, rejected = InstagramHandler._parse_update(account_id, webhook_data)
+            if rejected:
+                return False, rejected
+            route = update['route']
             
             # Get AI response with knowledge base context
-            from models.user import User
-            user_obj = User.query.get(account.user_id)
-            ai_response = get_ai_response(text, user_obj)
-            
-            # Save conversation
-            conversation = InstagramConversation(
-                account_id=account.id,
-                instagram_user_id=user_id,
-                message_text=text,
-                response_text=ai_response,
-                message_type='direct_message'
-            )
-            db.session.add(conversation)
+            ai_result = get_ai_result(update['text'], route.tenant, update['history'])
+            ai_response, ai_ok = ai_result['response'], bool(ai_result.get('success'))
+            if not ai_ok and not InboundQueue.is_final_attempt():
+                # Xato xabari faqat oxirgi urinishda yuboriladi
+                raise RetryableError(f"AI error: {ai_result.get('error')}")
             
-            # Send direct message reply
-            access_token = account.get_access_token()
-            success, result = InstagramHandler.send_direct_message(
-                access_token, account.page_id, user_id, ai_response
-            )
+            # Reply to comment or direct message
+            access_token = route.credentials['access_token']
+            if update['message_type'] == 'comment':
+                success, result = InstagramHandler.reply_to_comment(access_token, update['comment_id'], ai_response)
+            else:
+                success, result = InstagramHandler.send_direct_message(
+                    access_token, route.settings['page_id'], update['user_id'], ai_response
+                )
             
             if success:
-                db.session.commit()
-                return True, "Message processed and reply sent"
-            else:
-                db.session.rollback()
-                return False, f"Failed to send reply: {result}"
+                InstagramHandler._save_reply(update, ai_response, ai_ok)
+            return InstagramHandler._finish(update, success, result)
                 
-        except Exception as e:
+        except Exception:
+            # Kutilmagan xato InboundQueue ga - yozuv qayta navbatga qo'yiladi
             db.session.rollback()
-            return False, f"Error processing message: {str(e)}"
\ No newline at end of file
+            raise
+    
+    @staticmethod
+    async def aprocess_webhook_update(account_id, webhook_data):
+        """process_webhook_update ning asinxron varianti (AI va Graph API so'rovi event loop da)"""
+        update, rejected = await AsyncRuntime.run(InstagramHandler._parse_update, account_id, webhook_data)
+        if rejected:
+            return False, rejected
+        route = update['route']
+        
+        ai_result = await aget_ai_result(update['text'], route.tenant, update['history'])
+        ai_response, ai_ok = ai_result['response'], bool(ai_result.get('success'))
+        if not ai_ok and not InboundQueue.is_final_attempt():
+            raise RetryableError(f"AI error: {ai_result.get('error')}")
+        
+        access_token = route.credentials['access_token']
+        if update['message_type'] == 'comment':
+            success, result = await InstagramHandler.areply_to_comment(access_token, update['comment_id'],
+                                                                       ai_response)
+        else:
+            success, result = await InstagramHandler.asend_direct_message(
+                access_token, route.settings['page_id'], update['user_id'], ai_response
+            )
+        
+        if success:
+            await AsyncRuntime.run(InstagramHandler._save_reply, update, ai_response, ai_ok)
+        return InstagramHandler._finish(update, success, result)
\ No newline at end of file
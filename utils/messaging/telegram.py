@@ -1,9 +1,15 @@
 import requests
 import json
 from flask import current_app
-from models.messaging import TelegramBot, TelegramConversation
+from utils.http_client import HttpClient, ErrorText
+from models.messaging import TelegramConversation
 from models.user import db
-from utils.ai_handler import get_ai_response
+from utils.ai_handler import get_ai_result, get_ai_response_stream, aget_ai_result, aget_ai_response_stream
+from utils.async_runtime import AsyncRuntime
+from utils.conversation_memory import ConversationMemory
+from utils.routing_table import RoutingTable
+from utils.inbound_queue import InboundQueue, RetryableError
+import asyncio
 import os
 import time
 import threading
@@ -12,6 +18,9 @@ import logging
 class TelegramHandler:
     """Handle Telegram Bot API operations"""
     
+    MAX_MESSAGE_LENGTH = 4096
+    STREAM_PLACEHOLDER = "⏳"
+    
     @staticmethod
     def set_webhook(bot_token, webhook_url, secret_token=None):
         """Set webhook for Telegram bot with optional secret token"""
@@ -27,7 +36,7 @@ class TelegramHandler:
             if secret_token:
                 data['secret_token'] = secret_token
             
-            response = requests.post(api_url, json=data, timeout=10)
+            response = HttpClient.post(api_url, json=data)
             response.raise_for_status()
             
             result = response.json()
@@ -39,85 +48,472 @@ class TelegramHandler:
             return False, f"Error: {str(e)}"
     
     @staticmethod
-    def send_message(bot_token, chat_id, text, reply_to_message_id=None):
+    def send_message(bot_token, chat_id, text, reply_to_message_id=None, parse_mode='Markdown'):
         """Send message via Telegram Bot API"""
         try:
             api_url = f"{current_app.config['TELEGRAM_API_URL']}{bot_token}/sendMessage"
             
             data = {
                 'chat_id': chat_id,
-                'text': text,
-                'parse_mode': 'Markdown'
+                'text': text
             }
+            if parse_mode:
+                data['parse_mode'] = parse_mode
             
             if reply_to_message_id:
                 data['reply_to_message_id'] = reply_to_message_id
             
-            response = requests.post(api_url, json=data, timeout=10)
+            response = HttpClient.post(api_url, json=data)
             response.raise_for_status()
             
             result = response.json()
             return result.get('ok', False), result.get('result', {})
             
         except requests.exceptions.RequestException as e:
-            return False, f"Network error: {str(e)}"
+            return False, HttpClient.error_message(e)
         except Exception as e:
             return False, f"Error: {str(e)}"
     
     @staticmethod
-    def process_webhook_update(bot_id, update_data):
-        """Process incoming webhook update from Telegram"""
+    def edit_message_text(bot_token, chat_id, message_id, text, parse_mode=None):
+        """
+        Yuborilgan xabar matnini almashtirish (editMessageText)
+        
+        Returns:
+            tuple: (success, description, retry_after) - retry_after 429 javobida
+                   Telegram so'ragan kutish vaqti (soniya), aks holda 0
+        """
         try:
-            # Get bot instance
-            bot = TelegramBot.query.get(bot_id)
-            if not bot or not bot.is_active:
-                return False, "Bot not found or inactive"
+            api_url = f"{current_app.config['TELEGRAM_API_URL']}{bot_token}/editMessageText"
             
-            # Extract message data
-            message = update_data.get('message', {})
-            if not message:
-                return False, "No message in update"
+            data = {
+                'chat_id': chat_id,
+                'message_id': message_id,
+                'text': text
+            }
+            if parse_mode:
+                data['parse_mode'] = parse_mode
             
-            chat_id = str(message.get('chat', {}).get('id', ''))
-            user_id = str(message.get('from', {}).get('id', ''))
-            username = message.get('from', {}).get('username', '')
-            text = message.get('text', '')
+            # HttpClient POST ni status bo'yicha qayta yubormaydi va Retry-After da
+            # uxlamaydi - 429 javobi (retry_after) shu yerga keladi, stream_message
+            # keyingi tahrirlashni shuncha kechiktiradi
+            response = HttpClient.post(api_url, json=data)
+            result = response.json()
+            if result.get('ok'):
+                return True, 'OK', 0
+            description = result.get('description', 'Unknown error')
+            if 'message is not modified' in description:
+                return True, description, 0
+            return False, description, result.get('parameters', {}).get('retry_after', 0)
             
-            if not text or not chat_id:
-                return False, "Missing required message data"
+        except requests.exceptions.RequestException as e:
+            return False, f"Network error: {str(e)}", 0
+        except Exception as e:
+            return False, f"Error: {str(e)}", 0
+    
+    @staticmethod
+    def send_chat_action(bot_token, chat_id, action='typing'):
+        """Chatda "yozmoqda..." holatini ko'rsatish (5 soniya yoki xabar kelguncha)"""
+        try:
+            api_url = f"{current_app.config['TELEGRAM_API_URL']}{bot_token}/sendChatAction"
+            response = HttpClient.post(api_url, json={'chat_id': chat_id, 'action': action})
+            return response.json().get('ok', False)
+        except Exception:
+            return False
+    
+    @staticmethod
+    def stream_message(bot_token, chat_id, events, reply_to_message_id=None):
+        """
+        AI javobini yozilish davomida ko'rsatish
+        
+        Darhol "typing" holati va vaqtinchalik xabar yuboriladi, keyin u
+        kelgan bo'laklar bilan tahrirlanadi: bitta xabar kamida
+        TELEGRAM_STREAM_EDIT_INTERVAL soniyada bir marta va kamida
+        TELEGRAM_STREAM_MIN_CHARS yangi belgi bo'lganda (Telegram tahrirlash
+        limiti). Oraliq matnlar parse_mode siz (yarim Markdown xato beradi),
+        oxirgi matn Markdown bilan yuboriladi. 4096 belgidan uzun javob
+        keyingi xabarlarda davom etadi.
+        
+        Args:
+            events: AIHandler.generate_response_stream hodisalari
+        
+        Returns:
+            tuple: (success, result) - result generate_response natijasi
+                   ('response' - foydalanuvchiga yuborilgan to'liq matn)
+        """
+        interval = current_app.config.get('TELEGRAM_STREAM_EDIT_INTERVAL', 1.5)
+        min_chars = current_app.config.get('TELEGRAM_STREAM_MIN_CHARS', 30)
+        limit = TelegramHandler.MAX_MESSAGE_LENGTH
+        
+        success, sent = TelegramHandler.send_message(
+            bot_token, chat_id, TelegramHandler.STREAM_PLACEHOLDER,
+            reply_to_message_id=reply_to_message_id, parse_mode=None
+        )
+        if not success:
+            # Foydalanuvchi hali hech narsa ko'rmagan - vaqtinchalik xatoda qayta urinish mumkin
+            return False, {'success': False, 'error': ErrorText(f"Failed to send placeholder: {sent}",
+                                                                getattr(sent, 'transient', False))}
+        # Xabar yuborilishi "yozmoqda" holatini o'chiradi - shuning uchun undan keyin
+        TelegramHandler.send_chat_action(bot_token, chat_id)
+        
+        message_id = sent.get('message_id')
+        offset = 0  # joriy xabar to'liq matnning shu joyidan boshlanadi
+        shown = ''
+        next_edit = time.time() + interval
+        text = ''
+        result = {}
+        
+        for event in events:
+            if event.get('done'):
+                result = event
+                break
+            text += event.get('delta', '')
+            
+            # Joriy xabar to'ldi - uni yakunlab, davomini yangi xabarda ko'rsatish
+            while len(text) - offset > limit:
+                _, _, retry_after = TelegramHandler.edit_message_text(bot_token, chat_id, message_id,
+                                                                      text[offset:offset + limit])
+                if retry_after:
+                    # Yopilayotgan xabar oxirgi tahrirsiz qolmasin - limit tugashini kutib qayta
+                    time.sleep(min(retry_after, 30))
+                    TelegramHandler.edit_message_text(bot_token, chat_id, message_id, text[offset:offset + limit])
+                offset += limit
+                success, sent = TelegramHandler.send_message(bot_token, chat_id, text[offset:offset + limit],
+                                                             parse_mode=None)
+                if not success:
+                    return False, {'success': False, 'error': f"Failed to send continuation: {sent}"}
+                message_id, shown = sent.get('message_id'), text[offset:offset + limit]
+                next_edit = time.time() + interval
+            
+            current = text[offset:]
+            if time.time() >= next_edit and len(current) - len(shown) >= min_chars:
+                ok, _, retry_after = TelegramHandler.edit_message_text(bot_token, chat_id, message_id, current)
+                if ok:
+                    shown = current
+                next_edit = time.time() + max(interval, retry_after)
+        
+        # AI xatosida foydalanuvchi yarim javob o'rniga xato xabarini ko'radi
+        final = result.get('response') or text
+        final_part = (final[offset:] if final == text else final[:limit]) or TelegramHandler.STREAM_PLACEHOLDER
+        
+        ok, description, retry_after = TelegramHandler.edit_message_text(
+            bot_token, chat_id, message_id, final_part, parse_mode='Markdown'
+        )
+        if not ok:
+            # Markdown ni Telegram qabul qilmadi yoki limit - oddiy matn bilan qayta urinish
+            if retry_after:
+                time.sleep(min(retry_after, 30))
+            ok, description, _ = TelegramHandler.edit_message_text(bot_token, chat_id, message_id, final_part)
+        
+        if not ok:
+            return False, dict(result, response=final, error=description)
+        return True, dict(result, response=final)
+    
+    @staticmethod
+    def chat_key(update_data):
+        """Xabarlarni birlashtirish uchun chat ID (matnli xabar bo'lmasa None)"""
+        message = update_data.get('message') or {}
+        chat_id = message.get('chat', {}).get('id')
+        if chat_id is None or not message.get('text'):
+            return None
+        return str(chat_id)
+    
+    @staticmethod
+    def merge_updates(updates):
+        """Bitta chatning ketma-ket yangilanishlarini bittaga birlashtirish (matnlar kelish tartibida)"""
+        texts = [update['message']['text'].strip() for update in updates
+                 if (update.get('message') or {}).get('text', '').strip()]
+        merged = dict(updates[-1])
+        merged['message'] = dict(updates[-1]['message'], text="\n".join(texts))
+        merged['merged_update_ids'] = [update.get('update_id') for update in updates]
+        return merged
+    
+    @staticmethod
+    def _parse_update(bot_id, update_data):
+        """
+        Javob uchun kerakli ma'lumotlar: marshrut jadvalidan bot va suhbat tarixi
+        
+        Returns:
+            tuple: (update, None) yoki rad etilganda (None, sabab)
+        """
+        # Bot, tenant va token - marshrut jadvalidan
+        route = RoutingTable.account('telegram', bot_id)
+        if not route or not route.is_active:
+            return None, "Bot not found or inactive"
+        
+        # Extract message data
+        message = update_data.get('message', {})
+        if not message:
+            return None, "No message in update"
+        
+        chat_id = str(message.get('chat', {}).get('id', ''))
+        text = message.get('text', '')
+        
+        if not text or not chat_id:
+            return None, "Missing required message data"
+        
+        if not route.credentials:
+            return None, "Bot token could not be decrypted"
+        
+        return {
+            'route': route,
+            'chat_id': chat_id,
+            'user_id': str(message.get('from', {}).get('id', '')),
+            'username': message.get('from', {}).get('username', ''),
+            'text': text,
+            'message_id': message.get('message_id'),
+            'history': ConversationMemory.history('telegram', bot_id, chat_id, route.user_id)
+        }, None
+    
+    @staticmethod
+    def _save_reply(bot_id, update, ai_response, ai_ok):
+        """Yuborilgan javobni saqlash"""
+        conversation = TelegramConversation(
+            bot_id=bot_id,
+            telegram_user_id=update['user_id'],
+            telegram_username=update['username'],
+            message_text=update['text'],
+            response_text=ai_response
+        )
+        db.session.add(conversation)
+        db.session.commit()
+        if ai_ok:
+            # AI xato xabari suhbat tarixiga kirmasin
+            ConversationMemory.append('telegram', bot_id, update['chat_id'], update['route'].user_id,
+                                      update['text'], ai_response, sender_name=update['username'] or None)
+    
+    @staticmethod
+    def _send_failed(result):
+        """Javob yuborilmadi: vaqtinchalik xatoda (oxirgi urinish bo'lmasa) qayta navbatga"""
+        if getattr(result, 'transient', False) and not InboundQueue.is_final_attempt():
+            raise RetryableError(f"Failed to send response: {result}")
+        return False, f"Failed to send response: {result}"
+    
+    @staticmethod
+    def process_webhook_update(bot_id, update_data):
+        """Process incoming webhook update from Telegram"""
+        try:
+            update, rejected = TelegramHandler._parse_update(bot_id, update_data)
+            if rejected:
+                return False, rejected
             
             # Get AI response with knowledge base context
-            from models.user import User
-            user_obj = User.query.get(bot.user_id)
-            ai_response = get_ai_response(text, user_obj)
-            
-            # Save conversation
-            conversation = TelegramConversation(
-                bot_id=bot_id,
-                telegram_user_id=user_id,
-                telegram_username=username,
-                message_text=text,
-                response_text=ai_response
+            route, chat_id, text = update['route'], update['chat_id'], update['text']
+            bot_token = route.credentials['token']
+            
+            if route.settings['stream_replies']:
+                # Javob yozilish davomida bitta xabarni tahrirlab ko'rsatiladi
+                success, result = TelegramHandler.stream_message(
+                    bot_token, chat_id, get_ai_response_stream(text, route.tenant, update['history']),
+                    reply_to_message_id=update['message_id']
+                )
+                ai_response = result.get('response')
+                ai_ok = bool(result.get('success'))
+                result = result.get('error')
+            else:
+                ai_result = get_ai_result(text, route.tenant, update['history'])
+                ai_response, ai_ok = ai_result['response'], bool(ai_result.get('success'))
+                if not ai_ok and not InboundQueue.is_final_attempt():
+                    # Xato xabari faqat oxirgi urinishda yuboriladi
+                    raise RetryableError(f"AI error: {ai_result.get('error')}")
+                
+                # Send response back to Telegram
+                success, result = TelegramHandler.send_message(
+                    bot_token, chat_id, ai_response, 
+                    reply_to_message_id=update['message_id']
+                )
+            
+            if not success:
+                return TelegramHandler._send_failed(result)
+            TelegramHandler._save_reply(bot_id, update, ai_response, ai_ok)
+            return True, "Message processed and response sent"
+                
+        except Exception:
+            # Kutilmagan xato InboundQueue ga - yozuv qayta navbatga qo'yiladi
+            db.session.rollback()
+            raise
+    
+    # ===== ASINXRON (asgi.py) =====
+    
+    @staticmethod
+    async def aprocess_webhook_update(bot_id, update_data):
+        """
+        process_webhook_update ning asinxron varianti
+        
+        AI va Bot API so'rovlari event loop da; marshrut, tarix va natijani
+        saqlash AsyncRuntime thread pulida.
+        """
+        update, rejected = await AsyncRuntime.run(TelegramHandler._parse_update, bot_id, update_data)
+        if rejected:
+            return False, rejected
+        
+        route, chat_id, text = update['route'], update['chat_id'], update['text']
+        bot_token = route.credentials['token']
+        
+        if route.settings['stream_replies']:
+            success, result = await TelegramHandler.astream_message(
+                bot_token, chat_id, await aget_ai_response_stream(text, route.tenant, update['history']),
+                reply_to_message_id=update['message_id']
             )
-            db.session.add(conversation)
+            ai_response = result.get('response')
+            ai_ok = bool(result.get('success'))
+            result = result.get('error')
+        else:
+            ai_result = await aget_ai_result(text, route.tenant, update['history'])
+            ai_response, ai_ok = ai_result['response'], bool(ai_result.get('success'))
+            if not ai_ok and not InboundQueue.is_final_attempt():
+                raise RetryableError(f"AI error: {ai_result.get('error')}")
             
-            # Send response back to Telegram
-            bot_token = bot.get_token()
-            success, result = TelegramHandler.send_message(
-                bot_token, chat_id, ai_response, 
-                reply_to_message_id=message.get('message_id')
+            success, result = await TelegramHandler.asend_message(
+                bot_token, chat_id, ai_response, reply_to_message_id=update['message_id']
             )
+        
+        if not success:
+            return TelegramHandler._send_failed(result)
+        await AsyncRuntime.run(TelegramHandler._save_reply, bot_id, update, ai_response, ai_ok)
+        return True, "Message processed and response sent"
+    
+    @staticmethod
+    async def asend_message(bot_token, chat_id, text, reply_to_message_id=None, parse_mode='Markdown'):
+        """send_message ning asinxron varianti"""
+        try:
+            api_url = f"{current_app.config['TELEGRAM_API_URL']}{bot_token}/sendMessage"
             
-            if success:
-                db.session.commit()
-                return True, "Message processed and response sent"
-            else:
-                db.session.rollback()
-                return False, f"Failed to send response: {result}"
-                
+            data = {
+                'chat_id': chat_id,
+                'text': text
+            }
+            if parse_mode:
+                data['parse_mode'] = parse_mode
+            
+            if reply_to_message_id:
+                data['reply_to_message_id'] = reply_to_message_id
+            
+            response = await HttpClient.apost(api_url, json=data)
+            response.raise_for_status()
+            
+            result = response.json()
+            return result.get('ok', False), result.get('result', {})
+            
+        except requests.exceptions.RequestException as e:
+            return False, HttpClient.error_message(e)
         except Exception as e:
-            db.session.rollback()
-            return False, f"Error processing update: {str(e)}"
+            return False, f"Error: {str(e)}"
+    
+    @staticmethod
+    async def aedit_message_text(bot_token, chat_id, message_id, text, parse_mode=None):
+        """edit_message_text ning asinxron varianti (natija bir xil: success, description, retry_after)"""
+        try:
+            api_url = f"{current_app.config['TELEGRAM_API_URL']}{bot_token}/editMessageText"
+            
+            data = {
+                'chat_id': chat_id,
+                'message_id': message_id,
+                'text': text
+            }
+            if parse_mode:
+                data['parse_mode'] = parse_mode
+            
+            response = await HttpClient.apost(api_url, json=data)
+            result = response.json()
+            if result.get('ok'):
+                return True, 'OK', 0
+            description = result.get('description', 'Unknown error')
+            if 'message is not modified' in description:
+                return True, description, 0
+            return False, description, result.get('parameters', {}).get('retry_after', 0)
+            
+        except requests.exceptions.RequestException as e:
+            return False, f"Network error: {str(e)}", 0
+        except Exception as e:
+            return False, f"Error: {str(e)}", 0
+    
+    @staticmethod
+    async def asend_chat_action(bot_token, chat_id, action='typing'):
+        """send_chat_action ning asinxron varianti"""
+        try:
+            api_url = f"{current_app.config['TELEGRAM_API_URL']}{bot_token}/sendChatAction"
+            response = await HttpClient.apost(api_url, json={'chat_id': chat_id, 'action': action})
+            return response.json().get('ok', False)
+        except Exception:
+            return False
+    
+    @staticmethod
+    async def astream_message(bot_token, chat_id, events, reply_to_message_id=None):
+        """
+        stream_message ning asinxron varianti
+        
+        Args:
+            events: AIHandler.agenerate_response_stream hodisalari (async iterator)
+        """
+        interval = current_app.config.get('TELEGRAM_STREAM_EDIT_INTERVAL', 1.5)
+        min_chars = current_app.config.get('TELEGRAM_STREAM_MIN_CHARS', 30)
+        limit = TelegramHandler.MAX_MESSAGE_LENGTH
+        
+        success, sent = await TelegramHandler.asend_message(
+            bot_token, chat_id, TelegramHandler.STREAM_PLACEHOLDER,
+            reply_to_message_id=reply_to_message_id, parse_mode=None
+        )
+        if not success:
+            await events.aclose()
+            return False, {'success': False, 'error': ErrorText(f"Failed to send placeholder: {sent}",
+                                                                getattr(sent, 'transient', False))}
+        await TelegramHandler.asend_chat_action(bot_token, chat_id)
+        
+        message_id = sent.get('message_id')
+        offset = 0
+        shown = ''
+        next_edit = time.time() + interval
+        text = ''
+        result = {}
+        
+        try:
+            async for event in events:
+                if event.get('done'):
+                    result = event
+                    break
+                text += event.get('delta', '')
+                
+                while len(text) - offset > limit:
+                    _, _, retry_after = await TelegramHandler.aedit_message_text(bot_token, chat_id, message_id,
+                                                                                 text[offset:offset + limit])
+                    if retry_after:
+                        await asyncio.sleep(min(retry_after, 30))
+                        await TelegramHandler.aedit_message_text(bot_token, chat_id, message_id,
+                                                                 text[offset:offset + limit])
+                    offset += limit
+                    success, sent = await TelegramHandler.asend_message(bot_token, chat_id,
+                                                                        text[offset:offset + limit], parse_mode=None)
+                    if not success:
+                        return False, {'success': False, 'error': f"Failed to send continuation: {sent}"}
+                    message_id, shown = sent.get('message_id'), text[offset:offset + limit]
+                    next_edit = time.time() + interval
+                
+                current = text[offset:]
+                if time.time() >= next_edit and len(current) - len(shown) >= min_chars:
+                    ok, _, retry_after = await TelegramHandler.aedit_message_text(bot_token, chat_id, message_id,
+                                                                                  current)
+                    if ok:
+                        shown = current
+                    next_edit = time.time() + max(interval, retry_after)
+        finally:
+            await events.aclose()
+        
+        final = result.get('response') or text
+        final_part = (final[offset:] if final == text else final[:limit]) or TelegramHandler.STREAM_PLACEHOLDER
+        
+        ok, description, retry_after = await TelegramHandler.aedit_message_text(
+            bot_token, chat_id, message_id, final_part, parse_mode='Markdown'
+        )
+        if not ok:
+            if retry_after:
+                await asyncio.sleep(min(retry_after, 30))
+            ok, description, _ = await TelegramHandler.aedit_message_text(bot_token, chat_id, message_id,
+                                                                          final_part)
+        
+        if not ok:
+            return False, dict(result, response=final, error=description)
+        return True, dict(result, response=final)
     
     @staticmethod
     def get_updates(bot_token, offset=0, timeout=10):
@@ -131,7 +527,7 @@ class TelegramHandler:
                 'limit': 100
             }
             
-            response = requests.post(api_url, json=data, timeout=timeout + 5)
+            response = HttpClient.post(api_url, json=data, read_timeout=timeout + 5)
             response.raise_for_status()
             
             result = response.json()
@@ -151,7 +547,7 @@ class TelegramHandler:
         try:
             api_url = f"{current_app.config['TELEGRAM_API_URL']}{bot_token}/getMe"
             
-            response = requests.get(api_url, timeout=10)
+            response = HttpClient.get(api_url)
             response.raise_for_status()
             
             result = response.json()
@@ -3,9 +3,14 @@ import json
 import hmac
 import hashlib
 from flask import current_app
+from utils.http_client import HttpClient
 from models.messaging import WhatsAppAccount, WhatsAppConversation
 from models.user import db
-from utils.ai_handler import get_ai_response
+from utils.ai_handler import get_ai_result, aget_ai_result
+from utils.async_runtime import AsyncRuntime
+from utils.conversation_memory import ConversationMemory
+from utils.routing_table import RoutingTable
+from utils.inbound_queue import InboundQueue, RetryableError
 
 class WhatsAppHandler:
     """Handle WhatsApp Business API operations"""
@@ -47,81 +52,174 @@ class WhatsAppHandler:
                 'text': {'body': message_text}
             }
             
-            response = requests.post(api_url, headers=headers, json=data, timeout=10)
+            response = HttpClient.post(api_url, headers=headers, json=data)
             response.raise_for_status()
             
             result = response.json()
             return True, result
             
         except requests.exceptions.RequestException as e:
-            return False, f"Network error: {str(e)}"
+            return False, HttpClient.error_message(e)
         except Exception as e:
             return False, f"Error: {str(e)}"
     
     @staticmethod
-    def process_webhook_message(account_id, webhook_data):
-        """Process incoming WhatsApp webhook message"""
+    async def asend_message(access_token, phone_number_id, to_number, message_text):
+        """send_message ning asinxron varianti (asgi.py)"""
         try:
-            # Get account instance
-            account = WhatsAppAccount.query.get(account_id)
-            if not account or not account.is_active:
-                return False, "Account not found or inactive"
-            
-            # Extract message data from webhook
-            entry = webhook_data.get('entry', [])
-            if not entry:
-                return False, "No entry in webhook data"
+            api_url = f"{current_app.config['WHATSAPP_API_URL']}/{phone_number_id}/messages"
             
-            changes = entry[0].get('changes', [])
-            if not changes:
-                return False, "No changes in entry"
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
             
-            value = changes[0].get('value', {})
-            messages = value.get('messages', [])
+            data = {
+                'messaging_product': 'whatsapp',
+                'to': to_number,
+                'type': 'text',
+                'text': {'body': message_text}
+            }
             
-            if not messages:
-                return False, "No messages in webhook"
+            response = await HttpClient.apost(api_url, headers=headers, json=data)
+            response.raise_for_status()
             
-            message = messages[0]
-            from_number = message.get('from', '')
-            message_text = message.get('text', {}).get('body', '')
+            result = response.json()
+            return True, result
             
-            if not message_text or not from_number:
-                return False, "Missing message text or sender"
+        except requests.exceptions.RequestException as e:
+            return False, HttpClient.error_message(e)
+        except Exception as e:
+            return False, f"Error: {str(e)}"
+    
+    @staticmethod
+    def _parse_message(account_id, webhook_data):
+        """
+        Javob uchun kerakli ma'lumotlar: marshrut jadvalidan akkaunt va suhbat tarixi
+        
+        Returns:
+            tuple: (message, None) yoki rad etilganda (None, sabab)
+        """
+        # Akkaunt, tenant va kalitlar - marshrut jadvalidan
+        route = RoutingTable.account('whatsapp', account_id)
+        if not route or not route.is_active:
+            return None, "Account not found or inactive"
+        
+        # Extract message data from webhook
+        entry = webhook_data.get('entry', [])
+        if not entry:
+            return None, "No entry in webhook data"
+        
+        changes = entry[0].get('changes', [])
+        if not changes:
+            return None, "No changes in entry"
+        
+        value = changes[0].get('value', {})
+        messages = value.get('messages', [])
+        
+        if not messages:
+            return None, "No messages in webhook"
+        
+        message = messages[0]
+        from_number = message.get('from', '')
+        message_text = message.get('text', {}).get('body', '')
+        
+        if not message_text or not from_number:
+            return None, "Missing message text or sender"
+        
+        if not route.credentials:
+            return None, "Account credentials could not be decrypted"
+        
+        return {
+            'route': route,
+            'from_number': from_number,
+            'text': message_text,
+            'history': ConversationMemory.history('whatsapp', account_id, from_number, route.user_id)
+        }, None
+    
+    @staticmethod
+    def _save_reply(account_id, message, ai_response, ai_ok):
+        """Yuborilgan javobni saqlash"""
+        conversation = WhatsAppConversation(
+            account_id=account_id,
+            whatsapp_user_id=message['from_number'],
+            message_text=message['text'],
+            response_text=ai_response
+        )
+        db.session.add(conversation)
+        db.session.commit()
+        if ai_ok:
+            # AI xato xabari suhbat tarixiga kirmasin
+            ConversationMemory.append('whatsapp', account_id, message['from_number'], message['route'].user_id,
+                                      message['text'], ai_response)
+    
+    @staticmethod
+    def _send_failed(result):
+        """Javob yuborilmadi: vaqtinchalik xatoda (oxirgi urinish bo'lmasa) qayta navbatga"""
+        if getattr(result, 'transient', False) and not InboundQueue.is_final_attempt():
+            raise RetryableError(f"Failed to send response: {result}")
+        return False, f"Failed to send response: {result}"
+    
+    @staticmethod
+    def process_webhook_message(account_id, webhook_data):
+        """Process incoming WhatsApp webhook message"""
+        try:
+            message, rejected = WhatsAppHandler._parse_message(account_id, webhook_data)
+            if rejected:
+                return False, rejected
+            route = message['route']
             
             # Get AI response with knowledge base context
-            from models.user import User
-            user_obj = User.query.get(account.user_id)
-            ai_response = get_ai_response(message_text, user_obj)
-            
-            # Save conversation
-            conversation = WhatsAppConversation(
-                account_id=account_id,
-                whatsapp_user_id=from_number,
-                message_text=message_text,
-                response_text=ai_response
-            )
-            db.session.add(conversation)
+            ai_result = get_ai_result(message['text'], route.tenant, message['history'])
+            ai_response = ai_result['response']
+            if not ai_result.get('success') and not InboundQueue.is_final_attempt():
+                # Xato xabari faqat oxirgi urinishda yuboriladi
+                raise RetryableError(f"AI error: {ai_result.get('error')}")
             
             # Send response back to WhatsApp
-            credentials = account.get_credentials()
+            credentials = route.credentials
             success, result = WhatsAppHandler.send_message(
                 credentials['app_secret'],  # This should be access_token in real implementation
-                account.phone_number_id,
-                from_number,
+                route.settings['phone_number_id'],
+                message['from_number'],
                 ai_response
             )
             
-            if success:
-                db.session.commit()
-                return True, "Message processed and response sent"
-            else:
-                db.session.rollback()
-                return False, f"Failed to send response: {result}"
+            if not success:
+                return WhatsAppHandler._send_failed(result)
+            WhatsAppHandler._save_reply(account_id, message, ai_response, bool(ai_result.get('success')))
+            return True, "Message processed and response sent"
                 
-        except Exception as e:
+        except Exception:
+            # Kutilmagan xato InboundQueue ga - yozuv qayta navbatga qo'yiladi
             db.session.rollback()
-            return False, f"Error processing message: {str(e)}"
+            raise
+    
+    @staticmethod
+    async def aprocess_webhook_message(account_id, webhook_data):
+        """process_webhook_message ning asinxron varianti (AI va Cloud API so'rovi event loop da)"""
+        message, rejected = await AsyncRuntime.run(WhatsAppHandler._parse_message, account_id, webhook_data)
+        if rejected:
+            return False, rejected
+        route = message['route']
+        
+        ai_result = await aget_ai_result(message['text'], route.tenant, message['history'])
+        ai_response = ai_result['response']
+        if not ai_result.get('success') and not InboundQueue.is_final_attempt():
+            raise RetryableError(f"AI error: {ai_result.get('error')}")
+        
+        success, result = await WhatsAppHandler.asend_message(
+            route.credentials['app_secret'],  # send_message dagidek
+            route.settings['phone_number_id'],
+            message['from_number'],
+            ai_response
+        )
+        
+        if not success:
+            return WhatsAppHandler._send_failed(result)
+        await AsyncRuntime.run(WhatsAppHandler._save_reply, account_id, message, ai_response,
+                               bool(ai_result.get('success')))
+        return True, "Message processed and response sent"
     
     @staticmethod
     def validate_credentials(app_id, app_secret, phone_number_id):
@@ -2,6 +2,8 @@ import requests
 import json
 from typing import Dict, Any, Optional
 from flask import current_app
+from utils.http_client import HttpClient
+from utils.token_manager import WhatsAppTokenManager
 import time
 
 class TelegramUtils:
@@ -31,7 +33,7 @@ class TelegramUtils:
                 'parse_mode': parse_mode
             }
             
-            response = requests.post(url, json=data, timeout=10)
+            response = HttpClient.post(url, json=data)
             result = response.json()
             
             if result.get('ok'):
@@ -69,7 +71,7 @@ class TelegramUtils:
                 'url': webhook_url
             }
             
-            response = requests.post(url, json=data, timeout=10)
+            response = HttpClient.post(url, json=data)
             result = response.json()
             
             if result.get('ok'):
@@ -100,7 +102,7 @@ class TelegramUtils:
         try:
             url = f"https://api.telegram.org/bot{bot_token}/getMe"
             
-            response = requests.get(url, timeout=10)
+            response = HttpClient.get(url)
             result = response.json()
             
             if result.get('ok'):
@@ -143,30 +145,36 @@ class WhatsAppUtils:
             Dict: {'success': bool, 'error': str, 'message_id': str}
         """
         try:
-            # Access token olish
-            access_token = WhatsAppUtils._get_access_token(app_id, app_secret)
-            if not access_token:
-                return {
-                    'success': False,
-                    'error': 'Access token olinmadi',
-                    'message_id': None
-                }
-            
             url = f"https://graph.facebook.com/v18.0/{phone_number_id}/messages"
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
             data = {
                 'messaging_product': 'whatsapp',
                 'to': to_number,
                 'text': {'body': message}
             }
             
-            response = requests.post(url, headers=headers, json=data, timeout=10)
-            result = response.json()
+            # Keshlangan token rad etilsa (muddati o'tgan/bekor qilingan) bir marta yangisi bilan
+            for attempt in range(2):
+                access_token = WhatsAppUtils._get_access_token(app_id, app_secret)
+                if not access_token:
+                    return {
+                        'success': False,
+                        'error': 'Access token olinmadi',
+                        'message_id': None
+                    }
+                
+                headers = {
+                    'Authorization': f'Bearer {access_token}',
+                    'Content-Type': 'application/json'
+                }
+                
+                response = HttpClient.post(url, headers=headers, json=data)
+                result = response.json()
+                
+                if attempt == 0 and WhatsAppUtils._is_token_error(response.status_code, result):
+                    WhatsAppTokenManager.invalidate(app_id)
+                    continue
+                break
             
             if response.status_code == 200:
                 return {
@@ -190,23 +198,17 @@ class WhatsAppUtils:
     
     @staticmethod
     def _get_access_token(app_id: str, app_secret: str) -> Optional[str]:
-        """WhatsApp uchun access token olish"""
+        """WhatsApp uchun access token olish (keshdan, kerak bo'lsa Graph API dan)"""
         try:
-            url = f"https://graph.facebook.com/oauth/access_token"
-            
-            params = {
-                'grant_type': 'client_credentials',
-                'client_id': app_id,
-                'client_secret': app_secret
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            result = response.json()
-            
-            return result.get('access_token')
-            
+            return WhatsAppTokenManager.get_token(app_id, app_secret)
         except:
             return None
+    
+    @staticmethod
+    def _is_token_error(status_code: int, result: Dict[str, Any]) -> bool:
+        """Graph API tokenni rad etdimi (401 yoki OAuthException code 190)"""
+        error = result.get('error', {}) if isinstance(result, dict) else {}
+        return status_code == 401 or error.get('code') == 190
 
 class MessagingUtils:
     """Umumiy messaging utilities"""
@@ -258,7 +260,7 @@ class InstagramUtils:
                 'message': {'text': message}
             }
             
-            response = requests.post(url, headers=headers, json=data, timeout=10)
+            response = HttpClient.post(url, headers=headers, json=data)
             result = response.json()
             
             if response.status_code == 200:
@@ -307,7 +309,7 @@ class InstagramUtils:
                 'message': message
             }
             
-            response = requests.post(url, headers=headers, json=data, timeout=10)
+            response = HttpClient.post(url, headers=headers, json=data)
             result = response.json()
             
             if response.status_code == 200:
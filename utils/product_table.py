@@ -0,0 +1,443 @@
+import array
+import bisect
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from itertools import accumulate, islice
+from typing import Dict, Any, List, Optional, Tuple
+from flask import current_app
+from utils import text_normalizer
+from utils.file_parser import FileParser
+from utils.knowledge_index import KnowledgeIndex, _Segment
+
+# Jadval fayl formati (little-endian):
+#   header (magic, meta uzunligi) | meta JSON | ustun bo'limlari (8 baytga tekislangan)
+# Har bir ustun uchun: qiymatlar offsetlari + UTF-8 blob, raqamli ustunlar uchun
+# float64 massiv va qiymat bo'yicha saralangan qatorlar, matnli ustunlar uchun
+# KIX1 segment (qator -> termlar). Barchasi bitta faylda mmap orqali o'qiladi.
+TABLE_MAGIC = b'KTB1'
+_TABLE_HEADER = struct.Struct('<4sI')  # magic, meta JSON uzunligi
+_OFFSETS = struct.Struct('<QQ')        # qiymat boshlanishi va oxiri
+
+# Ustun turlari
+TYPE_TEXT = 'text'
+TYPE_NUMBER = 'number'
+TYPE_PRICE = 'price'
+TYPE_URL = 'url'
+NUMERIC_TYPES = (TYPE_NUMBER, TYPE_PRICE)
+
+_NUMBER_PATTERN = r"\d[\d\s.,]*\d|\d"
+_CURRENCY_PATTERN = r"so'm|sum|сум|сўм|uzs|usd|\$|€|руб|rub|р\."
+_NUMBER_RE = re.compile(r"^[-+]?(?:" + _NUMBER_PATTERN + r")$")
+_PRICE_RE = re.compile(
+    r"^(?:[$€]\s*)?(?:" + _NUMBER_PATTERN + r")\s*(?:" + _CURRENCY_PATTERN + r")?$"
+)
+# Savoldagi narx oralig'i: "50 000 so'mgacha", "до 50000", "100000 dan qimmat"
+_MAX_RANGE_RE = re.compile(
+    r"(" + _NUMBER_PATTERN + r")\s*(?:" + _CURRENCY_PATTERN + r")?\s*-?"
+    r"(?:gacha|dan arzon|dan kam|dan past)"
+    r"|(?:до|дешевле|under|below|less than|up to)\s*(" + _NUMBER_PATTERN + r")"
+)
+_MIN_RANGE_RE = re.compile(
+    r"(" + _NUMBER_PATTERN + r")\s*(?:" + _CURRENCY_PATTERN + r")?\s*-?"
+    r"(?:dan qimmat|dan ko'p|dan yuqori|dan ortiq)"
+    r"|(?:от|дороже|over|above|more than|from)\s*(" + _NUMBER_PATTERN + r")"
+)
+
+# Tur aniqlash uchun tekshiriladigan qiymatlar soni va ulushi
+_TYPE_SAMPLE_SIZE = 1000
+_TYPE_THRESHOLD = 0.9
+# Juda ko'p qatorda uchraydigan termlar uchun to'liq postings o'qilmaydi
+_SCAN_LIMIT = 5000
+# Barcha termlar keng tarqalgan bo'lsa (masalan "paket") ko'rib chiqiladigan qatorlar
+_CANDIDATE_LIMIT = 1000
+
+class _Table:
+    """mmap qilingan mahsulot jadvali (ustunlar bo'yicha saqlangan)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, meta_length = _TABLE_HEADER.unpack_from(self._mm, 0)
+        if magic != TABLE_MAGIC:
+            self._mm.close()
+            raise ValueError(f"Noto'g'ri jadval fayl: {path}")
+        meta_start = _TABLE_HEADER.size
+        meta = json.loads(self._mm[meta_start:meta_start + meta_length].decode('utf-8'))
+        base = meta['data_offset']
+
+        self.row_count = meta['rows']
+        self.file_name = meta['file_name']
+        self.columns = meta['columns']
+        self._offsets = [base + column['offsets'] for column in self.columns]
+        self._blobs = [base + column['blob'] for column in self.columns]
+
+        view = memoryview(self._mm)
+        self.indexes: Dict[int, _Segment] = {}
+        self.values: Dict[int, memoryview] = {}
+        self.sorted_rows: Dict[int, memoryview] = {}
+        self.sorted_values: Dict[int, memoryview] = {}
+        for position, column in enumerate(self.columns):
+            if 'index' in column:
+                self.indexes[position] = _Segment(path, self._mm, base + column['index'])
+            if 'values' in column:
+                start = base + column['values']
+                self.values[position] = view[start:start + 8 * self.row_count].cast('d')
+                count = column['sorted_count']
+                start = base + column['sorted_rows']
+                self.sorted_rows[position] = view[start:start + 4 * count].cast('I')
+                start = base + column['sorted_values']
+                self.sorted_values[position] = view[start:start + 8 * count].cast('d')
+
+        # Savoldagi ustun nomlari ("narxi" -> narx ustuni)
+        self.header_terms: Dict[str, int] = {}
+        for position, column in enumerate(self.columns):
+            for term in text_normalizer.tokenize(column['name']):
+                if not term.isdigit():
+                    self.header_terms.setdefault(term, position)
+
+    def cell(self, row: int, column: int) -> str:
+        start, end = _OFFSETS.unpack_from(self._mm, self._offsets[column] + 8 * row)
+        blob = self._blobs[column]
+        return self._mm[blob + start:blob + end].decode('utf-8')
+
+    def row(self, row: int) -> List[str]:
+        return [self.cell(row, column) for column in range(len(self.columns))]
+
+    def range_column(self, requested: List[int]) -> Optional[int]:
+        """Narx oralig'i qo'llanadigan raqamli ustun"""
+        for position in requested:
+            if position in self.values:
+                return position
+        for wanted in NUMERIC_TYPES[::-1]:
+            for position, column in enumerate(self.columns):
+                if column['type'] == wanted and position in self.values:
+                    return position
+        return None
+
+    def rows_in_range(self, column: int, low: float, high: float, limit: int) -> List[int]:
+        """Qiymati [low, high] oralig'idagi qatorlar (arzonidan boshlab)"""
+        values = self.sorted_values[column]
+        start = bisect.bisect_left(values, low)
+        end = bisect.bisect_right(values, high)
+        return list(self.sorted_rows[column][start:min(end, start + limit)])
+
+    def match(self, terms: List[str], value_range: Optional[Tuple[float, float]],
+              limit: int) -> List[int]:
+        """
+        Savol termlariga mos qatorlar
+
+        Eng ko'p turli termni o'z ichiga olgan qatorlar qaytariladi (masalan
+        "zip paket 4x6" uchun faqat shu mahsulot, "zip paket" uchun barcha zip
+        paketlar), teng bo'lsa noyob termlar og'irligi (idf) bo'yicha.
+
+        Returns:
+            List[int]: Qator indekslari
+        """
+        requested = sorted({self.header_terms[term] for term in terms if term in self.header_terms})
+        terms = [term for term in set(terms) if term not in self.header_terms]
+        range_column = self.range_column(requested) if value_range else None
+
+        lists = []
+        for position, segment in self.indexes.items():
+            for term in terms:
+                found = segment.postings(term.encode('utf-8'))
+                if found:
+                    start, count = found
+                    idf = math.log(1 + (self.row_count - count + 0.5) / (count + 0.5))
+                    lists.append((count, position, term, segment, start, idf))
+
+        if not lists:
+            if range_column is None:
+                return []
+            return self.rows_in_range(range_column, value_range[0], value_range[1], limit)
+
+        # Noyob termlardan boshlab; ko'p uchraydigan termlar faqat topilgan
+        # qatorlar uchun binary search bilan tekshiriladi
+        lists.sort(key=lambda item: (item[0], item[1], item[2]))
+        scores: Dict[int, float] = {}
+        coverage: Dict[int, set] = {}
+        for count, position, term, segment, start, idf in lists:
+            if count <= _SCAN_LIMIT or not scores:
+                for row, tf in segment.iter_postings(start, count if count <= _SCAN_LIMIT else _CANDIDATE_LIMIT):
+                    scores[row] = scores.get(row, 0.0) + idf
+                    coverage.setdefault(row, set()).add(term)
+            else:
+                docs = segment.posting_docs(start, count)
+                for row in scores:
+                    found = bisect.bisect_left(docs, row)
+                    if found < count and docs[found] == row:
+                        scores[row] += idf
+                        coverage[row].add(term)
+
+        rows = scores.keys()
+        if range_column is not None:
+            values = self.values[range_column]
+            rows = [row for row in rows if value_range[0] <= values[row] <= value_range[1]]
+        if not rows:
+            return []
+
+        best = max(len(coverage[row]) for row in rows)
+        matched = [row for row in rows if len(coverage[row]) == best]
+        matched.sort(key=lambda row: (-scores[row], row))
+        return matched[:limit]
+
+class ProductTable:
+    """CSV mahsulot katalogi uchun ustunli jadval va ustun indekslari
+
+    CSV fayl yuklanganda u matn bo'laklariga emas, turlari aniqlangan
+    ustunlar ko'rinishida jadval fayliga yoziladi. Savol kelganda faqat mos
+    qatorlar promptga qo'shiladi ("narxi qancha X" -> X qatori).
+    """
+
+    # Process ichidagi ochiq jadvallar: (user_id, knowledge_base_id) -> (versiya, _Table)
+    _tables: Dict[Tuple[str, int], Tuple[int, _Table]] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _table_name(knowledge_base_id: int) -> str:
+        return f"kb_{knowledge_base_id}.tbl"
+
+    # ===== TURLAR =====
+
+    @staticmethod
+    def parse_number(value: str) -> Optional[float]:
+        """
+        Katakdagi raqamni o'qish ("12 500 so'm" -> 12500.0, "1,5" -> 1.5)
+
+        Returns:
+            Optional[float]: Raqam yoki None
+        """
+        digits = re.sub(r"[^\d.,-]", "", value)
+        if not digits or not any(char.isdigit() for char in digits):
+            return None
+        if ',' in digits and '.' in digits:
+            digits = digits.replace(',', '')
+        elif digits.count(',') == 1 and len(digits) - digits.index(',') - 1 != 3:
+            digits = digits.replace(',', '.')
+        else:
+            digits = digits.replace(',', '')
+        if digits.count('.') > 1:
+            digits = digits.replace('.', '')
+        try:
+            return float(digits.rstrip('.'))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def infer_type(values: List[str]) -> str:
+        """Ustun qiymatlaridan turini aniqlash (text, number, price, url)"""
+        sample = [text_normalizer.normalize(value) for value in islice(filter(None, values), _TYPE_SAMPLE_SIZE)]
+        if not sample:
+            return TYPE_TEXT
+        needed = len(sample) * _TYPE_THRESHOLD
+
+        if sum(1 for value in sample if value.startswith(('http://', 'https://'))) >= needed:
+            return TYPE_URL
+        if sum(1 for value in sample if _NUMBER_RE.match(value)) >= needed:
+            return TYPE_NUMBER
+        if sum(1 for value in sample if _PRICE_RE.match(value)) >= needed:
+            return TYPE_PRICE
+        return TYPE_TEXT
+
+    @staticmethod
+    def _column_names(header: List[str]) -> List[str]:
+        """Bo'sh va takrorlangan ustun nomlarini to'ldirish"""
+        names = []
+        for position, name in enumerate(header):
+            name = name or f"ustun_{position + 1}"
+            if name in names:
+                name = f"{name}_{position + 1}"
+            names.append(name)
+        return names
+
+    # ===== YOZISH =====
+
+    @staticmethod
+    def _encode_table(file_name: str, header: List[str], rows: List[List[str]]) -> bytes:
+        """Jadval fayl baytlarini yaratish"""
+        sections = bytearray()
+
+        def add_section(data: bytes) -> int:
+            sections.extend(b'\0' * (-len(sections) % 8))
+            offset = len(sections)
+            sections.extend(data)
+            return offset
+
+        def to_bytes(values: array.array) -> bytes:
+            if sys.byteorder != 'little':
+                values.byteswap()
+            return values.tobytes()
+
+        columns = []
+        for position, name in enumerate(ProductTable._column_names(header)):
+            values = [row[position] for row in rows]
+            column_type = ProductTable.infer_type(values)
+            column = {'name': name, 'type': column_type}
+
+            encoded = [value.encode('utf-8') for value in values]
+            column['offsets'] = add_section(to_bytes(array.array('Q', accumulate((len(value) for value in encoded), initial=0))))
+            column['blob'] = add_section(b''.join(encoded))
+
+            if column_type in NUMERIC_TYPES:
+                numbers = [ProductTable.parse_number(value) if value else None for value in values]
+                column['values'] = add_section(to_bytes(array.array(
+                    'd', (math.nan if number is None else number for number in numbers)
+                )))
+                order = sorted((row for row, number in enumerate(numbers) if number is not None),
+                               key=lambda row: numbers[row])
+                column['sorted_count'] = len(order)
+                column['sorted_rows'] = add_section(to_bytes(array.array('I', order)))
+                column['sorted_values'] = add_section(to_bytes(array.array('d', (numbers[row] for row in order))))
+
+            if column_type != TYPE_URL:
+                data, _, _ = KnowledgeIndex._encode_segment(list(enumerate(values)))
+                column['index'] = add_section(data)
+
+            columns.append(column)
+
+        meta = {'file_name': file_name, 'rows': len(rows), 'columns': columns, 'data_offset': 0}
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        # data_offset meta uzunligiga bog'liq - yakuniy qiymat bilan qayta kodlash
+        data_offset = _TABLE_HEADER.size + len(meta_bytes) + 32
+        data_offset += -data_offset % 8
+        meta['data_offset'] = data_offset
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        padding = b' ' * (data_offset - _TABLE_HEADER.size - len(meta_bytes))
+        return _TABLE_HEADER.pack(TABLE_MAGIC, len(meta_bytes)) + meta_bytes + padding + bytes(sections)
+
+    @staticmethod
+    def build(user_id: str, knowledge_base_id: int, file_path: str,
+              file_name: str) -> Optional[Dict[str, Any]]:
+        """
+        CSV fayldan jadval faylini yaratish
+
+        Args:
+            user_id: Foydalanuvchi ID si
+            knowledge_base_id: KnowledgeBase ID si
+            file_path: CSV fayl manzili
+            file_name: Promptda ko'rsatiladigan fayl nomi
+
+        Returns:
+            Optional[Dict]: Manifest uchun {'file', 'rows', 'file_name'} yoki
+            CSV jadval sifatida o'qilmasa None
+        """
+        max_rows = current_app.config.get('KNOWLEDGE_TABLE_MAX_ROWS', 500000)
+        result = FileParser.read_csv_table(file_path, max_rows)
+        if not result['success'] or not result['rows']:
+            return None
+        if result['truncated']:
+            current_app.logger.warning(
+                f"CSV table {file_name}: faqat birinchi {max_rows} qator indekslandi"
+            )
+
+        data = ProductTable._encode_table(file_name, result['header'], result['rows'])
+        tenant_dir = KnowledgeIndex._tenant_dir(user_id)
+        os.makedirs(tenant_dir, exist_ok=True)
+        table_name = ProductTable._table_name(knowledge_base_id)
+        KnowledgeIndex._write_atomic(os.path.join(tenant_dir, table_name), data)
+        return {'file': table_name, 'rows': len(result['rows']), 'file_name': file_name}
+
+    @staticmethod
+    def describe(user_id: str, knowledge_base_id: int) -> Optional[Dict[str, Any]]:
+        """Diskdagi jadval faylining manifest ma'lumoti (fayl bo'lmasa None)"""
+        table_name = ProductTable._table_name(knowledge_base_id)
+        path = os.path.join(KnowledgeIndex._tenant_dir(user_id), table_name)
+        try:
+            table = _Table(path)
+        except (OSError, ValueError):
+            return None
+        return {'file': table_name, 'rows': table.row_count, 'file_name': table.file_name}
+
+    # ===== QIDIRUV =====
+
+    @staticmethod
+    def _open(user_id: str, knowledge_base_id: int, tenant_dir: str,
+              entry: Dict[str, Any], version: int) -> Optional[_Table]:
+        key = (str(user_id), knowledge_base_id)
+        cached = ProductTable._tables.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+        try:
+            table = _Table(os.path.join(tenant_dir, entry['file']))
+        except (OSError, ValueError) as e:
+            current_app.logger.warning(f"Product table skipped: {str(e)}")
+            return None
+        with ProductTable._lock:
+            ProductTable._tables[key] = (version, table)
+        return table
+
+    @staticmethod
+    def parse_value_range(query: str) -> Tuple[Optional[Tuple[float, float]], str]:
+        """
+        Savoldan narx oralig'ini ajratish
+
+        Returns:
+            Tuple: ((min, max) yoki None, oraliq olib tashlangan savol)
+        """
+        low, high = -math.inf, math.inf
+        for pattern, is_max in ((_MAX_RANGE_RE, True), (_MIN_RANGE_RE, False)):
+            match = pattern.search(query)
+            if not match:
+                continue
+            number = ProductTable.parse_number(match.group(1) or match.group(2))
+            if number is None:
+                continue
+            if is_max:
+                high = number
+            else:
+                low = number
+            query = query[:match.start()] + ' ' + query[match.end():]
+        if low == -math.inf and high == math.inf:
+            return None, query
+        return (low, high), query
+
+    @staticmethod
+    def search(user_id: str, query: str, limit: Optional[int] = None,
+               language: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Faol CSV jadvallaridan savolga mos qatorlarni topish
+
+        Args:
+            user_id: Foydalanuvchi (tenant) ID si
+            query: Foydalanuvchi savoli
+            limit: Har bir jadvaldan qaytariladigan qatorlar soni
+            language: Savol tili (berilmasa KNOWLEDGE_QUERY_LANGUAGE)
+
+        Returns:
+            List[Dict]: [{'file_name', 'columns', 'rows': [[qiymatlar]]}]
+        """
+        limit = limit or current_app.config.get('KNOWLEDGE_TABLE_ROW_LIMIT', 10)
+        state = KnowledgeIndex.get_tables(user_id)
+        if not state or not state['tables'] or not query:
+            return []
+
+        value_range, rest = ProductTable.parse_value_range(text_normalizer.normalize(query))
+        terms = text_normalizer.tokenize(rest, language or current_app.config.get('KNOWLEDGE_QUERY_LANGUAGE', 'uz'))
+        if not terms and not value_range:
+            return []
+
+        results = []
+        for knowledge_base_id, entry in sorted(state['tables'].items()):
+            table = ProductTable._open(user_id, knowledge_base_id, state['dir'], entry, state['version'])
+            if table is None:
+                continue
+            rows = table.match(terms, value_range, limit)
+            if rows:
+                results.append({
+                    'file_name': table.file_name,
+                    'columns': [column['name'] for column in table.columns],
+                    'rows': [table.row(row) for row in rows]
+                })
+        return results
+
+    @staticmethod
+    def format_row(columns: List[str], values: List[str]) -> str:
+        """Qatorni prompt uchun "ustun: qiymat | ..." ko'rinishiga keltirish"""
+        return " | ".join(f"{name}: {value}" for name, value in zip(columns, values) if value)
@@ -0,0 +1,231 @@
+import math
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+from flask import current_app
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken o'rnatilmagan bo'lsa belgilar nisbati ishlatiladi
+    tiktoken = None
+
+class PromptBuilder:
+    """Model kontekst byudjetiga sig'adigan prompt yig'ish
+
+    Ustuvorlik: system prompt va foydalanuvchi savoli (doim) -> suhbat
+    tarixi (eng yangisidan boshlab) -> savolga mos bilimlar (qolgan joyga).
+    Kesish deterministik: tarixdan eng eski xabarlar, bilimlardan oxirgi
+    qatorlar tashlanadi (KnowledgeRetriever konteksti moslik bo'yicha
+    tartiblangan). System prompt kesilmaydi - u tenant uchun o'zgarmas
+    prefiks (PromptPrefix).
+
+    Tokenlar OpenAI modellari uchun tiktoken (o'rnatilgan bo'lsa), qolgan
+    hollarda yozuv tizimi bo'yicha kalibrlangan belgi/token nisbati bilan
+    hisoblanadi.
+    """
+
+    # Model -> kontekst oynasi (token)
+    MODEL_CONTEXT_WINDOWS = {
+        'gemini-1.5-flash': 1048576,
+        'gemini-1.5-pro': 2097152,
+        'gemini-1.0-pro': 30720,
+        'gpt-4o': 128000,
+        'gpt-4o-mini': 128000,
+        'gpt-4-turbo': 128000,
+        'gpt-3.5-turbo': 16385
+    }
+    DEFAULT_CONTEXT_WINDOW = 8192
+
+    # Belgi/token nisbati: lotin (o'zbek, ingliz) va kirill matnlari uchun
+    LATIN_CHARS_PER_TOKEN = 3.5
+    CYRILLIC_CHARS_PER_TOKEN = 2.5
+    MESSAGE_OVERHEAD_TOKENS = 4  # har bir xabar (rol, ajratgichlar)
+    TRUNCATION_MARKER = "\n..."
+
+    _CYRILLIC_RE = re.compile(r"[Ѐ-ӿ]")
+
+    # user_id -> prompt o'lchamlari statistikasi (process ichida)
+    _stats: Dict[str, Dict[str, int]] = {}
+    _lock = threading.Lock()
+
+    # ===== TOKENLAR =====
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def _encoding(model: str):
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('o200k_base')
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def estimate_tokens(text: str, model: Optional[str] = None) -> int:
+        """
+        Matndagi token soni
+
+        Args:
+            model: OpenAI modeli bo'lsa va tiktoken o'rnatilgan bo'lsa aniq hisob
+        """
+        if not text:
+            return 0
+        if tiktoken is not None and model and model.startswith('gpt'):
+            return len(PromptBuilder._encoding(model).encode(text, disallowed_special=()))
+        cyrillic = len(PromptBuilder._CYRILLIC_RE.findall(text))
+        return max(1, math.ceil(cyrillic / PromptBuilder.CYRILLIC_CHARS_PER_TOKEN
+                                + (len(text) - cyrillic) / PromptBuilder.LATIN_CHARS_PER_TOKEN))
+
+    @staticmethod
+    def context_window(model: str) -> int:
+        return PromptBuilder.MODEL_CONTEXT_WINDOWS.get(model, PromptBuilder.DEFAULT_CONTEXT_WINDOW)
+
+    @staticmethod
+    def input_budget(model: str) -> int:
+        """Prompt uchun token byudjeti: kontekst oynasi (javobga joy qoldirib) va PROMPT_MAX_INPUT_TOKENS"""
+        config = current_app.config
+        window = PromptBuilder.context_window(model) - config.get('AI_MAX_OUTPUT_TOKENS', 1500)
+        return max(1, min(window, config.get('PROMPT_MAX_INPUT_TOKENS', 12000)))
+
+    @staticmethod
+    def truncate(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+        """
+        Matnni boshidan boshlab max_tokens ga sig'adigan qismini qoldirish
+
+        Butun qatorlar saqlanadi; sig'magan birinchi qator belgilar bo'yicha
+        qisqartiriladi va kesilganlik TRUNCATION_MARKER bilan belgilanadi.
+        """
+        if max_tokens <= 0 or not text:
+            return ""
+        if PromptBuilder.estimate_tokens(text, model) <= max_tokens:
+            return text
+
+        budget = max_tokens - PromptBuilder.estimate_tokens(PromptBuilder.TRUNCATION_MARKER, model)
+        kept, used = [], 0
+        for line in text.split("\n"):
+            line_tokens = PromptBuilder.estimate_tokens(line, model) + 1  # yangi qator belgisi
+            if used + line_tokens > budget:
+                remaining = budget - used
+                if remaining > 0 and line:
+                    # Belgilar nisbati bo'yicha qisqartirish, keyin aniq tekshirish
+                    cut = int(len(line) * remaining / line_tokens)
+                    while cut > 0 and PromptBuilder.estimate_tokens(line[:cut], model) > remaining:
+                        cut = int(cut * 0.9)
+                    if cut > 0:
+                        kept.append(line[:cut])
+                break
+            kept.append(line)
+            used += line_tokens
+
+        result = "\n".join(kept).rstrip()
+        return result + PromptBuilder.TRUNCATION_MARKER if result else ""
+
+    # ===== YIG'ISH =====
+
+    @staticmethod
+    def build(system: str, message: str, knowledge_base: str, model: str,
+              history: Optional[List[Dict[str, str]]] = None,
+              user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Promptni byudjetga moslab yig'ish
+
+        Args:
+            system: System prompt (yo'riqnoma, o'zgarmas bilimlar) - to'liq saqlanadi
+            knowledge_base: Savolga mos bilimlar - sig'magan qismi kesiladi
+            history: [{'role': 'user'|'assistant', 'content': str}] - eskisidan yangisiga
+            user_id: berilsa tenant statistikasiga yoziladi
+
+        Returns:
+            Dict: {'system', 'history', 'knowledge', 'message', 'input_tokens',
+                   'max_output_tokens', 'knowledge_truncated', 'history_dropped'}
+        """
+        estimate = PromptBuilder.estimate_tokens
+        overhead = PromptBuilder.MESSAGE_OVERHEAD_TOKENS
+        budget = PromptBuilder.input_budget(model)
+        history = history or []
+
+        # 1. System prompt va savol
+        system_tokens = estimate(system, model) + overhead
+        message_tokens = estimate(message, model) + overhead
+        message_truncated = system_tokens + message_tokens > budget
+        if message_truncated:
+            message = PromptBuilder.truncate(message, budget - system_tokens - overhead, model)
+            message_tokens = estimate(message, model) + overhead
+        used = system_tokens + message_tokens
+
+        # 2. Suhbat tarixi - yangisidan eskisiga, sig'magan joyda to'xtash
+        kept_history: List[Dict[str, str]] = []
+        for item in reversed(history):
+            item_tokens = estimate(item['content'], model) + overhead
+            if used + item_tokens > budget:
+                break
+            kept_history.append(item)
+            used += item_tokens
+        kept_history.reverse()
+
+        # 3. Savolga mos bilimlar - qolgan joyga
+        knowledge = ""
+        if knowledge_base and not message_truncated:
+            knowledge = PromptBuilder.truncate(knowledge_base, budget - used, model)
+        input_tokens = used + estimate(knowledge, model)
+
+        built = {
+            'system': system,
+            'history': kept_history,
+            'knowledge': knowledge,
+            'message': message,
+            'input_tokens': input_tokens,
+            'max_output_tokens': max(1, min(current_app.config.get('AI_MAX_OUTPUT_TOKENS', 1500),
+                                            PromptBuilder.context_window(model) - input_tokens)),
+            'knowledge_truncated': bool(knowledge_base) and knowledge != knowledge_base,
+            'history_dropped': len(history) - len(kept_history)
+        }
+        if user_id:
+            PromptBuilder._record(str(user_id), built, message_truncated)
+        return built
+
+    # ===== STATISTIKA =====
+
+    @staticmethod
+    def _record(user_id: str, built: Dict[str, Any], message_truncated: bool) -> None:
+        with PromptBuilder._lock:
+            entry = PromptBuilder._stats_entry(user_id)
+            entry['prompts'] += 1
+            entry['input_tokens'] += built['input_tokens']
+            entry['max_input_tokens'] = max(entry['max_input_tokens'], built['input_tokens'])
+            entry['knowledge_truncated'] += int(built['knowledge_truncated'])
+            entry['history_dropped'] += built['history_dropped']
+            entry['message_truncated'] += int(message_truncated)
+
+    @staticmethod
+    def _stats_entry(user_id: str) -> Dict[str, int]:
+        """_lock ostida chaqiriladi"""
+        return PromptBuilder._stats.setdefault(user_id, {
+            'prompts': 0, 'input_tokens': 0, 'max_input_tokens': 0,
+            'knowledge_truncated': 0, 'history_dropped': 0, 'message_truncated': 0,
+            'provider_prompt_tokens': 0, 'cached_prompt_tokens': 0
+        })
+
+    @staticmethod
+    def record_usage(user_id: Optional[str], prompt_tokens: int, cached_tokens: int) -> None:
+        """Provayder hisoblagan prompt tokenlari va ulardan keshdan olinganlari"""
+        if not user_id:
+            return
+        with PromptBuilder._lock:
+            entry = PromptBuilder._stats_entry(str(user_id))
+            entry['provider_prompt_tokens'] += prompt_tokens or 0
+            entry['cached_prompt_tokens'] += cached_tokens or 0
+
+    @staticmethod
+    def get_stats() -> Dict[str, Any]:
+        """Admin panel uchun: tenant -> prompt o'lchamlari (shu process)"""
+        with PromptBuilder._lock:
+            return {
+                user_id: dict(
+                    entry,
+                    avg_input_tokens=round(entry['input_tokens'] / entry['prompts'], 1) if entry['prompts'] else 0,
+                    cached_ratio=round(entry['cached_prompt_tokens'] / entry['provider_prompt_tokens'], 4)
+                    if entry['provider_prompt_tokens'] else 0
+                )
+                for user_id, entry in PromptBuilder._stats.items()
+            }
@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from flask import current_app
+from sqlalchemy import func
+from models.user import db
+from models.knowledge_base import KnowledgeBase
+from models.knowledge_chunk import KnowledgeChunk
+from utils.knowledge_index import KnowledgeIndex
+
+class PromptPrefix:
+    """Tenantning o'zgarmas prompt boshlanishi (provayder prefiks keshi uchun)
+
+    OpenAI bir xil boshlanadigan promptlarning (1024 tokendan uzun) prefiksini
+    avtomatik keshlaydi: keshlangan tokenlar arzonroq va tezroq ishlanadi.
+    Buning uchun bilimlar bazasi to'liq PROMPT_PREFIX_MAX_TOKENS ga sig'adigan
+    tenantlarda butun baza (fayl va bo'lak tartibida) system promptga
+    qo'yiladi - u tenantning barcha xabarlari uchun bir xil bo'ladi; savolga
+    qarab o'zgaradigan qismlar (tarix, savol) undan keyin keladi.
+
+    Prefiks (tenant, bilimlar bazasi versiyasi) bo'yicha process xotirasida
+    saqlanadi: fayl yuklansa/o'chirilsa versiya kaliti o'zgaradi va keyingi
+    so'rovda yangisi yig'iladi; eskisi LRU bo'yicha chiqib ketadi.
+    """
+
+    # (user_id, kb version_key) -> bilimlar matni ('' - prefiks ishlatilmaydi)
+    _prefixes: 'OrderedDict[Tuple[str, str], str]' = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def supports(provider: str) -> bool:
+        """Provayder prefiksni keshlaydimi (PROMPT_PREFIX_PROVIDERS)"""
+        config = current_app.config
+        return config.get('PROMPT_PREFIX_MAX_TOKENS', 0) > 0 and \
+            provider in config.get('PROMPT_PREFIX_PROVIDERS', ('openai',))
+
+    @staticmethod
+    def knowledge(user_id: Optional[str], provider: str) -> str:
+        """
+        Tenantning o'zgarmas bilimlar matni
+
+        Returns:
+            str: Butun bilimlar bazasi yoki prefiks ishlatilmasa '' (provayder
+                 keshlamaydi, baza juda katta yoki CSV jadvallari bor) -
+                 bunda savolga mos bo'laklar ishlatiladi
+        """
+        if not user_id or not PromptPrefix.supports(provider):
+            return ""
+        key = (str(user_id), KnowledgeIndex.get_version_key(user_id))
+        with PromptPrefix._lock:
+            if key in PromptPrefix._prefixes:
+                PromptPrefix._prefixes.move_to_end(key)
+                return PromptPrefix._prefixes[key]
+
+        try:
+            text = PromptPrefix._load(str(user_id))
+        except Exception as e:
+            current_app.logger.warning(f"Prompt prefix load error: {str(e)}")
+            db.session.rollback()
+            return ""
+
+        with PromptPrefix._lock:
+            PromptPrefix._prefixes[key] = text
+            PromptPrefix._prefixes.move_to_end(key)
+            while len(PromptPrefix._prefixes) > current_app.config.get('PROMPT_PREFIX_CACHE_SIZE', 256):
+                PromptPrefix._prefixes.popitem(last=False)
+        return text
+
+    @staticmethod
+    def _load(user_id: str) -> str:
+        """Faol fayllar bo'laklarini deterministik tartibda yig'ish"""
+        tables = KnowledgeIndex.get_tables(user_id)
+        if tables and tables['tables']:
+            return ""  # Mahsulot jadvali qatorlari savol bo'yicha tanlanadi
+
+        active = db.session.query(KnowledgeChunk.id).join(KnowledgeBase).filter(
+            KnowledgeChunk.user_id == user_id,
+            KnowledgeBase.is_active.is_(True)
+        )
+        total = active.with_entities(func.coalesce(func.sum(KnowledgeChunk.token_count), 0)).scalar()
+        if not total or total > current_app.config.get('PROMPT_PREFIX_MAX_TOKENS', 0):
+            return ""
+
+        rows = db.session.query(KnowledgeBase.file_name, KnowledgeChunk.content).join(KnowledgeChunk).filter(
+            KnowledgeChunk.user_id == user_id,
+            KnowledgeBase.is_active.is_(True)
+        ).order_by(KnowledgeBase.id, KnowledgeChunk.chunk_index).all()
+
+        sections: 'OrderedDict[str, list]' = OrderedDict()
+        for file_name, content in rows:
+            sections.setdefault(file_name, []).append(content)
+        return "".join(f"\n\n{file_name}:\n" + "\n".join(contents) for file_name, contents in sections.items())
+
+    @staticmethod
+    def forget(user_id: str) -> None:
+        """Tenant prefikslarini o'chirish (masalan, tenant o'chirilganda)"""
+        with PromptPrefix._lock:
+            for key in [key for key in PromptPrefix._prefixes if key[0] == str(user_id)]:
+                del PromptPrefix._prefixes[key]
+
+    @staticmethod
+    def get_stats() -> Dict[str, Any]:
+        with PromptPrefix._lock:
+            return {
+                'entries': len(PromptPrefix._prefixes),
+                'pinned_tenants': len({user_id for (user_id, _), text in PromptPrefix._prefixes.items() if text})
+            }
@@ -0,0 +1,319 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional
+import openai
+from google.api_core import exceptions as google_exceptions
+from flask import current_app
+from sqlalchemy import insert, select, update
+from models.user import db
+from models.provider_circuit import ProviderCircuit
+from utils.async_runtime import AsyncRuntime
+
+class ProviderUnavailable(Exception):
+    """Provayder vaqtincha ishlatilmaydi (circuit ochiq yoki parallel so'rovlar limiti to'lgan)"""
+
+class _ProviderState:
+    """Bitta provayderning process ichidagi holati (ProviderGuard._lock emas, cond ostida o'zgaradi)"""
+
+    def __init__(self, limit: float):
+        self.cond = threading.Condition()
+        self.state = 'closed'  # closed, open, half_open
+        self.failures = 0  # ketma-ket xatolar
+        self.opened_until = 0.0  # time.time()
+        self.changed_at = 0.0
+        self.probe_running = False
+        self.limit = float(limit)
+        self.inflight = 0
+        self.last_decrease = 0.0
+        self.last_sync = 0.0
+        self.counters = {'accepted': 0, 'shed_open': 0, 'shed_limit': 0, 'failures': 0, 'opened': 0}
+
+class ProviderGuard:
+    """AI provayderlari uchun circuit breaker va AIMD parallellik limiti
+
+    Provayder sekinlashganda har bir thread javobni kutib qolmasligi uchun:
+
+    - Circuit breaker: PROVIDER_BREAKER_FAILURES ta ketma-ket xato (timeout,
+      5xx, 429, ulanish xatosi) dan keyin circuit PROVIDER_BREAKER_COOLDOWN
+      soniyaga ochiladi - so'rovlar darhol ProviderUnavailable bilan rad
+      etiladi. Keyin bitta sinov so'rovi (half-open) o'tkaziladi: muvaffaqiyat
+      - yopiladi, xato - yana ochiladi. Holat provider_circuits jadvali orqali
+      boshqa gunicorn workerlariga ham tarqaladi.
+    - AIMD limit: process ichida bir vaqtdagi so'rovlar soni. Har bir
+      o'z vaqtida kelgan javob limitni sekin oshiradi (+1/limit), xato yoki
+      PROVIDER_LATENCY_TARGET dan sekin javob uni ikki barobar kamaytiradi.
+      Limit to'lganda so'rov PROVIDER_QUEUE_TIMEOUT kutadi, keyin rad etiladi.
+
+    Tenant kaliti noto'g'ri bo'lishi kabi mijoz xatolari provayder xatosi
+    hisoblanmaydi. OpenAI kalitlari tenantlarniki: har bir kalit uchun
+    alohida circuit va limit ('openai:<kalit xeshi>', circuit_name), shuning
+    uchun bitta tenant kalitining 429/kvota xatosi boshqalarga ta'sir
+    qilmaydi. Platformaning umumiy Gemini kaliti bitta 'gemini' circuitida.
+    Holatlar soni PROVIDER_GUARD_SIZE bilan cheklangan (band bo'lmagan eng
+    uzoq ishlatilmagani chiqariladi).
+    """
+
+    _states: 'OrderedDict[str, _ProviderState]' = OrderedDict()
+    _lock = threading.Lock()
+
+    DECREASE_INTERVAL = 1.0  # bir vaqtda kelgan xatolar limitni bir martadan ortiq kamaytirmasin
+
+    FAILURE_EXCEPTIONS = (
+        openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError,
+        google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded,
+        google_exceptions.ResourceExhausted, google_exceptions.InternalServerError,
+        google_exceptions.GatewayTimeout, google_exceptions.RetryError,
+        TimeoutError, ConnectionError
+    )
+
+    @staticmethod
+    def circuit_name(provider: str, api_key: Optional[str] = None) -> str:
+        """Circuit nomi: OpenAI uchun kalit bo'yicha, Gemini uchun umumiy"""
+        if provider == 'openai' and api_key:
+            return f"openai:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]}"
+        return provider
+
+    @staticmethod
+    def _state(provider: str) -> _ProviderState:
+        with ProviderGuard._lock:
+            state = ProviderGuard._states.get(provider)
+            if state is None:
+                state = ProviderGuard._states[provider] = _ProviderState(
+                    current_app.config.get('PROVIDER_CONCURRENCY_INITIAL', 8)
+                )
+                ProviderGuard._trim()
+            ProviderGuard._states.move_to_end(provider)
+        return state
+
+    @staticmethod
+    def _trim() -> None:
+        """_lock ostida: PROVIDER_GUARD_SIZE dan oshgan, band bo'lmagan holatlarni chiqarish"""
+        excess = len(ProviderGuard._states) - current_app.config.get('PROVIDER_GUARD_SIZE', 1000)
+        for name in list(ProviderGuard._states):
+            if excess <= 0:
+                break
+            state = ProviderGuard._states[name]
+            if state.inflight == 0 and state.state == 'closed':
+                del ProviderGuard._states[name]
+                excess -= 1
+
+    @staticmethod
+    def is_provider_failure(error: Exception) -> bool:
+        """Provayder tomonidagi xato (mijoz xatosi emas)"""
+        return isinstance(error, ProviderGuard.FAILURE_EXCEPTIONS)
+
+    # ===== CHAQIRUV =====
+
+    @staticmethod
+    @contextmanager
+    def call(provider: str):
+        """
+        Provayder chaqiruvini himoyalash
+
+        Args:
+            provider: circuit_name() natijasi
+
+        Raises:
+            ProviderUnavailable: circuit ochiq yoki limit to'lgan - so'rov yuborilmaydi
+        """
+        state = ProviderGuard._state(provider)
+        ProviderGuard._sync(provider, state)
+        probe = ProviderGuard._acquire(state)
+        started = time.monotonic()
+        ok = True
+        try:
+            yield
+        except Exception as e:
+            ok = not ProviderGuard.is_provider_failure(e)
+            raise
+        finally:
+            # Stream o'rtasida to'xtatilsa (GeneratorExit) ham joy bo'shatiladi
+            ProviderGuard._release(provider, state, time.monotonic() - started, ok, probe)
+
+    @staticmethod
+    @asynccontextmanager
+    async def acall(provider: str):
+        """
+        call() ning asinxron varianti (asgi.py)
+
+        Holatni sinxronlash (DB) va limit bo'shashini kutish AsyncRuntime
+        thread pulida - event loop to'xtamaydi.
+        """
+        state = ProviderGuard._state(provider)
+        await AsyncRuntime.run(ProviderGuard._sync, provider, state)
+        acquiring = asyncio.ensure_future(AsyncRuntime.run(ProviderGuard._acquire, state))
+        try:
+            probe = await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # Thread joyni baribir oladi - vazifa bekor qilingan bo'lsa ham bo'shatiladi
+            def release(done):
+                if not done.cancelled() and done.exception() is None:
+                    ProviderGuard._release(provider, state, 0.0, True, done.result())
+            acquiring.add_done_callback(release)
+            raise
+        started = time.monotonic()
+        ok = True
+        try:
+            yield
+        except Exception as e:
+            ok = not ProviderGuard.is_provider_failure(e)
+            raise
+        finally:
+            # Hedge da yutqazgan vazifa bekor qilinganda (CancelledError) ham joy bo'shatiladi
+            ProviderGuard._release(provider, state, time.monotonic() - started, ok, probe)
+
+    @staticmethod
+    def _acquire(state: _ProviderState) -> bool:
+        """Joy olish; half-open sinov so'rovi bo'lsa True"""
+        config = current_app.config
+        with state.cond:
+            probe = False
+            if state.state == 'open':
+                if time.time() < state.opened_until:
+                    state.counters['shed_open'] += 1
+                    raise ProviderUnavailable("Circuit open")
+                state.state = 'half_open'
+            if state.state == 'half_open':
+                if state.probe_running:
+                    state.counters['shed_open'] += 1
+                    raise ProviderUnavailable("Circuit half-open, probe in progress")
+                state.probe_running = probe = True
+
+            deadline = time.monotonic() + config.get('PROVIDER_QUEUE_TIMEOUT', 1.0)
+            while state.inflight >= max(1, int(state.limit)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if probe:
+                        state.probe_running = False
+                    state.counters['shed_limit'] += 1
+                    raise ProviderUnavailable("Concurrency limit reached")
+                state.cond.wait(remaining)
+
+            state.inflight += 1
+            state.counters['accepted'] += 1
+            return probe
+
+    @staticmethod
+    def _release(provider: str, state: _ProviderState, latency: float, ok: bool, probe: bool) -> None:
+        config = current_app.config
+        transition = None
+        with state.cond:
+            state.inflight -= 1
+            if probe:
+                state.probe_running = False
+
+            if ok:
+                state.failures = 0
+                if state.state == 'half_open' and probe:
+                    state.state, state.changed_at = 'closed', time.time()
+                    transition = 'closed'
+                if latency <= config.get('PROVIDER_LATENCY_TARGET', 15.0):
+                    state.limit = min(config.get('PROVIDER_CONCURRENCY_MAX', 32), state.limit + 1 / state.limit)
+                else:
+                    ProviderGuard._decrease(state)
+            else:
+                state.failures += 1
+                state.counters['failures'] += 1
+                ProviderGuard._decrease(state)
+                if state.state == 'half_open' or state.failures >= config.get('PROVIDER_BREAKER_FAILURES', 5):
+                    ProviderGuard._open(state, time.time() + config.get('PROVIDER_BREAKER_COOLDOWN', 30))
+                    transition = 'open'
+            state.cond.notify()
+
+        if transition:
+            current_app.logger.warning(f"AI provider {provider} circuit {transition}")
+            ProviderGuard._publish(provider, state)
+
+    @staticmethod
+    def _decrease(state: _ProviderState) -> None:
+        """Limitni ikki barobar kamaytirish (state.cond ostida)"""
+        now = time.monotonic()
+        if now - state.last_decrease >= ProviderGuard.DECREASE_INTERVAL:
+            state.last_decrease = now
+            state.limit = max(current_app.config.get('PROVIDER_CONCURRENCY_MIN', 1), state.limit / 2)
+
+    @staticmethod
+    def _open(state: _ProviderState, until: float) -> None:
+        state.state, state.opened_until, state.changed_at = 'open', until, time.time()
+        state.failures = 0
+        state.counters['opened'] += 1
+
+    # ===== WORKERLAR O'RTASIDA =====
+
+    @staticmethod
+    def _sync(provider: str, state: _ProviderState) -> None:
+        """Boshqa worker o'zgartirgan holatni olish (PROVIDER_BREAKER_SYNC_INTERVAL da bir marta)"""
+        now = time.monotonic()
+        if now - state.last_sync < current_app.config.get('PROVIDER_BREAKER_SYNC_INTERVAL', 2.0):
+            return
+        state.last_sync = now
+
+        table = ProviderCircuit.__table__
+        try:
+            with db.engine.connect() as conn:
+                row = conn.execute(select(table.c.state, table.c.opened_until, table.c.changed_at)
+                                   .where(table.c.provider == provider)).first()
+        except Exception as e:
+            current_app.logger.warning(f"Provider circuit sync error: {str(e)}")
+            return
+        if not row:
+            return
+
+        with state.cond:
+            if (row.changed_at or 0) <= state.changed_at:
+                return  # Bizning holatimiz yangiroq
+            if row.state == 'open' and (row.opened_until or 0) > time.time() and state.state == 'closed':
+                ProviderGuard._open(state, row.opened_until)
+                state.changed_at = row.changed_at
+            elif row.state == 'closed' and state.state != 'closed':
+                # Boshqa workerning sinov so'rovi muvaffaqiyatli bo'ldi
+                state.state, state.changed_at, state.failures = 'closed', row.changed_at, 0
+                state.cond.notify_all()
+
+    @staticmethod
+    def _publish(provider: str, state: _ProviderState) -> None:
+        """O'tishni jadvalga yozish - fonda, chaqiruvchining tranzaksiyasini kutmasdan"""
+        values = {
+            'state': 'open' if state.state == 'open' else 'closed',
+            'opened_until': state.opened_until,
+            'changed_at': state.changed_at
+        }
+        app = current_app._get_current_object()
+
+        def write():
+            table = ProviderCircuit.__table__
+            with app.app_context():
+                try:
+                    with db.engine.begin() as conn:
+                        updated = conn.execute(update(table).where(table.c.provider == provider)
+                                               .values(**values)).rowcount
+                        if not updated:
+                            conn.execute(insert(table).values(provider=provider, **values))
+                except Exception as e:
+                    app.logger.warning(f"Provider circuit publish error: {str(e)}")
+
+        threading.Thread(target=write, name=f"provider-circuit-{provider}", daemon=True).start()
+
+    # ===== STATISTIKA =====
+
+    @staticmethod
+    def get_stats() -> Dict[str, Any]:
+        """Admin panel uchun: provider -> holat, limit, band joylar, hisoblagichlar"""
+        result = {}
+        with ProviderGuard._lock:
+            states = list(ProviderGuard._states.items())
+        for provider, state in states:
+            with state.cond:
+                result[provider] = {
+                    'state': state.state,
+                    'open_for_seconds': round(max(0.0, state.opened_until - time.time()), 1)
+                    if state.state == 'open' else 0,
+                    'concurrency_limit': round(state.limit, 2),
+                    'inflight': state.inflight,
+                    **state.counters
+                }
+        return result
@@ -0,0 +1,296 @@
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Tuple
+from flask import current_app
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from models.user import db
+from models.response_cache import ResponseCacheEntry, ResponseCacheStats
+from utils import text_normalizer
+from utils.knowledge_index import KnowledgeIndex
+
+class ResponseCache:
+    """Takrorlanadigan savollar uchun AI javoblari keshi
+
+    Ikki qatlam:
+      1. Process ichidagi LRU (TTL bilan) - DB ga murojaatsiz javob
+      2. response_cache jadvali - gunicorn workerlari orasida umumiy
+
+    Kalit: (tenant, normallashtirilgan savol, til, provayder/model, KB versiyasi).
+    Bilimlar bazasi o'zgarganda KB versiyasi o'zgaradi, shuning uchun eski
+    javoblar avtomatik ishlatilmay qoladi; invalidate_tenant ularni tozalaydi.
+
+    DB amallari alohida tranzaksiyada bajariladi (_connection).
+    """
+
+    # Process ichidagi LRU: cache_key -> (user_id, expires_at (monotonic), javob)
+    _memory: 'OrderedDict[str, Tuple[str, float, str]]' = OrderedDict()
+    _lock = threading.Lock()
+
+    # DB ga hali yozilmagan hisoblagichlar: user_id -> [hits, misses]
+    _pending_stats: Dict[str, list] = {}
+    _last_stats_flush = time.monotonic()
+
+    # Taxminan har 50-yozuvda eskirgan qatorlar tozalanadi
+    PRUNE_PROBABILITY = 0.02
+    STATS_FLUSH_EVENTS = 50
+    STATS_FLUSH_INTERVAL = 30  # soniya
+
+    @staticmethod
+    @contextmanager
+    def _connection():
+        """
+        Kesh jadvallari uchun DB ulanishi
+
+        Alohida tranzaksiya ishlatiladi - chaqiruvchining db.session dagi
+        saqlanmagan o'zgarishlari commit qilinmaydi. SQLite (development) da
+        bir vaqtda faqat bitta yozuvchi bo'lgani uchun joriy sessiya ulanishi
+        ishlatiladi, aks holda sessiya qulfi tufayli kutib qolinadi.
+        """
+        if db.engine.dialect.name == 'sqlite':
+            yield db.session.connection()
+        else:
+            with db.engine.begin() as conn:
+                yield conn
+
+    # ===== KALIT =====
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return bool(current_app.config.get('RESPONSE_CACHE_ENABLED', True))
+
+    @staticmethod
+    def make_key(user_id: str, message: str, language: str, provider: str,
+                 model: Optional[str], kb_version: str) -> Tuple[str, str]:
+        """
+        Kesh kalitini yaratish
+
+        Returns:
+            Tuple: (sha256 kalit, normallashtirilgan savol)
+        """
+        normalized = text_normalizer.canonical(message)
+        raw = "\x1f".join((str(user_id), normalized, language or '', provider or '', model or '', kb_version))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest(), normalized
+
+    # ===== O'QISH / YOZISH =====
+
+    @staticmethod
+    def get(user_id: str, message: str, language: str, provider: str,
+            model: Optional[str]) -> Optional[str]:
+        """
+        Keshdan javob olish
+
+        Returns:
+            Optional[str]: Keshlangan javob yoki None
+        """
+        if not ResponseCache.is_enabled():
+            return None
+
+        cache_key, normalized = ResponseCache.make_key(
+            user_id, message, language, provider, model, KnowledgeIndex.get_version_key(user_id)
+        )
+        if not normalized:
+            return None
+
+        now = time.monotonic()
+        response = None
+        with ResponseCache._lock:
+            entry = ResponseCache._memory.get(cache_key)
+            if entry is not None:
+                if entry[1] > now:
+                    ResponseCache._memory.move_to_end(cache_key)
+                    response = entry[2]
+                else:
+                    del ResponseCache._memory[cache_key]
+        if response is not None:
+            ResponseCache._record(user_id, hit=True)
+            return response
+
+        try:
+            table = ResponseCacheEntry.__table__
+            utc_now = datetime.utcnow()
+            with ResponseCache._connection() as conn:
+                row = conn.execute(
+                    select(table.c.response, table.c.expires_at).where(table.c.cache_key == cache_key)
+                ).first()
+                if row and row.expires_at > utc_now:
+                    response = row.response
+                    conn.execute(
+                        update(table).where(table.c.cache_key == cache_key)
+                        .values(hit_count=table.c.hit_count + 1, last_hit_at=utc_now)
+                    )
+                    ResponseCache._remember(cache_key, user_id, response,
+                                            (row.expires_at - utc_now).total_seconds())
+        except Exception as e:
+            current_app.logger.warning(f"Response cache read error: {str(e)}")
+
+        ResponseCache._record(user_id, hit=response is not None)
+        return response
+
+    @staticmethod
+    def set(user_id: str, message: str, language: str, provider: str,
+            model: Optional[str], response: str) -> None:
+        """Muvaffaqiyatli AI javobini keshga yozish"""
+        if not ResponseCache.is_enabled() or not response:
+            return
+
+        kb_version = KnowledgeIndex.get_version_key(user_id)
+        cache_key, normalized = ResponseCache.make_key(user_id, message, language, provider, model, kb_version)
+        if not normalized:
+            return
+
+        ttl = current_app.config.get('RESPONSE_CACHE_TTL', 86400)
+        ResponseCache._remember(cache_key, user_id, response, ttl)
+
+        table = ResponseCacheEntry.__table__
+        utc_now = datetime.utcnow()
+        values = {
+            'kb_version': kb_version,
+            'language': language or '',
+            'provider': provider or '',
+            'model': model,
+            'message': normalized,
+            'response': response,
+            'created_at': utc_now,
+            'last_hit_at': utc_now,
+            'expires_at': utc_now + timedelta(seconds=ttl)
+        }
+        try:
+            try:
+                with ResponseCache._connection() as conn:
+                    updated = conn.execute(
+                        update(table).where(table.c.cache_key == cache_key).values(**values)
+                    ).rowcount
+                    if not updated:
+                        conn.execute(insert(table).values(cache_key=cache_key, user_id=user_id, hit_count=0, **values))
+            except IntegrityError:
+                # Boshqa worker xuddi shu savolga javob yozib ulgurgan
+                with ResponseCache._connection() as conn:
+                    conn.execute(update(table).where(table.c.cache_key == cache_key).values(**values))
+
+            if random.random() < ResponseCache.PRUNE_PROBABILITY:
+                ResponseCache.prune(user_id)
+        except Exception as e:
+            current_app.logger.warning(f"Response cache write error: {str(e)}")
+
+    @staticmethod
+    def _remember(cache_key: str, user_id: str, response: str, ttl: float) -> None:
+        """Process ichidagi LRU ga qo'shish"""
+        max_entries = current_app.config.get('RESPONSE_CACHE_MEMORY_SIZE', 2048)
+        with ResponseCache._lock:
+            ResponseCache._memory[cache_key] = (str(user_id), time.monotonic() + ttl, response)
+            ResponseCache._memory.move_to_end(cache_key)
+            while len(ResponseCache._memory) > max_entries:
+                ResponseCache._memory.popitem(last=False)
+
+    # ===== TOZALASH =====
+
+    @staticmethod
+    def prune(user_id: Optional[str] = None) -> int:
+        """
+        Muddati o'tgan yozuvlarni va tenant limitidan ortiq eng eski yozuvlarni o'chirish
+
+        Returns:
+            int: O'chirilgan yozuvlar soni
+        """
+        table = ResponseCacheEntry.__table__
+        max_rows = current_app.config.get('RESPONSE_CACHE_MAX_PER_TENANT', 5000)
+        removed = 0
+        with ResponseCache._connection() as conn:
+            removed += conn.execute(delete(table).where(table.c.expires_at <= datetime.utcnow())).rowcount or 0
+            if user_id:
+                count = conn.execute(
+                    select(func.count()).select_from(table).where(table.c.user_id == user_id)
+                ).scalar() or 0
+                if count > max_rows:
+                    # LRU: eng uzoq ishlatilmagan yozuvlar
+                    stale_ids = select(table.c.id).where(table.c.user_id == user_id) \
+                        .order_by(table.c.last_hit_at.asc()).limit(count - max_rows)
+                    removed += conn.execute(
+                        delete(table).where(table.c.id.in_(stale_ids.scalar_subquery()))
+                    ).rowcount or 0
+        return removed
+
+    @staticmethod
+    def invalidate_tenant(user_id: str) -> None:
+        """Bilimlar bazasi o'zgarganda tenant javoblarini o'chirish"""
+        with ResponseCache._lock:
+            stale = [key for key, entry in ResponseCache._memory.items() if entry[0] == str(user_id)]
+            for key in stale:
+                del ResponseCache._memory[key]
+        try:
+            table = ResponseCacheEntry.__table__
+            with ResponseCache._connection() as conn:
+                conn.execute(delete(table).where(table.c.user_id == str(user_id)))
+        except Exception as e:
+            current_app.logger.warning(f"Response cache invalidate error: {str(e)}")
+
+    # ===== STATISTIKA =====
+
+    @staticmethod
+    def _record(user_id: str, hit: bool) -> None:
+        """Hit/miss hisoblagichini oshirish (DB ga vaqti-vaqti bilan yoziladi)"""
+        with ResponseCache._lock:
+            counters = ResponseCache._pending_stats.setdefault(str(user_id), [0, 0])
+            counters[0 if hit else 1] += 1
+            events = sum(hits + misses for hits, misses in ResponseCache._pending_stats.values())
+            due = events >= ResponseCache.STATS_FLUSH_EVENTS or \
+                time.monotonic() - ResponseCache._last_stats_flush >= ResponseCache.STATS_FLUSH_INTERVAL
+        if due:
+            ResponseCache.flush_stats()
+
+    @staticmethod
+    def flush_stats() -> None:
+        """Process ichidagi hisoblagichlarni response_cache_stats jadvaliga qo'shish"""
+        with ResponseCache._lock:
+            pending = ResponseCache._pending_stats
+            ResponseCache._pending_stats = {}
+            ResponseCache._last_stats_flush = time.monotonic()
+        if not pending:
+            return
+
+        table = ResponseCacheStats.__table__
+        utc_now = datetime.utcnow()
+        try:
+            with ResponseCache._connection() as conn:
+                for user_id, (hits, misses) in pending.items():
+                    updated = conn.execute(
+                        update(table).where(table.c.user_id == user_id).values(
+                            hits=table.c.hits + hits, misses=table.c.misses + misses, updated_at=utc_now
+                        )
+                    ).rowcount
+                    if not updated:
+                        conn.execute(insert(table).values(
+                            user_id=user_id, hits=hits, misses=misses, updated_at=utc_now
+                        ))
+        except Exception as e:
+            # Hisoblagichlar yo'qolmasligi uchun qaytarib qo'yish
+            current_app.logger.warning(f"Response cache stats flush error: {str(e)}")
+            with ResponseCache._lock:
+                for user_id, (hits, misses) in pending.items():
+                    counters = ResponseCache._pending_stats.setdefault(user_id, [0, 0])
+                    counters[0] += hits
+                    counters[1] += misses
+
+    @staticmethod
+    def get_stats(user_id: str) -> Dict[str, Any]:
+        """
+        Tenant kesh statistikasi
+
+        Returns:
+            Dict: {'hits', 'misses', 'hit_rate', 'entries', 'memory_entries'}
+        """
+        ResponseCache.flush_stats()
+        stats = ResponseCacheStats.query.get(str(user_id))
+        result = stats.to_dict() if stats else {'hits': 0, 'misses': 0, 'hit_rate': 0.0, 'updated_at': None}
+        result['entries'] = ResponseCacheEntry.query.filter_by(user_id=str(user_id)).count()
+        with ResponseCache._lock:
+            result['memory_entries'] = sum(
+                1 for entry in ResponseCache._memory.values() if entry[0] == str(user_id)
+            )
+        return result
@@ -0,0 +1,240 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from flask import current_app
+from sqlalchemy import insert, select, update
+from models.user import db, User
+from models.messaging import InstagramAccount, TelegramBot, WhatsAppAccount
+from models.routing_version import RoutingVersion
+
+class RouteTenant:
+    """Marshrutdagi tenant (get_ai_response ga User o'rniga beriladi - faqat id ishlatiladi)"""
+
+    def __init__(self, user: User):
+        self.id = user.id
+        self.is_active = bool(user.is_active)
+
+class Route:
+    """Platforma akkaunti marshruti: akkaunt, tenant va ochilgan kalitlar
+
+    DB obyekti emas - threadlar o'rtasida xavfsiz ulashiladi va o'zgarmaydi;
+    akkaunt o'zgarsa yangisi yuklanadi.
+    """
+
+    def __init__(self, platform: str, account_id: int, user_id: str, is_active: bool,
+                 tenant: Optional[RouteTenant], settings: Dict[str, Any],
+                 credentials: Optional[Dict[str, str]]):
+        self.platform = platform
+        self.account_id = account_id
+        self.user_id = user_id
+        self.is_active = is_active
+        self.tenant = tenant  # None - tenant o'chirilgan
+        self.settings = settings  # stream_replies (telegram), phone_number_id (whatsapp), page_id (instagram)
+        self.credentials = credentials  # None - kalitlar ochilmadi
+        self.loaded_at = time.monotonic()
+
+class RoutingTable:
+    """Kiruvchi webhooklar uchun marshrut jadvali (process xotirasida)
+
+    Webhook va navbat workeri har bir xabar uchun akkauntni, tenantni
+    (User) qidirib kalitlarni ochmasligi uchun: tashqi id (Telegram - webhook
+    URL dagi tenant id, WhatsApp - phone_number_id, Instagram - page_id) va
+    akkaunt id bo'yicha Route saqlanadi, topilmagan tashqi id ham eslab
+    qolinadi.
+
+    Invalidatsiya versiyalangan: akkaunt saqlansa, yoqilsa/o'chirilsa yoki
+    o'chirilsa invalidate() shu processda platforma yozuvlarini darhol
+    tashlaydi va routing_versions dagi versiyani oshiradi; boshqa workerlar
+    versiyani ROUTING_TABLE_SYNC_INTERVAL da bir marta tekshiradi. Yuklash
+    davomida invalidatsiya bo'lsa (avlod o'zgarsa) eskirgan natija
+    saqlanmaydi. Boshqa yo'l bilan o'zgargan yozuvlar ROUTING_TABLE_TTL dan
+    keyin qayta o'qiladi.
+    """
+
+    # platforma -> (model, webhook dagi tashqi id maydoni)
+    PLATFORMS = {
+        'telegram': (TelegramBot, 'user_id'),
+        'whatsapp': (WhatsAppAccount, 'phone_number_id'),
+        'instagram': (InstagramAccount, 'page_id')
+    }
+
+    _accounts: 'OrderedDict[Tuple[str, int], Route]' = OrderedDict()
+    # (platforma, tashqi id) -> (akkaunt id yoki None - faol akkaunt yo'q, yuklangan vaqt)
+    _external: 'OrderedDict[Tuple[str, str], Tuple[Optional[int], float]]' = OrderedDict()
+    _generations: Dict[str, int] = {}  # platforma -> invalidatsiyalar soni (shu process)
+    _versions: Dict[str, int] = {}  # platforma -> routing_versions dan oxirgi ko'rilgan versiya
+    _last_sync: Dict[str, float] = {}
+    _lock = threading.Lock()
+    _stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    # ===== QIDIRISH =====
+
+    @staticmethod
+    def resolve(platform: str, external_id: Any) -> Optional[Route]:
+        """
+        Webhook dagi tashqi id bo'yicha faol akkaunt marshruti
+
+        Returns:
+            Optional[Route]: None - bu id uchun faol akkaunt yo'q
+        """
+        RoutingTable._sync(platform)
+        key = (platform, str(external_id))
+        with RoutingTable._lock:
+            generation = RoutingTable._generations.get(platform, 0)
+            entry = RoutingTable._external.get(key)
+            if entry is not None and RoutingTable._is_fresh(entry[1]):
+                route = RoutingTable._accounts.get((platform, entry[0])) if entry[0] is not None else None
+                if entry[0] is None or (route is not None and RoutingTable._is_fresh(route.loaded_at)):
+                    RoutingTable._stats['hits'] += 1
+                    return route
+            RoutingTable._stats['misses'] += 1
+
+        model, field = RoutingTable.PLATFORMS[platform]
+        account = model.query.filter(
+            getattr(model, field) == str(external_id),
+            model.is_active.is_(True)
+        ).order_by(model.id).first()
+        route = RoutingTable._build(platform, account) if account else None
+
+        with RoutingTable._lock:
+            if RoutingTable._generations.get(platform, 0) == generation:
+                RoutingTable._external[key] = (route.account_id if route else None, time.monotonic())
+                RoutingTable._external.move_to_end(key)
+                if route:
+                    RoutingTable._remember(route)
+                RoutingTable._trim()
+        return route
+
+    @staticmethod
+    def account(platform: str, account_id: int) -> Optional[Route]:
+        """Akkaunt id bo'yicha marshrut (navbat workeri uchun; faol bo'lmasa ham)"""
+        RoutingTable._sync(platform)
+        key = (platform, int(account_id))
+        with RoutingTable._lock:
+            generation = RoutingTable._generations.get(platform, 0)
+            route = RoutingTable._accounts.get(key)
+            if route is not None and RoutingTable._is_fresh(route.loaded_at):
+                RoutingTable._accounts.move_to_end(key)
+                RoutingTable._stats['hits'] += 1
+                return route
+            RoutingTable._stats['misses'] += 1
+
+        model, _ = RoutingTable.PLATFORMS[platform]
+        account = db.session.get(model, int(account_id))
+        route = RoutingTable._build(platform, account) if account else None
+
+        if route:
+            with RoutingTable._lock:
+                if RoutingTable._generations.get(platform, 0) == generation:
+                    RoutingTable._remember(route)
+                    RoutingTable._trim()
+        return route
+
+    @staticmethod
+    def _build(platform: str, account) -> Route:
+        user = db.session.get(User, account.user_id)
+        if platform == 'telegram':
+            settings = {'stream_replies': bool(account.stream_replies)}
+        elif platform == 'whatsapp':
+            settings = {'phone_number_id': account.phone_number_id}
+        else:
+            settings = {'page_id': account.page_id}
+
+        try:
+            if platform == 'telegram':
+                credentials = {'token': account.get_token()}
+            elif platform == 'whatsapp':
+                credentials = account.get_credentials()
+            else:
+                credentials = {'access_token': account.get_access_token()}
+        except Exception as e:
+            current_app.logger.warning(f"Routing table: {platform} account {account.id} credentials error: {type(e).__name__}")
+            credentials = None
+
+        return Route(platform, account.id, account.user_id, bool(account.is_active),
+                     RouteTenant(user) if user else None, settings, credentials)
+
+    @staticmethod
+    def _is_fresh(loaded_at: float) -> bool:
+        return time.monotonic() - loaded_at < current_app.config.get('ROUTING_TABLE_TTL', 300)
+
+    @staticmethod
+    def _remember(route: Route) -> None:
+        """_lock ostida chaqiriladi"""
+        key = (route.platform, route.account_id)
+        RoutingTable._accounts[key] = route
+        RoutingTable._accounts.move_to_end(key)
+
+    @staticmethod
+    def _trim() -> None:
+        """_lock ostida: ROUTING_TABLE_SIZE dan oshganini LRU bo'yicha chiqarish"""
+        max_size = current_app.config.get('ROUTING_TABLE_SIZE', 10000)
+        while len(RoutingTable._accounts) > max_size:
+            RoutingTable._accounts.popitem(last=False)
+        while len(RoutingTable._external) > max_size:
+            RoutingTable._external.popitem(last=False)
+
+    # ===== INVALIDATSIYA =====
+
+    @staticmethod
+    def invalidate(platform: str) -> None:
+        """Akkaunt o'zgargandan keyin (commit dan so'ng): shu process va boshqa workerlar uchun"""
+        RoutingTable._drop(platform)
+        table = RoutingVersion.__table__
+        try:
+            with db.engine.begin() as conn:
+                updated = conn.execute(update(table).where(table.c.platform == platform)
+                                       .values(version=table.c.version + 1, changed_at=time.time())).rowcount
+                if not updated:
+                    conn.execute(insert(table).values(platform=platform, version=1, changed_at=time.time()))
+                version = conn.execute(select(table.c.version).where(table.c.platform == platform)).scalar()
+            with RoutingTable._lock:
+                RoutingTable._versions[platform] = version
+        except Exception as e:
+            # Boshqa workerlar ROUTING_TABLE_TTL dan keyin yangilaydi
+            current_app.logger.warning(f"Routing version publish error: {str(e)}")
+
+    @staticmethod
+    def _drop(platform: str) -> None:
+        with RoutingTable._lock:
+            RoutingTable._generations[platform] = RoutingTable._generations.get(platform, 0) + 1
+            RoutingTable._stats['invalidations'] += 1
+            for key in [key for key in RoutingTable._accounts if key[0] == platform]:
+                del RoutingTable._accounts[key]
+            for key in [key for key in RoutingTable._external if key[0] == platform]:
+                del RoutingTable._external[key]
+
+    @staticmethod
+    def _sync(platform: str) -> None:
+        """Boshqa worker oshirgan versiyani tekshirish (ROUTING_TABLE_SYNC_INTERVAL da bir marta)"""
+        now = time.monotonic()
+        if now - RoutingTable._last_sync.get(platform, 0.0) < current_app.config.get('ROUTING_TABLE_SYNC_INTERVAL', 1.0):
+            return
+        RoutingTable._last_sync[platform] = now
+
+        table = RoutingVersion.__table__
+        try:
+            with db.engine.connect() as conn:
+                version = conn.execute(select(table.c.version).where(table.c.platform == platform)).scalar() or 0
+        except Exception as e:
+            current_app.logger.warning(f"Routing version sync error: {str(e)}")
+            return
+
+        with RoutingTable._lock:
+            known = RoutingTable._versions.get(platform)
+            RoutingTable._versions[platform] = version
+        if known is not None and known != version:
+            RoutingTable._drop(platform)
+
+    # ===== STATISTIKA =====
+
+    @staticmethod
+    def get_stats() -> Dict[str, Any]:
+        with RoutingTable._lock:
+            return dict(
+                RoutingTable._stats,
+                accounts=len(RoutingTable._accounts),
+                external_ids=len(RoutingTable._external),
+                versions=dict(RoutingTable._versions)
+            )
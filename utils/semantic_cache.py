@@ -0,0 +1,294 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+from flask import current_app
+from sqlalchemy import select
+from models.user import db
+from models.ai_config import AIConfig
+from models.response_cache import ResponseCacheEntry
+from utils import text_normalizer
+from utils.knowledge_index import KnowledgeIndex
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy o'rnatilmagan bo'lsa qatlam o'chiq
+    np = None
+
+class SemanticCache:
+    """O'xshash (qayta ifodalangan) savollar uchun javob keshi
+
+    Har bir savol uchun lokal vektor hisoblanadi: belgilar n-gramlari va
+    so'z o'zaklari xeshlanib, belgilangan o'lchamdagi vektorga yig'iladi
+    (GPU va tarmoq kerak emas). Tenant vektorlari float16 massivda saqlanadi,
+    eng o'xshash savol bitta matritsa ko'paytmasi bilan topiladi.
+
+    Ma'lumotlar manbai - ResponseCache ning response_cache jadvali: boshqa
+    workerlar yozgan javoblar vaqti-vaqti bilan qo'shib olinadi.
+    """
+
+    NGRAM_SIZES = (3,)
+    # So'z o'zaklari og'irligi - qo'shimchalar farqi (manzil/manzilingiz) kamroq ta'sir qiladi
+    TERM_WEIGHT = 4.0
+    # Katta massivlar float32 ga bloklab o'tkaziladi (vaqtinchalik xotira cheklanadi)
+    SEARCH_BLOCK = 1024
+    # Eng yaxshi nomzodlardan nechtasi raqamlar mosligi uchun tekshiriladi
+    CANDIDATES = 5
+
+    # Tenantlar LRU: user_id -> {guruh kaliti: guruh}
+    _tenants: 'OrderedDict[str, Dict[Tuple, Dict[str, Any]]]' = OrderedDict()
+    # Tenant bo'yicha AIConfig chegarasi: user_id -> (o'qilgan vaqt, chegara)
+    _thresholds: Dict[str, Tuple[float, Optional[float]]] = {}
+    _lock = threading.Lock()
+
+    THRESHOLD_TTL = 60  # soniya
+
+    @staticmethod
+    def is_available() -> bool:
+        return np is not None and bool(current_app.config.get('SEMANTIC_CACHE_ENABLED', True))
+
+    # ===== VEKTOR =====
+
+    @staticmethod
+    def vectorize(text: str) -> Optional['np.ndarray']:
+        """
+        Savol uchun normallashtirilgan (L2) xeshlangan n-gram vektori
+
+        Returns:
+            Optional[np.ndarray]: float32 vektor yoki bo'sh savol uchun None
+        """
+        canonical = text_normalizer.canonical(text)
+        if not canonical:
+            return None
+
+        padded = f" {canonical} "
+        features = [padded[i:i + size] for size in SemanticCache.NGRAM_SIZES
+                    for i in range(len(padded) - size + 1)]
+        ngram_count = len(features)
+        features += [f"w:{term}" for term in text_normalizer.tokenize(canonical)]
+
+        # crc32 - Python hash() dan farqli, processlar orasida barqaror
+        hashes = np.fromiter((zlib.crc32(feature.encode('utf-8')) for feature in features),
+                             dtype=np.uint32, count=len(features))
+        weights = np.ones(len(features), dtype=np.float32)
+        weights[ngram_count:] = SemanticCache.TERM_WEIGHT
+        # Yuqori bit belgi sifatida - to'qnashuvlar bir-birini qisman yo'qotadi
+        weights[(hashes >> 31).astype(bool)] *= -1
+        dim = current_app.config.get('SEMANTIC_CACHE_DIM', 512)
+        vector = np.bincount(hashes % dim, weights=weights, minlength=dim).astype(np.float32)
+        norm = float(np.linalg.norm(vector))
+        if not norm:
+            return None
+        return vector / norm
+
+    @staticmethod
+    def numbers(text: str) -> frozenset:
+        """Savoldagi raqamli so'zlar (4x6, 250, 2024) - ular farq qilsa savollar har xil"""
+        return frozenset(token for token in text_normalizer.canonical(text).split()
+                         if any(char.isdigit() for char in token))
+
+    @staticmethod
+    def similarity(first: str, second: str) -> float:
+        """Ikki savol orasidagi kosinus o'xshashlik (chegarani sozlash uchun)"""
+        a, b = SemanticCache.vectorize(first), SemanticCache.vectorize(second)
+        if a is None or b is None:
+            return 0.0
+        return float(a @ b)
+
+    # ===== CHEGARA =====
+
+    @staticmethod
+    def get_threshold(user_id: str) -> Optional[float]:
+        """
+        Tenant uchun o'xshashlik chegarasi
+
+        AIConfig.semantic_cache_threshold, bo'lmasa SEMANTIC_CACHE_THRESHOLD.
+
+        Returns:
+            Optional[float]: Chegara yoki qatlam o'chiq bo'lsa None
+        """
+        now = time.monotonic()
+        cached = SemanticCache._thresholds.get(str(user_id))
+        if cached and now - cached[0] < SemanticCache.THRESHOLD_TTL:
+            return cached[1]
+
+        threshold = current_app.config.get('SEMANTIC_CACHE_THRESHOLD', 0.85)
+        config = AIConfig.query.filter_by(user_id=user_id).order_by(AIConfig.updated_at.desc()).first()
+        if config and config.semantic_cache_threshold is not None:
+            threshold = config.semantic_cache_threshold
+        if threshold is None or threshold <= 0 or threshold >= 1:
+            threshold = None
+
+        SemanticCache._thresholds[str(user_id)] = (now, threshold)
+        return threshold
+
+    @staticmethod
+    def forget_threshold(user_id: str) -> None:
+        """AIConfig o'zgarganda keshlangan chegarani o'chirish"""
+        SemanticCache._thresholds.pop(str(user_id), None)
+
+    # ===== GURUHLAR =====
+
+    @staticmethod
+    def _new_group(dim: int) -> Dict[str, Any]:
+        return {
+            'vectors': np.zeros((16, dim), dtype=np.float16),
+            'count': 0,
+            'messages': {},    # normallashtirilgan savol -> qator
+            'responses': [],
+            'numbers': [],     # har bir savoldagi raqamlar
+            'loaded_at': 0.0,
+            'since': None      # DB dan oxirgi o'qilgan created_at
+        }
+
+    @staticmethod
+    def _append(group: Dict[str, Any], message: str, vector: 'np.ndarray', response: str) -> None:
+        """Guruhga savol qo'shish yoki mavjud savol javobini yangilash"""
+        position = group['messages'].get(message)
+        if position is not None:
+            group['responses'][position] = response
+            return
+
+        max_entries = current_app.config.get('SEMANTIC_CACHE_MAX_PER_TENANT', 5000)
+        if group['count'] >= max_entries:
+            return
+
+        vectors = group['vectors']
+        if group['count'] == len(vectors):
+            # Sig'imni ikki barobar oshirish (o'quvchilar eski massivni ishlatishi mumkin)
+            grown = np.zeros((min(len(vectors) * 2, max_entries), vectors.shape[1]), dtype=np.float16)
+            grown[:len(vectors)] = vectors
+            vectors = group['vectors'] = grown
+        vectors[group['count']] = vector
+        group['messages'][message] = group['count']
+        group['responses'].append(response)
+        group['numbers'].append(SemanticCache.numbers(message))
+        group['count'] += 1
+
+    @staticmethod
+    def _group(user_id: str, language: str, provider: str, model: Optional[str]) -> Dict[str, Any]:
+        """Tenant guruhini olish; yangi javoblar DB dan vaqti-vaqti bilan qo'shiladi"""
+        kb_version = KnowledgeIndex.get_version_key(user_id)
+        group_key = (language or '', provider or '', model or '', kb_version)
+        dim = current_app.config.get('SEMANTIC_CACHE_DIM', 512)
+
+        with SemanticCache._lock:
+            groups = SemanticCache._tenants.get(str(user_id))
+            if groups is None:
+                groups = SemanticCache._tenants[str(user_id)] = {}
+            SemanticCache._tenants.move_to_end(str(user_id))
+            # Bilimlar bazasi o'zgargan - eski versiya guruhlari kerak emas
+            for stale in [key for key in groups if key[3] != kb_version]:
+                del groups[stale]
+            group = groups.get(group_key)
+            if group is None:
+                group = groups[group_key] = SemanticCache._new_group(dim)
+            max_tenants = current_app.config.get('SEMANTIC_CACHE_MAX_TENANTS', 100)
+            while len(SemanticCache._tenants) > max_tenants:
+                SemanticCache._tenants.popitem(last=False)
+
+        refresh = current_app.config.get('SEMANTIC_CACHE_REFRESH', 60)
+        if time.monotonic() - group['loaded_at'] >= refresh:
+            SemanticCache._load_new_rows(user_id, group_key, group)
+        return group
+
+    @staticmethod
+    def _load_new_rows(user_id: str, group_key: Tuple, group: Dict[str, Any]) -> None:
+        """Boshqa workerlar keshga yozgan javoblarni guruhga qo'shish"""
+        language, provider, model, kb_version = group_key
+        table = ResponseCacheEntry.__table__
+        query = select(table.c.message, table.c.response, table.c.created_at).where(
+            table.c.user_id == str(user_id),
+            table.c.kb_version == kb_version,
+            table.c.language == language,
+            table.c.provider == provider,
+            table.c.model == (model or None),
+            table.c.expires_at > datetime.utcnow()
+        )
+        if group['since'] is not None:
+            query = query.where(table.c.created_at > group['since'])
+        max_entries = current_app.config.get('SEMANTIC_CACHE_MAX_PER_TENANT', 5000)
+        query = query.order_by(table.c.created_at.asc()).limit(max_entries)
+
+        try:
+            rows = db.session.execute(query).all()
+        except Exception as e:
+            current_app.logger.warning(f"Semantic cache load error: {str(e)}")
+            return
+
+        vectors = [(row, SemanticCache.vectorize(row.message)) for row in rows]
+        with SemanticCache._lock:
+            for row, vector in vectors:
+                if vector is not None:
+                    SemanticCache._append(group, row.message, vector, row.response)
+                if group['since'] is None or row.created_at > group['since']:
+                    group['since'] = row.created_at
+            group['loaded_at'] = time.monotonic()
+
+    # ===== QIDIRUV / YOZISH =====
+
+    @staticmethod
+    def lookup(user_id: str, message: str, language: str, provider: str,
+               model: Optional[str]) -> Optional[Tuple[str, float]]:
+        """
+        Eng o'xshash oldingi savol javobini topish
+
+        Returns:
+            Optional[Tuple]: (javob, o'xshashlik) yoki chegaradan past bo'lsa None
+        """
+        if not SemanticCache.is_available():
+            return None
+        threshold = SemanticCache.get_threshold(user_id)
+        if threshold is None:
+            return None
+        vector = SemanticCache.vectorize(message)
+        if vector is None:
+            return None
+
+        group = SemanticCache._group(user_id, language, provider, model)
+        with SemanticCache._lock:
+            count = group['count']
+            vectors = group['vectors']
+            responses = group['responses']
+            numbers = group['numbers']
+        if not count:
+            return None
+
+        # numpy da float16 matritsa ko'paytmasi sekin - bloklab float32 da hisoblanadi
+        block = SemanticCache.SEARCH_BLOCK
+        scores = np.concatenate([
+            vectors[start:min(start + block, count)].astype(np.float32) @ vector
+            for start in range(0, count, block)
+        ])
+        wanted_numbers = SemanticCache.numbers(message)
+        top = min(SemanticCache.CANDIDATES, count)
+        candidates = np.argpartition(-scores, top - 1)[:top]
+        for position in sorted(candidates, key=lambda item: -scores[item]):
+            score = float(scores[position])
+            if score < threshold:
+                break
+            # "4x6 paket narxi" va "6x8 paket narxi" - o'xshash, lekin boshqa savol
+            if numbers[position] == wanted_numbers:
+                return responses[position], score
+        return None
+
+    @staticmethod
+    def add(user_id: str, message: str, language: str, provider: str,
+            model: Optional[str], response: str) -> None:
+        """Yangi AI javobini shu worker guruhiga qo'shish (DB ga ResponseCache yozadi)"""
+        if not SemanticCache.is_available() or not response:
+            return
+        vector = SemanticCache.vectorize(message)
+        if vector is None:
+            return
+        group = SemanticCache._group(user_id, language, provider, model)
+        with SemanticCache._lock:
+            SemanticCache._append(group, text_normalizer.canonical(message), vector, response)
+
+    @staticmethod
+    def invalidate_tenant(user_id: str) -> None:
+        """Tenant vektorlarini xotiradan o'chirish"""
+        with SemanticCache._lock:
+            SemanticCache._tenants.pop(str(user_id), None)
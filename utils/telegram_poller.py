@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+from sqlalchemy import or_, update
+from models.user import db
+from models.messaging import TelegramBot
+from utils.inbound_queue import InboundQueue
+from utils.credential_vault import CredentialVault
+
+class TelegramPoller:
+    """Ko'p botli Telegram long polling (webhook o'rnatib bo'lmaydigan muhitlar uchun)
+
+    webhook_url siz barcha faol TelegramBot lar uchun bittadan asyncio
+    vazifasi getUpdates ni long polling qiladi; barcha vazifalar bitta httpx
+    ulanishlar pulini ishlatadi, shuning uchun bitta process minglab botga
+    xizmat qiladi. Yangilanishlar webhook bilan bir xil yo'ldan o'tadi
+    (InboundQueue.submit: dedup, birlashtirish, navbat).
+
+    - Offset telegram_bots.polling_offset da saqlanadi: qayta ishga
+      tushganda yangilanishlar yo'qolmaydi va takrorlanmaydi
+    - Navbat to'lganda offset oshirilmaydi - Telegram yangilanishlarni
+      saqlab turadi, keyinroq qayta olinadi
+    - Botlar ro'yxati har TELEGRAM_POLLING_REFRESH soniyada qayta o'qiladi:
+      yoqilgan bot qo'shiladi, o'chirilgan (yoki webhook o'rnatilgan) bot
+      to'xtatiladi, token almashsa qayta ishga tushadi
+    """
+
+    RETRY_BASE_SECONDS = 2
+    RETRY_MAX_SECONDS = 300
+
+    def __init__(self, app):
+        self.app = app
+        self.timeout = app.config.get('TELEGRAM_POLLING_TIMEOUT', 30)
+        self._tasks: Dict[int, Tuple[str, asyncio.Task]] = {}  # bot_id -> (token xeshi, vazifa)
+        self._executor = ThreadPoolExecutor(max_workers=app.config.get('TELEGRAM_POLLING_SUBMIT_THREADS', 8),
+                                            thread_name_prefix='telegram-poller')
+        self._client: Optional[httpx.AsyncClient] = None
+        self._stop: Optional[asyncio.Event] = None
+
+    @staticmethod
+    def _token_hash(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def _api_url(self, token: str, method: str) -> str:
+        return f"{self.app.config['TELEGRAM_API_URL']}{token}/{method}"
+
+    async def _in_thread(self, func, *args):
+        """DB / navbat ishini app context bilan thread pulida bajarish"""
+        def call():
+            with self.app.app_context():
+                try:
+                    return func(*args)
+                finally:
+                    db.session.remove()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    # ===== BOSHQARUV =====
+
+    async def run(self) -> None:
+        """stop() chaqirilguncha botlarni polling qilish"""
+        self._stop = asyncio.Event()
+        max_connections = self.app.config.get('TELEGRAM_POLLING_MAX_CONNECTIONS', 1000)
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            # Ulanish bo'shashini kutish cheklanmagan - botlar ko'p bo'lsa navbat bilan
+            timeout=httpx.Timeout(self.timeout + 10, connect=self.app.config.get('HTTP_CONNECT_TIMEOUT', 3.05),
+                                  pool=None)
+        )
+        refresh = self.app.config.get('TELEGRAM_POLLING_REFRESH', 15)
+        try:
+            while not self._stop.is_set():
+                try:
+                    await self._reconcile()
+                except Exception as e:
+                    self.app.logger.error(f"Telegram poller refresh error: {str(e)}")
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=refresh)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for _, task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*(task for _, task in self._tasks.values()), return_exceptions=True)
+            self._tasks.clear()
+            await self._client.aclose()
+            self._executor.shutdown(wait=False)
+
+    def stop(self) -> None:
+        if self._stop is not None:
+            self._stop.set()
+
+    def bot_count(self) -> int:
+        return len(self._tasks)
+
+    async def _reconcile(self) -> None:
+        """Faol botlar ro'yxatiga ko'ra vazifalarni qo'shish/to'xtatish"""
+        bots = await self._in_thread(self._active_bots)
+
+        for bot_id in list(self._tasks):
+            token_hash, task = self._tasks[bot_id]
+            bot = bots.get(bot_id)
+            if task.done() or bot is None or self._token_hash(bot[0]) != token_hash:
+                task.cancel()
+                del self._tasks[bot_id]
+
+        for bot_id, (token, offset) in bots.items():
+            if bot_id not in self._tasks:
+                task = asyncio.get_running_loop().create_task(self._poll_bot(bot_id, token, offset))
+                self._tasks[bot_id] = (self._token_hash(token), task)
+
+    @staticmethod
+    def _active_bots() -> Dict[int, Tuple[str, int]]:
+        """bot_id -> (token, offset): webhook o'rnatilmagan faol botlar"""
+        rows = TelegramBot.query.filter(
+            TelegramBot.is_active.is_(True),
+            or_(TelegramBot.webhook_url.is_(None), TelegramBot.webhook_url == '')
+        ).all()
+        tokens = CredentialVault.decrypt_many([bot.encrypted_token for bot in rows], legacy_base64=True)
+        # Token ochilmagan bot (None) keyingi yangilashda qayta uriniladi
+        return {bot.id: (token, bot.polling_offset or 0) for bot, token in zip(rows, tokens) if token}
+
+    # ===== BITTA BOT =====
+
+    async def _poll_bot(self, bot_id: int, token: str, offset: int) -> None:
+        failures = 0
+        while True:
+            try:
+                updates = await self._get_updates(token, offset)
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except _WebhookConflict:
+                # Eski webhook qolgan - getUpdates ishlashi uchun o'chiriladi
+                await self._delete_webhook(token)
+                continue
+            except Exception as e:
+                failures += 1
+                delay = min(self.RETRY_BASE_SECONDS * 2 ** (failures - 1), self.RETRY_MAX_SECONDS)
+                self.app.logger.warning(f"Telegram polling error for bot {bot_id}: {str(e)} (retry in {delay}s)")
+                await asyncio.sleep(delay)
+                continue
+
+            if not updates:
+                continue
+            try:
+                next_offset, rejected = await self._in_thread(self._submit, bot_id, updates, offset)
+            except Exception as e:
+                self.app.logger.error(f"Telegram polling submit error for bot {bot_id}: {str(e)}")
+                next_offset, rejected = offset, True
+            offset = next_offset
+            if rejected:
+                # Navbat to'lgan - qolgan yangilanishlar Telegram da kutadi
+                await asyncio.sleep(self.RETRY_BASE_SECONDS * 5)
+
+    async def _get_updates(self, token: str, offset: int) -> List[Dict[str, Any]]:
+        response = await self._client.post(self._api_url(token, 'getUpdates'), json={
+            'offset': offset,
+            'timeout': self.timeout,
+            'limit': 100,
+            'allowed_updates': ['message']
+        })
+        result = response.json()
+        if result.get('ok'):
+            return result.get('result', [])
+        if response.status_code == 409:
+            raise _WebhookConflict(result.get('description'))
+        raise Exception(result.get('description', f"HTTP {response.status_code}"))
+
+    async def _delete_webhook(self, token: str) -> None:
+        try:
+            await self._client.post(self._api_url(token, 'deleteWebhook'), json={'drop_pending_updates': False})
+        except httpx.HTTPError as e:
+            self.app.logger.warning(f"Telegram deleteWebhook error: {str(e)}")
+
+    @staticmethod
+    def _submit(bot_id: int, updates: List[Dict[str, Any]], offset: int) -> Tuple[int, bool]:
+        """
+        Yangilanishlarni webhook kabi navbatga berish va offsetni saqlash
+
+        Returns:
+            Tuple: (keyingi offset, navbat to'lib qolganmi)
+        """
+        start_offset, rejected = offset, False
+        for update_data in updates:
+            update_id = update_data.get('update_id', offset - 1)
+            if update_data.get('message'):
+                success, message = InboundQueue.submit('telegram_bot', bot_id, update_data, 'telegram')
+                if not success and message == "Queue is full":
+                    rejected = True
+                    break
+            offset = max(offset, update_id + 1)
+
+        if offset != start_offset:
+            table = TelegramBot.__table__
+            with db.engine.begin() as conn:
+                conn.execute(update(table).where(table.c.id == bot_id).values(polling_offset=offset))
+        return offset, rejected
+
+class _WebhookConflict(Exception):
+    """getUpdates 409: botda webhook o'rnatilgan"""
@@ -0,0 +1,242 @@
+"""
+Bilimlar bazasi qidiruvi uchun matn normalizatsiyasi va stemming
+O'zbek (lotin va kirill), rus va ingliz tillari uchun
+"""
+import re
+import time
+from typing import Dict, List, Optional
+
+# Tokenizer yoki stemming o'zgarsa oshiriladi - eski indekslar qayta quriladi
+NORMALIZER_VERSION = 2
+
+# Apostrof variantlari (o‘, oʻ, o`, o’ ...) bitta ' belgisiga keltiriladi,
+# ё -> е (rus matnlarida ikkalasi ham uchraydi). str.replace zanjiri
+# katta matnlarda dict asosidagi str.translate dan ancha tez ishlaydi.
+_APOSTROPHES = ('‘', '’', 'ʻ', 'ʼ', '`', '´', '′', 'ʹ')
+
+# Token: lotin, kirill (o'zbek harflari bilan) harflari, raqamlar va apostrof.
+# Oddiy belgilar sinfi \w va alternativali naqshlardan bir necha marta tez;
+# chetdagi apostroflar stem() da olib tashlanadi.
+_TOKEN_RE = re.compile(r"[0-9a-zß-öø-ÿа-яіўқғҳ']+")
+_CYRILLIC_RE = re.compile(r"[Ѐ-ӿ]")
+_UZ_CYRILLIC_RE = re.compile(r"[ўқғҳ]")
+# Matndagi kirill so'zlarning shu ulushida ў/қ/ғ/ҳ bo'lsa matn o'zbekcha (манзил, нархи)
+_UZ_CYRILLIC_SHARE = 0.1
+# So'z boshida va unlidan keyin е -> ye (қаерда -> qayerda)
+_UZ_YE_RE = re.compile(r"(?:(?<=^)|(?<=[аоуэиеюяў]))е")
+
+# O'zbek kirill -> lotin transliteratsiyasi
+_UZ_CYR_TO_LAT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'j', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'x', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'ъ': "'", 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', 'ў': "o'",
+    'қ': 'q', 'ғ': "g'", 'ҳ': 'h',
+})
+
+# O'zbek qo'shimchalari qatlamlar bo'yicha kesiladi: kelishik -> egalik -> ko'plik
+# (paketlarimizni -> paketlarimiz -> paketlar -> paket)
+_UZ_CASE_SUFFIXES = ('gacha', 'dagi', 'ning', 'dan', 'tan', 'ga', 'ka', 'qa', 'da', 'ta', 'ni')
+_UZ_POSSESSIVE_SUFFIXES = ('ingiz', 'imiz', 'ngiz', 'miz', 'ing', 'im', 'si')
+_UZ_PLURAL_SUFFIXES = ('lar',)
+# Yuklamalar (bormi, narxichi, bormidi, kitobu) - faqat savolda qo'shimcha term sifatida
+# kesiladi: hujjatdagi o'lchami, sotuvchi kabi so'zlar buzilmasin
+_UZ_PARTICLES = ('mikan', 'midi', 'chi', 'mi', 'yu', 'u')
+# Ingliz qo'shimchalari
+_EN_SUFFIXES = ('ies', 'ing', 'ed', 'es', 's')
+# Rus qo'shimchalari (fe'l, sifat, ot kelishiklari)
+_RU_SUFFIXES = (
+    'ться', 'тся', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ость', 'ая', 'яя', 'ое', 'ее', 'ую', 'юю', 'ые', 'ие', 'ый', 'ий', 'ой', 'ей',
+    'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ых', 'их', 'ть',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+)
+
+_VOWELS = set("aeiou'")
+_MIN_STEM = 3
+
+_stem_cache: Dict[str, str] = {}
+# stem(token, uzbek=True) natijalari (ў/қ/ғ/ҳ siz kirill so'zlar ham o'zbekcha)
+_uz_stem_cache: Dict[str, str] = {}
+_STEM_CACHE_LIMIT = 200000
+
+def _strip_suffix(token: str, suffixes) -> str:
+    for suffix in suffixes:
+        if token.endswith(suffix) and len(token) - len(suffix) >= _MIN_STEM:
+            return token[:-len(suffix)]
+    return token
+
+def _stem_latin(token: str) -> str:
+    """O'zbek (lotin) va ingliz so'zlari uchun yengil stemming"""
+    stem = _strip_suffix(token, _UZ_CASE_SUFFIXES)
+    possessive = _strip_suffix(stem, _UZ_POSSESSIVE_SUFFIXES)
+    # Egalik -i qo'shimchasi: narxi -> narx, mahsulotlari -> mahsulotlar
+    if possessive == stem and stem.endswith('i') and len(stem) - 1 >= _MIN_STEM \
+            and stem[-2] not in _VOWELS:
+        possessive = stem[:-1]
+    stem = _strip_suffix(possessive, _UZ_PLURAL_SUFFIXES)
+    if stem != token:
+        return stem
+
+    stem = _strip_suffix(token, _EN_SUFFIXES)
+    if stem != token and token.endswith('ies'):
+        stem += 'y'
+    elif token.endswith('ss'):
+        stem = token
+    return stem
+
+def _strip_particle(word: str) -> str:
+    """O'zbekcha so'z oxiridagi yuklamani kesish (-u faqat undoshdan keyin, -yu unlidan keyin)"""
+    for particle in _UZ_PARTICLES:
+        if word.endswith(particle) and len(word) - len(particle) >= _MIN_STEM:
+            rest = word[:-len(particle)]
+            if particle == 'u' and rest[-1] in _VOWELS:
+                continue
+            return rest
+    return word
+
+def _to_latin(word: str) -> str:
+    """O'zbek kirill so'zini lotin yozuviga o'tkazish"""
+    return _UZ_YE_RE.sub('ye', word).translate(_UZ_CYR_TO_LAT)
+
+def _is_uzbek_cyrillic(normalized: str, tokens: List[str]) -> bool:
+    """Kirill matn o'zbekchami (ў/қ/ғ/ҳ li so'zlar ulushi bo'yicha)"""
+    if not _UZ_CYRILLIC_RE.search(normalized):
+        return False
+    cyrillic = list(filter(_CYRILLIC_RE.search, tokens))
+    uzbek = sum(1 for _ in filter(_UZ_CYRILLIC_RE.search, cyrillic))
+    return uzbek >= len(cyrillic) * _UZ_CYRILLIC_SHARE
+
+def _stem_russian(token: str) -> str:
+    """Rus so'zlari uchun yengil (suffiks kesish) stemming"""
+    return _strip_suffix(token, _RU_SUFFIXES)
+
+def stem(token: str, uzbek: bool = False) -> str:
+    """
+    Bitta normallashtirilgan tokenni stem qilish (natija keshlanadi)
+
+    Args:
+        uzbek: Kirill so'z ў/қ/ғ/ҳ siz ham o'zbekcha (lotin shakliga o'tkaziladi)
+    """
+    cache = _uz_stem_cache if uzbek else _stem_cache
+    cached = cache.get(token)
+    if cached is not None:
+        return cached
+
+    word = token.strip("'")
+    if not word or word.isdigit():
+        result = word
+    elif _CYRILLIC_RE.search(word):
+        if uzbek or _UZ_CYRILLIC_RE.search(word):
+            # O'zbek kirill matni lotin shakliga o'tkaziladi
+            result = _stem_latin(_to_latin(word))
+        else:
+            result = _stem_russian(word)
+    else:
+        result = _stem_latin(word)
+
+    if len(cache) >= _STEM_CACHE_LIMIT:
+        cache.clear()
+    cache[token] = result
+    return result
+
+def _query_variants(token: str, uzbek: bool, language: Optional[str]) -> List[str]:
+    """Savol so'zi uchun qo'shimcha termlar: o'zbekcha kirill varianti va yuklamasiz shakl"""
+    word = token.strip("'")
+    if not word or word.isdigit():
+        return []
+    variants = []
+    if _CYRILLIC_RE.search(word):
+        if not uzbek and language != 'uz':
+            return []
+        if not _UZ_CYRILLIC_RE.search(word):
+            # Harflaridan tilini bilib bo'lmaydi (манзил, нархи) - o'zbekcha ham qidiriladi
+            variants.append(stem(token, uzbek=True))
+        word = _to_latin(word)
+    elif language != 'uz':
+        return variants
+    stripped = _strip_particle(word)
+    if stripped != word:
+        variants.append(_stem_latin(stripped))
+    return variants
+
+def normalize(text: str) -> str:
+    """Apostrof variantlari, ё va katta-kichik harflarni bir xillashtirish"""
+    for apostrophe in _APOSTROPHES:
+        if apostrophe in text:
+            text = text.replace(apostrophe, "'")
+    return text.replace('ё', 'е').replace('Ё', 'Е').lower()
+
+def canonical(text: str) -> str:
+    """
+    Stemmingsiz normallashtirilgan so'zlar ketma-ketligi
+
+    Katta-kichik harf, apostrof, tinish belgilari va bo'shliqlardagi farqlarni
+    yo'qotadi ("Manzil qayerda?" == "manzil  qayerda"). Kesh kalitlari uchun.
+    """
+    return " ".join(_TOKEN_RE.findall(normalize(text or "")))
+
+def tokenize(text: str, language: Optional[str] = None) -> List[str]:
+    """
+    Matnni qidiruv termlariga ajratish (normalizatsiya + stemming)
+
+    Indekslashda language berilmaydi: kirill so'zlarning yetarli qismida
+    ў/қ/ғ/ҳ bo'lsa matndagi barcha kirill so'zlar o'zbekcha stem qilinadi.
+    Savolda language beriladi: tenant/xabar tili 'uz' bo'lsa (yoki xabar
+    o'zbekcha bo'lsa) noaniq kirill so'zlarning o'zbekcha varianti va
+    yuklamasiz shakli (bormi -> bor) qo'shimcha term sifatida qo'shiladi.
+
+    Args:
+        text: Istalgan tildagi matn
+        language: Savol tili (uz, ru, en) - faqat savolni qayta ishlashda
+
+    Returns:
+        List[str]: Termlar ro'yxati (takrorlanishlar saqlanadi)
+    """
+    if not text:
+        return []
+    normalized = normalize(text)
+    tokens = _TOKEN_RE.findall(normalized)
+    uzbek = _is_uzbek_cyrillic(normalized, tokens)
+    if uzbek and language is None:
+        uz_get = _uz_stem_cache.get
+        terms = [uz_get(token) or stem(token, uzbek=True) for token in tokens]
+    else:
+        cache_get = _stem_cache.get
+        terms = [cache_get(token) or stem(token) for token in tokens]
+        if language is not None:
+            for token in tokens:
+                terms.extend(_query_variants(token, uzbek, language))
+    # Faqat apostrofdan iborat tokenlar bo'sh stemga aylanadi
+    return list(filter(None, terms))
+
+def benchmark(text: str, repeat: int = 3) -> float:
+    """
+    Tokenizatsiya tezligini o'lchash
+
+    Returns:
+        float: MB/soniya (bitta yadroda, eng yaxshi natija)
+    """
+    size_mb = len(text.encode('utf-8')) / (1024 * 1024)
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        tokenize(text)
+        best = min(best, time.perf_counter() - started)
+    return size_mb / best if best else float('inf')
+
+if __name__ == '__main__':
+    import glob
+    import os
+    import sys
+
+    # Namuna fayllardan ~10 MB korpus yig'ib tezlikni o'lchash
+    base = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'uploads', 'knowledge')
+    paths = sys.argv[1:] or glob.glob(os.path.join(base, '**', '*.*'), recursive=True)
+    sample = "\n".join(open(path, encoding='utf-8', errors='ignore').read() for path in paths)
+    if not sample:
+        print("Namuna matn topilmadi")
+        sys.exit(1)
+    corpus = sample * max(1, (10 * 1024 * 1024) // len(sample.encode('utf-8')))
+    print(f"Korpus: {len(corpus.encode('utf-8')) / (1024 * 1024):.1f} MB")
+    print(f"Tezlik: {benchmark(corpus):.1f} MB/s")
@@ -0,0 +1,230 @@
+import hashlib
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from flask import current_app
+from sqlalchemy import delete, insert, select, update
+from models.user import db
+from models.access_token import AccessTokenCache
+from utils.crypto_utils import CryptoUtils
+from utils.http_client import HttpClient
+
+class WhatsAppTokenManager:
+    """WhatsApp (Graph API) app access tokenlari keshi
+
+    Token app_id bo'yicha process xotirasida va access_token_cache
+    jadvalida (shifrlangan) saqlanadi, shuning uchun har bir xabar uchun
+    oauth/access_token so'rovi yuborilmaydi va worker qayta ishga tushganda
+    ham token qayta olinmaydi.
+
+    - Muddati tugashiga WHATSAPP_TOKEN_REFRESH_MARGIN qolganda token fonda
+      yangilanadi, so'rovlar eski (hali amal qiladigan) tokenni ishlataveradi
+    - Bitta app_id uchun bir vaqtda faqat bitta yangilash (single-flight):
+      kutayotgan threadlar tayyor tokenni oladi
+    - app_secret o'zgarsa saqlangan token ishlatilmaydi
+    """
+
+    # app_id -> (token, expires_at, refresh_at, secret_hash); vaqtlar time.time()
+    _tokens: Dict[str, Tuple[str, float, float, str]] = {}
+    _app_locks: Dict[str, threading.Lock] = {}
+    _refreshing = set()
+    _lock = threading.Lock()
+
+    TOKEN_URL = "https://graph.facebook.com/oauth/access_token"
+
+    @staticmethod
+    def _secret_hash(app_id: str, app_secret: str) -> str:
+        return hashlib.sha256(f"{app_id}:{app_secret}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _app_lock(app_id: str) -> threading.Lock:
+        with WhatsAppTokenManager._lock:
+            lock = WhatsAppTokenManager._app_locks.get(app_id)
+            if lock is None:
+                lock = WhatsAppTokenManager._app_locks[app_id] = threading.Lock()
+            return lock
+
+    @staticmethod
+    def _refresh_at(fetched_at: float, expires_at: float) -> float:
+        """Fonda yangilash vaqti: muddatdan margin oldin, lekin umrining yarmidan keyin"""
+        margin = current_app.config.get('WHATSAPP_TOKEN_REFRESH_MARGIN', 600)
+        return max(expires_at - margin, fetched_at + (expires_at - fetched_at) / 2)
+
+    # ===== TOKEN OLISH =====
+
+    @staticmethod
+    def get_token(app_id: str, app_secret: str) -> Optional[str]:
+        """
+        App uchun amal qiladigan access token
+
+        Returns:
+            Optional[str]: Token yoki Graph API dan olib bo'lmasa None
+        """
+        secret_hash = WhatsAppTokenManager._secret_hash(app_id, app_secret)
+        token = WhatsAppTokenManager._cached(app_id, secret_hash, app_secret)
+        if token:
+            return token
+
+        with WhatsAppTokenManager._app_lock(app_id):
+            # Kutish paytida boshqa thread tokenni olib bo'lgan bo'lishi mumkin
+            token = WhatsAppTokenManager._cached(app_id, secret_hash, app_secret)
+            if token:
+                return token
+
+            stored = WhatsAppTokenManager._load(app_id, secret_hash)
+            if stored:
+                WhatsAppTokenManager._tokens[app_id] = stored
+                token = WhatsAppTokenManager._cached(app_id, secret_hash, app_secret)
+                if token:
+                    return token
+
+            return WhatsAppTokenManager._refresh(app_id, app_secret, secret_hash)
+
+    @staticmethod
+    def _cached(app_id: str, secret_hash: str, app_secret: str) -> Optional[str]:
+        """Xotiradagi token; yangilash vaqti kelgan bo'lsa fonda yangilash boshlanadi"""
+        cached = WhatsAppTokenManager._tokens.get(app_id)
+        now = time.time()
+        if not cached or cached[3] != secret_hash or cached[1] <= now:
+            return None
+        if cached[2] <= now:
+            WhatsAppTokenManager._refresh_async(app_id, app_secret, secret_hash)
+        return cached[0]
+
+    @staticmethod
+    def _fetch(app_id: str, app_secret: str) -> Optional[Tuple[str, float]]:
+        """Graph API dan yangi token olish: (token, expires_at)"""
+        try:
+            response = HttpClient.get(WhatsAppTokenManager.TOKEN_URL, params={
+                'grant_type': 'client_credentials',
+                'client_id': app_id,
+                'client_secret': app_secret
+            })
+            result = response.json()
+        except Exception as e:
+            current_app.logger.warning(f"WhatsApp token request error: {str(e)}")
+            return None
+
+        token = result.get('access_token')
+        if not token:
+            current_app.logger.warning(
+                f"WhatsApp token error for app {app_id}: {result.get('error', {}).get('message', 'no token')}"
+            )
+            return None
+        lifetime = result.get('expires_in') or current_app.config.get('WHATSAPP_TOKEN_TTL', 86400)
+        return token, time.time() + float(lifetime)
+
+    @staticmethod
+    def _refresh(app_id: str, app_secret: str, secret_hash: str) -> Optional[str]:
+        """Token olish va xotira hamda DB keshiga yozish (app lock ostida chaqiriladi)"""
+        fetched = WhatsAppTokenManager._fetch(app_id, app_secret)
+        if not fetched:
+            return None
+        token, expires_at = fetched
+        refresh_at = WhatsAppTokenManager._refresh_at(time.time(), expires_at)
+        WhatsAppTokenManager._tokens[app_id] = (token, expires_at, refresh_at, secret_hash)
+        WhatsAppTokenManager._in_background(WhatsAppTokenManager._store, app_id, secret_hash, token, expires_at)
+        return token
+
+    @staticmethod
+    def _refresh_async(app_id: str, app_secret: str, secret_hash: str) -> None:
+        """Tokenni fonda yangilash (app_id uchun bitta thread)"""
+        with WhatsAppTokenManager._lock:
+            if app_id in WhatsAppTokenManager._refreshing:
+                return
+            WhatsAppTokenManager._refreshing.add(app_id)
+
+        app = current_app._get_current_object()
+
+        def run():
+            try:
+                with app.app_context():
+                    with WhatsAppTokenManager._app_lock(app_id):
+                        cached = WhatsAppTokenManager._tokens.get(app_id)
+                        # Boshqa thread allaqachon yangilagan
+                        if cached and cached[3] == secret_hash and cached[2] > time.time():
+                            return
+                        WhatsAppTokenManager._refresh(app_id, app_secret, secret_hash)
+            except Exception as e:
+                app.logger.warning(f"WhatsApp token background refresh error: {str(e)}")
+            finally:
+                with WhatsAppTokenManager._lock:
+                    WhatsAppTokenManager._refreshing.discard(app_id)
+
+        threading.Thread(target=run, name=f"whatsapp-token-{app_id}", daemon=True).start()
+
+    # ===== DB KESHI =====
+
+    @staticmethod
+    def _in_background(func, *args) -> None:
+        """
+        DB ga yozishni alohida threadda bajarish
+
+        Chaqiruvchining db.session tranzaksiyasiga qo'shilmaydi va uni
+        kutmaydi (SQLite da bitta yozuvchi qulfi so'rovni to'xtatib qo'ymaydi).
+        """
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                func(*args)
+
+        threading.Thread(target=run, name="whatsapp-token-cache", daemon=True).start()
+
+    @staticmethod
+    def _load(app_id: str, secret_hash: str) -> Optional[Tuple[str, float, float, str]]:
+        """Boshqa worker yoki oldingi process olgan tokenni o'qish"""
+        table = AccessTokenCache.__table__
+        try:
+            with db.engine.connect() as conn:
+                row = conn.execute(select(table.c.encrypted_token, table.c.expires_at, table.c.updated_at).where(
+                    table.c.provider == 'whatsapp', table.c.app_id == app_id, table.c.secret_hash == secret_hash
+                )).first()
+            if not row:
+                return None
+            # DB dagi vaqtlar UTC (naive)
+            expires_at = time.time() + (row.expires_at - datetime.utcnow()).total_seconds()
+            if expires_at <= time.time():
+                return None
+            fetched_at = time.time() - (datetime.utcnow() - (row.updated_at or datetime.utcnow())).total_seconds()
+            token = CryptoUtils.decrypt_text(row.encrypted_token)
+            return token, expires_at, WhatsAppTokenManager._refresh_at(fetched_at, expires_at), secret_hash
+        except Exception as e:
+            current_app.logger.warning(f"WhatsApp token cache read error: {str(e)}")
+            return None
+
+    @staticmethod
+    def _store(app_id: str, secret_hash: str, token: str, expires_at: float) -> None:
+        table = AccessTokenCache.__table__
+        values = {
+            'secret_hash': secret_hash,
+            'encrypted_token': CryptoUtils.encrypt_text(token),
+            'expires_at': datetime.utcfromtimestamp(expires_at),
+            'updated_at': datetime.utcnow()
+        }
+        try:
+            with db.engine.begin() as conn:
+                updated = conn.execute(update(table).where(
+                    table.c.provider == 'whatsapp', table.c.app_id == app_id
+                ).values(**values)).rowcount
+                if not updated:
+                    conn.execute(insert(table).values(provider='whatsapp', app_id=app_id, **values))
+        except Exception as e:
+            # Token xotirada bor - keyingi yangilashda yana yoziladi
+            current_app.logger.warning(f"WhatsApp token cache write error: {str(e)}")
+
+    @staticmethod
+    def invalidate(app_id: str) -> None:
+        """API token rad etganda (401 / OAuth xato 190) keshni tozalash"""
+        WhatsAppTokenManager._tokens.pop(app_id, None)
+        WhatsAppTokenManager._in_background(WhatsAppTokenManager._delete, app_id)
+
+    @staticmethod
+    def _delete(app_id: str) -> None:
+        table = AccessTokenCache.__table__
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(delete(table).where(table.c.provider == 'whatsapp', table.c.app_id == app_id))
+        except Exception as e:
+            current_app.logger.warning(f"WhatsApp token cache invalidate error: {str(e)}")
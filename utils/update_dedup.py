@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Tuple
+from flask import current_app
+from sqlalchemy import delete, insert
+from sqlalchemy.exc import IntegrityError
+from models.user import db
+from models.inbound_queue import SeenUpdate
+
+class UpdateDeduplicator:
+    """Platformalar qayta yuborgan webhook yangilanishlarini aniqlash
+
+    Telegram update_id, WhatsApp message.id va Instagram mid har bir
+    akkaunt bo'yicha seen_updates jadvaliga yoziladi (unique indeks).
+    Qayta kelgan yangilanish bitta indeks tekshiruvi bilan tashlab
+    yuboriladi - AI javobi qayta tayyorlanmaydi. Yaqinda ko'rilgan ID lar
+    process xotirasida ham saqlanadi (DB ga murojaatsiz).
+    """
+
+    # (platform, account_key, external_id) -> None, LRU tartibida
+    _recent: 'OrderedDict[Tuple[str, str, str], None]' = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return bool(current_app.config.get('UPDATE_DEDUP_ENABLED', True))
+
+    @staticmethod
+    def extract_ids(platform: str, payload: Dict[str, Any]) -> List[str]:
+        """
+        Yangilanishdagi platforma xabar ID lari
+
+        Returns:
+            List[str]: ID lar (topilmasa bo'sh ro'yxat - tekshiruv o'tkazilmaydi)
+        """
+        ids = []
+        if platform == 'telegram':
+            if payload.get('update_id') is not None:
+                ids.append(str(payload['update_id']))
+        elif platform == 'whatsapp':
+            for entry in payload.get('entry', []):
+                for change in entry.get('changes', []):
+                    for message in change.get('value', {}).get('messages', []):
+                        if message.get('id'):
+                            ids.append(str(message['id']))
+        elif platform == 'instagram':
+            for entry in payload.get('entry', []):
+                for event in entry.get('messaging', []):
+                    mid = event.get('message', {}).get('mid')
+                    if mid:
+                        ids.append(str(mid))
+                for change in entry.get('changes', []):
+                    value = change.get('value', {})
+                    mid = value.get('message', {}).get('mid') or value.get('comment_id')
+                    if mid:
+                        ids.append(str(mid))
+        return ids
+
+    @staticmethod
+    def claim(platform: str, account_key: str, external_ids: List[str]) -> List[str]:
+        """
+        Yangi ID larni ko'rilgan deb belgilash
+
+        Bir vaqtda kelgan ikki nusxadan faqat bittasi yozuvni qo'sha oladi
+        (unique indeks), shuning uchun workerlar orasida ham bitta javob.
+
+        Returns:
+            List[str]: Avval ko'rilmagan ID lar
+        """
+        new_ids = []
+        with UpdateDeduplicator._lock:
+            candidates = [external_id for external_id in dict.fromkeys(external_ids)
+                          if (platform, account_key, external_id) not in UpdateDeduplicator._recent]
+        if not candidates:
+            return []
+
+        table = SeenUpdate.__table__
+        utc_now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            for external_id in candidates:
+                try:
+                    with conn.begin_nested():
+                        conn.execute(insert(table).values(
+                            platform=platform, account_key=account_key,
+                            external_id=external_id, created_at=utc_now
+                        ))
+                    new_ids.append(external_id)
+                except IntegrityError:
+                    pass  # Boshqa so'rov yoki worker allaqachon qabul qilgan
+
+        max_entries = current_app.config.get('UPDATE_DEDUP_MEMORY_SIZE', 20000)
+        with UpdateDeduplicator._lock:
+            for external_id in candidates:
+                UpdateDeduplicator._recent[(platform, account_key, external_id)] = None
+                UpdateDeduplicator._recent.move_to_end((platform, account_key, external_id))
+            while len(UpdateDeduplicator._recent) > max_entries:
+                UpdateDeduplicator._recent.popitem(last=False)
+        return new_ids
+
+    @staticmethod
+    def release(platform: str, account_key: str, external_ids: List[str]) -> None:
+        """Qabul qilinmagan (navbat to'lgan) yangilanish ID larini o'chirish - qayta yuborilganda ishlanadi"""
+        if not external_ids:
+            return
+        with UpdateDeduplicator._lock:
+            for external_id in external_ids:
+                UpdateDeduplicator._recent.pop((platform, account_key, external_id), None)
+        table = SeenUpdate.__table__
+        with db.engine.begin() as conn:
+            conn.execute(delete(table).where(
+                table.c.platform == platform, table.c.account_key == account_key,
+                table.c.external_id.in_(external_ids)
+            ))
+
+    @staticmethod
+    def filter_payload(platform: str, payload: Dict[str, Any], new_ids: List[str]) -> Dict[str, Any]:
+        """WhatsApp to'plamidan allaqachon qabul qilingan xabarlarni olib tashlash"""
+        if platform != 'whatsapp':
+            return payload
+        keep = set(new_ids)
+        for entry in payload.get('entry', []):
+            for change in entry.get('changes', []):
+                value = change.get('value', {})
+                if 'messages' in value:
+                    value['messages'] = [message for message in value['messages']
+                                         if not message.get('id') or str(message['id']) in keep]
+        return payload
+
+    @staticmethod
+    def prune() -> int:
+        """
+        UPDATE_DEDUP_RETENTION dan eski ID larni o'chirish
+
+        Returns:
+            int: O'chirilgan yozuvlar soni
+        """
+        retention = current_app.config.get('UPDATE_DEDUP_RETENTION', 604800)
+        table = SeenUpdate.__table__
+        with db.engine.begin() as conn:
+            return conn.execute(delete(table).where(
+                table.c.created_at < datetime.utcnow() - timedelta(seconds=retention)
+            )).rowcount or 0